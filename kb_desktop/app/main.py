@@ -1,5 +1,6 @@
 import sys
 import os
+import multiprocessing
 
 # 将项目根目录添加到 sys.path 以允许从 core 导入
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -10,6 +11,8 @@ from PySide6.QtWidgets import QApplication
 from app.ui_main import MainWindow
 
 def main():
+    # 打包后的程序启动解析进程（core.parsers.ParsePool）时需要
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     
     # 设置全局样式
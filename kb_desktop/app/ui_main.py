@@ -1,21 +1,27 @@
 import sys
 import os
-import re
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
     QPushButton, QLabel, QTextEdit, QListWidget, QTabWidget, 
-    QFileDialog, QSplitter, QFrame, QStatusBar, QProgressBar, QMessageBox, QMenu
+    QFileDialog, QSplitter, QFrame, QStatusBar, QProgressBar, QMessageBox, QMenu,
+    QCheckBox, QAbstractItemView
 )
 from PySide6.QtCore import Qt
 
 # 导入核心模块
 from core.storage import DBManager
-from core.ingest import Ingestor
-from core.chunker import Chunker
-from core.embedder import Embedder
+from core.importer import Importer
+from core.parsers import supported_extensions
+from core.embedder import create_embedder
 from core.index_faiss import FaissIndex
+from core.index_sharded import ShardedFaissIndex
 from core.rag import RAGGenerator
-import numpy as np
+from core.retriever import Retriever
+from core.speculative import SpeculativeAnswerer, speculative_enabled
+from core.conversation import Conversation
+from core.vector_store import VectorStore
+from core.indexer import Indexer
+from core import tracing
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -25,11 +31,15 @@ class MainWindow(QMainWindow):
         
         # 初始化核心组件
         self.db = DBManager()
-        self.faiss_index = FaissIndex()
+        # 设置 INDEX_SHARD_SIZE 后使用按大小分片的索引（适合大规模知识库）
+        shard_size = os.getenv("INDEX_SHARD_SIZE")
+        self.faiss_index = ShardedFaissIndex(max_shard_size=int(shard_size)) if shard_size else FaissIndex()
+        self.vector_store = VectorStore()  # 已计算的嵌入，重建索引时无需重复调用 API
         self.embedder = None  # 需要时初始化（需要API密钥）
+        self.conversation = None  # 多轮对话会话（勾选“多轮对话”后的第一次提问时创建）
         
-        # 尝试加载已有索引
-        index_loaded = self.faiss_index.load()
+        # 尝试加载已有索引（并检查与数据库是否一致）
+        index_loaded = self.faiss_index.load(db=self.db)
         
         # 中央组件
         central_widget = QWidget()
@@ -56,16 +66,21 @@ class MainWindow(QMainWindow):
         left_layout.addWidget(lb_kb_title)
         
         self.file_list = QListWidget()
+        self.file_list.setSelectionMode(QAbstractItemView.ExtendedSelection)  # 支持多选以限定检索范围
         self.file_list.itemClicked.connect(self.on_file_selected) # 连接选择事件
         # 启用右键上下文菜单
         self.file_list.setContextMenuPolicy(Qt.CustomContextMenu)
         self.file_list.customContextMenuRequested.connect(self.on_file_list_context_menu)
         left_layout.addWidget(self.file_list)
         
-        self.btn_import = QPushButton("导入文档 (txt/md/docx)")
+        self.btn_import = QPushButton("导入文档")
         self.btn_import.clicked.connect(self.on_import_clicked)
         left_layout.addWidget(self.btn_import)
         
+        self.btn_sync = QPushButton("同步已修改的文档")
+        self.btn_sync.clicked.connect(self.on_sync_clicked)
+        left_layout.addWidget(self.btn_sync)
+        
         self.reindex_btn = QPushButton("重建索引")
         self.reindex_btn.clicked.connect(self.on_build_index)  # 启用第4天功能
         left_layout.addWidget(self.reindex_btn)
@@ -105,6 +120,17 @@ class MainWindow(QMainWindow):
         btn_layout.addWidget(self.btn_clear)
         middle_layout.addLayout(btn_layout)
         
+        self.chk_scope = QCheckBox("仅在选中的文档中检索")
+        middle_layout.addWidget(self.chk_scope)
+        
+        chat_layout = QHBoxLayout()
+        self.chk_conversation = QCheckBox("多轮对话（追问沿用上文）")
+        self.btn_new_conversation = QPushButton("新对话")
+        self.btn_new_conversation.clicked.connect(self.on_new_conversation)
+        chat_layout.addWidget(self.chk_conversation)
+        chat_layout.addWidget(self.btn_new_conversation)
+        middle_layout.addLayout(chat_layout)
+        
         splitter.addWidget(middle_panel)
         
         # --- 右侧面板：输出区域 ---
@@ -136,6 +162,17 @@ class MainWindow(QMainWindow):
         tab2_layout.addWidget(self.list_chunks)
         self.tabs.addTab(self.tab_chunks, "命中片段 (Top-K)")
         
+        # 选项卡3: 性能指标（最近一次提问的阶段耗时 + 各阶段耗时分布）
+        self.tab_metrics = QWidget()
+        tab3_layout = QVBoxLayout(self.tab_metrics)
+        tab3_layout.setContentsMargins(10, 10, 10, 10)
+        self.text_metrics = QTextEdit()
+        self.text_metrics.setReadOnly(True)
+        self.text_metrics.setStyleSheet("font-family: monospace;")
+        self.text_metrics.setPlainText("尚无提问记录。")
+        tab3_layout.addWidget(self.text_metrics)
+        self.tabs.addTab(self.tab_metrics, "性能指标")
+        
 
         
         right_layout.addWidget(self.tabs)
@@ -152,6 +189,9 @@ class MainWindow(QMainWindow):
         self.status = QStatusBar()
         self.setStatusBar(self.status)
         self.status.showMessage("就绪")
+        consistency = self.faiss_index.consistency
+        if index_loaded and consistency and not consistency['consistent']:
+            self.status.showMessage("索引与数据库不一致，建议重建索引")
         
         self.progress = QProgressBar()
         self.progress.setTextVisible(False)
@@ -182,6 +222,13 @@ class MainWindow(QMainWindow):
         
         self.lb_doc_count.setText(f"已索引文档: {len(docs)}")
 
+    def current_doc_filter(self):
+        """根据“仅在选中的文档中检索”选项返回文档过滤条件，未启用时返回 None。"""
+        if not self.chk_scope.isChecked():
+            return None
+        doc_ids = [item.data(Qt.UserRole) for item in self.file_list.selectedItems()]
+        return {'doc_ids': doc_ids} if doc_ids else None
+
     def on_file_selected(self, item):
         """点击文件时显示文本块。"""
         try:
@@ -205,52 +252,77 @@ class MainWindow(QMainWindow):
 
     def on_import_clicked(self):
         file_paths, _ = QFileDialog.getOpenFileNames(
-            self, "选择文档", "", "Documents (*.txt *.md *.docx)"
+            self, "选择文档", "",
+            "Documents ({})".format(" ".join(f"*{ext}" for ext in supported_extensions()))
         )
         if not file_paths:
             return
             
-        success_count = 0
-        duplicate_count = 0
-        fail_count = 0
-        
         self.status.showMessage("正在导入文档...")
         self.progress.setVisible(True)
         self.progress.setValue(0)
         
-        total = len(file_paths)
-        
-        for i, path in enumerate(file_paths):
-            filename = os.path.basename(path)
-            try:
-                # 1. 提取
-                content = Ingestor.load_file(path)
-                
-                # 2. 存储到数据库
-                doc_id = self.db.add_document(filename, path, content)
-                
-                if doc_id:
-                    # 3. 分块（第3天功能）
-                    chunks = Chunker.split_text(content)
-                    self.db.add_chunks(doc_id, chunks)
-                    success_count += 1
-                else:
-                    duplicate_count += 1
-            
-            except Exception as e:
-                print(f"导入 {filename} 时出错: {e}")
-                fail_count += 1
-            
-            self.progress.setValue(int((i + 1) / total * 100))
+        def on_progress(done, total, filename):
+            self.progress.setValue(int(done / total * 100))
             QApplication.processEvents() # 保持UI响应
         
+        # 先按文件指纹跳过已导入的文件，只解析新文件
+        result = Importer(self.db).import_files(file_paths, on_progress=on_progress)
+        success_count = result['imported']
+        duplicate_count = result['duplicate']
+        fail_count = result['failed']
+        
         self.progress.setVisible(False)
         self.refresh_doc_list()
         
         msg = f"已导入: {success_count}\n重复: {duplicate_count}\n失败: {fail_count}"
+        if result['updated']:
+            msg += f"\n已更新（源文件已修改）: {result['updated']}"
         QMessageBox.information(self, "导入结果", msg)
         self.status.showMessage("就绪")
 
+    def on_sync_clicked(self):
+        """重新扫描已导入文档的源文件，只替换并重新嵌入修改过的文本块。"""
+        self.status.showMessage("正在检查源文件...")
+        self.progress.setVisible(True)
+        self.progress.setValue(0)
+        
+        def on_progress(done, total, filename):
+            self.progress.setValue(int(done / total * 100))
+            QApplication.processEvents()
+        
+        try:
+            result = Importer(self.db).sync(on_progress=on_progress)
+            msg = (f"已更新: {result['updated']}\n未变化: {result['unchanged']}\n"
+                   f"源文件缺失: {result['missing']}\n失败: {result['failed']}")
+            if result['imported']:
+                msg += f"\n副本已修改、作为新文档导入: {result['imported']}"
+            if result['duplicate']:
+                msg += f"\n修改后与其他文档相同（已合并）: {result['duplicate']}"
+            
+            if result['added'] or result['removed']:
+                if self.embedder is None:
+                    try:
+                        self.embedder = create_embedder()
+                    except ValueError:
+                        pass
+                
+                if self.embedder is not None or not self.vector_store.missing_ids(result['added']):
+                    indexer = Indexer(self.db, self.faiss_index, self.embedder, self.vector_store)
+                    changes = indexer.apply_changes(result['added'], result['removed'])
+                    msg += f"\n\n索引: 新增 {changes['added']} 个向量，移除 {changes['removed']} 个（新嵌入 {changes['embedded']} 个）"
+                else:
+                    msg += "\n\n未设置 API 密钥，请稍后重建索引以更新向量库。"
+            
+            self.refresh_doc_list()
+            QMessageBox.information(self, "同步结果", msg)
+        except Exception as e:
+            QMessageBox.critical(self, "同步失败", f"同步出错:\n{str(e)}")
+            print(f"Sync error: {e}")
+        finally:
+            self.progress.setVisible(False)
+            self.status.showMessage("就绪")
+
     def on_build_index(self):
         """从数据库中的所有文本块构建 FAISS 索引。"""
         self.status.showMessage("正在构建索引...")
@@ -258,85 +330,47 @@ class MainWindow(QMainWindow):
         self.progress.setValue(0)
         
         try:
-            # 1. 初始化嵌入器（如果还没有）
-            if self.embedder is None:
-                try:
-                    self.embedder = Embedder()
-                except ValueError as e:
-                    QMessageBox.critical(
-                        self, 
-                        "需要 API 密钥", 
-                        "请设置 OPENAI_API_KEY 环境变量。\n\n" +
-                        "例如:\n" +
-                        "set OPENAI_API_KEY=sk-xxxx (Windows)\n" +
-                        "export OPENAI_API_KEY=sk-xxxx (Linux/Mac)"
-                    )
-                    self.progress.setVisible(False)
-                    self.status.showMessage("就绪")
-                    return
-            
-            # 2. 从数据库获取所有文本块
-            conn = self.db.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT id, text FROM chunks ORDER BY id ASC')
-            all_chunks = cursor.fetchall()
-            conn.close()
-            
-            if not all_chunks:
+            all_chunk_ids = self.db.get_indexable_chunk_ids()
+            if not all_chunk_ids:
                 QMessageBox.warning(self, "无数据", "未找到文本块。请先导入文档。")
                 self.progress.setVisible(False)
                 self.status.showMessage("就绪")
                 return
             
-            chunk_ids = [row[0] for row in all_chunks]
-            chunk_texts = [row[1] for row in all_chunks]
-            
-            total = len(chunk_texts)
-            self.status.showMessage(f"正在嵌入 {total} 个文本块...")
-            
-            # 3. 获取嵌入（批量处理以提高效率）
-            batch_size = 100  # 批量处理以提高效率
-            all_embeddings = []
-            
-            for i in range(0, total, batch_size):
-                batch = chunk_texts[i:i+batch_size]
-                embeddings = self.embedder.get_embeddings(batch)
-                all_embeddings.extend(embeddings)
-                
-                progress = int((i + len(batch)) / total * 90)  # 保留最后10%用于构建索引
-                self.progress.setValue(progress)
+            # 1. 初始化嵌入器（如果还没有）
+            if self.embedder is None:
+                try:
+                    self.embedder = create_embedder()
+                except ValueError as e:
+                    # 所有文本块的嵌入都已存储时，无需 API 密钥即可离线重建
+                    if self.vector_store.missing_ids(all_chunk_ids):
+                        QMessageBox.critical(
+                            self, 
+                            "需要 API 密钥", 
+                            "请设置 OPENAI_API_KEY 环境变量。\n\n" +
+                            "例如:\n" +
+                            "set OPENAI_API_KEY=sk-xxxx (Windows)\n" +
+                            "export OPENAI_API_KEY=sk-xxxx (Linux/Mac)"
+                        )
+                        self.progress.setVisible(False)
+                        self.status.showMessage("就绪")
+                        return
+            
+            # 2-6. 嵌入缺失的文本块（结果写入向量存储）、构建索引、标记文档并保存
+            def on_progress(message, percent):
+                self.status.showMessage(message)
+                self.progress.setValue(percent)
                 QApplication.processEvents()
             
-            # 转换为numpy数组
-            vectors = np.array(all_embeddings)
-            
-            self.status.showMessage("正在构建 FAISS 索引...")
-            self.progress.setValue(95)
-            
-            # 4. 构建 FAISS 索引
-            dimension = self.embedder.get_dimension()
-            self.faiss_index.build_index(vectors, chunk_ids, dimension)
-            
-            # 5. 将所有文档标记为已索引
-            self.status.showMessage("正在更新文档状态...")
-            doc_ids = set()
-            for chunk_id in chunk_ids:
-                conn = self.db.get_connection()
-                cursor = conn.cursor()
-                cursor.execute('SELECT doc_id FROM chunks WHERE id = ?', (chunk_id,))
-                result = cursor.fetchone()
-                conn.close()
-                if result:
-                    doc_ids.add(result[0])
-            
-            for doc_id in doc_ids:
-                self.db.mark_as_indexed(doc_id)
-            
-            # 6. 保存索引
-            self.faiss_index.save()
+            indexer = Indexer(self.db, self.faiss_index, self.embedder, self.vector_store)
+            result = indexer.rebuild(on_progress=on_progress)
+            total = result['total']
+            dimension = result['dimension']
             
             self.progress.setValue(100)
-            self.status.showMessage(f"索引构建成功：{total} 个向量，{len(doc_ids)} 个文档")
+            self.status.showMessage(
+                f"索引构建成功：{total} 个向量（新嵌入 {result['embedded']} 个），{result['documents']} 个文档"
+            )
             
             # 刷新文档列表以显示索引状态
             self.refresh_doc_list()
@@ -344,7 +378,7 @@ class MainWindow(QMainWindow):
             QMessageBox.information(
                 self, 
                 "成功", 
-                f"索引构建成功！\n\n向量数: {total}\n维度: {dimension}"
+                f"索引构建成功！\n\n向量数: {total}\n新嵌入: {result['embedded']}\n维度: {dimension}"
             )
             
         except Exception as e:
@@ -358,13 +392,31 @@ class MainWindow(QMainWindow):
             self.status.showMessage("就绪")
 
     def on_ask_question(self):
-        """处理用户问题：嵌入、搜索、显示 Top-K 文本块。"""
+        """处理用户问题：嵌入、搜索、显示 Top-K 文本块。各阶段耗时记录到一次追踪中。"""
         query = self.input_text.toPlainText().strip()
         
         if not query:
             QMessageBox.warning(self, "问题为空", "请输入一个问题。")
             return
         
+        with tracing.start_trace("question", query_chars=len(query)):
+            self._answer_question(query)
+        self.refresh_metrics()
+
+    def refresh_metrics(self):
+        """在“性能指标”选项卡中显示最近一次提问的阶段耗时和最近各次提问的耗时分布。"""
+        trace = tracing.recorder.last()
+        if trace is None:
+            return
+        lines = ["最近一次提问", trace.format(), "", f"最近 {len(tracing.recorder.recent())} 次追踪的阶段耗时 (ms)"]
+        lines.append(f"{'阶段':<22}{'次数':>6}{'p50':>10}{'p95':>10}{'最大':>10}")
+        for stage, s in sorted(tracing.recorder.stage_stats("question").items(), key=lambda x: -x[1]['p50']):
+            lines.append(f"{stage:<22}{s['count']:>6}{s['p50']:>10.1f}{s['p95']:>10.1f}{s['max']:>10.1f}")
+        if tracing.recorder.log_path:
+            lines.append(f"\n追踪日志: {tracing.recorder.log_path}")
+        self.text_metrics.setPlainText("\n".join(lines))
+
+    def _answer_question(self, query):
         self.status.showMessage("正在搜索...")
         self.progress.setVisible(True)
         self.progress.setValue(0)
@@ -385,7 +437,7 @@ class MainWindow(QMainWindow):
             # 2. 如果还没有初始化嵌入器
             if self.embedder is None:
                 try:
-                    self.embedder = Embedder()
+                    self.embedder = create_embedder()
                 except ValueError as e:
                     QMessageBox.critical(
                         self, 
@@ -396,92 +448,38 @@ class MainWindow(QMainWindow):
                     self.status.showMessage("就绪")
                     return
             
-            self.progress.setValue(30)
-            QApplication.processEvents()
-            
-            # 3. 获取查询嵌入
-            self.status.showMessage("正在嵌入查询...")
-            query_embedding = self.embedder.get_embedding(query)
-            query_vector = np.array(query_embedding)
-            
-            self.progress.setValue(60)
-            QApplication.processEvents()
+            # 3-6. 混合检索：向量 + 关键词（可限定在选中的文档内）
+            def on_stage(message, percent):
+                self.status.showMessage(message)
+                self.progress.setValue(percent)
+                QApplication.processEvents()
             
-            # 4. 搜索 FAISS
-            self.status.showMessage("正在搜索索引...")
             k = 5  # Top-5 结果
-            distances, chunk_ids = self.faiss_index.search(query_vector, k=k)
-            
-            self.progress.setValue(80)
+            retriever = Retriever(self.db, self.faiss_index, self.embedder)
+            rag = RAGGenerator()
             
-            # 5. 执行关键词搜索（P1：混合搜索）
-            self.status.showMessage("正在执行关键词搜索...")
-            keyword_results = self.db.keyword_search(query, k=k)
+            if self.chk_conversation.isChecked():
+                # 多轮对话：追问改写后检索，同一话题复用上一轮的检索结果，生成时附带历史
+                self._answer_in_conversation(query, retriever, rag, k, on_stage)
+                return
             
-            # 6. 合并向量和关键词结果（混合搜索）
-            combined_chunks = {}  # chunk_id -> 数据
-            self.list_chunks.clear()
+            if speculative_enabled():
+                # 流水线模式：向量结果足够可信时不等关键词检索，提前开始生成
+                self._answer_speculatively(query, retriever, rag, k, on_stage)
+                return
             
-            # 添加向量搜索结果
-            for dist, chunk_id in zip(distances, chunk_ids):
-                vector_score = 1 / (1 + dist)
-                conn = self.db.get_connection()
-                cursor = conn.cursor()
-                cursor.execute(
-                    'SELECT c.text, d.filename FROM chunks c JOIN documents d ON c.doc_id = d.id WHERE c.id = ?',
-                    (chunk_id,)
-                )
-                result = cursor.fetchone()
-                conn.close()
-                
-                if result:
-                    text, filename = result
-                    combined_chunks[chunk_id] = {
-                        'text': text,
-                        'filename': filename,
-                        'chunk_id': chunk_id,
-                        'vector_score': vector_score,
-                        'keyword_score': 0
-                    }
-            
-            # 添加关键词搜索结果
-            if keyword_results:
-                max_kw = max(r[3] for r in keyword_results)
-                for chunk_id, text, filename, score in keyword_results:
-                    norm_kw = score / max_kw if max_kw > 0 else 0
-                    if chunk_id in combined_chunks:
-                        combined_chunks[chunk_id]['keyword_score'] = norm_kw
-                    else:
-                        combined_chunks[chunk_id] = {
-                            'text': text,
-                            'filename': filename,
-                            'chunk_id': chunk_id,
-                            'vector_score': 0,
-                            'keyword_score': norm_kw
-                        }
-            
-            # 计算综合分数
-            for data in combined_chunks.values():
-                data['combined_score'] = data['vector_score'] * 0.6 + data['keyword_score'] * 0.4
-                data['similarity'] = data['combined_score']
-            
-            # 排序并显示
-            sorted_chunks = sorted(combined_chunks.values(), key=lambda x: x['combined_score'], reverse=True)[:k]
-            context_chunks = []
-            
-            for i, chunk_data in enumerate(sorted_chunks):
-                self.list_chunks.addItem(
-                    f"【{i+1}】 综合: {chunk_data['combined_score']:.3f} " +
-                    f"(向量: {chunk_data['vector_score']:.3f}, 关键词: {chunk_data['keyword_score']:.3f})\n" +
-                    f"来源: {chunk_data['filename']}\n{chunk_data['text']}\n{'='*60}"
+            with tracing.span("retrieve", k=k):
+                sorted_chunks = retriever.retrieve(
+                    query, k=k, doc_filter=self.current_doc_filter(), on_stage=on_stage
                 )
-                context_chunks.append(chunk_data)
+            
+            context_chunks = list(sorted_chunks)
+            self._show_chunks(context_chunks)
             
             self.progress.setValue(85)
             QApplication.processEvents()
             
             # 6. 生成回答前检查置信度（P0：防止幻觉）
-            rag = RAGGenerator()
             is_confident, confidence_reason = rag.check_confidence(context_chunks)
             
             if not is_confident:
@@ -504,31 +502,15 @@ class MainWindow(QMainWindow):
             # 7. 生成 RAG 回答（第6天功能）- 仅在置信度足够时
             self.status.showMessage("正在生成回答...")
             try:
-                answer, citations = rag.generate_answer(query, context_chunks)
+                # 补充命中块前后的相邻块，再在 token 预算内装填上下文（去重并合并为连续窗口）
+                window = int(os.getenv("CONTEXT_WINDOW", "1"))
+                expanded_chunks = retriever.expand_neighbors(context_chunks, window=window)
+                context_blocks = rag.pack_context(expanded_chunks)
+                answer, citations = rag.generate_answer(query, context_blocks)
                 
                 # 验证引用（P0：引用验证）
-                is_valid, citation_issue = rag.verify_citations(answer, context_chunks)
-                if not is_valid:
-                    # 显示关于无效引用的警告
-                    self.text_answer.clear()
-                    self.text_answer.append("⚠️ **引用验证警告**\n")
-                    self.text_answer.append(f"生成的回答存在引用问题: {citation_issue}\n")
-                    self.text_answer.append("="*60 + "\n\n")
-                    self.text_answer.append(answer)
-                else:
-                    # 显示正常回答
-                    self.text_answer.clear()
-                    self.text_answer.append(answer)
-                
-                self.text_answer.append("\n" + "="*60)
-                self.text_answer.append("\n【引用来源】")
-                for i, cite in enumerate(citations):
-                    self.text_answer.append(
-                        f"\n[{i+1}] {cite['filename']}\n摘录: {cite['excerpt']}"
-                    )
-                
-                # 切换到回答选项卡
-                self.tabs.setCurrentIndex(0)
+                is_valid, citation_issue = rag.verify_citations(answer, context_blocks)
+                self._show_answer(answer, citations, is_valid, citation_issue)
                 
             except Exception as e:
                 # 如果 RAG 失败，仍显示文本块（回退到第5天行为）
@@ -543,7 +525,7 @@ class MainWindow(QMainWindow):
                 )
             
             self.progress.setValue(100)
-            self.status.showMessage(f"找到 {len(chunk_ids)} 个相关文本块")
+            self.status.showMessage(f"找到 {len(context_chunks)} 个相关文本块")
             
         except Exception as e:
             QMessageBox.critical(self, "搜索错误", f"搜索失败：\n{str(e)}")
@@ -555,6 +537,77 @@ class MainWindow(QMainWindow):
             self.progress.setVisible(False)
             self.status.showMessage("就绪")
 
+    def _answer_speculatively(self, query, retriever, rag, k, on_stage):
+        """推测式提前生成（SPECULATIVE_GENERATION=1），检索结果和回答的显示方式同普通流程。"""
+        answerer = SpeculativeAnswerer(retriever, rag)
+        with tracing.span("retrieve_and_generate", k=k):
+            result = answerer.answer(query, k=k, doc_filter=self.current_doc_filter(), on_stage=on_stage)
+        self._show_result(result, f"推测生成: {result['speculation']}")
+
+    def _answer_in_conversation(self, query, retriever, rag, k, on_stage):
+        """在当前会话中回答（见 core/conversation.py），显示方式同普通流程。"""
+        if self.conversation is None:
+            self.conversation = Conversation(retriever, rag)
+        result = self.conversation.ask(query, k=k, doc_filter=self.current_doc_filter(), on_stage=on_stage)
+        note = f"第 {len(self.conversation.turns)} 轮"
+        if result['standalone_query'] != query:
+            note += f"，检索问题: {result['standalone_query']}"
+        if result['reused']:
+            note += "，复用上一轮检索结果"
+        self._show_result(result, note)
+
+    def on_new_conversation(self):
+        """开始新对话：清空会话历史和检索缓存。"""
+        self.conversation = None
+        self.status.showMessage("已开始新对话")
+
+    def _show_result(self, result, note):
+        """显示 SpeculativeAnswerer / Conversation 返回的结果（置信度低时显示备用回复）。"""
+        self._show_chunks(result['chunks'])
+        
+        if not result['confident']:
+            self.text_answer.clear()
+            self.text_answer.append(result['answer'])
+            self.tabs.setCurrentIndex(0)
+            self.progress.setValue(100)
+            self.status.showMessage(f"置信度低: {result['reason']}（{note}）")
+            return
+        
+        self._show_answer(result['answer'], result['citations'], result['citations_valid'], result['citation_issue'])
+        self.progress.setValue(100)
+        self.status.showMessage(f"找到 {len(result['chunks'])} 个相关文本块（{note}）")
+
+    def _show_chunks(self, chunks):
+        """在“命中片段”选项卡中列出 Top-K 文本块及其分数。"""
+        self.list_chunks.clear()
+        for i, chunk_data in enumerate(chunks):
+            self.list_chunks.addItem(
+                f"【{i+1}】 综合: {chunk_data['combined_score']:.3f} " +
+                f"(向量: {chunk_data['vector_score']:.3f}, 关键词: {chunk_data['keyword_score']:.3f})\n" +
+                f"来源: {chunk_data['filename']}\n{chunk_data['text']}\n{'='*60}"
+            )
+
+    def _show_answer(self, answer, citations, is_valid, citation_issue):
+        """显示回答（引用验证失败时附带警告）和引用来源，并切换到回答选项卡。"""
+        self.text_answer.clear()
+        if not is_valid:
+            # 显示关于无效引用的警告
+            self.text_answer.append("⚠️ **引用验证警告**\n")
+            self.text_answer.append(f"生成的回答存在引用问题: {citation_issue}\n")
+            self.text_answer.append("="*60 + "\n\n")
+        self.text_answer.append(answer)
+        
+        self.text_answer.append("\n" + "="*60)
+        self.text_answer.append("\n【引用来源】")
+        for i, cite in enumerate(citations):
+            also_in = f"（另见: {', '.join(cite['also_in'])}）" if cite.get('also_in') else ""
+            self.text_answer.append(
+                f"\n[{i+1}] {cite['filename']}{also_in}\n摘录: {cite['excerpt']}"
+            )
+        
+        # 切换到回答选项卡
+        self.tabs.setCurrentIndex(0)
+
     def on_file_list_context_menu(self, position):
         """显示文件列表的上下文菜单（右键单击）。"""
         item = self.file_list.itemAt(position)
@@ -590,28 +643,34 @@ class MainWindow(QMainWindow):
             if reply == QMessageBox.No:
                 return
             
-            # 从数据库删除
-            conn = self.db.get_connection()
-            cursor = conn.cursor()
-            
-            # 先删除文本块（外键约束）
-            cursor.execute('DELETE FROM chunks WHERE doc_id = ?', (doc_id,))
-            deleted_chunks = cursor.rowcount
-            
-            # 删除文档
-            cursor.execute('DELETE FROM documents WHERE id = ?', (doc_id,))
-            
-            conn.commit()
-            conn.close()
+            # 从数据库删除（文本块、文件指纹；近似重复块改指向新的规范块）
+            deleted = self.db.delete_document(doc_id)
+            self.conversation = None  # 缓存的检索结果可能引用已删除的文本块
+            msg = f"已删除文档 (ID: {doc_id}) 及其 {deleted['chunks']} 个片段。"
+            
+            # 从索引移除被删除的文本块，加入被提升为规范块的近似重复块（索引尚未建立时无需更新）
+            if (deleted['chunk_ids'] or deleted['promoted']) and self.faiss_index.get_stats().get("loaded"):
+                if self.embedder is None and self.vector_store.missing_ids(deleted['promoted']):
+                    try:
+                        self.embedder = create_embedder()
+                    except ValueError:
+                        pass
+                
+                if self.embedder is not None or not self.vector_store.missing_ids(deleted['promoted']):
+                    try:
+                        indexer = Indexer(self.db, self.faiss_index, self.embedder, self.vector_store)
+                        changes = indexer.apply_changes(deleted['promoted'], deleted['chunk_ids'])
+                        msg += f"\n\n索引: 新增 {changes['added']} 个向量，移除 {changes['removed']} 个（新嵌入 {changes['embedded']} 个）"
+                    except Exception as e:
+                        print(f"Index update after delete failed: {e}")
+                        msg += f"\n\n索引更新失败（{e}），请重新建立索引以更新向量库。"
+                else:
+                    msg += "\n\n未设置 API 密钥，请稍后重建索引以更新向量库。"
             
             # 刷新UI
             self.refresh_doc_list()
             
-            QMessageBox.information(
-                self,
-                "删除成功",
-                f"已删除文档 (ID: {doc_id}) 及其 {deleted_chunks} 个片段。\n\n请重新建立索引以更新向量库。"
-            )
+            QMessageBox.information(self, "删除成功", msg)
             
         except Exception as e:
             QMessageBox.critical(self, "删除失败", f"删除出错:\n{str(e)}")
@@ -0,0 +1,93 @@
+import os
+import random
+from typing import Iterator, List, Tuple
+
+# 合成制度文档的词表：部门 x 主题 x 事项 x 动作 x 条件，组合出足够多样的句子，
+# 使不同段落的 SimHash 相距较远（不会被近似去重合并）
+DEPARTMENTS = ["人力资源部", "财务部", "行政部", "信息技术部", "法务部", "采购部", "市场部", "销售部",
+               "研发中心", "质量管理部", "客户服务部", "安全生产部", "审计部", "战略发展部", "供应链中心", "工会"]
+TOPICS = ["考勤", "报销", "年假", "加班", "出差", "培训", "采购", "保密", "绩效", "招聘", "离职", "福利",
+          "合同", "印章", "档案", "资产", "预算", "差旅", "会议", "值班", "消防", "网络安全", "数据备份", "供应商"]
+OBJECTS = ["申请单", "审批流程", "登记表", "备案材料", "发票", "工作台账", "月度报告", "费用明细", "评估结果",
+           "操作记录", "验收单", "归档清单", "项目计划", "风险清单", "整改方案", "培训记录", "考核表", "访客登记"]
+ACTIONS = ["提交", "审核", "复核", "签字确认", "归档", "备案", "更新", "抽查", "汇总", "公示", "报送", "核对"]
+TIMES = ["三个工作日", "五个工作日", "七个自然日", "每月十日前", "每季度末", "次月五日前", "两周", "当日"]
+CONDITIONS = ["逾期未办理的视为自动放弃", "特殊情况须经分管领导批准", "金额超过五万元的须报总经理审批",
+              "涉及外部单位的须经法务部审查", "未按规定执行的将纳入绩效考核", "紧急情况可先口头报备后补办手续",
+              "跨部门事项由牵头部门统一协调", "相关费用由所在部门预算列支", "资料保存期限不少于五年",
+              "发现问题须在二十四小时内上报", "新员工入职一个月内须完成学习", "外包人员参照本规定执行"]
+CONNECTORS = ["原则上", "一般情况下", "如无特殊说明", "自本办法发布之日起", "经研究决定", "为进一步规范管理"]
+
+class SyntheticCorpus:
+    """
+    可复现的合成中文制度文档语料。
+
+    同一 seed 生成完全相同的文档；每个文档由标题和若干段落组成，每段 110~165 个字符，
+    配合 CHUNK_TOKENS（200）、无重叠的分块器时每段（第一段连同标题）正好成为一个文本块，
+    因此文本块总数可以精确控制。
+    """
+
+    MIN_CHARS = 110
+    # 与语料配套的分块大小：两段之和一定超过它，标题加一段一定不超过它
+    CHUNK_TOKENS = 200
+
+    def __init__(self, seed: int = 42, paragraphs_per_doc: int = 20):
+        self.seed = seed
+        self.paragraphs_per_doc = paragraphs_per_doc
+
+    def _sentence(self, rng: random.Random, dept: str, topic: str) -> str:
+        return (f"{rng.choice(CONNECTORS)}，{dept}应在{rng.choice(TIMES)}内{rng.choice(ACTIONS)}"
+                f"{topic}{rng.choice(OBJECTS)}，{rng.choice(CONDITIONS)}。")
+
+    def paragraph(self, rng: random.Random, dept: str, topic: str) -> str:
+        """由整句组成、不少于 MIN_CHARS 个字符的段落（每句 30~55 个字符）。"""
+        text = ""
+        while len(text) < self.MIN_CHARS:
+            text += self._sentence(rng, dept, topic)
+        return text
+
+    def document(self, doc_index: int) -> Tuple[str, List[str]]:
+        """返回第 doc_index 个文档的 (标题, 段落列表)。"""
+        rng = random.Random(f"{self.seed}:{doc_index}")
+        dept, topic = rng.choice(DEPARTMENTS), rng.choice(TOPICS)
+        title = f"{dept}{topic}管理办法（第{doc_index}号）"
+        # 每段换一个相关主题，使同一文档内的段落也各不相同
+        paragraphs = [self.paragraph(rng, dept, rng.choice(TOPICS) if i else topic)
+                      for i in range(self.paragraphs_per_doc)]
+        return title, paragraphs
+
+    def documents(self, num_chunks: int) -> Iterator[Tuple[int, str, List[str]]]:
+        """产出约 num_chunks 个段落（文本块）所需的文档 (doc_index, 标题, 段落)。"""
+        num_docs = max(1, -(-num_chunks // self.paragraphs_per_doc))
+        for doc_index in range(num_docs):
+            title, paragraphs = self.document(doc_index)
+            if doc_index == num_docs - 1:
+                paragraphs = paragraphs[:num_chunks - doc_index * self.paragraphs_per_doc] or paragraphs[:1]
+            yield doc_index, title, paragraphs
+
+    def write(self, directory: str, num_chunks: int, files_per_dir: int = 1000) -> List[str]:
+        """把语料写成 UTF-8 文本文件（每个子目录最多 files_per_dir 个），返回文件路径。"""
+        paths = []
+        for doc_index, title, paragraphs in self.documents(num_chunks):
+            subdir = os.path.join(directory, f"{doc_index // files_per_dir:04d}")
+            os.makedirs(subdir, exist_ok=True)
+            path = os.path.join(subdir, f"制度_{doc_index:07d}.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(title + "\n" + "\n".join(paragraphs))
+            paths.append(path)
+        return paths
+
+    def queries(self, num_queries: int, num_docs: int) -> List[str]:
+        """
+        生成查询：从随机文档的随机段落中取出其中的三个主题、事项或动作词。
+        关键词之间用空格分隔，使关键词检索（按空格切分）也能命中。
+        """
+        rng = random.Random(f"{self.seed}:queries")
+        queries = []
+        for _ in range(num_queries):
+            _, paragraphs = self.document(rng.randrange(num_docs))
+            paragraph = rng.choice(paragraphs)
+            terms = [term for term in TOPICS + OBJECTS + ACTIONS if term in paragraph]
+            picked = rng.sample(terms, min(3, len(terms)))
+            queries.append(" ".join(picked))
+        return queries
@@ -0,0 +1,269 @@
+import sys
+import os
+import csv
+import json
+import time
+import math
+import argparse
+import tempfile
+import shutil
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import faiss
+
+sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+from core.index_faiss import FaissIndex
+from bench.corpus import SyntheticCorpus
+from bench.fake_embedder import FakeEmbedder
+from bench.run_bench import latency_stats, environment, parse_size
+
+# 默认扫描的索引类型；{nlist} 和 {m} 按向量数量和维度自动填入
+DEFAULT_FACTORIES = ("Flat", "HNSW16", "HNSW32", "IVF{nlist},Flat", "IVF{nlist},PQ{m}", "PQ{m}")
+DEFAULT_EF_SEARCH = (16, 32, 64, 128)
+DEFAULT_NPROBE = (1, 4, 16, 64)
+
+def default_nlist(num_vectors: int) -> int:
+    """IVF 聚类中心数：约 4·√n，并保证每个中心至少有 39 个训练向量（FAISS 的建议下限）。"""
+    return max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // 39))
+
+def default_pq_m(dimension: int) -> int:
+    """PQ 子向量数：不超过 dimension / 4 的最大约数（每个向量 m 字节）。"""
+    for m in range(max(1, dimension // 4), 0, -1):
+        if dimension % m == 0:
+            return m
+    return 1
+
+def expand_factory(factory: str, num_vectors: int, dimension: int) -> str:
+    return factory.format(nlist=default_nlist(num_vectors), m=default_pq_m(dimension))
+
+def search_param_grid(index: FaissIndex, ef_search=DEFAULT_EF_SEARCH, nprobe=DEFAULT_NPROBE) -> List[str]:
+    """按索引类型返回要扫描的搜索参数（构建一次，只改搜索参数）。"""
+    kind = faiss.downcast_index(index.index)
+    if isinstance(kind, faiss.IndexHNSW):
+        return [f"efSearch={ef}" for ef in ef_search]
+    if isinstance(kind, faiss.IndexIVF):
+        return [f"nprobe={n}" for n in nprobe if n <= kind.nlist]
+    return [""]
+
+def exact_neighbors(vectors: np.ndarray, queries: np.ndarray, k: int) -> List[set]:
+    flat = faiss.IndexFlatL2(vectors.shape[1])
+    flat.add(vectors)
+    _, positions = flat.search(queries, k)
+    return [{int(p) for p in row if p >= 0} for row in positions]
+
+def measure(index: FaissIndex, queries: np.ndarray, truth: List[set], k: int,
+            latency_queries: int = 200) -> Dict:
+    """
+    一组搜索参数下的 recall@k、批量吞吐（一次 FAISS 调用）和单查询延迟。
+    扫描时 chunk_id 就是向量下标，可以直接与精确结果比较。
+    """
+    start = time.perf_counter()
+    results = index.search_batch(queries, k=k)
+    batch_seconds = time.perf_counter() - start
+
+    recalls = [len(expected & set(found)) / max(1, len(expected))
+               for (_, found), expected in zip(results, truth)]
+
+    seconds = []
+    for vector in queries[:latency_queries]:
+        start = time.perf_counter()
+        index.search(vector, k=k)
+        seconds.append(time.perf_counter() - start)
+
+    return {
+        f'recall_at_{k}': float(np.mean(recalls)),
+        'qps': len(queries) / batch_seconds if batch_seconds > 0 else 0.0,
+        'latency_ms': latency_stats(seconds)
+    }
+
+def mark_pareto(rows: List[Dict], k: int) -> List[Dict]:
+    """标记 recall-QPS 帕累托最优的配置：没有其他配置在两者上都不差且至少一项更好。"""
+    key = f'recall_at_{k}'
+    for row in rows:
+        row['pareto'] = not any(
+            other is not row and other[key] >= row[key] and other['qps'] >= row['qps']
+            and (other[key] > row[key] or other['qps'] > row['qps'])
+            for other in rows
+        )
+    return rows
+
+def sweep(vectors: np.ndarray, queries: np.ndarray, k: int = 10,
+          factories=DEFAULT_FACTORIES, ef_search=DEFAULT_EF_SEARCH, nprobe=DEFAULT_NPROBE,
+          workdir: Optional[str] = None) -> List[Dict]:
+    """
+    对每种 index_factory 构建一次 FaissIndex，再逐个搜索参数测量 recall@k（相对平坦索引的精确结果）、
+    QPS、单查询延迟、内存占用（序列化后的字节数）和构建时间。返回带 'pareto' 标记的结果行。
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    dimension = vectors.shape[1]
+    chunk_ids = list(range(len(vectors)))
+    truth = exact_neighbors(vectors, queries, k)
+
+    root = workdir or tempfile.mkdtemp(prefix="kb_sweep_")
+    rows = []
+    try:
+        for factory in factories:
+            spec = expand_factory(factory, len(vectors), dimension)
+            index = FaissIndex(index_path=os.path.join(root, "sweep.index"),
+                               meta_path=os.path.join(root, "sweep.json"),
+                               index_factory=spec, search_params="")
+            start = time.perf_counter()
+            index.build_index(vectors, chunk_ids, dimension)
+            build_seconds = time.perf_counter() - start
+            index_type = index.index_type()
+            if spec != "Flat" and index_type == "IndexFlatL2":
+                print(f"Skipping {spec}: too few vectors to train")
+                continue
+            memory = int(faiss.serialize_index(index.index).nbytes)
+
+            for params in search_param_grid(index, ef_search, nprobe):
+                index.set_search_params(params)
+                row = {'factory': spec, 'search_params': params, 'index_type': index_type,
+                       'build_seconds': build_seconds, 'memory_bytes': memory}
+                row.update(measure(index, queries, truth, k))
+                rows.append(row)
+                print(f"{spec:<18} {params:<12} recall@{k}={row[f'recall_at_{k}']:.4f} qps={row['qps']:.0f}")
+    finally:
+        if workdir is None:
+            shutil.rmtree(root, ignore_errors=True)
+    return mark_pareto(rows, k)
+
+def recommend(rows: List[Dict], k: int, target_recall: float) -> Optional[Dict]:
+    """达到目标 recall 的配置中 QPS 最高的一个。"""
+    candidates = [r for r in rows if r[f'recall_at_{k}'] >= target_recall]
+    return max(candidates, key=lambda r: r['qps']) if candidates else None
+
+def format_table(rows: List[Dict], k: int) -> str:
+    key = f'recall_at_{k}'
+    lines = [f"{'factory':<20}{'params':<14}{'recall@' + str(k):>10}{'QPS':>10}{'p50 ms':>9}"
+             f"{'memory MB':>11}{'build s':>9}  pareto"]
+    for row in sorted(rows, key=lambda r: (-r[key], -r['qps'])):
+        lines.append(f"{row['factory']:<20}{row['search_params'] or '-':<14}{row[key]:>10.4f}{row['qps']:>10.0f}"
+                     f"{row['latency_ms']['p50']:>9.3f}{row['memory_bytes'] / 1e6:>11.2f}"
+                     f"{row['build_seconds']:>9.2f}  {'*' if row['pareto'] else ''}")
+    return "\n".join(lines)
+
+def write_csv(rows: List[Dict], k: int, path: str):
+    key = f'recall_at_{k}'
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(['factory', 'search_params', 'index_type', key, 'qps', 'latency_p50_ms',
+                         'latency_p95_ms', 'memory_bytes', 'build_seconds', 'pareto'])
+        for row in rows:
+            writer.writerow([row['factory'], row['search_params'], row['index_type'], row[key], row['qps'],
+                             row['latency_ms']['p50'], row['latency_ms']['p95'], row['memory_bytes'],
+                             row['build_seconds'], row['pareto']])
+
+def load_stored_vectors(store_dir: Optional[str] = None, db_path: Optional[str] = None) -> np.ndarray:
+    """知识库中已存储的嵌入（只取数据库中仍需索引的文本块）。"""
+    from core.storage import DBManager
+    from core.vector_store import VectorStore
+
+    store = VectorStore(store_dir=store_dir)
+    db = DBManager(db_path=db_path)
+    chunk_ids = [cid for cid in db.get_indexable_chunk_ids() if cid in store]
+    if not chunk_ids:
+        raise ValueError("No stored embeddings found. Build the index from the app first.")
+    return store.get(chunk_ids)
+
+def eval_queries(eval_file: str) -> np.ndarray:
+    """用当前嵌入器（需与知识库相同的模型）嵌入 eval.jsonl 中的问题。"""
+    from core.embedder import create_embedder
+
+    with open(eval_file, "r", encoding="utf-8") as f:
+        questions = [json.loads(line)['question'] for line in f if line.strip()]
+    return np.array(create_embedder().get_embeddings(questions), dtype=np.float32)
+
+def sample_queries(vectors: np.ndarray, count: int, seed: int = 42) -> np.ndarray:
+    """随机抽取已存储的文本块向量作为查询。"""
+    rng = np.random.default_rng(seed)
+    return vectors[rng.choice(len(vectors), size=min(count, len(vectors)), replace=False)]
+
+def synthetic_data(num_chunks: int, num_queries: int, dimension: int, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+    """合成语料和查询（与 run_bench.py 相同），不需要已有知识库。"""
+    corpus = SyntheticCorpus(seed=seed)
+    embedder = FakeEmbedder(dimension=dimension, seed=seed)
+    texts, num_docs = [], 0
+    for _, _, paragraphs in corpus.documents(num_chunks):
+        texts.extend(paragraphs)
+        num_docs += 1
+    vectors = np.vstack([embedder.embed_batch(texts[i:i + 4096]) for i in range(0, len(texts), 4096)])
+    return vectors, embedder.embed_batch(corpus.queries(num_queries, num_docs))
+
+def parse_list(text: str) -> List[int]:
+    return [int(x) for x in text.split(",") if x.strip()]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recall vs. latency sweep over FAISS index configurations")
+    parser.add_argument("--source", choices=("store", "synthetic"), default="store",
+                        help="stored knowledge-base embeddings, or a synthetic corpus")
+    parser.add_argument("--store-dir", default=None, help="vector store directory (default kb_desktop/data/vectors)")
+    parser.add_argument("--db", default=None, help="database path (default kb_desktop/data/kb.sqlite)")
+    parser.add_argument("--size", default="100k", help="synthetic corpus size, e.g. 100k")
+    parser.add_argument("--dim", type=int, default=128, help="synthetic embedding dimension")
+    parser.add_argument("--queries", choices=("sample", "eval"), default="sample",
+                        help="sampled chunk vectors, or eval.jsonl questions (store source only)")
+    parser.add_argument("--eval-file", default=os.path.join("kb_desktop", "eval", "eval.jsonl"))
+    parser.add_argument("--num-queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--factory", action="append", default=None,
+                        help="index_factory string, repeatable ({nlist}/{m} are filled in); default: "
+                             + "; ".join(DEFAULT_FACTORIES))
+    parser.add_argument("--ef-search", default=",".join(map(str, DEFAULT_EF_SEARCH)))
+    parser.add_argument("--nprobe", default=",".join(map(str, DEFAULT_NPROBE)))
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None,
+                        help="result JSON or CSV (default kb_desktop/bench/results/sweep_<time>.json)")
+    args = parser.parse_args(argv)
+
+    if args.source == "synthetic":
+        vectors, queries = synthetic_data(parse_size(args.size), args.num_queries, args.dim, args.seed)
+    else:
+        vectors = load_stored_vectors(args.store_dir, args.db)
+        if args.queries == "eval":
+            queries = eval_queries(args.eval_file)
+            if queries.shape[1] != vectors.shape[1]:
+                parser.error(f"query dimension {queries.shape[1]} does not match stored vectors {vectors.shape[1]}")
+        else:
+            queries = sample_queries(vectors, args.num_queries, args.seed)
+    print(f"{len(vectors)} vectors, dimension={vectors.shape[1]}, {len(queries)} queries")
+
+    rows = sweep(vectors, queries, k=args.k, factories=args.factory or DEFAULT_FACTORIES,
+                 ef_search=parse_list(args.ef_search), nprobe=parse_list(args.nprobe))
+    print()
+    print(format_table(rows, args.k))
+
+    best = recommend(rows, args.k, args.target_recall)
+    if best:
+        print(f"\nFastest config with recall@{args.k} >= {args.target_recall}: "
+              f"FAISS_INDEX_FACTORY=\"{best['factory']}\" FAISS_SEARCH_PARAMS=\"{best['search_params']}\"")
+    else:
+        print(f"\nNo config reached recall@{args.k} >= {args.target_recall}")
+
+    output = args.output or os.path.join(
+        "kb_desktop", "bench", "results", f"sweep_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    if output.endswith(".csv"):
+        write_csv(rows, args.k, output)
+    else:
+        report = {
+            'benchmark': 'index_sweep',
+            'timestamp': datetime.now().isoformat(),
+            'environment': environment(),
+            'config': {'source': args.source, 'vectors': len(vectors), 'dimension': int(vectors.shape[1]),
+                       'queries': len(queries), 'query_source': args.queries if args.source == "store" else "synthetic",
+                       'k': args.k, 'target_recall': args.target_recall},
+            'results': rows,
+            'recommended': best
+        }
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Results written to {output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
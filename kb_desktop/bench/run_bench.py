@@ -0,0 +1,296 @@
+import sys
+import os
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+import faiss
+
+sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+from core.storage import DBManager
+from core.importer import Importer
+from core.chunker import Chunker
+from core.index_faiss import FaissIndex
+from core.index_sharded import ShardedFaissIndex
+from core.vector_store import VectorStore
+from core.indexer import Indexer
+from core.retriever import Retriever
+from bench.corpus import SyntheticCorpus
+from bench.fake_embedder import FakeEmbedder
+
+SEARCH_MODES = ("vector", "keyword", "hybrid")
+
+def parse_size(text: str) -> int:
+    """'1k' -> 1000, '100k' -> 100000, '1m' -> 1000000。"""
+    text = text.strip().lower()
+    for suffix, factor in (("k", 1000), ("m", 1000000)):
+        if text.endswith(suffix):
+            return int(float(text[:-1]) * factor)
+    return int(text)
+
+def size_label(num_chunks: int) -> str:
+    if num_chunks >= 1000000 and num_chunks % 1000000 == 0:
+        return f"{num_chunks // 1000000}m"
+    if num_chunks >= 1000 and num_chunks % 1000 == 0:
+        return f"{num_chunks // 1000}k"
+    return str(num_chunks)
+
+def latency_stats(seconds: List[float]) -> Dict:
+    """延迟分布（毫秒）: p50/p95/p99/mean/max 以及串行吞吐 qps。"""
+    ms = np.array(seconds) * 1000
+    return {
+        'p50': float(np.percentile(ms, 50)), 'p95': float(np.percentile(ms, 95)),
+        'p99': float(np.percentile(ms, 99)), 'mean': float(ms.mean()), 'max': float(ms.max()),
+        'qps': float(len(ms) / (ms.sum() / 1000)) if ms.sum() else 0.0
+    }
+
+def dir_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+def environment() -> Dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        commit = None
+    return {
+        'python': platform.python_version(), 'platform': platform.platform(),
+        'cpu_count': os.cpu_count(), 'numpy': np.__version__, 'faiss': faiss.__version__,
+        'git_commit': commit
+    }
+
+def run_size(num_chunks: int, workdir: str, k: int = 10, num_queries: int = 200, dimension: int = 128,
+             seed: int = 42, index_type: str = "flat", shard_size: int = 50000,
+             workers: Optional[int] = None, modes=SEARCH_MODES) -> Dict:
+    """
+    在 workdir 中对 num_chunks 个文本块的合成语料跑一遍完整流程，返回该规模的测量结果:
+    导入（生成文件 -> Importer）、嵌入、构建索引、磁盘占用、各检索方式的延迟和 recall@k。
+    """
+    corpus = SyntheticCorpus(seed=seed)
+    docs_dir = os.path.join(workdir, "docs")
+
+    # 1. 生成语料文件
+    start = time.perf_counter()
+    paths = corpus.write(docs_dir, num_chunks)
+    generate_seconds = time.perf_counter() - start
+
+    # 2. 导入：指纹 -> 解析 -> 分块 -> 近似去重 -> 入库
+    db_path = os.path.join(workdir, "kb.sqlite")
+    db = DBManager(db_path=db_path)
+    chunker = Chunker(max_tokens=corpus.CHUNK_TOKENS, overlap_tokens=0, paragraph_overlap=False)
+    importer = Importer(db, chunker, workers=workers)
+    start = time.perf_counter()
+    imported = importer.import_files(paths)
+    ingest_seconds = time.perf_counter() - start
+    chunk_ids = db.get_indexable_chunk_ids()
+    source_bytes = dir_size(docs_dir)
+
+    # 3. 嵌入（确定性的假嵌入器）和构建索引
+    embedder = FakeEmbedder(dimension=dimension, seed=seed)
+    store = VectorStore(store_dir=os.path.join(workdir, "vectors"))
+    if index_type == "sharded":
+        index = ShardedFaissIndex(shard_dir=os.path.join(workdir, "shards"), max_shard_size=shard_size)
+        index_files = [index.shard_dir]
+    else:
+        index = FaissIndex(index_path=os.path.join(workdir, "faiss.index"),
+                           meta_path=os.path.join(workdir, "meta.json"))
+        index_files = [index.index_path, index.meta_path]
+    indexer = Indexer(db, index, embedder, store, batch_size=4096)
+
+    start = time.perf_counter()
+    indexer.embed_missing(chunk_ids)
+    embed_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indexer.rebuild()
+    build_seconds = time.perf_counter() - start
+
+    # 4. 查询：向量检索的精确答案来自平坦索引（暴力搜索）
+    queries = corpus.queries(num_queries, len(paths))
+    query_vectors = embedder.embed_batch(queries)
+    flat = faiss.IndexFlatL2(dimension)
+    flat.add(store.get(chunk_ids))
+    _, truth_positions = flat.search(query_vectors, k)
+    truth = [{chunk_ids[p] for p in row if p >= 0} for row in truth_positions]
+
+    latency, recall = {}, None
+    if "vector" in modes:
+        seconds, recalls = [], []
+        for query, vector, expected in zip(queries, query_vectors, truth):
+            start = time.perf_counter()
+            vector = np.array(embedder.get_embedding(query), dtype=np.float32)
+            _, found = index.search(vector, k=k)
+            seconds.append(time.perf_counter() - start)
+            recalls.append(len(expected & set(found)) / max(1, len(expected)))
+        latency['vector'] = latency_stats(seconds)
+        recall = float(np.mean(recalls))
+
+    if "keyword" in modes:
+        seconds = []
+        for query in queries:
+            start = time.perf_counter()
+            db.keyword_search(query, k=k)
+            seconds.append(time.perf_counter() - start)
+        latency['keyword'] = latency_stats(seconds)
+
+    if "hybrid" in modes:
+        retriever = Retriever(db, index, embedder)
+        seconds = []
+        for query in queries:
+            start = time.perf_counter()
+            retriever.retrieve(query, k=k)
+            seconds.append(time.perf_counter() - start)
+        latency['hybrid'] = latency_stats(seconds)
+
+    return {
+        'size': size_label(num_chunks),
+        'chunks': len(chunk_ids),
+        'documents': len(paths),
+        'generate_seconds': generate_seconds,
+        'ingest': {
+            'seconds': ingest_seconds,
+            'docs_per_second': len(paths) / ingest_seconds,
+            'chunks_per_second': len(chunk_ids) / ingest_seconds,
+            'mb_per_second': source_bytes / 1e6 / ingest_seconds,
+            'failed': imported['failed']
+        },
+        'embed': {'seconds': embed_seconds, 'chunks_per_second': len(chunk_ids) / embed_seconds},
+        'build': {'seconds': build_seconds, 'index_type': index_type},
+        'size_bytes': {
+            'source': source_bytes,
+            'database': dir_size(db_path),
+            'vectors': dir_size(store.store_dir),
+            'index': sum(dir_size(path) for path in index_files if os.path.exists(path))
+        },
+        'queries': len(queries),
+        'k': k,
+        'latency_ms': latency,
+        f'recall_at_{k}': recall
+    }
+
+def run_benchmark(sizes: List[int], k: int = 10, num_queries: int = 200, dimension: int = 128,
+                  seed: int = 42, index_type: str = "flat", shard_size: int = 50000,
+                  workers: Optional[int] = None, modes=SEARCH_MODES,
+                  workdir: Optional[str] = None, keep: bool = False) -> Dict:
+    """按规模依次运行基准测试，返回可直接写成 JSON 的报告。"""
+    report = {
+        'benchmark': 'retrieval',
+        'timestamp': datetime.now().isoformat(),
+        'environment': environment(),
+        'config': {'sizes': [size_label(s) for s in sizes], 'k': k, 'queries': num_queries,
+                   'dimension': dimension, 'seed': seed, 'index_type': index_type,
+                   'shard_size': shard_size, 'workers': workers, 'modes': list(modes)},
+        'results': []
+    }
+    root = workdir or tempfile.mkdtemp(prefix="kb_bench_")
+    try:
+        for num_chunks in sizes:
+            size_dir = os.path.join(root, size_label(num_chunks))
+            shutil.rmtree(size_dir, ignore_errors=True)
+            os.makedirs(size_dir)
+            print(f"\n=== {size_label(num_chunks)} chunks ===")
+            result = run_size(num_chunks, size_dir, k=k, num_queries=num_queries, dimension=dimension,
+                              seed=seed, index_type=index_type, shard_size=shard_size,
+                              workers=workers, modes=modes)
+            report['results'].append(result)
+            print_result(result)
+            if not keep:
+                shutil.rmtree(size_dir, ignore_errors=True)
+    finally:
+        if not keep and workdir is None:
+            shutil.rmtree(root, ignore_errors=True)
+    return report
+
+def print_result(result: Dict):
+    k = result['k']
+    print(f"ingest: {result['ingest']['chunks_per_second']:.0f} chunks/s "
+          f"({result['ingest']['docs_per_second']:.1f} docs/s, {result['ingest']['seconds']:.1f}s)")
+    print(f"embed: {result['embed']['seconds']:.1f}s, build: {result['build']['seconds']:.2f}s, "
+          f"index: {result['size_bytes']['index'] / 1e6:.1f} MB, db: {result['size_bytes']['database'] / 1e6:.1f} MB")
+    for mode, stats in result['latency_ms'].items():
+        print(f"{mode:>8}: p50={stats['p50']:.2f}ms p95={stats['p95']:.2f}ms p99={stats['p99']:.2f}ms")
+    if result[f'recall_at_{k}'] is not None:
+        print(f"recall@{k}: {result[f'recall_at_{k}']:.4f}")
+
+def compare(report: Dict, baseline: Dict, tolerance: float = 0.25) -> List[str]:
+    """
+    与基线报告比较同一规模的结果，返回回退项的描述:
+    导入速率下降、p95 延迟上升超过 tolerance，或 recall 下降超过 0.01。
+    """
+    regressions = []
+    previous = {r['size']: r for r in baseline.get('results', [])}
+    for result in report['results']:
+        old = previous.get(result['size'])
+        if old is None:
+            continue
+        size = result['size']
+        rate, old_rate = result['ingest']['chunks_per_second'], old['ingest']['chunks_per_second']
+        if rate < old_rate * (1 - tolerance):
+            regressions.append(f"{size} ingest: {old_rate:.0f} -> {rate:.0f} chunks/s")
+        for mode, stats in result['latency_ms'].items():
+            old_stats = old.get('latency_ms', {}).get(mode)
+            if old_stats and stats['p95'] > old_stats['p95'] * (1 + tolerance):
+                regressions.append(f"{size} {mode} p95: {old_stats['p95']:.2f} -> {stats['p95']:.2f} ms")
+        key = f"recall_at_{result['k']}"
+        if result.get(key) is not None and old.get(key) is not None and result[key] < old[key] - 0.01:
+            regressions.append(f"{size} {key}: {old[key]:.4f} -> {result[key]:.4f}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end retrieval benchmark on a synthetic Chinese corpus")
+    parser.add_argument("--sizes", default="1k", help="comma-separated chunk counts, e.g. 1k,100k,1m")
+    parser.add_argument("--queries", type=int, default=200, help="queries per size")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dim", type=int, default=128, help="fake embedding dimension")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--index", choices=("flat", "sharded"), default="flat")
+    parser.add_argument("--shard-size", type=int, default=50000)
+    parser.add_argument("--workers", type=int, default=None, help="parser processes (IMPORT_WORKERS)")
+    parser.add_argument("--modes", default=",".join(SEARCH_MODES), help="search modes to time")
+    parser.add_argument("--output", default=None, help="result JSON (default kb_desktop/bench/results/)")
+    parser.add_argument("--baseline", default=None, help="earlier result JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown")
+    parser.add_argument("--workdir", default=None, help="keep corpora and indexes here instead of a temp dir")
+    parser.add_argument("--keep", action="store_true", help="do not delete generated data")
+    args = parser.parse_args(argv)
+
+    modes = tuple(m.strip() for m in args.modes.split(",") if m.strip())
+    unknown = set(modes) - set(SEARCH_MODES)
+    if unknown:
+        parser.error(f"unknown modes: {', '.join(sorted(unknown))}")
+
+    report = run_benchmark([parse_size(s) for s in args.sizes.split(",")], k=args.k,
+                           num_queries=args.queries, dimension=args.dim, seed=args.seed,
+                           index_type=args.index, shard_size=args.shard_size, workers=args.workers,
+                           modes=modes, workdir=args.workdir, keep=args.keep)
+
+    output = args.output or os.path.join(
+        "kb_desktop", "bench", "results", f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("No regressions against baseline.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
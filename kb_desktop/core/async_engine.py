@@ -0,0 +1,187 @@
+import os
+import asyncio
+import functools
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from core.retriever import Retriever
+from core.tracing import span, event, bind
+
+async def gather_or_cancel(*coros):
+    """
+    并发运行协程，按传入顺序返回结果；任何一个失败时取消其余协程并抛出该异常
+    （调用方被取消时也会取消全部协程）。
+    """
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if task.exception() is not None:
+                raise task.exception()
+        return [task.result() for task in tasks]
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+class AsyncDB:
+    """
+    DBManager 的异步访问层：查询在最多 pool_size 个专用线程中执行，每个线程同一时刻只占用一个 SQLite 连接。
+    事件循环不会被阻塞，并发查询数（即同时打开的连接数）受池大小限制。
+    """
+
+    def __init__(self, db, pool_size: Optional[int] = None):
+        """
+        Args:
+            db: DBManager 实例
+            pool_size: 并发查询的线程（连接）数，默认读取 ASYNC_DB_POOL，未设置时为 8
+        """
+        self.db = db
+        self.pool_size = pool_size or int(os.getenv("ASYNC_DB_POOL", "8"))
+        self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="kb-sqlite")
+
+    async def run(self, func: Callable, *args, **kwargs):
+        """在数据库线程池中调用 func（保留当前追踪上下文）。"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, bind(functools.partial(func, *args, **kwargs)))
+
+    async def keyword_search(self, query: str, k: int = 10, doc_filter: Optional[Dict] = None):
+        return await self.run(self.db.keyword_search, query, k, doc_filter)
+
+    async def get_chunk_ids_by_filter(self, doc_filter: Optional[Dict]) -> List[int]:
+        return await self.run(self.db.get_chunk_ids_by_filter, doc_filter)
+
+    async def get_chunks_by_ids(self, chunk_ids: List[int]) -> Dict[int, Dict]:
+        return await self.run(self.db.get_chunks_by_ids, chunk_ids)
+
+    async def get_neighbor_chunks(self, chunk_ids: List[int], window: int = 1) -> Dict[int, List[Dict]]:
+        return await self.run(self.db.get_neighbor_chunks, chunk_ids, window)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+class AsyncRAGEngine:
+    """
+    asyncio 版本的检索与生成流程。
+
+    一个问题内，查询嵌入（HTTP）和关键词检索（SQLite）并发执行，检索延迟约为两者中较慢的一个而不是两者之和；
+    多个问题共享同一个事件循环、嵌入/LLM 的 HTTP 连接池和数据库线程池，并发数不再受每个请求一个线程的限制。
+    融合、置信度检查、上下文装填和引用处理复用 Retriever / RAGGenerator 的同步实现。
+    """
+
+    def __init__(self, db, index, embedder, llm=None, rag=None,
+                 pool_size: Optional[int] = None, window: Optional[int] = None):
+        """
+        Args:
+            db: DBManager 实例
+            index: FaissIndex 或 ShardedFaissIndex 实例（已加载）
+            embedder: 异步嵌入器（AsyncEmbedder / ThreadedAsyncEmbedder，见 create_async_embedder）
+            llm: AsyncLLMClient，默认在需要时创建
+            rag: RAGGenerator（置信度、装填、提示和引用），默认在需要时创建
+            pool_size: 数据库线程池大小（见 AsyncDB）
+            window: 相邻块扩展窗口，默认读取 CONTEXT_WINDOW
+        """
+        self.index = index
+        self.embedder = embedder
+        self.db = AsyncDB(db, pool_size)
+        self.retriever = Retriever(db, index, embedder=None)
+        self._llm = llm
+        self._rag = rag
+        self.window = window if window is not None else int(os.getenv("CONTEXT_WINDOW", "1"))
+
+    @property
+    def llm(self):
+        if self._llm is None:
+            from core.llm import AsyncLLMClient
+            self._llm = AsyncLLMClient()
+        return self._llm
+
+    @property
+    def rag(self):
+        if self._rag is None:
+            from core.rag import RAGGenerator
+            self._rag = RAGGenerator()
+        return self._rag
+
+    async def retrieve(self, query: str, k: int = 5, doc_filter: Optional[Dict] = None) -> List[Dict]:
+        """混合检索（结果同 Retriever.retrieve）。向量分支和关键词分支并发执行，任一分支失败时取消另一个。"""
+        allowed_chunk_ids = None
+        if doc_filter:
+            with span("filter"):
+                allowed_chunk_ids = set(await self.db.get_chunk_ids_by_filter(doc_filter))
+
+        async def vector_branch():
+            with span("embed_query"):
+                vector = np.array(await self.embedder.get_embedding(query))
+            with span("vector_search", k=k):
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(
+                    None, bind(functools.partial(self.index.search, vector, k, allowed_chunk_ids))
+                )
+
+        async def keyword_branch():
+            with span("keyword_search", k=k):
+                return await self.db.keyword_search(query, k=k, doc_filter=doc_filter)
+
+        (distances, chunk_ids), keyword_results = await gather_or_cancel(vector_branch(), keyword_branch())
+
+        with span("fuse"):
+            return await self.db.run(self.retriever.fuse, distances, chunk_ids, keyword_results, k, doc_filter)
+
+    async def answer(self, query: str, k: int = 5, doc_filter: Optional[Dict] = None,
+                     on_token: Optional[Callable[[str], None]] = None) -> Dict:
+        """
+        回答一个问题（流程同界面：检索 -> 置信度检查 -> 相邻块扩展 -> 装填 -> 流式生成 -> 引用验证）。
+
+        Args:
+            on_token: 可选回调，每收到一段生成的文本调用一次
+
+        Returns:
+            {'answer', 'citations', 'chunks'（检索结果）, 'confident', 'reason', 'citations_valid', 'citation_issue'}
+        """
+        hits = await self.retrieve(query, k, doc_filter)
+        is_confident, reason = self.rag.check_confidence(hits)
+        result = {'chunks': hits, 'confident': is_confident, 'reason': reason,
+                  'citations_valid': True, 'citation_issue': None}
+        if not is_confident:
+            answer, citations = self.rag.generate_fallback_response(query, hits, reason)
+            result.update(answer=answer, citations=citations)
+            return result
+
+        expanded = await self.db.run(self.retriever.expand_neighbors, hits, self.window)
+        blocks = self.rag.pack_context(expanded)
+        messages = self.rag.build_messages(query, blocks)
+
+        parts = []
+        with span("llm_generate", model=getattr(self.llm, "model", None)) as s:
+            async for chunk in self.llm.chat(messages, stream=True):
+                if not parts and chunk:
+                    event("first_token")
+                    s.set(ttft_ms=round(s.elapsed_ms(), 1))
+                parts.append(chunk)
+                if on_token:
+                    on_token(chunk)
+            answer = "".join(parts)
+            s.set(output_chars=len(answer))
+
+        is_valid, issue = self.rag.verify_citations(answer, blocks)
+        result.update(answer=answer, citations=self.rag.extract_citations(answer, blocks),
+                      citations_valid=is_valid, citation_issue=None if is_valid else issue)
+        return result
+
+    async def answer_many(self, queries: List[str], k: int = 5, max_concurrency: int = 32) -> List[Dict]:
+        """在同一个事件循环中并发回答多个问题（最多 max_concurrency 个同时进行），按输入顺序返回。"""
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def one(query):
+            async with semaphore:
+                return await self.answer(query, k)
+
+        return await asyncio.gather(*(one(query) for query in queries))
+
+    async def close(self):
+        for client in (self.embedder, self._llm):
+            if client is not None and hasattr(client, 'close'):
+                await client.close()
+        self.db.close()
@@ -1,98 +1,340 @@
+import os
 import re
+import numpy as np
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Tuple
+
+from core.tokenizer import CHAR_CJK, CHAR_OTHER, CHAR_SPACE, TokenCounter, char_classes, get_token_counter
+
+# 句子结束符（连续的标点视为一个结束位置）
+_SENTENCE_END_PATTERN = re.compile(r'[。！？.!?]+')
+# 分块用的字符分类表（覆盖全部 Unicode 码位，查表前不需要裁剪）：
+# 低两位是 token 字符类（换行单独一类），_SENTENCE_END 位标记句末标点
+_NEWLINE = 3
+_SENTENCE_END = 4
+_CHUNK_CLASSES = np.full(0x110000, CHAR_OTHER, dtype=np.uint8)
+_CHUNK_CLASSES[:0x10000] = char_classes(np.arange(0x10000, dtype=np.uint32))
+_CHUNK_CLASSES[[ord("\n"), ord("\r")]] = _NEWLINE
+_CHUNK_CLASSES[[ord(c) for c in '。！？.!?']] |= _SENTENCE_END
+# 启发式计数下每个字符的 token 权重（以 1/4 token 计）：CJK 每字一个 token，其他字符每 4 字一个
+_TOKEN_WEIGHTS = np.zeros(4, dtype=np.int64)
+_TOKEN_WEIGHTS[CHAR_CJK] = 4
+_TOKEN_WEIGHTS[CHAR_OTHER] = 1
 
 class Chunker:
+    """
+    针对中文优化的分块器，按 token 数控制块大小。
+
+    策略:
+    1. 一次查表把文本分成字符类相同的连续段，段落（按换行分割）边界、token 数和句子结束位置
+       都在连续段上计算（连续段比字符少得多），段落只以 (start, end) 偏移表示
+    2. 相邻段落累积到 max_tokens 为止（按累计 token 数二分查找，不逐段循环）
+    3. 超过 max_tokens 的段落按 token 切分，优先在句子结束符处断开，块之间保留 overlap_tokens 的重叠
+    4. paragraph_overlap 为 True 时，跨段落开始的新块也带上前一个块结尾的重叠
+
+    输出的是原文中的字符偏移，文本只在最后按需切片一次。
+    """
+
+    # 每次向量化扫描的文本长度（限制大文本的内存占用）
+    SEGMENT_CHARS = 1 << 20
+
+    def __init__(self, max_tokens: Optional[int] = None, overlap_tokens: Optional[int] = None,
+                 paragraph_overlap: Optional[bool] = None, counter: Optional[TokenCounter] = None):
+        """
+        Args:
+            max_tokens: 每个块的最大 token 数，默认读取 CHUNK_MAX_TOKENS（300）
+            overlap_tokens: 块之间重叠的 token 数，默认读取 CHUNK_OVERLAP_TOKENS（50）
+            paragraph_overlap: 是否在段落之间也保留重叠，默认读取 CHUNK_PARAGRAPH_OVERLAP（关闭）
+            counter: token 计数器，应与嵌入模型的分词方式一致
+        """
+        self.max_tokens = max_tokens or int(os.getenv("CHUNK_MAX_TOKENS", "300"))
+        if overlap_tokens is None:
+            overlap_tokens = int(os.getenv("CHUNK_OVERLAP_TOKENS", "50"))
+        # 重叠至少要给新内容留出一半空间，否则切分无法前进
+        self.overlap_tokens = max(0, min(overlap_tokens, self.max_tokens // 2))
+        if paragraph_overlap is None:
+            paragraph_overlap = os.getenv("CHUNK_PARAGRAPH_OVERLAP", "0").lower() in ("1", "true", "yes")
+        self.paragraph_overlap = paragraph_overlap
+        self.counter = counter or get_token_counter()
+
     @staticmethod
-    def split_text(text, max_len=300, overlap=50):
+    def split_text(text, max_tokens=300, overlap_tokens=50):
+        """
+        将文本分割为文本块字符串列表（块大小和重叠都以 token 计）。
+        """
+        chunker = Chunker(max_tokens=max_tokens, overlap_tokens=overlap_tokens, paragraph_overlap=False)
+        return [text[start:end] for start, end, _ in chunker.split_spans(text)]
+
+    def chunk(self, text: str) -> List[Dict]:
+        """
+        分块并返回字典列表: {'text', 'start', 'end', 'tokens'}，偏移相对于传入的 text。
+        """
+        return [
+            {'text': text[start:end], 'start': start, 'end': end, 'tokens': tokens}
+            for start, end, tokens in self.split_spans(text)
+        ]
+
+    def split_spans(self, text: str) -> List[Tuple[int, int, int]]:
         """
-        Splits text into chunks optimized for Chinese.
-        Strategy:
-        1. Split by coarse separators (\n\n, \n)
-        2. If chunk > max_len, split by sentence endings (。！?...)
-        3. Merge small chunks to reach max_len (with overlap)
+        返回 (start, end, token 数) 列表，text[start:end] 即为文本块。
         """
         if not text:
             return []
-            
-        # 1. First cleanup
-        text = text.replace("\r\n", "\n")
-        
-        # 2. 首先按段落分割（强语义断开）
-        # 如果需要，使用先行断言保留分隔符，但简单分割对MVP更简单
-        paragraphs = text.split("\n")
-        
-        chunks = []
-        current_chunk = ""
-        
-        for para in paragraphs:
-            para = para.strip()
-            if not para:
-                continue
-                
-            # 如果添加这个段落超过 max_len，我们需要处理 current_chunk
-            if len(current_chunk) + len(para) + 1 <= max_len:
-                current_chunk += ("\n" + para) if current_chunk else para
-            else:
-                # current_chunk 已经足够满，保存它
-                if current_chunk:
-                    chunks.append(current_chunk)
-                    
-                # 现在处理新的段落。
-                # 如果段落本身很大 (> max_len)，我们需要按句子分割它
-                if len(para) > max_len:
-                    sub_chunks = Chunker._split_long_sentence(para, max_len, overlap)
-                    # 如果我们有 current_chunk，第一个 sub_chunk 可能需要重叠
-                    # 对于 MVP，只需附加所有 sub_chunks
-                    chunks.extend(sub_chunks)
-                    current_chunk = "" # 重置
+
+        spans = []
+        cur = None  # 上一个片段结尾处未完成的块 [start, end, tokens]
+
+        for starts, ends, tokens, long_paragraphs in self._paragraphs(text):
+            # 每个段落的成本为其 token 数加 1（段落之间的换行）。由累计成本一次性二分得到
+            # 从每个段落开始的块最多能并入到哪个段落之前，循环只需按块前进
+            cum = np.concatenate(([0], np.cumsum(tokens + 1)))
+            stops = (np.searchsorted(cum, cum[:-1] + self.max_tokens + 1, side='right') - 1).tolist()
+            # 循环中逐个访问的数组先转为列表（按下标取 numpy 标量比取列表元素慢得多）
+            cum, starts, ends = cum.tolist(), starts.tolist(), ends.tolist()
+            p, n = 0, len(tokens)
+
+            if cur is not None:
+                p = bisect_right(cum, self.max_tokens - cur[2]) - 1
+                if p > 0:
+                    cur[1] = ends[p - 1]
+                    cur[2] += cum[p]
+                if p < n:
+                    spans.append(tuple(cur))
+                    cur = None
+
+            while p < n:
+                q = stops[p]
+                if q == p:
+                    # 段落本身过长（连自身都放不下）：已按句子/token 切分
+                    spans.extend(long_paragraphs[p])
+                    p += 1
+                    continue
+
+                start, extra = starts[p], 0
+                if self.paragraph_overlap and spans:
+                    budget = min(self.overlap_tokens, self.max_tokens - int(tokens[p]) - 1)
+                    prev_start, prev_end, _ = spans[-1]
+                    overlap_start, overlap_tokens = self._tail(text, prev_start, prev_end, budget)
+                    if overlap_tokens:
+                        start, extra = overlap_start, overlap_tokens + 1
+                        q = bisect_right(cum, cum[p] + self.max_tokens + 1 - extra) - 1
+                span = (start, ends[q - 1], cum[q] - cum[p] - 1 + extra)
+                p = q
+                if p < n:
+                    spans.append(span)
                 else:
-                    # 用这个段落开始新的文本块，可能从前一个重用重叠
-                    # （段落的简单滑动窗口很棘手，让我们坚持简单积累）
-                    # 要正确地做重叠：从前一个文本块拿最后 N 个字符？
-                    # MVP 简化：段落之间没有重叠，仅在长段落内部
-                    current_chunk = para
-        
-        # 添加最后一部分
-        if current_chunk:
-            chunks.append(current_chunk)
-            
-        return chunks
+                    # 片段的最后一个块可能还要并入下一个片段开头的段落
+                    cur = list(span)
+
+        if cur is not None:
+            spans.append(tuple(cur))
+
+        return spans
+
+    def _paragraphs(self, text: str):
+        """
+        按片段产出 (starts, ends, token 数, 长段落)。长段落是 {段落下标: 切分好的块列表}，
+        只为超过 max_tokens 的段落计算（见 _split_long）。
+
+        段落是按换行分割、去掉首尾空白后的非空行。文本按换行对齐分成 SEGMENT_CHARS 大小的片段，
+        每个片段只查一次字符分类表，之后的计算都在字符类相同的连续段上进行：
+        段落是每行第一个到最后一个非空白连续段，句子结束于连续句末标点之后（与 _SENTENCE_END_PATTERN 一致）。
+        启发式计数下 token 数也直接由连续段得到（CJK 每字一个，其他字符每个连续串每 4 字一个）；
+        使用 tiktoken 时按片段计算 token 起点。
+        """
+        pos = 0
+        while pos < len(text):
+            seg_end = len(text)
+            if seg_end - pos > self.SEGMENT_CHARS:
+                newline = text.rfind("\n", pos, pos + self.SEGMENT_CHARS)
+                seg_end = newline + 1 if newline > pos else pos + self.SEGMENT_CHARS
+
+            segment = text[pos:seg_end]
+            codes = _CHUNK_CLASSES.take(np.frombuffer(segment.encode('utf-32-le'), dtype=np.uint32))
+            kinds = codes & 3
+            bounds = np.flatnonzero(kinds[1:] != kinds[:-1]) + 1
+            run_starts = np.concatenate(([0], bounds))
+            run_ends = np.concatenate((bounds, [len(codes)]))
+            run_kinds = kinds[run_starts]
+
+            # 段落：每行（以换行段为界）第一个到最后一个非空白段
+            visible = np.flatnonzero(run_kinds < CHAR_SPACE)
+            line = np.cumsum(run_kinds == _NEWLINE)[visible]
+            new_line = np.flatnonzero(line[1:] != line[:-1]) + 1
+            first_run = visible[np.concatenate(([0], new_line))] if len(visible) else visible
+            last_run = visible[np.concatenate((new_line - 1, [len(visible) - 1]))] if len(visible) else visible
+            starts = run_starts[first_run] + pos
+            ends = run_ends[last_run] + pos
+
+            if self.counter.encoding is None:
+                tokens, long_paragraphs = self._run_tokens(text, codes, pos, run_starts, run_ends, run_kinds,
+                                                           first_run, last_run)
+            else:
+                tokens, long_paragraphs = self._segment_tokens(text, segment, pos, starts, ends)
+            yield starts, ends, tokens, long_paragraphs
+            pos = seg_end
+
+    def _run_tokens(self, text: str, codes: np.ndarray, pos: int, run_starts: np.ndarray, run_ends: np.ndarray,
+                    run_kinds: np.ndarray, first_run: np.ndarray, last_run: np.ndarray):
+        """
+        启发式计数：由连续段得到每个段落的 token 数和长段落的切分结果，
+        不为每个 token 生成数组（CJK 段每字一个 token，其他字符段从段首起每 4 字一个）。
+        """
+        lengths = run_ends - run_starts
+        weights = _TOKEN_WEIGHTS.take(run_kinds)
+        counts = (lengths * weights + 3) >> 2
+        cum = np.concatenate(([0], np.cumsum(counts)))
+        tokens = cum[last_run + 1] - cum[first_run]
+
+        long = np.flatnonzero(tokens > self.max_tokens)
+        if not len(long):
+            return tokens, {}
+        first, last = first_run[long], last_run[long]
+        bases = cum[first]
+
+        # 句子结束于连续句末标点之后；断点为此前的 token 数，只接受恰好是 token 起点
+        # （或段落中已没有更多 token）的位置
+        is_end = codes >= _SENTENCE_END
+        sentence_ends = np.flatnonzero(is_end[:-1] & ~is_end[1:]) + 1
+        if is_end[-1]:
+            sentence_ends = np.append(sentence_ends, len(codes))
+        lo = np.searchsorted(sentence_ends, run_starts[first], side='right')
+        hi = np.searchsorted(sentence_ends, run_ends[last], side='right')
+        end_owner = np.repeat(np.arange(len(long)), hi - lo)
+        sentence_ends = sentence_ends[_ranges(lo, hi - lo)]
+        r = np.searchsorted(run_starts, sentence_ends, side='right') - 1
+        offset = (sentence_ends - run_starts[r]) * weights[r]
+        breaks = cum[r] - bases[end_owner] + ((offset + 3) >> 2)
+        at_token = (weights[r] > 0) & (offset & 3 == 0) & (sentence_ends < run_ends[r])
+        keep = at_token | (breaks == tokens[long][end_owner])
+        breaks = breaks[keep].tolist()
+        break_offsets = np.searchsorted(end_owner[keep], np.arange(len(long) + 1)).tolist()
+
+        # 按 token 下标切分，再一次性换算成字符偏移：第 g 个 token 位于其所在段的
+        # 段首之后 (g - 段内第一个 token 的序号) * 步长处（CJK 步长 1，其他字符 4）
+        totals = tokens[long].tolist()
+        windows = [self._split_long(totals[k], breaks[break_offsets[k]:break_offsets[k + 1]])
+                   for k in range(len(long))]
+        owner = np.repeat(np.arange(len(long)), [len(w) for w in windows])
+        token_indices = np.array([w for ws in windows for w in ws], dtype=np.int64).reshape(-1, 2)
+        token_indices += bases[owner, None]
+        token_runs = np.flatnonzero(counts)
+        run_cum = cum[token_runs]
+        idx = np.searchsorted(run_cum, token_indices, side='right') - 1
+        runs = token_runs[idx]
+        positions = run_starts[runs] + pos + (token_indices - run_cum[idx]) * (4 // weights[runs])
+
+        starts, ends = (run_starts[first] + pos).tolist(), (run_ends[last] + pos).tolist()
+        positions = iter(positions.ravel().tolist())
+        long_paragraphs = {}
+        for k, p in enumerate(long.tolist()):
+            long_paragraphs[p] = self._pieces(text, starts[k], ends[k], totals[k], windows[k], positions)
+        return tokens, long_paragraphs
+
+    def _segment_tokens(self, text: str, segment: str, pos: int, starts: np.ndarray, ends: np.ndarray):
+        """使用 tiktoken 时按片段计算 token 起点，得到每个段落的 token 数和长段落的切分结果。"""
+        all_starts = self.counter.token_starts(segment) + pos
+        first = np.searchsorted(all_starts, starts)
+        tokens = np.searchsorted(all_starts, ends) - first
+        long_paragraphs = {}
+        for p in np.flatnonzero(tokens > self.max_tokens).tolist():
+            start, end, total = int(starts[p]), int(ends[p]), int(tokens[p])
+            token_starts = all_starts[first[p]:first[p] + total]
+            breaks = self._sentence_breaks(self._sentence_ends(text, start, end), token_starts)
+            windows = self._split_long(total, breaks)
+            positions = iter(token_starts[np.minimum(np.array(windows).ravel(), total - 1)].tolist())
+            long_paragraphs[p] = self._pieces(text, start, end, total, windows, positions)
+        return tokens, long_paragraphs
+
+    @staticmethod
+    def _sentence_ends(text: str, start: int, end: int) -> np.ndarray:
+        """text[start:end] 中句子结束的位置（句末标点之后），升序。"""
+        return np.array([m.end() for m in _SENTENCE_END_PATTERN.finditer(text, start, end)], dtype=np.int64)
+
+    @staticmethod
+    def _sentence_breaks(ends: np.ndarray, token_starts: np.ndarray) -> List[int]:
+        """返回句子结束处的 token 下标（该下标之前的 token 以句末标点结尾），升序。"""
+        if not len(ends) or not len(token_starts):
+            return []
+        breaks = np.searchsorted(token_starts, ends)
+        # 只接受恰好落在 token 边界上的结束位置
+        at_boundary = (breaks == len(token_starts)) | (token_starts[np.minimum(breaks, len(token_starts) - 1)] == ends)
+        return breaks[at_boundary].tolist()
 
     @staticmethod
-    def _split_long_sentence(text, max_len, overlap):
-        """
-        按句子分隔符分割长字符串。
-        """
-        # 用于按中文句子结束符分割的正则表达式
-        # split 返回: [part1, sep1, part2, sep2, ...]
-        pattern = r'([。！？.!?])' 
-        parts = re.split(pattern, text)
-        
-        sentences = []
-        # 重新组装带标点的句子
-        for i in range(0, len(parts), 2):
-            sent = parts[i]
-            if i + 1 < len(parts):
-                sent += parts[i+1] # 把标点加回来
-            if sent.strip():
-                sentences.append(sent)
-        
-        chunks = []
-        current_chunk = ""
-        
-        for sent in sentences:
-            if len(current_chunk) + len(sent) <= max_len:
-                current_chunk += sent
+    def _pieces(text: str, start: int, end: int, total: int, windows: List[Tuple[int, int]],
+                positions) -> List[Tuple[int, int, int]]:
+        """
+        把长段落 text[start:end] 的 token 窗口换算成 (start, end, token 数)。
+        positions 依次给出每个窗口 (i, j) 中第 i、j 个 token 的起点；块在第 j 个 token 之前结束（去掉结尾空白）。
+        """
+        pieces = []
+        for i, j in windows:
+            piece_start, cut = next(positions), next(positions)
+            if j >= total:
+                cut = end
             else:
-                if current_chunk:
-                    chunks.append(current_chunk)
-                
-                # 重叠逻辑：用前一个文本块的结尾开始新文本块
-                # 对于 MVP 的简化：只是重新开始还是带一点上下文？
-                # 让我们从 current_chunk 的结尾拿 'overlap' 个字符（如果可能）
-                overlap_text = current_chunk[-overlap:] if len(current_chunk) > overlap else ""
-                current_chunk = overlap_text + sent
-        
-        if current_chunk:
-            chunks.append(current_chunk)
-            
-        return chunks
+                while cut > start and text[cut - 1].isspace():
+                    cut -= 1
+            pieces.append((piece_start, cut, j - i))
+        return pieces
+
+    def _split_long(self, total: int, breaks: List[int]) -> List[Tuple[int, int]]:
+        """
+        按 token 窗口切分含 total 个 token 的长段落，返回各块的 token 下标区间 (i, j)。
+        窗口内有句子结束符（breaks 为句子结束处的 token 下标）时在最后一个句子结束处断开；
+        下一个窗口回退 overlap_tokens 个 token，并尽量从句子开头开始。
+        """
+        # 每个窗口都会执行的循环，属性和常量先取到局部变量
+        max_tokens, overlap, half = self.max_tokens, self.overlap_tokens, self.max_tokens // 2
+        windows = []
+        i = prev_j = 0
+
+        while i < total:
+            j = i + max_tokens
+            if j >= total:
+                windows.append((i, total))
+                break
+
+            # 最后一个句子断点（至少保留半个窗口且必须包含新内容，避免产生过小或重复的块）
+            b = bisect_right(breaks, j) - 1
+            if b >= 0 and breaks[b] > prev_j and breaks[b] - i >= half:
+                j = breaks[b]
+            windows.append((i, j))
+
+            prev_j = j
+            next_i = j - overlap
+            if overlap:
+                # 在重叠窗口内寻找第一个句子开头
+                b = bisect_left(breaks, next_i)
+                if b < len(breaks) and breaks[b] < j:
+                    next_i = breaks[b]
+            i = next_i if next_i > i else i + 1
+
+        return windows
+
+    def _tail(self, text: str, start: int, end: int, budget: int) -> Tuple[int, int]:
+        """
+        返回 text[start:end] 结尾不超过 budget 个 token 的部分的起始偏移及其 token 数，
+        尽量从句子开头开始。
+        """
+        if budget <= 0:
+            return end, 0
+        token_starts = self.counter.token_starts(text[start:end]) + start
+        if not len(token_starts):
+            return end, 0
+
+        total = len(token_starts)
+        breaks = self._sentence_breaks(self._sentence_ends(text, start, end), token_starts)
+        t = max(0, total - budget)
+        b = bisect_left(breaks, t)
+        if b < len(breaks) and breaks[b] < total:
+            t = breaks[b]
+        return int(token_starts[t]), total - t
+
+def _ranges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """拼接 arange(start, start + count)（向量化，不逐段循环）。"""
+    counts = np.asarray(counts, dtype=np.int64)
+    total = int(counts.sum())
+    offsets = np.arange(total, dtype=np.int64) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(np.asarray(starts, dtype=np.int64), counts) + offsets
@@ -0,0 +1,82 @@
+import os
+import zlib
+from typing import Optional, Union
+
+# 压缩数据的前缀，用于识别编码方式；未压缩的数据保持为 TEXT，以兼容旧数据
+_ZLIB_MAGIC = b"KZ1"
+_ZSTD_MAGIC = b"KS1"
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+class TextCodec:
+    """
+    文档内容的可选压缩编解码器（文本块文本不压缩，以便关键词检索直接匹配）。
+
+    codec:
+        "none"  不压缩，原样保存为 TEXT
+        "zlib"  标准库 zlib
+        "zstd"  zstandard（未安装时回退到 zlib）
+
+    压缩结果保存为 BLOB（带前缀），只有比原文更小时才使用压缩结果。
+    解码时按前缀识别，因此不同编码方式写入的数据可以混合存在。
+    """
+
+    def __init__(self, codec: Optional[str] = None, level: Optional[int] = None, min_size: int = 256):
+        """
+        Args:
+            codec: 编码方式，默认读取 CONTENT_COMPRESSION 环境变量（none）
+            level: 压缩级别，默认 zlib 6 / zstd 3
+            min_size: 小于该字节数的文本不压缩（收益太小）
+        """
+        codec = (codec or os.getenv("CONTENT_COMPRESSION", "none")).lower()
+        if codec not in ("none", "zlib", "zstd"):
+            raise ValueError(f"Unknown compression codec: {codec}")
+        if codec == "zstd" and zstandard is None:
+            print("zstandard is not installed, falling back to zlib compression")
+            codec = "zlib"
+
+        self.codec = codec
+        self.level = level
+        self.min_size = min_size
+
+    def encode(self, text: Optional[str]) -> Union[str, bytes, None]:
+        """压缩文本；不压缩或压缩无收益时返回原字符串。"""
+        if text is None or self.codec == "none":
+            return text
+
+        raw = text.encode('utf-8')
+        if len(raw) < self.min_size:
+            return text
+
+        if self.codec == "zstd":
+            # zstandard 的压缩器对象不是线程安全的，每次创建（开销很小）
+            packed = _ZSTD_MAGIC + zstandard.ZstdCompressor(level=self.level or 3).compress(raw)
+        else:
+            packed = _ZLIB_MAGIC + zlib.compress(raw, self.level or 6)
+
+        return packed if len(packed) < len(raw) else text
+
+    @staticmethod
+    def stored_size(value: Union[str, bytes, None]) -> int:
+        """数据库中保存的字节数（TEXT 按 UTF-8 计）。"""
+        if value is None:
+            return 0
+        return len(value.encode('utf-8')) if isinstance(value, str) else len(value)
+
+    def decode(self, value: Union[str, bytes, None]) -> Optional[str]:
+        """解码 encode() 的结果；TEXT 值原样返回。"""
+        if value is None or isinstance(value, str):
+            return value
+
+        value = bytes(value)
+        if value.startswith(_ZLIB_MAGIC):
+            return zlib.decompress(value[len(_ZLIB_MAGIC):]).decode('utf-8')
+        if value.startswith(_ZSTD_MAGIC):
+            if zstandard is None:
+                raise RuntimeError("Content is zstd-compressed but zstandard is not installed")
+            return zstandard.ZstdDecompressor().decompress(value[len(_ZSTD_MAGIC):]).decode('utf-8')
+        # 未知前缀的 BLOB 按 UTF-8 文本处理
+        return value.decode('utf-8')
@@ -0,0 +1,168 @@
+import os
+from typing import Dict, List, Optional
+
+from core.tokenizer import TokenCounter, get_token_counter
+
+# 默认上下文 token 预算（仅文档片段部分，不含问题和指令）
+DEFAULT_TOKEN_BUDGET = 2000
+# 每个文档块标题（编号 + 来源）的大致 token 开销
+BLOCK_OVERHEAD_TOKENS = 12
+
+class ContextPacker:
+    """
+    在 token 预算内按分数装填检索到的文本块。
+
+    - 按相似度从高到低依次选择，直到预算用完（相邻扩展块排在所有命中块之后）
+    - 第一个入选的块本身超出预算时截断到预算以内，而不是返回空上下文
+    - 去除完全重复的文本块
+    - 同一文档中相邻的文本块（chunk_index 连续）合并为一个块，并去掉分块器产生的重叠部分
+    """
+
+    def __init__(self, token_budget: Optional[int] = None, counter: Optional[TokenCounter] = None,
+                 min_overlap: int = 5, max_overlap: int = 200):
+        """
+        Args:
+            token_budget: 上下文 token 预算，默认读取 CONTEXT_TOKEN_BUDGET 环境变量
+            counter: token 计数器
+            min_overlap: 认定为重叠的最少字符数（避免把偶然相同的一两个字当作重叠）
+            max_overlap: 检查重叠的最大字符数
+        """
+        if token_budget is None:
+            token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", DEFAULT_TOKEN_BUDGET))
+        self.token_budget = token_budget
+        self.counter = counter or get_token_counter()
+        self.min_overlap = min_overlap
+        self.max_overlap = max_overlap
+
+    def pack(self, context_chunks: List[Dict]) -> List[Dict]:
+        """
+        装填上下文。已经装填过的块（带 'packed' 标记）原样返回。
+
+        Args:
+            context_chunks: 字典列表，包含键 'text', 'filename'，可选 'chunk_id',
+                            'similarity', 'doc_id', 'chunk_index', 'window_distance'
+
+        Returns:
+            按最高分降序排列的文档块列表，每个块包含:
+            'text', 'filename', 'chunk_id'（最高分的块）, 'chunk_ids', 'doc_id',
+            'similarity'（块内最高分）, 'tokens', 'also_in', 'packed'
+        """
+        if not context_chunks:
+            return []
+        if all(chunk.get('packed') for chunk in context_chunks):
+            return context_chunks
+
+        # 命中块优先，相邻扩展块（window_distance > 0）按距离由近到远，其次按分数
+        ranked = sorted(context_chunks, key=lambda c: (c.get('window_distance', 0), -c.get('similarity', 0)))
+
+        selected = []  # 入选的原始文本块
+        seen_texts = set()
+        by_position = {}  # (doc_id, chunk_index) -> 入选的文本块
+        used = 0
+
+        for chunk in ranked:
+            text = chunk['text']
+            if text in seen_texts:
+                continue
+
+            # 增量成本：与已入选的相邻块合并时，重叠部分不再重复计入
+            cost = self._merged_cost(chunk, by_position)
+            if used + cost > self.token_budget:
+                if selected:
+                    continue
+                chunk = self._truncate(chunk)
+                if chunk is None:
+                    continue
+                cost = self.counter.count(chunk['text']) + BLOCK_OVERHEAD_TOKENS
+
+            used += cost
+            seen_texts.add(text)
+            selected.append(chunk)
+            position = self._position(chunk)
+            if position is not None:
+                by_position[position] = chunk
+
+        return self._merge(selected)
+
+    def _merged_cost(self, chunk: Dict, by_position: Dict) -> int:
+        text = chunk['text']
+        position = self._position(chunk)
+        if position is None:
+            return self.counter.count(text) + BLOCK_OVERHEAD_TOKENS
+
+        doc_id, index = position
+        prev_chunk = by_position.get((doc_id, index - 1))
+        next_chunk = by_position.get((doc_id, index + 1))
+        start = self._overlap(prev_chunk['text'], text) if prev_chunk else 0
+        end = len(text) - self._overlap(text, next_chunk['text']) if next_chunk else len(text)
+        cost = self.counter.count(text[start:max(start, end)])
+        if prev_chunk is None and next_chunk is None:
+            cost += BLOCK_OVERHEAD_TOKENS
+        return cost
+
+    def _truncate(self, chunk: Dict) -> Optional[Dict]:
+        """
+        把超出预算的块截断到预算以内（预算不足以放下任何内容时返回 None）。
+        截断的块不再与相邻块合并：它的结尾已不是原文的结尾。
+        """
+        text = self.counter.truncate(chunk['text'], self.token_budget - BLOCK_OVERHEAD_TOKENS)
+        if not text:
+            return None
+        return dict(chunk, text=text, chunk_index=None)
+
+    def _merge(self, selected: List[Dict]) -> List[Dict]:
+        """把同一文档中连续的文本块合并为一个块。"""
+        groups = []  # 每组是按 chunk_index 排序的连续文本块
+        positioned = [c for c in selected if self._position(c) is not None]
+        positioned.sort(key=self._position)
+
+        for chunk in positioned:
+            doc_id, index = self._position(chunk)
+            if groups:
+                last = groups[-1][-1]
+                last_doc, last_index = self._position(last)
+                if last_doc == doc_id and last_index == index - 1:
+                    groups[-1].append(chunk)
+                    continue
+            groups.append([chunk])
+
+        groups.extend([c] for c in selected if self._position(c) is None)
+
+        blocks = []
+        for group in groups:
+            text = group[0]['text']
+            for prev, chunk in zip(group, group[1:]):
+                text += chunk['text'][self._overlap(prev['text'], chunk['text']):]
+
+            best = max(group, key=lambda c: c.get('similarity', 0))
+            also_in = []
+            for chunk in group:
+                also_in.extend(name for name in chunk.get('also_in', ()) if name not in also_in)
+            blocks.append({
+                'text': text,
+                'filename': best['filename'],
+                'chunk_id': best.get('chunk_id'),
+                'chunk_ids': [c.get('chunk_id') for c in group],
+                'doc_id': best.get('doc_id'),
+                'similarity': best.get('similarity', 0),
+                'tokens': self.counter.count(text),
+                'also_in': also_in,
+                'packed': True
+            })
+
+        blocks.sort(key=lambda b: b['similarity'], reverse=True)
+        return blocks
+
+    def _overlap(self, left: str, right: str) -> int:
+        """返回 left 的后缀与 right 的前缀重叠的最大长度（小于 min_overlap 时视为 0）。"""
+        limit = min(len(left), len(right), self.max_overlap)
+        for size in range(limit, self.min_overlap - 1, -1):
+            if left.endswith(right[:size]):
+                return size
+        return 0
+
+    @staticmethod
+    def _position(chunk: Dict):
+        if chunk.get('doc_id') is None or chunk.get('chunk_index') is None:
+            return None
+        return chunk['doc_id'], chunk['chunk_index']
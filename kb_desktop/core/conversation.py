@@ -0,0 +1,193 @@
+import os
+import re
+import numpy as np
+from typing import Callable, Dict, List, Optional
+
+from core.tokenizer import TokenCounter
+from core.tracing import span
+
+# 对话历史（此前各轮的问题和回答）的默认 token 预算
+DEFAULT_HISTORY_BUDGET = 1000
+# 追问改写后的问题与上次检索所用问题的嵌入余弦相似度达到该值时，复用上次的检索结果。
+# 只对追问生效：不同嵌入模型给无关问题的相似度差别很大（例如 ada-002 普遍在 0.7 以上），
+# 单靠阈值无法区分新问题
+DEFAULT_REUSE_SIMILARITY = 0.85
+
+# 追问只认明确的形式：以“呢”结尾、包含指代上文的词，或以承接词开头的短问题。
+# 以“如果”“这”“其”等开头的完整问题通常是独立的，不算追问
+_FOLLOW_UP_SUFFIXES = ('呢', '呢？', '呢?')
+_FOLLOW_UP_WORDS = ('它', '这个', '这些', '上述', '刚才', '前面提到')
+_FOLLOW_UP_PREFIXES = ('那', '那么', '还有', '另外')
+# 以承接词开头时只把不超过该字数（不含空白）的问题当作追问
+_SHORT_FOLLOW_UP_CHARS = 8
+# 回答末尾的引用行：编号只对当轮的上下文有效，不放入历史
+_CITATION_LINE = re.compile(r'\n*【引用】.*$', re.S)
+_FALLBACK_HISTORY = "（知识库中没有找到足够可靠的相关内容，未作回答。）"
+
+class Conversation:
+    """
+    多轮对话会话。
+
+    - 历史：此前各轮的问题和回答保存在按 token 预算截断的缓冲区中（超出时丢弃最早的轮次），
+      作为 user/assistant 消息放在本轮问题之前；
+    - 改写：追问在检索前改写为独立问题。默认（heuristic）在追问前拼接当前话题的问题；
+      CONVERSATION_CONDENSE=llm 时由 LLM 根据历史改写，off 时不改写；
+    - 复用：追问改写后的问题与上次检索所用问题的嵌入相似度达到阈值（且 k 和检索范围相同）时，
+      直接复用上次的检索结果和装填好的上下文，跳过索引检索、关键词检索和相邻块扩展；
+      不是追问的问题总是重新检索。
+    """
+
+    def __init__(self, retriever, rag, history_budget: Optional[int] = None,
+                 reuse_similarity: Optional[float] = None, condense: Optional[str] = None,
+                 window: Optional[int] = None, counter: Optional[TokenCounter] = None):
+        """
+        Args:
+            retriever: Retriever 实例
+            rag: RAGGenerator 实例
+            history_budget: 历史 token 预算，默认读取 CONVERSATION_HISTORY_BUDGET
+            reuse_similarity: 复用检索结果的相似度阈值，默认读取 CONVERSATION_REUSE_SIMILARITY
+            condense: 追问改写方式 heuristic / llm / off，默认读取 CONVERSATION_CONDENSE
+            window: 相邻块扩展窗口，默认读取 CONTEXT_WINDOW
+            counter: token 计数器
+        """
+        self.retriever = retriever
+        self.rag = rag
+        self.history_budget = history_budget or int(
+            os.getenv("CONVERSATION_HISTORY_BUDGET", DEFAULT_HISTORY_BUDGET))
+        if reuse_similarity is None:
+            reuse_similarity = float(os.getenv("CONVERSATION_REUSE_SIMILARITY", str(DEFAULT_REUSE_SIMILARITY)))
+        self.reuse_similarity = reuse_similarity
+        self.condense_mode = (condense or os.getenv("CONVERSATION_CONDENSE", "heuristic")).lower()
+        if self.condense_mode not in ("heuristic", "llm", "off"):
+            raise ValueError(f"Unknown condense mode: {self.condense_mode}")
+        self.window = window if window is not None else int(os.getenv("CONTEXT_WINDOW", "1"))
+        self.counter = counter or TokenCounter()
+
+        self.turns: List[Dict] = []   # {'question', 'standalone', 'answer', 'reused', 'tokens'}
+        self._topic = None            # 当前话题的独立问题，追问按它改写
+        self._cache = None            # 最近一次检索：查询嵌入、k、范围、检索结果和装填好的上下文
+
+    def reset(self):
+        """开始新对话：清空历史、话题和检索缓存。"""
+        self.turns = []
+        self._topic = None
+        self._cache = None
+
+    def ask(self, query: str, k: int = 5, doc_filter: Optional[Dict] = None,
+            on_stage: Optional[Callable[[str, int], None]] = None) -> Dict:
+        """
+        在会话中回答一个问题（追问改写 -> 检索或复用 -> 置信度检查 -> 带历史生成 -> 引用验证）。
+
+        Returns:
+            {'answer', 'citations', 'chunks', 'context_blocks', 'confident', 'reason',
+             'citations_valid', 'citation_issue', 'standalone_query', 'reused'}
+        """
+        def stage(message, percent):
+            if on_stage:
+                on_stage(message, percent)
+
+        with span("condense", mode=self.condense_mode) as s:
+            follow_up = self.is_follow_up(query)
+            standalone = self.condense(query)
+            s.set(rewritten=standalone != query)
+        if standalone == query or self.condense_mode == "llm":
+            self._topic = standalone
+
+        stage("正在嵌入查询...", 30)
+        with span("embed_query"):
+            query_vector = np.array(self.retriever.embedder.get_embedding(standalone))
+
+        cache = self._cache
+        reused = follow_up and cache is not None and cache['k'] == k and cache['doc_filter'] == doc_filter \
+            and _cosine(query_vector, cache['vector']) >= self.reuse_similarity
+        if reused:
+            hits, blocks = cache['hits'], cache['blocks']
+        else:
+            hits = self.retriever.retrieve(standalone, k, doc_filter, on_stage, query_vector=query_vector)
+            blocks = None
+            self._cache = {'vector': query_vector, 'k': k, 'doc_filter': doc_filter, 'hits': hits, 'blocks': None}
+
+        is_confident, reason = self.rag.check_confidence(hits)
+        result = {'chunks': hits, 'confident': is_confident, 'reason': reason, 'context_blocks': [],
+                  'citations_valid': True, 'citation_issue': None,
+                  'standalone_query': standalone, 'reused': reused}
+        if not is_confident:
+            answer, citations = self.rag.generate_fallback_response(standalone, hits, reason)
+            result.update(answer=answer, citations=citations)
+            self._add_turn(query, standalone, _FALLBACK_HISTORY, reused)
+            return result
+
+        if blocks is None:
+            expanded = self.retriever.expand_neighbors(hits, window=self.window)
+            blocks = self.rag.pack_context(expanded)
+            self._cache['blocks'] = blocks
+
+        stage("正在生成回答...", 85)
+        answer, citations = self.rag.generate_answer(query, blocks, history=self.history_messages())
+        is_valid, issue = self.rag.verify_citations(answer, blocks)
+        result.update(answer=answer, citations=citations, context_blocks=blocks,
+                      citations_valid=is_valid, citation_issue=None if is_valid else issue)
+        self._add_turn(query, standalone, _CITATION_LINE.sub('', answer).strip(), reused)
+        return result
+
+    def is_follow_up(self, query: str) -> bool:
+        """问题是否依赖上文（以“呢”结尾、包含指代词，或以承接词开头的短问题）。"""
+        if not self.turns:
+            return False
+        text = query.strip()
+        if text.endswith(_FOLLOW_UP_SUFFIXES) or any(word in text for word in _FOLLOW_UP_WORDS):
+            return True
+        return text.startswith(_FOLLOW_UP_PREFIXES) and len("".join(text.split())) <= _SHORT_FOLLOW_UP_CHARS
+
+    def condense(self, query: str) -> str:
+        """把追问改写为可以独立检索的问题；不是追问时原样返回。"""
+        if self.condense_mode == "off" or not self._topic or not self.is_follow_up(query):
+            return query
+        if self.condense_mode == "llm":
+            rewritten = self._condense_with_llm(query)
+            if rewritten:
+                return rewritten
+        return f"{self._topic} {query}"
+
+    def history_messages(self) -> List[Dict[str, str]]:
+        """此前各轮的 user/assistant 消息（总 token 数不超过预算，最早的轮次先被丢弃）。"""
+        messages = []
+        for turn in self.turns:
+            messages.append({"role": "user", "content": turn['question']})
+            messages.append({"role": "assistant", "content": turn['answer']})
+        return messages
+
+    def history_tokens(self) -> int:
+        return sum(turn['tokens'] for turn in self.turns)
+
+    def _add_turn(self, question: str, standalone: str, answer: str, reused: bool):
+        # 单轮超出预算时截断回答，再从最早的轮次开始丢弃直到总数不超过预算
+        question_tokens = self.counter.count(question)
+        answer = self._truncate(answer, max(self.history_budget - question_tokens, 0))
+        self.turns.append({'question': question, 'standalone': standalone, 'answer': answer, 'reused': reused,
+                           'tokens': question_tokens + self.counter.count(answer)})
+        while self.turns and self.history_tokens() > self.history_budget:
+            self.turns.pop(0)
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        spans = self.counter.spans(text)
+        if len(spans) <= max_tokens:
+            return text
+        return text[:spans[max_tokens - 1][1]] if max_tokens > 0 else ""
+
+    def _condense_with_llm(self, query: str) -> Optional[str]:
+        history = "\n".join(f"{'用户' if m['role'] == 'user' else '助手'}: {m['content']}"
+                            for m in self.history_messages())
+        messages = [
+            {"role": "system", "content": "你负责把对话中的追问改写为可以独立检索的完整问题。只输出改写后的问题，不要回答。"},
+            {"role": "user", "content": f"对话历史:\n{history}\n\n追问: {query}\n\n改写后的问题:"}
+        ]
+        text = "".join(self.rag.llm.chat(messages, stream=False)).strip()
+        # LLMClient 出错时以文本形式返回错误信息
+        if not text or text.startswith("调用 LLM 时出错"):
+            return None
+        return text.splitlines()[0].strip()
+
+def _cosine(a: np.ndarray, b: np.ndarray) -> float:
+    norm = float(np.linalg.norm(a) * np.linalg.norm(b))
+    return float(np.dot(a, b)) / norm if norm > 0 else 0.0
@@ -0,0 +1,159 @@
+import os
+import re
+import numpy as np
+from typing import Dict, List, Optional
+
+_MASK64 = (1 << 64) - 1
+_WHITESPACE_PATTERN = re.compile(r'[\s　]+')
+_DIGITS_PATTERN = re.compile(r'\d+')
+_BIT_WEIGHTS = np.uint64(1) << np.arange(64, dtype=np.uint64)
+
+def simhash(text: str, shingle_size: int = 4) -> int:
+    """
+    计算文本的 64 位 SimHash（无符号整数）。
+
+    特征为去掉空白、数字归一（页码、编号不影响指纹）后的字符 shingle_size-gram；
+    在码位数组上用多项式滚动哈希一次性算出所有 n-gram 的哈希，再经 splitmix64 混合后按位投票。
+    近似的文本得到汉明距离很小的指纹。
+    """
+    text = _DIGITS_PATTERN.sub("0", _WHITESPACE_PATTERN.sub("", text.lower()))
+    if not text:
+        return 0
+
+    codepoints = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    size = min(shingle_size, len(codepoints))
+    with np.errstate(over='ignore'):
+        hashes = np.zeros(len(codepoints) - size + 1, dtype=np.uint64)
+        for j in range(size):
+            hashes = hashes * np.uint64(0x100000001B3) + codepoints[j:len(codepoints) - size + 1 + j]
+
+        # splitmix64 终结函数，使各个位近似独立
+        hashes ^= hashes >> np.uint64(30)
+        hashes *= np.uint64(0xBF58476D1CE4E5B9)
+        hashes ^= hashes >> np.uint64(27)
+        hashes *= np.uint64(0x94D049BB133111EB)
+        hashes ^= hashes >> np.uint64(31)
+
+    ones = ((hashes[:, None] & _BIT_WEIGHTS) != 0).sum(axis=0)
+    bits = ones * 2 > len(hashes)
+    return int(np.bitwise_or.reduce(_BIT_WEIGHTS[bits])) if bits.any() else 0
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin((a ^ b) & _MASK64).count("1")
+
+def to_signed(value: int) -> int:
+    """无符号 64 位 -> SQLite INTEGER（有符号 64 位）。"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def to_unsigned(value: int) -> int:
+    return value & _MASK64
+
+class NearDuplicateIndex:
+    """
+    SimHash 的 LSH 索引：把 64 位指纹分成 max_distance + 1 段，
+    由抽屉原理，汉明距离不超过 max_distance 的两个指纹至少有一段完全相同，
+    因此只需比较至少一段相同的候选。
+    """
+
+    def __init__(self, max_distance: int = 3):
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        width = 64 // bands
+        self._bands = [(i * width, 64 if i == bands - 1 else (i + 1) * width) for i in range(bands)]
+        self._buckets: Dict[tuple, List[tuple]] = {}
+
+    def _keys(self, fingerprint: int):
+        for i, (low, high) in enumerate(self._bands):
+            yield i, (fingerprint >> low) & ((1 << (high - low)) - 1)
+
+    def add(self, key, fingerprint: int):
+        for band_key in self._keys(fingerprint):
+            self._buckets.setdefault(band_key, []).append((fingerprint, key))
+
+    def find(self, fingerprint: int) -> Optional[object]:
+        """返回汉明距离不超过 max_distance 的最近的已有键，没有时返回 None。"""
+        best, best_distance = None, self.max_distance + 1
+        for band_key in self._keys(fingerprint):
+            for candidate, key in self._buckets.get(band_key, ()):
+                distance = hamming_distance(candidate, fingerprint)
+                if distance < best_distance:
+                    best, best_distance = key, distance
+                    if distance == 0:
+                        return best
+        return best
+
+class ChunkDeduplicator:
+    """
+    近似重复文本块检测（页眉、页脚、制度模板等）。
+
+    每个文本块计算 SimHash；与已有的规范块（canonical chunk）近似重复的文本块记录 canonical_id，
+    不单独嵌入和索引，检索命中规范块时仍保留其所属的全部文档用于引用。
+    """
+
+    def __init__(self, db, max_distance: Optional[int] = None, min_chars: int = 20):
+        """
+        Args:
+            db: DBManager 实例
+            max_distance: 判定为近似重复的最大汉明距离，默认读取 NEAR_DUP_DISTANCE（3）；
+                          小于 0 时关闭检测
+            min_chars: 短于该长度的文本块不参与去重（指纹不可靠）
+        """
+        self.db = db
+        if max_distance is None:
+            max_distance = int(os.getenv("NEAR_DUP_DISTANCE", "3"))
+        self.max_distance = max_distance
+        self.min_chars = min_chars
+        self._index = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_distance >= 0
+
+    def _get_index(self) -> NearDuplicateIndex:
+        if self._index is None:
+            self._index = NearDuplicateIndex(self.max_distance)
+            for chunk_id, fingerprint in self.db.get_canonical_simhashes():
+                self._index.add(chunk_id, to_unsigned(fingerprint))
+        return self._index
+
+    def assign(self, chunks: List[Dict]) -> List[Dict]:
+        """
+        为一个文档的文本块计算指纹并查找规范块，返回带有以下键的新字典列表:
+            'simhash'       有符号 64 位指纹
+            'canonical_id'  与已入库的规范块重复时为其 chunk_id
+            'duplicate_of'  与本批次中更早的文本块重复时为其下标
+        """
+        if not self.enabled:
+            return chunks
+
+        index = self._get_index()
+        batch = NearDuplicateIndex(self.max_distance)
+        assigned = []
+        for i, chunk in enumerate(chunks):
+            chunk = dict(chunk)
+            if len(chunk['text']) >= self.min_chars:
+                fingerprint = simhash(chunk['text'])
+                chunk['simhash'] = to_signed(fingerprint)
+                canonical_id = index.find(fingerprint)
+                if canonical_id is not None:
+                    chunk['canonical_id'] = canonical_id
+                else:
+                    earlier = batch.find(fingerprint)
+                    if earlier is not None:
+                        chunk['duplicate_of'] = earlier
+                    else:
+                        batch.add(i, fingerprint)
+            assigned.append(chunk)
+        return assigned
+
+    def register(self, chunk_ids: List[int], chunks: List[Dict]):
+        """把新入库的规范块加入索引，使后续文档可以与之去重。"""
+        if not self.enabled or self._index is None:
+            return
+        for chunk_id, chunk in zip(chunk_ids, chunks):
+            if 'simhash' in chunk and 'canonical_id' not in chunk and 'duplicate_of' not in chunk:
+                self._index.add(chunk_id, to_unsigned(chunk['simhash']))
+
+    def invalidate(self):
+        """规范块被删除或替换后调用，下次使用时从数据库重新加载索引。"""
+        self._index = None
@@ -1,12 +1,43 @@
 import os
-from openai import OpenAI
-from typing import List
+import re
+import zlib
+import time
+import queue
+import asyncio
+import threading
+import numpy as np
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from openai import OpenAI, AsyncOpenAI
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
 
+from core.tracing import current_span
+
 # 从 .env 文件加载环境变量（如果存在）
 load_dotenv()
 
-class Embedder:
+class BaseEmbedder:
+    """
+    嵌入器接口。所有后端都提供 get_embeddings / get_embedding / get_dimension。
+    """
+
+    model = None
+
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+    def get_embedding(self, text: str) -> List[float]:
+        return self.get_embeddings([text])[0]
+
+    def get_dimension(self) -> int:
+        """
+        通过实际嵌入一段探测文本获取维度（结果会缓存）。
+        """
+        if getattr(self, '_dimension', None) is None:
+            self._dimension = len(self.get_embedding("维度探测"))
+        return self._dimension
+
+class Embedder(BaseEmbedder):
     """
     支持 OpenAI 兼容 API 的嵌入适配器 (OpenAI v1.x)。
     """
@@ -18,6 +49,7 @@ class Embedder:
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
         self.base_url = base_url or os.getenv("OPENAI_BASE_URL")
         self.model = model or os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+        self._dimension = None
         
         if not self.api_key:
             raise ValueError(
@@ -55,13 +87,19 @@ class Embedder:
             # 回退或错误
             raise Exception(f"Failed to get embeddings: {str(e)}")
     
-    def get_embedding(self, text: str) -> List[float]:
-        return self.get_embeddings([text])[0]
-    
     def get_dimension(self) -> int:
         """
         获取此模型的嵌入维度。
+        优先通过一次 API 调用探测真实维度，失败时回退到已知模型的维度。
         """
+        if self._dimension is not None:
+            return self._dimension
+        
+        try:
+            return super().get_dimension()
+        except Exception as e:
+            print(f"Dimension probe failed, using known dimension: {e}")
+        
         # 已知模型的字典
         known_dims = {
             "text-embedding-ada-002": 1536,
@@ -69,3 +107,323 @@ class Embedder:
             "text-embedding-3-large": 3072,
         }
         return known_dims.get(self.model, 1536)
+
+class _BatchedLocalEmbedder(BaseEmbedder):
+    """
+    本地嵌入器的公共部分：把输入拆分为批次并在线程池上并行计算。
+    """
+
+    def __init__(self, batch_size=64, num_threads=None):
+        self.batch_size = batch_size
+        self.num_threads = num_threads or min(8, os.cpu_count() or 1)
+        self._dimension = None
+        self._executor = None
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+
+        batches = [texts[i:i+self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1 or self.num_threads == 1:
+            results = [self._embed_batch(batch) for batch in batches]
+        else:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.num_threads)
+            results = list(self._executor.map(self._embed_batch, batches))
+
+        return np.vstack(results).astype(np.float32).tolist()
+
+class HashingEmbedder(_BatchedLocalEmbedder):
+    """
+    基于哈希字符 n-gram 的本地嵌入器，无需模型文件和网络，作为离线兜底方案。
+
+    中文没有空格分词，因此直接对字符 1~3-gram 做带符号的特征哈希，
+    再进行 L2 归一化。使用 crc32 而不是 Python 内置 hash，保证跨进程结果一致
+    （向量会被持久化到 VectorStore）。
+    """
+
+    _whitespace = re.compile(r'\s+')
+
+    def __init__(self, dimension=512, ngram_range=(1, 3), batch_size=256, num_threads=None):
+        super().__init__(batch_size=batch_size, num_threads=num_threads)
+        self.dimension = dimension
+        self.ngram_range = ngram_range
+        self.model = f"hashing-{dimension}-ngram{ngram_range[0]}-{ngram_range[1]}"
+        self._dimension = dimension
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        low, high = self.ngram_range
+
+        for row, text in enumerate(texts):
+            text = self._whitespace.sub(" ", text.lower()).strip()
+            buckets = []
+            for n in range(low, high + 1):
+                for i in range(len(text) - n + 1):
+                    buckets.append(zlib.crc32(text[i:i+n].encode('utf-8')))
+            if not buckets:
+                continue
+
+            hashes = np.array(buckets, dtype=np.int64)
+            # 最高位决定符号，以减少哈希冲突带来的偏差
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+            np.add.at(matrix[row], hashes % self.dimension, signs)
+
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+class SentenceTransformerEmbedder(_BatchedLocalEmbedder):
+    """
+    基于 sentence-transformers 模型的本地 CPU 嵌入器（需要安装 sentence-transformers）。
+    """
+
+    def __init__(self, model=None, batch_size=32, num_threads=None, device="cpu"):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError(
+                "sentence-transformers is required for the local embedding backend. "
+                "Install it with: pip install sentence-transformers"
+            )
+
+        # 模型推理本身已使用多线程，批次之间默认串行
+        super().__init__(batch_size=batch_size, num_threads=num_threads or 1)
+        self.model = model or os.getenv("LOCAL_EMBEDDING_MODEL", "BAAI/bge-small-zh-v1.5")
+        self._model = SentenceTransformer(self.model, device=device)
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        return self._model.encode(
+            texts, batch_size=self.batch_size, normalize_embeddings=True,
+            convert_to_numpy=True, show_progress_bar=False
+        )
+
+class BatchingEmbedder(BaseEmbedder):
+    """
+    查询嵌入的微批处理前端。
+
+    多个线程并发调用时，第一个请求到达后最多再等待 max_wait_ms 毫秒，期间到达的请求合并为一次
+    批量嵌入请求（最多约 max_batch 条文本），结果再按顺序分发给各个等待的调用方。
+    并发负载下 HTTP 请求数和限流压力明显下降；只有一个调用方时只多等待 max_wait_ms。
+    一次就包含 max_batch 条以上文本的调用（例如建索引）直接交给底层嵌入器。
+
+    收集线程只负责组批，批量请求在最多 concurrency 个线程中发出，因此一个慢请求
+    不会阻塞后续请求的收集；调用方最多等待 timeout 秒。
+    """
+
+    def __init__(self, embedder: BaseEmbedder, max_wait_ms: Optional[float] = None, max_batch: Optional[int] = None,
+                 concurrency: Optional[int] = None, timeout: Optional[float] = None):
+        """
+        Args:
+            embedder: 底层嵌入器
+            max_wait_ms: 收集并发请求的时间窗口，默认读取 QUERY_BATCH_WINDOW_MS，未设置时为 5
+            max_batch: 一次批量请求的最大文本数，默认读取 QUERY_BATCH_SIZE，未设置时为 64
+            concurrency: 同时进行的批量请求数，默认读取 QUERY_BATCH_CONCURRENCY，未设置时为 4
+            timeout: 调用方等待结果的最长秒数，默认读取 QUERY_BATCH_TIMEOUT，未设置时为 60
+        """
+        self.embedder = embedder
+        self.model = getattr(embedder, 'model', None)
+        if max_wait_ms is None:
+            max_wait_ms = float(os.getenv("QUERY_BATCH_WINDOW_MS", "5"))
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch = max_batch or int(os.getenv("QUERY_BATCH_SIZE", "64"))
+        self.concurrency = concurrency or int(os.getenv("QUERY_BATCH_CONCURRENCY", "4"))
+        self.timeout = timeout or float(os.getenv("QUERY_BATCH_TIMEOUT", "60"))
+        self._lock = threading.Lock()
+        self._queue = None  # 当前收集线程的请求队列（每个收集线程一个）
+        self._worker = None
+        self.requests = 0   # 调用方请求数
+        self.batches = 0    # 发往底层嵌入器的批量请求数
+        self.texts = 0
+
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        if len(texts) >= self.max_batch:
+            return self.embedder.get_embeddings(texts)
+
+        future = Future()
+        self._submit((list(texts), future))
+        try:
+            vectors, batch_size = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise TimeoutError(f"Query embedding timed out after {self.timeout:g}s") from None
+        # 在调用方的追踪阶段（例如 embed_query）中记录实际的批大小
+        s = current_span()
+        if s is not None:
+            s.set(batch=batch_size)
+        return vectors
+
+    def get_dimension(self) -> int:
+        return self.embedder.get_dimension()
+
+    def stats(self) -> Dict:
+        """请求数、批量请求数和平均每批合并的请求数。"""
+        with self._lock:
+            return {'requests': self.requests, 'batches': self.batches, 'texts': self.texts,
+                    'requests_per_batch': self.requests / self.batches if self.batches else 0.0}
+
+    def close(self):
+        """停止后台线程（已在队列中的请求仍会完成）。之后的请求会启动新的收集线程。"""
+        with self._lock:
+            if self._worker is not None:
+                self._queue.put(None)
+                self._queue = self._worker = None
+
+    def _submit(self, item):
+        """
+        把请求放入当前收集线程的队列，需要时先启动收集线程。
+        每个收集线程有自己的队列，close() 放入的结束标记不会被之后启动的线程取走。
+        """
+        with self._lock:
+            if self._worker is None:
+                self._queue = queue.Queue()
+                executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="kb-embed-dispatch")
+                self._worker = threading.Thread(target=self._run, args=(self._queue, executor),
+                                                name="kb-embed-batcher", daemon=True)
+                self._worker.start()
+            self._queue.put(item)
+
+    def _run(self, requests: queue.Queue, executor: ThreadPoolExecutor):
+        stopping = False
+        while not stopping:
+            item = requests.get()
+            if item is None:
+                break
+            pending = [item]
+            count = len(item[0])
+            deadline = time.monotonic() + self.max_wait
+            while count < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                pending.append(item)
+                count += len(item[0])
+            # 批量请求交给线程池发出，收集线程立即回去接收下一批
+            executor.submit(self._dispatch, pending)
+        # 已提交的批量请求仍会完成
+        executor.shutdown(wait=False)
+
+    def _dispatch(self, pending):
+        texts = [text for request, _ in pending for text in request]
+        try:
+            vectors = self.embedder.get_embeddings(texts)
+        except Exception as e:
+            for _, future in pending:
+                future.set_exception(e)
+            return
+
+        with self._lock:
+            self.requests += len(pending)
+            self.batches += 1
+            self.texts += len(texts)
+        pos = 0
+        for request, future in pending:
+            future.set_result((vectors[pos:pos + len(request)], len(texts)))
+            pos += len(request)
+
+def create_embedder(backend=None) -> BaseEmbedder:
+    """
+    按配置创建嵌入器。设置 QUERY_BATCH_WINDOW_MS（大于 0）时包装为 BatchingEmbedder，
+    合并并发的查询嵌入请求。
+
+    Args:
+        backend: "openai"（默认）、"local"（sentence-transformers，未安装时回退到哈希）
+                 或 "hashing"；未指定时读取 EMBEDDING_BACKEND 环境变量
+    """
+    embedder = _create_backend(backend)
+    if float(os.getenv("QUERY_BATCH_WINDOW_MS", "0")) > 0:
+        return BatchingEmbedder(embedder)
+    return embedder
+
+def _create_backend(backend=None) -> BaseEmbedder:
+    backend = (backend or os.getenv("EMBEDDING_BACKEND", "openai")).lower()
+
+    if backend == "openai":
+        return Embedder()
+    if backend == "local":
+        try:
+            return SentenceTransformerEmbedder()
+        except (ImportError, OSError, ValueError) as e:
+            # 未安装 sentence-transformers，或模型无法下载/加载
+            print(f"{e}\nFalling back to hashing embedder.")
+            return _create_backend("hashing")
+    if backend == "hashing":
+        return HashingEmbedder(dimension=int(os.getenv("HASHING_EMBEDDING_DIM", "512")))
+
+    raise ValueError(f"Unknown embedding backend: {backend}")
+
+class AsyncEmbedder:
+    """
+    Embedder 的 asyncio 版本（AsyncOpenAI），所有请求共享一个 HTTP 连接池。
+    """
+
+    def __init__(self, api_key=None, base_url=None, model=None):
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.base_url = base_url or os.getenv("OPENAI_BASE_URL")
+        self.model = model or os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+
+        if not self.api_key:
+            raise ValueError(
+                "API key is required. Set OPENAI_API_KEY environment variable in .env file."
+            )
+
+        self.client = AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url
+        )
+
+    async def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+
+        texts = [t.replace("\n", " ") for t in texts]
+        try:
+            response = await self.client.embeddings.create(input=texts, model=self.model)
+            return [item.embedding for item in response.data]
+        except Exception as e:
+            raise Exception(f"Failed to get embeddings: {str(e)}")
+
+    async def get_embedding(self, text: str) -> List[float]:
+        return (await self.get_embeddings([text]))[0]
+
+    async def close(self):
+        await self.client.close()
+
+class ThreadedAsyncEmbedder:
+    """
+    把同步嵌入器（本地模型、哈希）包装为异步接口：计算在线程中进行，不阻塞事件循环。
+    """
+
+    def __init__(self, embedder: BaseEmbedder):
+        self.embedder = embedder
+        self.model = getattr(embedder, 'model', None)
+
+    async def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.embedder.get_embeddings, texts)
+
+    async def get_embedding(self, text: str) -> List[float]:
+        return (await self.get_embeddings([text]))[0]
+
+    async def close(self):
+        pass
+
+def create_async_embedder(backend=None):
+    """
+    按配置创建异步嵌入器：openai 后端使用 AsyncEmbedder，本地后端在线程中运行。
+    设置 QUERY_BATCH_WINDOW_MS 时所有后端都经过 BatchingEmbedder，合并并发问题的查询嵌入。
+    """
+    backend = (backend or os.getenv("EMBEDDING_BACKEND", "openai")).lower()
+    if backend == "openai" and float(os.getenv("QUERY_BATCH_WINDOW_MS", "0")) <= 0:
+        return AsyncEmbedder()
+    return ThreadedAsyncEmbedder(create_embedder(backend))
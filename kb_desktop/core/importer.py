@@ -0,0 +1,368 @@
+import os
+import hashlib
+from difflib import SequenceMatcher
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from core.ingest import Ingestor
+from core.storage import content_hash
+from core.parsers import ParsePool
+from core.chunker import Chunker
+from core.dedup import ChunkDeduplicator
+
+# 导入结果状态
+IMPORTED = "imported"
+DUPLICATE = "duplicate"
+UPDATED = "updated"
+UNCHANGED = "unchanged"
+MISSING = "missing"
+FAILED = "failed"
+
+def file_fingerprint(path: str, block_size: int = 1 << 20) -> Dict:
+    """
+    计算文件指纹: {'path', 'size', 'mtime', 'file_hash'}。
+    file_hash 是文件字节的 BLAKE2b 哈希（流式读取，远快于解析文档）。
+    """
+    stat = os.stat(path)
+    hasher = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            hasher.update(block)
+    return {
+        'path': normalize_path(path),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'file_hash': hasher.hexdigest()
+    }
+
+def normalize_path(path: str) -> str:
+    """指纹表中使用的路径形式（绝对路径，Windows 下不区分大小写）。"""
+    return os.path.normcase(os.path.abspath(path))
+
+class Importer:
+    """
+    文档导入流程：指纹检查 -> 解析 -> 入库 -> 分块。
+
+    在解析文件之前先检查文件指纹：
+    1. 同一路径且大小和修改时间未变 -> 直接判定为已导入（不读取文件）
+    2. 文件字节哈希与已导入的文件相同（例如复制到了其他目录）-> 已导入（不解析文件）
+    3. 否则解析文件；提取的内容与已有文档相同时仍按内容哈希去重
+
+    分块后对文本块做近似重复检测，重复的页眉、页脚和模板文字共享同一个嵌入和索引条目。
+
+    已导入路径的文件被修改后，重新分块并与已存储的文本块序列比对，
+    未变化的文本块保留 ID（以及已存储的向量），只有新增或改动的文本块需要嵌入。
+
+    批量导入时，需要解析的文件在工作进程中并行解析（每个文件有超时，只有一个文件时也一样），
+    解析结果仍按输入顺序逐个入库，结果与逐个导入相同。
+    """
+
+    def __init__(self, db, chunker: Optional[Chunker] = None,
+                 deduplicator: Optional[ChunkDeduplicator] = None,
+                 workers: Optional[int] = None, parse_timeout: Optional[float] = None):
+        """
+        Args:
+            db: DBManager 实例
+            chunker: 分块器，默认 Chunker()
+            deduplicator: 近似重复检测器，默认 ChunkDeduplicator(db)
+            workers: 批量导入时的解析进程数，默认读取 IMPORT_WORKERS（CPU 核数，最多 4）；
+                     0 表示在当前进程中逐个解析（没有超时）
+            parse_timeout: 单个文件的解析超时秒数（在解析进程中解析时生效），默认读取 PARSE_TIMEOUT（120）
+        """
+        self.db = db
+        self.chunker = chunker or Chunker()
+        self.deduplicator = deduplicator or ChunkDeduplicator(db)
+        if workers is None:
+            workers = int(os.getenv("IMPORT_WORKERS", str(min(4, os.cpu_count() or 1))))
+        self.workers = workers
+        self.parse_timeout = parse_timeout
+
+    def is_unchanged(self, path: str) -> Optional[int]:
+        """路径的大小和修改时间与记录的指纹一致时返回其文档 ID，否则返回 None。"""
+        stat = os.stat(path)
+        known = self.db.get_fingerprint(normalize_path(path))
+        if known and known['size'] == stat.st_size and known['mtime'] == stat.st_mtime:
+            return known['doc_id']
+        return None
+
+    def import_file(self, path: str) -> Dict:
+        """
+        导入单个文件。
+
+        Returns:
+            {'status': IMPORTED | DUPLICATE | UPDATED, 'doc_id', 'parsed'（是否解析了文件）,
+             'added', 'removed'（需要加入/移出索引的 chunk_id）}
+        """
+        doc_id = self.is_unchanged(path)
+        if doc_id is not None:
+            return {'status': DUPLICATE, 'doc_id': doc_id, 'parsed': False, 'added': [], 'removed': []}
+        return self._import(path, file_fingerprint(path))
+
+    def _resolve(self, fingerprint: Dict) -> Optional[Dict]:
+        """不解析文件即可确定导入结果时记录指纹并返回结果，否则返回 None。"""
+        known_id = self.db.find_document_by_path(fingerprint['path'])
+        known = self.db.get_fingerprint(fingerprint['path'])
+        if known_id is not None:
+            if known and known['doc_id'] == known_id and known['file_hash'] == fingerprint['file_hash']:
+                # 只有修改时间变了（例如文件被重新保存）
+                self.db.save_fingerprint(doc_id=known_id, **fingerprint)
+                return {'status': UNCHANGED, 'doc_id': known_id, 'parsed': False, 'added': [], 'removed': []}
+            return None
+        if known and known['file_hash'] != fingerprint['file_hash']:
+            # 副本路径（指纹指向以其他路径为源文件的文档）被修改：不再是那个文档的副本
+            self.db.delete_fingerprint(fingerprint['path'])
+
+        doc_id = self.db.find_document_by_file_hash(fingerprint['file_hash'])
+        if doc_id is not None:
+            self.db.save_fingerprint(doc_id=doc_id, **fingerprint)
+            return {'status': DUPLICATE, 'doc_id': doc_id, 'parsed': False, 'added': [], 'removed': []}
+        return None
+
+    def _import(self, path: str, fingerprint: Dict, content: Optional[str] = None) -> Dict:
+        """按指纹导入文件；content 为已解析的文件内容（None 时在此解析）。"""
+        outcome = self._resolve(fingerprint)
+        if outcome is not None:
+            return outcome
+
+        known_id = self.db.find_document_by_path(fingerprint['path'])
+        if known_id is not None:
+            # 已导入的源文件路径：内容被修改时更新原文档，而不是作为新文档导入
+            return self.update_file(known_id, path, fingerprint, content)
+
+        if content is None:
+            content = Ingestor.load_file(path)
+        doc_id = self.db.add_document(os.path.basename(path), path, content)
+        if doc_id is None:
+            # 内容与已有文档相同（例如同一内容的不同文件格式）
+            doc_id = self.db.find_document_by_hash(content_hash(content))
+            self.db.save_fingerprint(doc_id=doc_id, **fingerprint)
+            return {'status': DUPLICATE, 'doc_id': doc_id, 'parsed': True, 'added': [], 'removed': []}
+
+        chunks = self.deduplicator.assign(self.chunker.chunk(content))
+        chunk_ids = self.db.add_chunks(doc_id, chunks)
+        self.deduplicator.register(chunk_ids, chunks)
+        self.db.save_fingerprint(doc_id=doc_id, **fingerprint)
+        indexable = [cid for cid, chunk in zip(chunk_ids, chunks)
+                     if 'canonical_id' not in chunk and 'duplicate_of' not in chunk]
+        return {'status': IMPORTED, 'doc_id': doc_id, 'parsed': True, 'added': indexable, 'removed': []}
+
+    def update_file(self, doc_id: int, path: str, fingerprint: Optional[Dict] = None,
+                    content: Optional[str] = None) -> Dict:
+        """
+        重新导入已知文档的源文件，只替换变化的文本块。
+
+        文件字节未变时只更新指纹；解析后的内容未变时不改动文本块；
+        修改后的内容与另一个文档完全相同时删除本文档，路径改为指向那个文档。
+        content 为已解析的文件内容（None 时在此解析）。
+        """
+        fingerprint = fingerprint or file_fingerprint(path)
+        known = self.db.get_fingerprint(fingerprint['path'])
+        if known and known['doc_id'] == doc_id and known['file_hash'] == fingerprint['file_hash']:
+            # 只有修改时间变了（例如文件被重新保存）
+            self.db.save_fingerprint(doc_id=doc_id, **fingerprint)
+            return {'status': UNCHANGED, 'doc_id': doc_id, 'parsed': False, 'added': [], 'removed': []}
+
+        if content is None:
+            content = Ingestor.load_file(path)
+        existing = self.db.find_document_by_hash(content_hash(content))
+        if existing == doc_id:
+            self.db.save_fingerprint(doc_id=doc_id, **fingerprint)
+            return {'status': UNCHANGED, 'doc_id': doc_id, 'parsed': True, 'added': [], 'removed': []}
+        if existing is not None:
+            deleted = self.db.delete_document(doc_id)
+            self.deduplicator.invalidate()
+            self.db.save_fingerprint(doc_id=existing, **fingerprint)
+            return {'status': DUPLICATE, 'doc_id': existing, 'parsed': True,
+                    'added': deleted['promoted'], 'removed': deleted['chunk_ids']}
+
+        kept, added, removed = self.diff_chunks(self.db.get_chunk_records(doc_id), self.chunker.chunk(content))
+        added = self.deduplicator.assign(added)
+        changes = self.db.update_document(doc_id, path, content, kept, added, removed)
+        if removed:
+            self.deduplicator.invalidate()
+        self.db.save_fingerprint(doc_id=doc_id, **fingerprint)
+        return {'status': UPDATED, 'doc_id': doc_id, 'parsed': True, 'kept': len(kept), **changes}
+
+    @staticmethod
+    def diff_chunks(old: List[Dict], new: List[Dict]) -> Tuple[List[Tuple], List[Dict], List[int]]:
+        """
+        比对已存储的文本块与新分块结果（按文本逐块比较最长公共子序列）。
+
+        Returns:
+            (kept: [(chunk_id, 新 chunk_index, start, end)],
+             added: 带 'chunk_index' 的新文本块字典,
+             removed: 要删除的 chunk_id)
+        """
+        matcher = SequenceMatcher(None, [c['text'] for c in old], [c['text'] for c in new], autojunk=False)
+        kept, added, removed = [], [], []
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                kept.extend((old[i]['id'], j, new[j].get('start'), new[j].get('end'))
+                            for i, j in zip(range(i1, i2), range(j1, j2)))
+            else:
+                removed.extend(old[i]['id'] for i in range(i1, i2))
+                added.extend(dict(new[j], chunk_index=j) for j in range(j1, j2))
+        return kept, added, removed
+
+    def _needs_update(self, doc_id: int, fingerprint: Dict) -> bool:
+        known = self.db.get_fingerprint(fingerprint['path'])
+        return not (known and known['doc_id'] == doc_id and known['file_hash'] == fingerprint['file_hash'])
+
+    def _parse_in_order(self, paths: List[str]) -> Iterator[Tuple[str, Optional[str], Optional[str]]]:
+        """
+        解析文件，按输入顺序产出 (path, content, error)。
+        workers > 0 时在 ParsePool 中解析（只有一个文件时也是如此，卡住的解析器会超时而不是拖住调用方），
+        已完成的文件按顺序尽早产出。重复出现的路径只解析一次，每次出现都产出一次结果。
+        """
+        if not paths:
+            return
+        if self.workers <= 0:
+            for path in paths:
+                try:
+                    yield path, Ingestor.load_file(path), None
+                except Exception as e:
+                    yield path, None, str(e)
+            return
+
+        last = {path: i for i, path in enumerate(paths)}
+        done = {}  # path -> (content, error)，该路径最后一次出现产出后释放
+        next_index = 0
+        for path, content, error in ParsePool(self.workers, self.parse_timeout).imap(list(last)):
+            done[path] = (content, error)
+            while next_index < len(paths) and paths[next_index] in done:
+                path = paths[next_index]
+                yield (path, *done[path])
+                if last[path] == next_index:
+                    del done[path]
+                next_index += 1
+
+    def import_files(self, paths: List[str],
+                     on_progress: Optional[Callable[[int, int, str], None]] = None) -> Dict:
+        """
+        批量导入文件，单个文件失败不影响其他文件。
+
+        先对所有文件做指纹检查，需要解析的文件再并行解析，最后按输入顺序入库。
+
+        Args:
+            on_progress: 可选回调 (已处理数, 总数, 文件名)
+
+        Returns:
+            {'imported', 'duplicate', 'updated', 'unchanged', 'failed', 'parsed'（计数）,
+             'doc_ids'（新导入的文档 ID）, 'added', 'removed'（需要加入/移出索引的 chunk_id）, 'errors'}
+        """
+        result = {IMPORTED: 0, DUPLICATE: 0, UPDATED: 0, UNCHANGED: 0, FAILED: 0, 'parsed': 0,
+                  'doc_ids': [], 'added': [], 'removed': [], 'errors': {}}
+        processed = 0
+
+        def record(path, outcome=None, error=None):
+            nonlocal processed
+            if error is not None:
+                print(f"Failed to import {os.path.basename(path)}: {error}")
+                result[FAILED] += 1
+                result['errors'][path] = error
+            else:
+                result[outcome['status']] += 1
+                result['parsed'] += outcome['parsed']
+                result['added'].extend(outcome['added'])
+                result['removed'].extend(outcome['removed'])
+                if outcome['status'] == IMPORTED:
+                    result['doc_ids'].append(outcome['doc_id'])
+            processed += 1
+            if on_progress:
+                on_progress(processed, len(paths), os.path.basename(path))
+
+        # 1. 指纹检查（不解析文件）
+        to_parse, fingerprints = [], {}
+        for path in paths:
+            try:
+                doc_id = self.is_unchanged(path)
+                if doc_id is not None:
+                    record(path, {'status': DUPLICATE, 'doc_id': doc_id, 'parsed': False, 'added': [], 'removed': []})
+                    continue
+                fingerprint = file_fingerprint(path)
+                outcome = self._resolve(fingerprint)
+                if outcome is not None:
+                    record(path, outcome)
+                    continue
+                fingerprints[path] = fingerprint
+                to_parse.append(path)
+            except Exception as e:
+                record(path, error=str(e))
+
+        # 2. 解析剩余文件并按顺序入库（入库时重新检查指纹，同一批次中字节相同的文件只入库一次）
+        for path, content, error in self._parse_in_order(to_parse):
+            if error is not None:
+                record(path, error=error)
+                continue
+            try:
+                record(path, self._import(path, fingerprints[path], content))
+            except Exception as e:
+                record(path, error=str(e))
+
+        return result
+
+    def sync(self, on_progress: Optional[Callable[[int, int, str], None]] = None) -> Dict:
+        """
+        重新扫描所有已导入文档的源文件路径，把修改过的文件同步到知识库。
+
+        大小和修改时间未变的文件不读取；修改过的文件只替换变化的文本块（并行解析）。
+        源文件已不存在的文档保留不动（计入 'missing'）。副本路径（同一文件被复制到的其他路径）
+        被修改时作为新文档导入（计入 'imported'），不改动原文档。修改后的内容与另一个文档完全相同时
+        删除本文档、路径改为指向那个文档（计入 'duplicate'）。
+
+        Returns:
+            {'updated', 'imported', 'duplicate', 'unchanged', 'missing', 'failed'（计数）,
+             'added', 'removed'（需要加入/移出索引的 chunk_id）, 'errors'}
+        """
+        paths = {}
+        for doc_id, path in self.db.get_source_paths():
+            paths.setdefault(normalize_path(path), doc_id)
+
+        result = {UPDATED: 0, IMPORTED: 0, DUPLICATE: 0, UNCHANGED: 0, MISSING: 0, FAILED: 0,
+                  'added': [], 'removed': [], 'errors': {}}
+        processed = 0
+
+        def record(path, status, outcome=None, error=None):
+            nonlocal processed
+            if error is not None:
+                print(f"Failed to sync {os.path.basename(path)}: {error}")
+                result['errors'][path] = error
+            result[status] += 1
+            if outcome is not None:
+                result['added'].extend(outcome['added'])
+                result['removed'].extend(outcome['removed'])
+            processed += 1
+            if on_progress:
+                on_progress(processed, len(paths), os.path.basename(path))
+
+        to_parse, fingerprints = [], {}
+        for path, doc_id in sorted(paths.items()):
+            try:
+                if not os.path.exists(path):
+                    record(path, MISSING)
+                elif self.is_unchanged(path) is not None:
+                    record(path, UNCHANGED)
+                else:
+                    fingerprint = file_fingerprint(path)
+                    if not self._needs_update(doc_id, fingerprint):
+                        record(path, UNCHANGED, self.update_file(doc_id, path, fingerprint))
+                    else:
+                        fingerprints[path] = fingerprint
+                        to_parse.append(path)
+            except Exception as e:
+                record(path, FAILED, error=str(e))
+
+        for path, content, error in self._parse_in_order(to_parse):
+            if error is not None:
+                record(path, FAILED, error=error)
+                continue
+            try:
+                if self.db.find_document_by_path(path) != paths[path]:
+                    # 副本路径被修改：作为新文档导入，原文档保持不变
+                    outcome = self._import(path, fingerprints[path], content)
+                else:
+                    outcome = self.update_file(paths[path], path, fingerprints[path], content)
+                record(path, outcome['status'], outcome)
+            except Exception as e:
+                record(path, FAILED, error=str(e))
+
+        return result
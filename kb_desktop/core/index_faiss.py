@@ -4,21 +4,55 @@ import numpy as np
 import faiss
 import shutil
 import tempfile
-from typing import List, Tuple
+from typing import List, Optional, Tuple
+
+try:
+    from core.snapshot import SnapshotStore, SnapshotError
+except ImportError:
+    # 作为 kb_desktop.core 包导入时（例如测试直接导入本模块）
+    from .snapshot import SnapshotStore, SnapshotError
+
+def verify_chunk_ids(chunk_ids: List[int], db) -> dict:
+    """
+    检查索引中的 chunk_id 与数据库 chunks 表是否一致（FaissIndex 和 ShardedFaissIndex 共用）。
+    
+    Returns:
+        {'consistent': bool, 'missing_chunk_ids': 索引中有但数据库已删除的 ID,
+         'unindexed_chunks': 数据库中有但未进入索引的文本块数量}
+    """
+    db_ids = set(db.get_indexable_chunk_ids())
+    indexed = set(chunk_ids)
+    missing = sorted(indexed - db_ids)
+    unindexed = len(db_ids - indexed)
+    
+    return {
+        "consistent": not missing and unindexed == 0,
+        "missing_chunk_ids": missing,
+        "unindexed_chunks": unindexed
+    }
 
 class FaissIndex:
     """
     用于向量存储和相似性搜索的 FAISS 索引管理器。
     """
     
-    def __init__(self, index_path=None, meta_path=None):
+    def __init__(self, index_path=None, meta_path=None, snapshot_dir=None, keep_snapshots=3,
+                 index_factory=None, search_params=None):
         """
         初始化 FAISS 索引管理器。
         
         Args:
             index_path: 保存/加载 FAISS 索引文件的路径
             meta_path: 保存/加载元数据 (chunk_id 映射) 的路径
+            snapshot_dir: 版本化快照目录。未指定任何路径时默认使用 data/snapshots；
+                          显式指定 index_path/meta_path 时使用单文件模式
+            keep_snapshots: 保留的历史快照数量（用于回滚）
+            index_factory: 构建新索引时使用的 FAISS index_factory 描述（如 "HNSW32"、
+                           "IVF1024,Flat"、"IVF1024,PQ32"），默认读取 FAISS_INDEX_FACTORY，未设置时为 "Flat"（精确搜索）
+            search_params: 搜索参数（如 "efSearch=64"、"nprobe=16"），默认读取 FAISS_SEARCH_PARAMS
         """
+        use_default_paths = index_path is None and meta_path is None
+        
         # 如果没有指定路径，使用 kb_desktop/data/ 目录
         if index_path is None or meta_path is None:
             # 获取 index_faiss.py 的目录（kb_desktop/core）
@@ -29,12 +63,20 @@ class FaissIndex:
                 index_path = os.path.join(kb_desktop_dir, "data", "faiss.index")
             if meta_path is None:
                 meta_path = os.path.join(kb_desktop_dir, "data", "meta.json")
+            if snapshot_dir is None and use_default_paths:
+                snapshot_dir = os.path.join(kb_desktop_dir, "data", "snapshots")
         
         self.index_path = index_path
         self.meta_path = meta_path
         self.index = None
         self.chunk_ids = []  # 映射 vector_id -> chunk_id
         self.dimension = None
+        self._positions = None  # chunk_id -> vector_id，过滤搜索时按需构建
+        self.snapshot = None  # 当前加载/保存的快照名
+        self.consistency = None  # 最近一次与数据库的一致性检查结果
+        self.snapshots = SnapshotStore(snapshot_dir, keep=keep_snapshots) if snapshot_dir else None
+        self.index_factory = index_factory or os.getenv("FAISS_INDEX_FACTORY") or "Flat"
+        self.search_params = search_params if search_params is not None else os.getenv("FAISS_SEARCH_PARAMS", "")
         
         # 确保 data 目录存在
         os.makedirs(os.path.dirname(index_path), exist_ok=True)
@@ -53,17 +95,47 @@ class FaissIndex:
         
         self.dimension = dimension
         self.chunk_ids = chunk_ids
+        self._positions = None
         
-        # 创建 FAISS 索引 (L2 距离)
-        # 对于 MVP，我们使用 IndexFlatL2（精确搜索）
-        # 对于更大的数据集，请考虑 IndexIVFFlat 或 IndexHNSW
-        self.index = faiss.IndexFlatL2(dimension)
+        # 创建 FAISS 索引 (L2 距离)：默认 IndexFlatL2（精确搜索），
+        # 更大的数据集可通过 index_factory 使用 HNSW / IVF / PQ（见 bench/index_sweep.py）
+        vectors = vectors.astype('float32')
+        self.index = self._create_index(dimension, vectors)
         
         # 将向量添加到索引
-        self.index.add(vectors.astype('float32'))
+        self.index.add(vectors)
+        self.set_search_params(self.search_params)
         
         print(f"Built FAISS index with {self.index.ntotal} vectors, dimension={dimension}")
     
+    def _create_index(self, dimension: int, vectors: np.ndarray):
+        """按 index_factory 创建索引，需要训练的索引（IVF、PQ）用待添加的向量训练。"""
+        if self.index_factory == "Flat":
+            return faiss.IndexFlatL2(dimension)
+        
+        index = faiss.index_factory(dimension, self.index_factory)
+        if not index.is_trained:
+            try:
+                index.train(vectors)
+            except RuntimeError:
+                # 向量太少，不足以训练聚类中心或码本（例如新建的小分片）
+                print(f"Cannot train {self.index_factory} on {len(vectors)} vectors, using a flat index")
+                return faiss.IndexFlatL2(dimension)
+        return index
+    
+    def set_search_params(self, params: str):
+        """设置搜索参数（FAISS ParameterSpace 格式，如 "efSearch=64" 或 "nprobe=16"）。"""
+        self.search_params = params or ""
+        if self.index is not None and self.search_params and self.index_type() != "IndexFlatL2":
+            try:
+                faiss.ParameterSpace().set_index_parameters(self.index, self.search_params)
+            except RuntimeError:
+                print(f"Search params '{self.search_params}' do not apply to {self.index_type()}, ignored")
+    
+    def index_type(self) -> str:
+        """当前索引的 FAISS 类型名（如 IndexFlatL2、IndexHNSWFlat、IndexIVFPQ）。"""
+        return type(faiss.downcast_index(self.index)).__name__ if self.index is not None else None
+    
     def add_to_index(self, vectors: np.ndarray, chunk_ids: List[int]):
         """
         将新向量添加到现有索引（增量索引）。
@@ -85,24 +157,68 @@ class FaissIndex:
         # 添加向量
         self.index.add(vectors.astype('float32'))
         self.chunk_ids.extend(chunk_ids)
+        self._positions = None
         
         print(f"Added {len(vectors)} vectors to index. Total: {self.index.ntotal}")
+    
+    def remove_ids(self, chunk_ids: List[int]) -> int:
+        """
+        从索引中删除指定 chunk_id 的向量（文档被修改或删除时），其余向量保持原有顺序。
+        返回删除的向量数。
+        """
+        if self.index is None:
+            raise ValueError("No existing index. Build an index first.")
+        
+        remove = set(chunk_ids)
+        positions = [pos for pos, cid in enumerate(self.chunk_ids) if cid in remove]
+        if not positions:
+            return 0
+        
+        index = faiss.downcast_index(self.index)
+        if isinstance(index, faiss.IndexFlatCodes):
+            self.index.remove_ids(np.array(positions, dtype='int64'))
+        else:
+            # HNSW 不支持删除，IVF 删除后不会重新编号：取出保留的向量，清空后按顺序重新添加
+            # （沿用已训练的聚类中心和码本；PQ 等有损编码重新添加的是解码后的近似向量）
+            kept_positions = np.setdiff1d(np.arange(self.index.ntotal), positions)
+            if isinstance(index, faiss.IndexIVF):
+                index.make_direct_map()
+            vectors = index.reconstruct_batch(kept_positions)
+            if isinstance(index, faiss.IndexIVF):
+                index.make_direct_map(False)
+            index.reset()
+            index.add(vectors)
+            self.set_search_params(self.search_params)
+        self.chunk_ids = [cid for cid in self.chunk_ids if cid not in remove]
+        self._positions = None
+        
+        print(f"Removed {len(positions)} vectors from index. Total: {self.index.ntotal}")
+        return len(positions)
 
     
     def save(self):
         """
         将索引和元数据保存到磁盘。
+        
+        快照模式下提交一个新的版本化快照；单文件模式下先写临时文件再原子替换，
+        并在元数据中记录向量数量以便加载时校验。
         """
         if self.index is None:
             raise ValueError("No index to save. Build or load an index first.")
         
+        if self.snapshots is not None:
+            self.snapshot = self.snapshots.commit(self.index, self.chunk_ids, self.dimension)
+            print(f"Saved index snapshot {self.snapshot} to {self.snapshots.root_dir}")
+            return
+        
         # 确保目录存在
         os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
         os.makedirs(os.path.dirname(self.meta_path), exist_ok=True)
         
         # 保存 FAISS 索引
         # 注意：Faiss 在 Windows 上不支持非 ASCII 路径
-        # 解决方案：先保存到临时文件（ASCII路径），然后移动到目标位置
+        # 解决方案：先保存到临时文件（ASCII路径），移动到目标目录旁的临时名，再原子替换
+        index_tmp = self.index_path + ".tmp"
         try:
             # 创建临时文件
             fd, temp_path = tempfile.mkstemp(suffix=".index")
@@ -111,35 +227,81 @@ class FaissIndex:
             # 写入索引到临时文件
             faiss.write_index(self.index, temp_path)
             
-            # 如果目标文件存在，先删除（Windows上shutil.move覆盖有时会失败）
-            if os.path.exists(self.index_path):
-                os.remove(self.index_path)
-                
-            # 移动到目标位置
-            shutil.move(temp_path, self.index_path)
+            # 移动到与目标同一目录（同一文件系统），保证 os.replace 是原子的
+            shutil.move(temp_path, index_tmp)
+            os.replace(index_tmp, self.index_path)
         except Exception as e:
             # 如果失败，清理临时文件
-            if 'temp_path' in locals() and os.path.exists(temp_path):
-                os.remove(temp_path)
+            for path in (locals().get('temp_path'), index_tmp):
+                if path and os.path.exists(path):
+                    os.remove(path)
             raise e
         
-        # 保存元数据
+        # 保存元数据（同样先写临时文件再原子替换）
         meta = {
             "dimension": self.dimension,
             "chunk_ids": self.chunk_ids,
             "total": self.index.ntotal
         }
         
-        with open(self.meta_path, 'w', encoding='utf-8') as f:
+        meta_tmp = self.meta_path + ".tmp"
+        with open(meta_tmp, 'w', encoding='utf-8') as f:
             json.dump(meta, f, ensure_ascii=False, indent=2)
+        os.replace(meta_tmp, self.meta_path)
         
         print(f"Saved index to {self.index_path}")
     
-    def load(self):
+    def load(self, db=None, snapshot: Optional[str] = None):
         """
         从磁盘加载索引和元数据。
-        成功返回 True，如果文件不存在返回 False。
+        成功返回 True，如果文件不存在或损坏返回 False。
+        
+        快照模式下加载当前快照，损坏时自动回退到上一个有效快照；
+        没有任何快照时回退到旧的单文件格式。
+        
+        Args:
+            db: 可选的 DBManager，用于检查索引与 chunks 表是否一致
+            snapshot: 可选，只加载指定的快照（不回退，例如分片清单引用的快照）
         """
+        loaded = False
+        if self.snapshots is not None and snapshot is not None:
+            try:
+                result = self.snapshots.load(snapshot)
+            except SnapshotError as e:
+                print(f"Snapshot {snapshot} is unusable: {e}")
+                return False
+        elif self.snapshots is not None:
+            result = self.snapshots.load_latest()
+        else:
+            result = None
+        if result is not None:
+            self.index, chunk_ids, manifest = result
+            self.chunk_ids = chunk_ids
+            self._positions = None
+            self.dimension = manifest['dimension']
+            self.snapshot = manifest['name']
+            print(f"Loaded index snapshot {self.snapshot} with {self.index.ntotal} vectors, dimension={self.dimension}")
+            loaded = True
+        
+        if not loaded:
+            loaded = self._load_files()
+        
+        if loaded:
+            self.set_search_params(self.search_params)
+        
+        if loaded and db is not None:
+            self.consistency = self.verify_against_db(db)
+            if not self.consistency['consistent']:
+                print(
+                    f"Index is out of sync with database: "
+                    f"{len(self.consistency['missing_chunk_ids'])} stale vectors, "
+                    f"{self.consistency['unindexed_chunks']} unindexed chunks"
+                )
+        
+        return loaded
+    
+    def _load_files(self):
+        """从单文件格式 (index_path + meta_path) 加载。"""
         if not os.path.exists(self.index_path) or not os.path.exists(self.meta_path):
             return False
         
@@ -153,7 +315,7 @@ class FaissIndex:
             shutil.copy2(self.index_path, temp_path)
             
             try:
-                self.index = faiss.read_index(temp_path)
+                index = faiss.read_index(temp_path)
             finally:
                 if os.path.exists(temp_path):
                     os.remove(temp_path)
@@ -162,8 +324,16 @@ class FaissIndex:
             with open(self.meta_path, 'r', encoding='utf-8') as f:
                 meta = json.load(f)
             
+            # 向量数量必须与 chunk_ids 对应，否则说明上次保存被中断
+            if index.ntotal != len(meta['chunk_ids']):
+                raise ValueError(
+                    f"Index has {index.ntotal} vectors but meta has {len(meta['chunk_ids'])} chunk_ids"
+                )
+            
+            self.index = index
             self.dimension = meta['dimension']
             self.chunk_ids = meta['chunk_ids']
+            self._positions = None
             
             print(f"Loaded index with {self.index.ntotal} vectors, dimension={self.dimension}")
             return True
@@ -172,32 +342,117 @@ class FaissIndex:
             print(f"Failed to load index: {e}")
             return False
     
-    def search(self, query_vector: np.ndarray, k: int = 5) -> Tuple[List[float], List[int]]:
+    def rollback(self):
+        """
+        回滚到上一个快照并重新加载（仅快照模式）。
+        成功返回 True，没有更早的快照时返回 False。
+        """
+        if self.snapshots is None:
+            raise ValueError("Rollback requires snapshot mode.")
+        
+        if self.snapshots.rollback() is None:
+            return False
+        return self.load()
+    
+    def verify_against_db(self, db) -> dict:
+        """检查索引中的 chunk_id 与数据库 chunks 表是否一致（见 verify_chunk_ids）。"""
+        return verify_chunk_ids(self.chunk_ids, db)
+    
+    def search(self, query_vector: np.ndarray, k: int = 5, allowed_chunk_ids=None) -> Tuple[List[float], List[int]]:
         """
         搜索 k 个最近邻。
         
         Args:
             query_vector: 查询向量（长度为 dimension 的 1D 数组）
             k: 返回的最近邻数量
+            allowed_chunk_ids: 可选的允许 chunk_id 集合。过滤通过 FAISS 的 ID 选择器
+                               在索引内部完成，因此结果仍是允许范围内完整的 top-k
             
         Returns:
             (distances, chunk_ids) 的元组
         """
+        return self.search_batch(query_vector, k, allowed_chunk_ids)[0]
+    
+    def search_batch(self, query_vectors: np.ndarray, k: int = 5, allowed_chunk_ids=None) -> List[Tuple[List[float], List[int]]]:
+        """
+        一次 FAISS 调用搜索多个查询（FAISS 在内部按查询并行），用于批量评测等场景。
+        
+        Args:
+            query_vectors: (n, dimension) 的查询矩阵（1D 数组视为单个查询）
+            k: 每个查询返回的最近邻数量
+            allowed_chunk_ids: 同 search，对所有查询生效
+            
+        Returns:
+            每个查询一个 (distances, chunk_ids) 元组
+        """
         if self.index is None:
             raise ValueError("No index loaded. Build or load an index first.")
         
         # 如果需要，重新整形为 2D
-        if len(query_vector.shape) == 1:
-            query_vector = query_vector.reshape(1, -1)
+        query_vectors = np.asarray(query_vectors)
+        if len(query_vectors.shape) == 1:
+            query_vectors = query_vectors.reshape(1, -1)
         
         # 搜索
-        distances, indices = self.index.search(query_vector.astype('float32'), k)
+        if allowed_chunk_ids is None:
+            distances, indices = self.index.search(query_vectors.astype('float32'), k)
+        else:
+            selector = self._make_selector(allowed_chunk_ids)
+            if selector is None:
+                return [([], []) for _ in range(len(query_vectors))]
+            distances, indices = self.index.search(
+                query_vectors.astype('float32'), k, params=self._search_params(selector)
+            )
         
-        # 将索引映射到 chunk_ids
-        result_chunk_ids = [self.chunk_ids[idx] for idx in indices[0]]
-        result_distances = distances[0].tolist()
+        # 将索引映射到 chunk_ids（k 大于向量总数时 FAISS 用 -1 填充，需跳过）
+        results = []
+        for row_distances, row_indices in zip(distances, indices):
+            result_chunk_ids = []
+            result_distances = []
+            for dist, idx in zip(row_distances, row_indices):
+                if idx < 0:
+                    continue
+                result_chunk_ids.append(self.chunk_ids[idx])
+                result_distances.append(float(dist))
+            results.append((result_distances, result_chunk_ids))
         
-        return result_distances, result_chunk_ids
+        return results
+    
+    def _make_selector(self, allowed_chunk_ids):
+        """
+        将允许的 chunk_id 转换为 FAISS ID 选择器（作用于向量位置）。
+        允许范围较大时使用位图（O(1) 判断），较小时使用批量 ID 集合。
+        没有任何允许的向量时返回 None。
+        """
+        if self._positions is None:
+            self._positions = {cid: pos for pos, cid in enumerate(self.chunk_ids)}
+        
+        positions = np.array(
+            [self._positions[cid] for cid in allowed_chunk_ids if cid in self._positions],
+            dtype='int64'
+        )
+        if len(positions) == 0:
+            return None
+        
+        ntotal = self.index.ntotal
+        if len(positions) * 32 >= ntotal:
+            bitmap = np.zeros((ntotal + 7) // 8, dtype='uint8')
+            np.bitwise_or.at(bitmap, positions >> 3, (1 << (positions & 7)).astype('uint8'))
+            selector = faiss.IDSelectorBitmap(ntotal, faiss.swig_ptr(bitmap))
+            selector.bitmap_ref = bitmap  # 位图必须在搜索期间保持存活
+        else:
+            selector = faiss.IDSelectorBatch(positions)
+        return selector
+    
+    def _search_params(self, selector):
+        """按索引类型构造带选择器的搜索参数。"""
+        # 搜索参数对象会覆盖索引上设置的 efSearch / nprobe，需要带上当前值
+        index = faiss.downcast_index(self.index)
+        if isinstance(index, faiss.IndexHNSW):
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+        if isinstance(index, faiss.IndexIVF):
+            return faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+        return faiss.SearchParameters(sel=selector)
     
     def get_stats(self) -> dict:
         """
@@ -210,5 +465,8 @@ class FaissIndex:
             "loaded": True,
             "total_vectors": self.index.ntotal,
             "dimension": self.dimension,
-            "total_chunks": len(self.chunk_ids)
+            "total_chunks": len(self.chunk_ids),
+            "snapshot": self.snapshot,
+            "index_type": self.index_type(),
+            "search_params": self.search_params
         }
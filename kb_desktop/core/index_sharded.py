@@ -0,0 +1,355 @@
+import os
+import json
+import heapq
+import shutil
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from core.index_faiss import FaissIndex, verify_chunk_ids
+except ImportError:
+    # 作为 kb_desktop.core 包导入时（与 index_faiss 导入 snapshot 的方式一致）
+    from .index_faiss import FaissIndex, verify_chunk_ids
+
+class ShardedFaissIndex:
+    """
+    将向量划分到多个 FAISS 分片中的索引管理器。
+
+    每个分片是一个独立的 FaissIndex，以版本化快照（见 SnapshotStore）保存在自己的目录中。
+    搜索时在线程池上并行查询所有分片（FAISS 搜索会释放 GIL），再合并各分片的 top-k。
+    增量更新只会标记被修改的分片，保存时只为这些分片提交新快照。
+
+    分片清单 shards.json 记录每个分片使用的快照，最后原子替换：保存中途崩溃时，
+    清单仍指向上一次完整保存的快照（旧快照在新清单写入后才删除），加载得到一致的索引。
+
+    分片策略:
+        - "size": 向最后一个分片追加，达到 max_shard_size 后开启新分片
+        - "document": 按 doc_id % num_shards 分配，同一文档的向量总在同一分片
+          （Indexer 会为这种索引查询并传入 doc_ids）
+    """
+
+    MANIFEST_FILE = "shards.json"
+
+    def __init__(self, shard_dir=None, shard_by="size", num_shards=8,
+                 max_shard_size=50000, max_workers=None, index_factory=None, search_params=None):
+        """
+        初始化分片索引管理器。
+
+        Args:
+            shard_dir: 保存分片文件的目录，默认 kb_desktop/data/shards
+            shard_by: 分片策略，"size" 或 "document"
+            num_shards: "document" 策略下的分片数量
+            max_shard_size: "size" 策略下每个分片的最大向量数
+            max_workers: 并行搜索的线程数，默认等于 CPU 核数
+            index_factory / search_params: 每个分片的索引类型和搜索参数（见 FaissIndex）
+        """
+        if shard_by not in ("size", "document"):
+            raise ValueError(f"Unknown shard strategy: {shard_by}")
+
+        if shard_dir is None:
+            current_dir = os.path.dirname(os.path.abspath(__file__))
+            kb_desktop_dir = os.path.dirname(current_dir)
+            shard_dir = os.path.join(kb_desktop_dir, "data", "shards")
+
+        self.shard_dir = shard_dir
+        self.shard_by = shard_by
+        self.num_shards = num_shards
+        self.max_shard_size = max_shard_size
+        self.max_workers = max_workers or os.cpu_count() or 4
+        self.index_factory = index_factory
+        self.search_params = search_params
+        self.dimension = None
+        self.shards: Dict[int, FaissIndex] = {}
+        self.dirty = set()  # 需要重写的分片
+        self.consistency = None
+        self._executor = None  # 并行搜索的线程池，第一次多分片搜索时创建
+        self._executor_lock = threading.Lock()
+
+        os.makedirs(shard_dir, exist_ok=True)
+
+    # ---------- 构建与更新 ----------
+
+    def build_index(self, vectors: np.ndarray, chunk_ids: List[int], dimension: int,
+                    doc_ids: Optional[List[int]] = None):
+        """
+        从向量构建全部分片（丢弃已有分片）。
+
+        Args:
+            vectors: 形状为 (n_vectors, dimension) 的 numpy 数组
+            chunk_ids: 与每个向量对应的 chunk ID 列表
+            dimension: 向量维度
+            doc_ids: 每个向量所属的文档 ID（"document" 策略必需）
+        """
+        if len(vectors) != len(chunk_ids):
+            raise ValueError("Number of vectors must match number of chunk_ids")
+
+        # 不再使用的旧分片文件在新清单写入后由 save() 清理
+        self.shards = {}
+        self.dirty = set()
+        self.dimension = dimension
+
+        self._add(np.asarray(vectors), list(chunk_ids), doc_ids)
+        print(f"Built sharded FAISS index with {self.ntotal} vectors in {len(self.shards)} shards")
+
+    def add_to_index(self, vectors: np.ndarray, chunk_ids: List[int],
+                     doc_ids: Optional[List[int]] = None):
+        """
+        增量添加向量，只有接收到新向量的分片会被标记为需要重写。
+        """
+        if self.dimension is None:
+            raise ValueError("No existing index. Build an index first.")
+
+        if len(vectors) != len(chunk_ids):
+            raise ValueError("Number of vectors must match number of chunk_ids")
+
+        vectors = np.asarray(vectors)
+        if vectors.shape[1] != self.dimension:
+            raise ValueError(f"Vector dimension {vectors.shape[1]} doesn't match index dimension {self.dimension}")
+
+        touched = self._add(vectors, list(chunk_ids), doc_ids)
+        print(f"Added {len(vectors)} vectors to shards {sorted(touched)}. Total: {self.ntotal}")
+
+    def remove_ids(self, chunk_ids: List[int]) -> int:
+        """删除指定 chunk_id 的向量，只有包含这些向量的分片会被标记为需要重写。返回删除的向量数。"""
+        removed = 0
+        for shard_id, shard in self.shards.items():
+            count = shard.remove_ids(chunk_ids)
+            if count:
+                self.dirty.add(shard_id)
+                removed += count
+        return removed
+
+    def _add(self, vectors: np.ndarray, chunk_ids: List[int], doc_ids: Optional[List[int]]) -> set:
+        """按分片策略分配向量，返回被修改的分片 ID 集合。"""
+        groups = self._assign(len(chunk_ids), doc_ids)
+        for shard_id, positions in groups.items():
+            shard = self.shards.get(shard_id)
+            if shard is None:
+                shard = self._new_shard(shard_id)
+                shard.build_index(vectors[positions], [chunk_ids[p] for p in positions], self.dimension)
+                self.shards[shard_id] = shard
+            else:
+                shard.add_to_index(vectors[positions], [chunk_ids[p] for p in positions])
+            self.dirty.add(shard_id)
+        return set(groups)
+
+    def _assign(self, count: int, doc_ids: Optional[List[int]]) -> Dict[int, List[int]]:
+        """返回 shard_id -> 向量下标列表。"""
+        groups: Dict[int, List[int]] = {}
+
+        if self.shard_by == "document":
+            if doc_ids is None or len(doc_ids) != count:
+                raise ValueError("doc_ids are required for document sharding")
+            for pos, doc_id in enumerate(doc_ids):
+                groups.setdefault(doc_id % self.num_shards, []).append(pos)
+            return groups
+
+        # 按大小：填满最后一个分片后再开新分片
+        shard_id = max(self.shards) if self.shards else 0
+        room = self.max_shard_size - (self.shards[shard_id].index.ntotal if shard_id in self.shards else 0)
+        for pos in range(count):
+            if room <= 0:
+                shard_id += 1
+                room = self.max_shard_size
+            groups.setdefault(shard_id, []).append(pos)
+            room -= 1
+        return groups
+
+    # ---------- 持久化 ----------
+
+    def save(self):
+        """为被修改的分片提交新快照，然后原子更新分片清单，最后删除清单不再引用的快照。"""
+        if not self.shards:
+            raise ValueError("No index to save. Build or load an index first.")
+
+        for shard_id in sorted(self.dirty):
+            self.shards[shard_id].save()
+
+        manifest = {
+            "shard_by": self.shard_by,
+            "num_shards": self.num_shards,
+            "max_shard_size": self.max_shard_size,
+            "dimension": self.dimension,
+            "shards": {str(sid): {"snapshot": shard.snapshot, "total": shard.index.ntotal}
+                       for sid, shard in sorted(self.shards.items())}
+        }
+        manifest_path = os.path.join(self.shard_dir, self.MANIFEST_FILE)
+        with open(manifest_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+        # 新清单已生效：旧快照和不再属于清单的分片都可以删除
+        for shard_id in self.dirty:
+            shard = self.shards[shard_id]
+            shard.snapshots.prune([shard.snapshot])
+        self._remove_orphan_files()
+
+        print(f"Saved {len(self.dirty)} of {len(self.shards)} shards to {self.shard_dir}")
+        self.dirty = set()
+
+    def load(self, db=None):
+        """
+        根据分片清单加载所有分片（每个分片加载清单引用的快照）。
+        成功返回 True，清单不存在或任一分片损坏返回 False。
+        """
+        manifest_path = os.path.join(self.shard_dir, self.MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return False
+
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+
+        shards = {}
+        legacy = set()
+        for sid, entry in manifest["shards"].items():
+            shard = self._new_shard(int(sid))
+            if isinstance(entry, int):
+                # 旧版清单只记录向量数，分片保存为单文件；下次保存时迁移为快照
+                loaded, total = shard.load(), entry
+                legacy.add(int(sid))
+            else:
+                loaded, total = shard.load(snapshot=entry["snapshot"]), entry["total"]
+            if not loaded or shard.index.ntotal != total:
+                print(f"Failed to load shard {sid}")
+                return False
+            shards[int(sid)] = shard
+
+        self.shard_by = manifest["shard_by"]
+        self.num_shards = manifest["num_shards"]
+        self.max_shard_size = manifest["max_shard_size"]
+        self.dimension = manifest["dimension"]
+        self.shards = shards
+        self.dirty = legacy
+
+        print(f"Loaded {len(shards)} shards with {self.ntotal} vectors, dimension={self.dimension}")
+
+        if db is not None:
+            self.consistency = self.verify_against_db(db)
+        return True
+
+    def _new_shard(self, shard_id: int) -> FaissIndex:
+        # 快照由本类在清单生效后清理（keep_snapshots=None），单文件路径只用于读取旧版分片
+        return FaissIndex(
+            index_path=os.path.join(self.shard_dir, f"shard-{shard_id:04d}.index"),
+            meta_path=os.path.join(self.shard_dir, f"shard-{shard_id:04d}.json"),
+            snapshot_dir=os.path.join(self.shard_dir, f"shard-{shard_id:04d}"),
+            keep_snapshots=None,
+            index_factory=self.index_factory,
+            search_params=self.search_params
+        )
+
+    def _remove_orphan_files(self):
+        """删除不再属于清单的分片目录和旧版单文件分片（例如重建后分片变少）。"""
+        live = {os.path.basename(shard.snapshots.root_dir) for shard in self.shards.values()}
+        for name in os.listdir(self.shard_dir):
+            if not name.startswith("shard-") or name in live:
+                continue
+            path = os.path.join(self.shard_dir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+
+    # ---------- 搜索 ----------
+
+    def search(self, query_vector: np.ndarray, k: int = 5, allowed_chunk_ids=None) -> Tuple[List[float], List[int]]:
+        """
+        在所有分片上并行搜索并合并 top-k。
+        allowed_chunk_ids 会传给每个分片，在分片内部用 ID 选择器过滤。
+
+        Returns:
+            (distances, chunk_ids) 的元组，按距离升序
+        """
+        if not self.shards:
+            raise ValueError("No index loaded. Build or load an index first.")
+
+        shards = list(self.shards.values())
+        if len(shards) == 1:
+            return shards[0].search(query_vector, k, allowed_chunk_ids)
+
+        executor = self._pool()
+        if allowed_chunk_ids is not None and not isinstance(allowed_chunk_ids, (set, frozenset)):
+            allowed_chunk_ids = set(allowed_chunk_ids)
+
+        results = executor.map(
+            lambda shard: shard.search(query_vector, k, allowed_chunk_ids), shards
+        )
+
+        candidates = []
+        for distances, chunk_ids in results:
+            candidates.extend(zip(distances, chunk_ids))
+
+        top = heapq.nsmallest(k, candidates, key=lambda x: x[0])
+        return [d for d, _ in top], [cid for _, cid in top]
+
+    def search_batch(self, query_vectors: np.ndarray, k: int = 5, allowed_chunk_ids=None) -> List[Tuple[List[float], List[int]]]:
+        """
+        批量搜索：每个分片用一次 FAISS 调用搜索全部查询（分片之间并行），再逐个查询合并 top-k。
+
+        Returns:
+            每个查询一个 (distances, chunk_ids) 元组，按距离升序
+        """
+        if not self.shards:
+            raise ValueError("No index loaded. Build or load an index first.")
+
+        shards = list(self.shards.values())
+        if len(shards) == 1:
+            return shards[0].search_batch(query_vectors, k, allowed_chunk_ids)
+
+        executor = self._pool()
+        if allowed_chunk_ids is not None and not isinstance(allowed_chunk_ids, (set, frozenset)):
+            allowed_chunk_ids = set(allowed_chunk_ids)
+
+        shard_results = list(executor.map(
+            lambda shard: shard.search_batch(query_vectors, k, allowed_chunk_ids), shards
+        ))
+
+        merged = []
+        for per_query in zip(*shard_results):
+            candidates = []
+            for distances, chunk_ids in per_query:
+                candidates.extend(zip(distances, chunk_ids))
+            top = heapq.nsmallest(k, candidates, key=lambda x: x[0])
+            merged.append(([d for d, _ in top], [cid for _, cid in top]))
+        return merged
+
+    def _pool(self) -> ThreadPoolExecutor:
+        # 并发的第一次搜索共用同一个线程池
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    # ---------- 统计 ----------
+
+    @property
+    def ntotal(self) -> int:
+        return sum(shard.index.ntotal for shard in self.shards.values())
+
+    @property
+    def chunk_ids(self) -> List[int]:
+        ids = []
+        for _, shard in sorted(self.shards.items()):
+            ids.extend(shard.chunk_ids)
+        return ids
+
+    def verify_against_db(self, db) -> dict:
+        """检查所有分片中的 chunk_id 与数据库 chunks 表是否一致（见 verify_chunk_ids）。"""
+        return verify_chunk_ids(self.chunk_ids, db)
+
+    def get_stats(self) -> dict:
+        if not self.shards:
+            return {"loaded": False}
+
+        return {
+            "loaded": True,
+            "total_vectors": self.ntotal,
+            "dimension": self.dimension,
+            "total_chunks": self.ntotal,
+            "shards": {sid: shard.index.ntotal for sid, shard in sorted(self.shards.items())},
+            "shard_by": self.shard_by
+        }
@@ -0,0 +1,170 @@
+import numpy as np
+from typing import Callable, Dict, List, Optional
+
+from core.vector_store import VectorStore
+
+class Indexer:
+    """
+    从数据库中的文本块构建向量索引。
+
+    嵌入结果一到达就写入 VectorStore，重建索引时只为还没有嵌入的文本块调用 API；
+    所有嵌入都已存储时，重建完全在本地完成（无网络、无令牌消耗）。
+    """
+
+    def __init__(self, db, index, embedder=None, vector_store: Optional[VectorStore] = None,
+                 batch_size: int = 100):
+        """
+        Args:
+            db: DBManager 实例
+            index: FaissIndex 或 ShardedFaissIndex 实例
+            embedder: 嵌入器实例；为 None 时只能使用已存储的嵌入（离线重建）
+            vector_store: 嵌入存储，默认 kb_desktop/data/vectors
+            batch_size: 每次嵌入请求的文本块数量
+        """
+        self.db = db
+        self.index = index
+        self.embedder = embedder
+        self.vector_store = vector_store if vector_store is not None else VectorStore()
+        self.batch_size = batch_size
+
+    def rebuild(self, on_progress: Optional[Callable[[str, int], None]] = None) -> Dict:
+        """
+        从数据库中的所有文本块重建索引并保存。
+
+        Args:
+            on_progress: 可选回调 (消息, 进度百分比)
+
+        Returns:
+            {'total': 向量数, 'embedded': 本次新调用 API 嵌入的数量,
+             'dimension': 维度, 'documents': 标记为已索引的文档数}
+        """
+        def progress(message, percent):
+            if on_progress:
+                on_progress(message, percent)
+
+        # 近似重复块共享规范块的嵌入和索引条目
+        chunk_ids = self.db.get_indexable_chunk_ids()
+        if not chunk_ids:
+            raise ValueError("No chunks found. Import documents first.")
+
+        # 1. 只嵌入缺少向量的文本块（保留最后 10% 用于构建索引）
+        embedded = self.embed_missing(chunk_ids, on_progress=lambda done, total: progress(
+            f"正在嵌入 {total} 个文本块...", int(done / total * 90)
+        ))
+
+        # 2. 从存储中读取全部向量并构建索引
+        progress("正在构建 FAISS 索引...", 95)
+        vectors = self.vector_store.get(chunk_ids)
+        dimension = vectors.shape[1]
+        self.index.build_index(vectors, chunk_ids, dimension, **self._placement(chunk_ids))
+
+        # 3. 标记文档并保存
+        progress("正在更新文档状态...", 97)
+        doc_count = self.db.mark_chunks_indexed(chunk_ids)
+        self.index.save()
+
+        # 被删除或重复写入的旧行过多时压缩存储
+        if self.vector_store.row_count > 2 * len(chunk_ids):
+            self.vector_store.compact(chunk_ids)
+
+        progress("索引构建完成", 100)
+        return {
+            'total': len(chunk_ids),
+            'embedded': embedded,
+            'dimension': dimension,
+            'documents': doc_count
+        }
+
+    def index_chunks(self, chunk_ids: List[int]) -> int:
+        """
+        增量索引指定的文本块（嵌入缺失的向量后追加到现有索引并保存）。
+        索引尚未加载时退化为完整重建。返回新加入索引的向量数。
+        """
+        if not chunk_ids:
+            return 0
+
+        if not self.index.get_stats().get("loaded"):
+            return self.rebuild()['total']
+
+        self.embed_missing(chunk_ids)
+        vectors = self.vector_store.get(chunk_ids)
+        self.index.add_to_index(vectors, chunk_ids, **self._placement(chunk_ids))
+        self.db.mark_chunks_indexed(chunk_ids)
+        self.index.save()
+        return len(chunk_ids)
+
+    def apply_changes(self, added_ids: List[int], removed_ids: List[int]) -> Dict:
+        """
+        把文档同步的结果应用到索引：移除被删除文本块的向量，嵌入并追加新文本块，只保存一次。
+        未变化的文本块保留原有向量，因此嵌入开销与修改量成正比。索引尚未加载时退化为完整重建。
+
+        Returns:
+            {'added': 加入索引的向量数, 'removed': 移出索引的向量数, 'embedded': 本次新嵌入的数量}
+        """
+        if not self.index.get_stats().get("loaded"):
+            result = self.rebuild()
+            return {'added': result['total'], 'removed': 0, 'embedded': result['embedded']}
+
+        removed = self.index.remove_ids(removed_ids) if removed_ids else 0
+        embedded = self.embed_missing(added_ids) if added_ids else 0
+        if added_ids:
+            self.index.add_to_index(self.vector_store.get(added_ids), added_ids, **self._placement(added_ids))
+            self.db.mark_chunks_indexed(added_ids)
+        if removed or added_ids:
+            self.index.save()
+        return {'added': len(added_ids), 'removed': removed, 'embedded': embedded}
+
+    def _placement(self, chunk_ids: List[int]) -> Dict:
+        """按文档分片的索引需要每个向量所属的文档 ID，其他索引不需要额外参数。"""
+        if getattr(self.index, 'shard_by', None) != "document":
+            return {}
+        doc_ids = self.db.get_chunk_doc_ids(chunk_ids)
+        return {'doc_ids': [doc_ids[cid] for cid in chunk_ids]}
+
+    def embed_missing(self, chunk_ids: List[int],
+                      on_progress: Optional[Callable[[int, int], None]] = None) -> int:
+        """
+        为存储中还没有嵌入的文本块调用嵌入器，每批结果立即追加到存储。
+
+        Args:
+            chunk_ids: 需要具备嵌入的文本块
+            on_progress: 可选回调 (已完成数, 总数)
+
+        Returns:
+            本次新嵌入的文本块数量
+        """
+        model = getattr(self.embedder, 'model', None)
+        store = self.vector_store
+        if self.embedder is not None and store.model != model:
+            # 更换了嵌入模型：旧向量不可再用
+            if store.row_count:
+                print(f"Embedding model changed ({store.model} -> {model}), clearing stored vectors")
+            store.reset(None, model)
+
+        missing = store.missing_ids(chunk_ids)
+        total = len(chunk_ids)
+        done = total - len(missing)
+        if on_progress:
+            on_progress(done, total)
+
+        if not missing:
+            return 0
+
+        if self.embedder is None:
+            raise ValueError(
+                f"{len(missing)} chunks have no stored embedding and no embedder is available."
+            )
+
+        rows = self.db.get_chunks_by_ids(missing)
+        missing = [cid for cid in missing if cid in rows]
+
+        for i in range(0, len(missing), self.batch_size):
+            batch_ids = missing[i:i+self.batch_size]
+            embeddings = self.embedder.get_embeddings([rows[cid]['text'] for cid in batch_ids])
+            store.append(batch_ids, np.array(embeddings, dtype=np.float32))
+
+            done += len(batch_ids)
+            if on_progress:
+                on_progress(done, total)
+
+        return len(missing)
@@ -1,48 +1,157 @@
 import os
-import docx
+import codecs
+import zipfile
+import xml.etree.ElementTree as ET
+
+from core.parsers import get_parser
+
+# Word 文档主体的 XML 命名空间
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_RELS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
 
 class Ingestor:
+    # 明确支持中文编码（按顺序尝试）
+    TEXT_ENCODINGS = ['utf-8', 'gb18030', 'gbk', 'big5', 'latin-1']
+    # 用于检测编码的样本大小（字节）
+    SAMPLE_SIZE = 64 * 1024
+    # 流式读取时每次解码的字符数
+    BLOCK_CHARS = 1 << 20
+
     @staticmethod
     def load_file(file_path):
         """
         读取文件并返回其文本内容。
-        支持: .txt, .md, .docx
+        支持: .txt, .md, .docx，以及 core.parsers 中注册的格式（.pdf, .html, .csv, .xlsx, .pptx 等）
         """
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"File not found: {file_path}")
-            
+
         ext = os.path.splitext(file_path)[1].lower()
-        
+
         try:
-            if ext == '.docx':
-                return Ingestor._read_docx(file_path)
-            elif ext in ['.txt', '.md']:
-                return Ingestor._read_text(file_path)
-            else:
+            parser = get_parser(file_path)
+            if parser is None:
                 raise ValueError(f"Unsupported file type: {ext}")
+            return '\n'.join(parser(file_path))
         except Exception as e:
             raise Exception(f"Failed to read {file_path}: {str(e)}")
 
+    @staticmethod
+    def detect_encoding(path, sample_size=None):
+        """
+        用文件开头的样本检测编码：先识别 BOM，再按 TEXT_ENCODINGS 顺序尝试解码样本。
+        样本末尾被截断的多字节字符不算错误。所有编码都失败时返回 None。
+        """
+        sample_size = sample_size or Ingestor.SAMPLE_SIZE
+        with open(path, 'rb') as f:
+            sample = f.read(sample_size)
+
+        if sample.startswith(codecs.BOM_UTF8):
+            return 'utf-8-sig'
+        if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+            return 'utf-16'
+
+        final = len(sample) < sample_size  # 样本即整个文件
+        for enc in Ingestor.TEXT_ENCODINGS:
+            try:
+                codecs.getincrementaldecoder(enc)().decode(sample, final=final)
+                return enc
+            except UnicodeDecodeError:
+                continue
+        return None
+
+    @staticmethod
+    def _iter_blocks(path, encoding, errors='strict'):
+        """按 BLOCK_CHARS 个字符逐块解码文件（换行统一为 \\n，与一次性读取的结果相同）。"""
+        with open(path, 'r', encoding=encoding, errors=errors) as f:
+            while True:
+                block = f.read(Ingestor.BLOCK_CHARS)
+                if not block:
+                    break
+                yield block
+
     @staticmethod
     def _read_text(path):
-        # 明确支持中文编码
-        encodings = ['utf-8', 'gb18030', 'gbk', 'big5', 'latin-1']
-        
-        for enc in encodings:
+        # 用样本检测编码后只读取一次文件
+        encoding = Ingestor.detect_encoding(path)
+        candidates = list(Ingestor.TEXT_ENCODINGS)
+        if encoding is not None:
+            try:
+                return "".join(Ingestor._iter_blocks(path, encoding))
+            except UnicodeDecodeError:
+                # 样本之后的内容不是该编码（例如开头是纯英文），继续尝试后面的编码
+                if encoding in candidates:
+                    candidates = candidates[candidates.index(encoding) + 1:]
+
+        for enc in candidates:
             try:
-                with open(path, 'r', encoding=enc) as f:
-                    return f.read()
+                return "".join(Ingestor._iter_blocks(path, enc))
             except UnicodeDecodeError:
                 continue
-        
+
         # 如果全部失败，尝试 ignore（最后手段）
-        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
-            return f.read()
+        return "".join(Ingestor._iter_blocks(path, 'utf-8', errors='ignore'))
+
+    @staticmethod
+    def _iter_docx_paragraphs(path):
+        """
+        流式解析 word/document.xml，逐个产出正文段落的文本（与 python-docx 的 Document.paragraphs 一致：
+        只包含正文顶层段落，文本来自段落中的 run 和超链接中的 run，制表符和换行转换为 \\t 和 \\n）。
+        每个顶层元素处理完后即释放，内存占用与单个段落相当，而不是整个文档对象树。
+        """
+        with zipfile.ZipFile(path) as archive, archive.open(Ingestor._docx_main_part(archive)) as f:
+            stack = []          # 当前元素路径上的标签
+            body = None
+            body_depth = None   # w:body 在路径中的深度
+            parts = None        # 当前正文段落已收集的文本
+            for event, elem in ET.iterparse(f, events=("start", "end")):
+                if event == "start":
+                    stack.append(elem.tag)
+                    if body is None and elem.tag == _W + "body":
+                        body, body_depth = elem, len(stack)
+                    elif elem.tag == _W + "p" and body is not None and len(stack) == body_depth + 1:
+                        parts = []
+                    continue
+
+                if parts is not None:
+                    # 相对正文段落的路径: p/r/X 或 p/hyperlink/r/X
+                    rel = stack[body_depth:]
+                    if (len(rel) == 3 and rel[1] == _W + "r") or \
+                            (len(rel) == 4 and rel[1] == _W + "hyperlink" and rel[2] == _W + "r"):
+                        parts.append(Ingestor._run_content_text(elem))
+                    elif len(rel) == 1:
+                        yield "".join(parts)
+                        parts = None
+
+                stack.pop()
+                if body is not None and len(stack) == body_depth:
+                    # 正文的一个顶层元素处理完毕，释放已解析的子树
+                    body.clear()
+
+    @staticmethod
+    def _docx_main_part(archive):
+        """从包关系中找到文档主体部件（通常是 word/document.xml）。"""
+        try:
+            rels = ET.fromstring(archive.read("_rels/.rels"))
+        except KeyError:
+            return "word/document.xml"
+        for rel in rels.iter(_RELS + "Relationship"):
+            if rel.get("Type", "").endswith("/officeDocument"):
+                return rel.get("Target").lstrip("/")
+        return "word/document.xml"
 
     @staticmethod
-    def _read_docx(path):
-        doc = docx.Document(path)
-        full_text = []
-        for para in doc.paragraphs:
-            full_text.append(para.text)
-        return '\n'.join(full_text)
+    def _run_content_text(elem):
+        """run 内部元素的文本（与 python-docx 的 Run.text 一致）。"""
+        tag = elem.tag
+        if tag == _W + "t":
+            return elem.text or ""
+        if tag in (_W + "tab", _W + "ptab"):
+            return "\t"
+        if tag == _W + "br":
+            return "\n" if elem.get(_W + "type", "textWrapping") == "textWrapping" else ""
+        if tag == _W + "cr":
+            return "\n"
+        if tag == _W + "noBreakHyphen":
+            return "-"
+        return ""
@@ -1,6 +1,6 @@
 import os
-from openai import OpenAI
-from typing import List, Dict, Any, Generator
+from openai import OpenAI, AsyncOpenAI
+from typing import List, Dict, Any, Generator, AsyncGenerator
 
 class LLMClient:
     def __init__(self, api_key=None, base_url=None, model=None):
@@ -42,3 +42,48 @@ class LLMClient:
             # 避免在来些 Windows 系统上可能导致 UnicodeEncodeError 输出中文到控制台
             # print(error_msg) 
             yield error_msg
+
+class AsyncLLMClient:
+    """
+    LLMClient 的 asyncio 版本（AsyncOpenAI）。一个实例内的所有请求共享同一个 HTTP 连接池，
+    多个问题可以在同一个事件循环中并发生成，不需要每个请求占用一个线程。
+    """
+
+    def __init__(self, api_key=None, base_url=None, model=None):
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.base_url = base_url or os.getenv("OPENAI_BASE_URL")
+        self.model = model or os.getenv("LLM_MODEL", "openai/gpt-oss-120b:free")
+
+        if not self.api_key:
+            raise ValueError("API key is required for AsyncLLMClient.")
+
+        self.client = AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url
+        )
+
+    async def chat(self, messages: List[Dict[str, str]], stream=True) -> AsyncGenerator[str, None]:
+        """
+        向 LLM 发送聊天消息并异步产生响应块（出错时与 LLMClient 一样产生错误消息）。
+        """
+        try:
+            response = await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                stream=stream,
+                extra_body={"reasoning": {"enabled": True}}
+            )
+
+            if stream:
+                async for chunk in response:
+                    content = chunk.choices[0].delta.content if chunk.choices else None
+                    if content:
+                        yield content
+            else:
+                yield response.choices[0].message.content
+
+        except Exception as e:
+            yield f"调用 LLM 时出错: {str(e)}"
+
+    async def close(self):
+        await self.client.close()
@@ -0,0 +1,366 @@
+import os
+import re
+import csv
+import time
+import importlib
+import mimetypes
+import multiprocessing
+import multiprocessing.connection
+from collections import deque
+from html.parser import HTMLParser
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# 扩展名 -> 解析器；MIME 类型 -> 扩展名
+_PARSERS: Dict[str, Callable[[str], Iterable[str]]] = {}
+_MIME_TYPES: Dict[str, str] = {}
+
+def register_parser(extensions: Iterable[str], mime_types: Iterable[str] = ()):
+    """
+    注册文档解析器的装饰器。
+
+    解析器 parser(path) 返回文本片段（段落、页、表格行等）的迭代器，
+    Ingestor.load_file 用换行连接这些片段得到文档内容。
+    扩展名查不到时按 MIME 类型（由 mimetypes 根据文件名推断）查找。
+    """
+    extensions = [ext.lower() for ext in extensions]
+
+    def decorator(parser):
+        for ext in extensions:
+            _PARSERS[ext] = parser
+        for mime in mime_types:
+            _MIME_TYPES[mime] = extensions[0]
+        return parser
+    return decorator
+
+def get_parser(path: str) -> Optional[Callable[[str], Iterable[str]]]:
+    """返回文件对应的解析器，不支持的格式返回 None。"""
+    parser = _PARSERS.get(os.path.splitext(path)[1].lower())
+    if parser is None:
+        mime, _ = mimetypes.guess_type(path)
+        if mime in _MIME_TYPES:
+            parser = _PARSERS.get(_MIME_TYPES[mime])
+    return parser
+
+def supported_extensions() -> List[str]:
+    """已注册的扩展名（升序）。"""
+    return sorted(_PARSERS)
+
+def _ingestor():
+    # 延迟导入（ingest 依赖本模块的注册表）
+    from core.ingest import Ingestor
+    return Ingestor
+
+def _require(module: str, package: str, ext: str):
+    try:
+        return importlib.import_module(module)
+    except ImportError:
+        raise ImportError(f"{package} is required to import {ext} files (pip install {package})")
+
+def _format_row(header: List[str], row: Iterable) -> str:
+    """表格行 -> "列名: 值，列名: 值"（没有表头或多出的列只保留值），空单元格省略。"""
+    parts = []
+    for i, value in enumerate(row):
+        if value is None:
+            continue
+        value = str(value).strip()
+        if not value:
+            continue
+        name = header[i] if i < len(header) else ""
+        parts.append(f"{name}: {value}" if name else value)
+    return "，".join(parts)
+
+# ---------- 文本 / Word ----------
+
+@register_parser(['.txt', '.md'], ['text/plain', 'text/markdown'])
+def parse_text(path: str) -> Iterator[str]:
+    """按样本检测编码后一次解码整个文本文件。"""
+    yield _ingestor()._read_text(path)
+
+@register_parser(['.docx'], ['application/vnd.openxmlformats-officedocument.wordprocessingml.document'])
+def parse_docx(path: str) -> Iterator[str]:
+    """流式解析正文段落（见 Ingestor._iter_docx_paragraphs）。"""
+    return _ingestor()._iter_docx_paragraphs(path)
+
+# ---------- PDF ----------
+
+@register_parser(['.pdf'], ['application/pdf'])
+def parse_pdf(path: str) -> Iterator[str]:
+    """逐页提取 PDF 文本（需要 pypdf）。扫描版 PDF 没有文本层，结果为空。"""
+    pypdf = _require("pypdf", "pypdf", ".pdf")
+    reader = pypdf.PdfReader(path)
+    for page in reader.pages:
+        text = (page.extract_text() or "").strip()
+        if text:
+            yield text
+
+# ---------- HTML ----------
+
+class _HTMLTextExtractor(HTMLParser):
+    """
+    提取 HTML 正文段落：跳过脚本、样式、导航、页眉页脚、侧栏等模板内容，
+    块级元素和 <br> 处分段，段内空白折叠为一个空格。
+    """
+
+    SKIP_TAGS = {'script', 'style', 'noscript', 'template', 'svg', 'nav', 'header', 'footer',
+                 'aside', 'form', 'button', 'select', 'iframe', 'canvas'}
+    SKIP_ROLES = {'navigation', 'banner', 'contentinfo', 'complementary', 'search', 'menu'}
+    SKIP_PATTERN = re.compile(r'(^|[\s_-])(nav|navbar|menu|header|masthead|footer|sidebar|breadcrumbs?|cookie|advert|ads|share|comments?)($|[\s_-])', re.I)
+    BLOCK_TAGS = {'p', 'div', 'section', 'article', 'main', 'li', 'ul', 'ol', 'dl', 'dt', 'dd', 'table', 'tr',
+                  'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote', 'pre', 'br', 'hr', 'title', 'figcaption',
+                  'caption'}
+    VOID_TAGS = {'br', 'hr', 'img', 'input', 'meta', 'link', 'area', 'base', 'col', 'embed', 'source', 'wbr'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.paragraphs: List[str] = []
+        self._current: List[str] = []
+        self._skip: List[str] = []  # 正在跳过的元素的标签栈
+
+    def _flush(self):
+        text = re.sub(r'\s+', ' ', "".join(self._current)).strip()
+        self._current = []
+        if text:
+            self.paragraphs.append(text)
+
+    def _is_boilerplate(self, tag: str, attrs) -> bool:
+        if tag in self.SKIP_TAGS:
+            return True
+        attrs = dict(attrs)
+        if (attrs.get('role') or '').lower() in self.SKIP_ROLES or 'hidden' in attrs:
+            return True
+        return bool(self.SKIP_PATTERN.search(f"{attrs.get('id') or ''} {attrs.get('class') or ''}"))
+
+    def handle_starttag(self, tag, attrs):
+        if self._skip:
+            if tag not in self.VOID_TAGS:
+                self._skip.append(tag)
+            return
+        if tag not in self.VOID_TAGS and self._is_boilerplate(tag, attrs):
+            self._flush()
+            self._skip.append(tag)
+            return
+        if tag in self.BLOCK_TAGS:
+            self._flush()
+        elif tag in ('td', 'th'):
+            # 单元格之间留空格，表格按行分段
+            self._current.append(" ")
+
+    def handle_endtag(self, tag):
+        if self._skip:
+            # 容忍未闭合的内层标签：弹出到匹配的开始标签为止
+            if tag in self._skip:
+                while self._skip.pop() != tag:
+                    pass
+            return
+        if tag in self.BLOCK_TAGS:
+            self._flush()
+
+    def handle_data(self, data):
+        if not self._skip:
+            self._current.append(data)
+
+    def close(self):
+        super().close()
+        self._flush()
+
+@register_parser(['.html', '.htm', '.xhtml'], ['text/html', 'application/xhtml+xml'])
+def parse_html(path: str) -> Iterator[str]:
+    """流式提取 HTML 正文段落（去除导航、页眉页脚等模板内容）。"""
+    Ingestor = _ingestor()
+    encoding = Ingestor.detect_encoding(path) or 'utf-8'
+    extractor = _HTMLTextExtractor()
+    for block in Ingestor._iter_blocks(path, encoding, errors='replace'):
+        extractor.feed(block)
+        yield from extractor.paragraphs
+        extractor.paragraphs = []
+    extractor.close()
+    yield from extractor.paragraphs
+
+# ---------- 表格 ----------
+
+@register_parser(['.csv', '.tsv'], ['text/csv', 'text/tab-separated-values'])
+def parse_csv(path: str) -> Iterator[str]:
+    """逐行读取 CSV/TSV，第一行作为表头，每行输出为 "列名: 值，..."。"""
+    Ingestor = _ingestor()
+    encoding = Ingestor.detect_encoding(path) or 'utf-8'
+    with open(path, 'r', encoding=encoding, errors='replace', newline='') as f:
+        sample = f.read(Ingestor.SAMPLE_SIZE)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t|")
+        except csv.Error:
+            dialect = csv.excel_tab if path.lower().endswith('.tsv') else csv.excel
+
+        header = None
+        for row in csv.reader(f, dialect):
+            if header is None:
+                header = [cell.strip() for cell in row]
+                continue
+            text = _format_row(header, row)
+            if text:
+                yield text
+
+@register_parser(['.xlsx', '.xlsm'], ['application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'])
+def parse_xlsx(path: str) -> Iterator[str]:
+    """以只读模式逐行读取每个工作表（需要 openpyxl），每行输出为 "列名: 值，..."。"""
+    openpyxl = _require("openpyxl", "openpyxl", ".xlsx")
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            yield f"[{sheet.title}]"
+            header = None
+            for row in sheet.iter_rows(values_only=True):
+                if header is None:
+                    if any(cell is not None for cell in row):
+                        header = ["" if cell is None else str(cell).strip() for cell in row]
+                    continue
+                text = _format_row(header, row)
+                if text:
+                    yield text
+    finally:
+        workbook.close()
+
+# ---------- 演示文稿 ----------
+
+def _shape_texts(shapes) -> Iterator[str]:
+    for shape in shapes:
+        if getattr(shape, 'shapes', None) is not None:
+            # 组合形状
+            yield from _shape_texts(shape.shapes)
+        if getattr(shape, 'has_text_frame', False) and shape.has_text_frame:
+            for paragraph in shape.text_frame.paragraphs:
+                text = "".join(run.text for run in paragraph.runs).strip()
+                if text:
+                    yield text
+        if getattr(shape, 'has_table', False) and shape.has_table:
+            for row in shape.table.rows:
+                text = " | ".join(cell.text.strip() for cell in row.cells)
+                if text.strip(" |"):
+                    yield text
+
+@register_parser(['.pptx'], ['application/vnd.openxmlformats-officedocument.presentationml.presentation'])
+def parse_pptx(path: str) -> Iterator[str]:
+    """逐页提取幻灯片中的文本框、表格和备注（需要 python-pptx）。"""
+    pptx = _require("pptx", "python-pptx", ".pptx")
+    presentation = pptx.Presentation(path)
+    for number, slide in enumerate(presentation.slides, 1):
+        yield f"[幻灯片 {number}]"
+        yield from _shape_texts(slide.shapes)
+        if slide.has_notes_slide:
+            notes = slide.notes_slide.notes_text_frame.text.strip()
+            if notes:
+                yield f"备注: {notes}"
+
+# ---------- 并行解析 ----------
+
+def _parse_worker(tasks, results):
+    """解析进程：从任务队列取 (序号, 路径)，把 (序号, 内容, 错误) 发送到本进程的结果管道。"""
+    Ingestor = _ingestor()
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        index, path = task
+        try:
+            results.send((index, Ingestor.load_file(path), None))
+        except Exception as e:
+            results.send((index, None, str(e)))
+
+class ParsePool:
+    """
+    在工作进程中并行解析文件，每个文件有独立的超时。
+
+    每个工作进程一次只处理一个文件；超时的文件所在的进程会被终止并由新进程替换，
+    因此一个卡住的解析器（例如损坏的 PDF）不会拖住整批导入。
+    每个工作进程通过自己的管道返回结果，终止一个进程不会损坏其他进程的结果通道。
+    """
+
+    def __init__(self, workers: Optional[int] = None, timeout: Optional[float] = None):
+        """
+        Args:
+            workers: 工作进程数，默认读取 IMPORT_WORKERS（CPU 核数，最多 4）
+            timeout: 单个文件的解析超时秒数，默认读取 PARSE_TIMEOUT（120）
+        """
+        if workers is None:
+            workers = int(os.getenv("IMPORT_WORKERS", str(min(4, os.cpu_count() or 1))))
+        self.workers = max(1, workers)
+        self.timeout = float(os.getenv("PARSE_TIMEOUT", "120")) if timeout is None else timeout
+
+    def imap(self, paths: List[str]) -> Iterator[Tuple[str, Optional[str], Optional[str]]]:
+        """
+        按完成顺序产出 (path, content, error)；解析失败或超时时 content 为 None。
+        """
+        if not paths:
+            return
+
+        ctx = multiprocessing.get_context()
+        pending = deque(enumerate(paths))
+        workers = {}  # 结果管道 -> {'process', 'tasks', 'task': (序号, 开始时间) 或 None}
+
+        def spawn():
+            tasks = ctx.Queue()
+            receiver, sender = ctx.Pipe(duplex=False)
+            process = ctx.Process(target=_parse_worker, args=(tasks, sender), daemon=True)
+            process.start()
+            sender.close()  # 只保留工作进程中的发送端，进程退出时接收端能读到 EOF
+            workers[receiver] = {'process': process, 'tasks': tasks, 'task': None}
+            return receiver
+
+        def assign(receiver):
+            worker = workers[receiver]
+            if pending:
+                index, path = pending.popleft()
+                worker['task'] = (index, time.monotonic())
+                worker['tasks'].put((index, path))
+            else:
+                worker['task'] = None
+                worker['tasks'].put(None)
+
+        def retire(receiver, terminate=False):
+            worker = workers.pop(receiver)
+            if terminate:
+                worker['process'].terminate()
+            worker['process'].join(1)
+            receiver.close()
+            if pending:
+                assign(spawn())
+
+        try:
+            for _ in range(min(self.workers, len(paths))):
+                assign(spawn())
+
+            remaining = len(paths)
+            while remaining:
+                ready = multiprocessing.connection.wait(list(workers), timeout=0.1)
+                for receiver in ready:
+                    task = workers[receiver]['task']
+                    try:
+                        index, content, error = receiver.recv()
+                    except (EOFError, OSError):
+                        # 进程意外退出（例如解析器崩溃）
+                        retire(receiver)
+                        if task is not None:
+                            remaining -= 1
+                            yield paths[task[0]], None, "Parser process exited unexpectedly"
+                        continue
+                    remaining -= 1
+                    assign(receiver)
+                    yield paths[index], content, error
+
+                now = time.monotonic()
+                for receiver, worker in list(workers.items()):
+                    task = worker['task']
+                    if task is not None and now - task[1] > self.timeout:
+                        # 超时：终止该进程，换一个新进程继续处理剩余文件
+                        retire(receiver, terminate=True)
+                        remaining -= 1
+                        yield paths[task[0]], None, f"Parsing timed out after {self.timeout:g}s"
+        finally:
+            for receiver, worker in workers.items():
+                if worker['process'].is_alive():
+                    if worker['task'] is None:
+                        worker['process'].join(1)
+                    if worker['process'].is_alive():
+                        worker['process'].terminate()
+                        worker['process'].join(1)
+                receiver.close()
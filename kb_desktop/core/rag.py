@@ -1,5 +1,7 @@
-from typing import List, Dict, Tuple, Optional
+from typing import Callable, List, Dict, Tuple, Optional
 from core.llm import LLMClient
+from core.context_packer import ContextPacker
+from core.tracing import span, event
 import re
 
 # 置信度阈值
@@ -11,8 +13,23 @@ class RAGGenerator:
     RAG 生成器，组装上下文并生成带有强制引用的回答。
     """
     
-    def __init__(self):
+    def __init__(self, token_budget: Optional[int] = None):
+        """
+        Args:
+            token_budget: 上下文 token 预算，默认读取 CONTEXT_TOKEN_BUDGET 环境变量
+        """
         self.llm = LLMClient()
+        self.packer = ContextPacker(token_budget)
+    
+    def pack_context(self, context_chunks: List[Dict]) -> List[Dict]:
+        """
+        在 token 预算内装填上下文：按分数选择、去重、合并同一文档的相邻文本块。
+        提示中的“文档 N”编号和引用都基于装填后的块；对已装填的块重复调用不会改变结果。
+        """
+        with span("pack_context", chunks=len(context_chunks)) as s:
+            packed = self.packer.pack(context_chunks)
+            s.set(packed=len(packed))
+        return packed
     
     def check_confidence(self, context_chunks: List[Dict]) -> Tuple[bool, str]:
         """
@@ -24,6 +41,10 @@ class RAGGenerator:
         Returns:
             (is_confident: bool, reason: str)
         """
+        with span("confidence"):
+            return self._check_confidence(context_chunks)
+
+    def _check_confidence(self, context_chunks: List[Dict]) -> Tuple[bool, str]:
         if not context_chunks:
             return False, "未找到相关文档"
         
@@ -42,31 +63,39 @@ class RAGGenerator:
         return True, "置信度足够"
 
     
-    def generate_answer(self, query: str, context_chunks: List[Dict]) -> Tuple[str, List[Dict]]:
+    def generate_answer(self, query: str, context_chunks: List[Dict],
+                        should_stop: Optional[Callable[[], bool]] = None,
+                        history: Optional[List[Dict[str, str]]] = None) -> Tuple[str, List[Dict]]:
         """
         生成带有强制引用的回答。
         
         Args:
             query: 用户的问题
             context_chunks: 字典列表，包含键: 'text', 'filename', 'chunk_id', 'similarity'
+                            （可选 'doc_id', 'chunk_index' 用于合并相邻块），或 pack_context 的结果
+            should_stop: 可选，每收到一段响应后调用，返回 True 时停止生成（返回已生成的部分）
+            history: 可选的多轮对话历史消息（见 build_messages）
             
         Returns:
             (answer_text, citations) 的元组
             citations 是字典列表: {'filename': str, 'chunk_id': int, 'excerpt': str}
         """
-        # 1. 用上下文构建提示
-        prompt = self._build_prompt(query, context_chunks)
-        
-        # 2. 准备消息
-        messages = [
-            {"role": "system", "content": "你是一个知识库助手。请基于提供的上下文回答问题，并在回答末尾列出引用来源。"},
-            {"role": "user", "content": prompt}
-        ]
+        # 1-2. 在 token 预算内装填上下文，并用它构建提示和消息
+        context_chunks = self.pack_context(context_chunks)
+        messages = self.build_messages(query, context_chunks, history)
         
-        # 3. 调用 LLM（流式传输）
+        # 3. 调用 LLM（流式传输），记录首个 token 时间（TTFT）
         full_response = ""
-        for chunk in self.llm.chat(messages, stream=True):
-            full_response += chunk
+        with span("llm_generate", model=getattr(self.llm, "model", None)) as s:
+            for chunk in self.llm.chat(messages, stream=True):
+                if should_stop and should_stop():
+                    s.set(cancelled=True)
+                    break
+                if not full_response and chunk:
+                    event("first_token")
+                    s.set(ttft_ms=round(s.elapsed_ms(), 1))
+                full_response += chunk
+            s.set(output_chars=len(full_response))
         
         # 4. 解析引用（简单方法：从响应中提取）
         # 对于 MVP，如果 LLM 没有提供，我们将手动附加引用
@@ -74,14 +103,31 @@ class RAGGenerator:
         
         return full_response, citations
     
+    def build_messages(self, query: str, context_chunks: List[Dict],
+                       history: Optional[List[Dict[str, str]]] = None) -> List[Dict[str, str]]:
+        """
+        构建发送给 LLM 的消息（context_chunks 为 pack_context 装填后的文档块）。
+        history 为此前各轮的 user/assistant 消息，放在系统消息和本轮问题之间。
+        """
+        return [
+            {"role": "system", "content": "你是一个知识库助手。请基于提供的上下文回答问题，并在回答末尾列出引用来源。"},
+            *(history or []),
+            {"role": "user", "content": self._build_prompt(query, context_chunks)}
+        ]
+    
+    def extract_citations(self, response: str, context_chunks: List[Dict]) -> List[Dict]:
+        """从回答中解析引用（编号基于装填后的文档块），LLM 未引用时列出全部文档块并标记为未验证。"""
+        return self._extract_or_force_citations(response, context_chunks)
+    
     def _build_prompt(self, query: str, context_chunks: List[Dict]) -> str:
-        """用上下文构建 RAG 提示。"""
-        context_text = ""
-        
+        """用上下文构建 RAG 提示。context_chunks 为 pack_context 装填后的文档块。"""
+        parts = []
         for i, chunk in enumerate(context_chunks):
-            context_text += f"\n【文档 {i+1}】来源: {chunk['filename']}\n"
-            context_text += f"{chunk['text']}\n"
-            context_text += "-" * 60 + "\n"
+            source = chunk['filename']
+            if chunk.get('also_in'):
+                source += f"（同样出现在: {', '.join(chunk['also_in'])}）"
+            parts.append(f"【文档 {i+1}】来源: {source}\n{chunk['text']}\n")
+        context_text = "\n".join(parts)
         
         prompt = f"""基于以下文档片段回答问题。请务必在回答末尾列出引用的文档编号。
 
@@ -124,7 +170,8 @@ class RAGGenerator:
                 citations.append({
                     'filename': chunk['filename'],
                     'chunk_id': chunk.get('chunk_id', idx),
-                    'excerpt': chunk['text'][:100] + "..."
+                    'excerpt': chunk['text'][:100] + "...",
+                    'also_in': chunk.get('also_in', [])
                 })
         else:
             # 回退：将所有提供的文本块作为潜在引用包含进来
@@ -134,6 +181,7 @@ class RAGGenerator:
                     'filename': chunk['filename'],
                     'chunk_id': chunk.get('chunk_id', i),
                     'excerpt': chunk['text'][:100] + "...",
+                    'also_in': chunk.get('also_in', []),
                     'verified': False  # 标记为未验证
                 })
         
@@ -141,11 +189,17 @@ class RAGGenerator:
     
     def verify_citations(self, response: str, context_chunks: List[Dict]) -> Tuple[bool, str]:
         """
-        验证响应中的所有引用是否对应于检索的文本块。
+        验证响应中的所有引用是否对应于检索的文本块（编号基于装填后的文档块）。
         
         Returns:
             (is_valid: bool, issue: str)
         """
+        context_chunks = self.pack_context(context_chunks)
+        
+        with span("verify_citations"):
+            return self._verify_citation_numbers(response, context_chunks)
+
+    def _verify_citation_numbers(self, response: str, context_chunks: List[Dict]) -> Tuple[bool, str]:
         # 从响应中提取引用的索引
         cited_pattern = re.findall(r'(?:文档|[\[\(])(\d+)(?:[\]\)])?', response)
         
@@ -0,0 +1,252 @@
+import threading
+import numpy as np
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from core.tracing import span, bind
+
+# 混合检索权重：向量检索(60%) + 关键词匹配(40%)
+VECTOR_WEIGHT = 0.6
+KEYWORD_WEIGHT = 0.4
+
+# 单问题检索中与查询嵌入重叠执行的关键词检索共用的线程池（多个检索器实例共享）
+_keyword_executor = None
+_keyword_executor_lock = threading.Lock()
+
+def _keyword_pool() -> ThreadPoolExecutor:
+    global _keyword_executor
+    with _keyword_executor_lock:
+        if _keyword_executor is None:
+            _keyword_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="kb-keyword")
+        return _keyword_executor
+
+class Retriever:
+    """
+    混合检索器：向量检索 + 关键词检索，按权重融合分数。
+    """
+
+    def __init__(self, db, index, embedder):
+        """
+        Args:
+            db: DBManager 实例
+            index: FaissIndex 或 ShardedFaissIndex 实例
+            embedder: 嵌入器实例
+        """
+        self.db = db
+        self.index = index
+        self.embedder = embedder
+
+    def retrieve(self, query: str, k: int = 5, doc_filter: Optional[Dict] = None,
+                 on_stage: Optional[Callable[[str, int], None]] = None,
+                 query_vector: Optional[np.ndarray] = None) -> List[Dict]:
+        """
+        执行混合检索。关键词检索在后台线程中与查询嵌入、FAISS 搜索同时进行，融合前汇合，
+        检索延迟约为较慢分支的耗时而不是两者之和；任一分支失败时异常直接抛出。
+
+        Args:
+            query: 用户问题
+            k: 返回的文本块数量
+            doc_filter: 可选的文档过滤条件（见 DBManager.build_doc_filter），
+                        同时作用于向量检索（FAISS ID 选择器）和关键词检索（SQL 谓词）
+            on_stage: 可选回调 (消息, 进度百分比)，用于界面显示当前阶段
+            query_vector: 可选，调用方已计算的查询嵌入（跳过嵌入请求）
+
+        Returns:
+            按综合分数降序排列的文本块字典列表，包含键:
+            'text', 'filename', 'chunk_id', 'doc_id', 'chunk_index',
+            'vector_score', 'keyword_score', 'combined_score', 'similarity',
+            'also_in'（包含近似重复内容的其他文档文件名）
+        """
+        def stage(message, percent):
+            if on_stage:
+                on_stage(message, percent)
+
+        # 过滤条件先解析为允许的 chunk_id，再下推到 FAISS 内部
+        allowed_chunk_ids = None
+        if doc_filter:
+            with span("filter") as s:
+                allowed_chunk_ids = set(self.db.get_chunk_ids_by_filter(doc_filter))
+                s.set(allowed=len(allowed_chunk_ids))
+
+        # 1. 关键词检索不依赖查询嵌入：先在后台线程中开始，与嵌入请求和 FAISS 搜索重叠执行
+        keyword_future = self.submit_keyword_search(query, k, doc_filter)
+        try:
+            # 2. 获取查询嵌入
+            if query_vector is None:
+                stage("正在嵌入查询...", 30)
+                with span("embed_query"):
+                    query_vector = np.array(self.embedder.get_embedding(query))
+
+            # 关键词检索已失败时不再搜索索引
+            if keyword_future.done() and keyword_future.exception() is not None:
+                raise keyword_future.exception()
+
+            # 3. 搜索 FAISS
+            stage("正在搜索索引...", 60)
+            with span("vector_search", k=k) as s:
+                distances, chunk_ids = self.index.search(query_vector, k=k, allowed_chunk_ids=allowed_chunk_ids)
+                s.set(hits=len(chunk_ids))
+
+            # 4. 等待关键词检索完成后融合
+            if not keyword_future.done():
+                stage("正在执行关键词搜索...", 80)
+            keyword_results = keyword_future.result()
+        finally:
+            # 任一分支失败时取消尚未开始的关键词检索（已在执行的结果会被丢弃）
+            keyword_future.cancel()
+
+        with span("fuse"):
+            return self.fuse(distances, chunk_ids, keyword_results, k, doc_filter)
+
+    def submit_keyword_search(self, query: str, k: int = 5, doc_filter: Optional[Dict] = None) -> Future:
+        """在后台线程中开始关键词检索（keyword_search 阶段记录在当前追踪中），返回 Future。"""
+        return _keyword_pool().submit(bind(self._keyword_search), query, k, doc_filter)
+
+    def _keyword_search(self, query: str, k: int, doc_filter: Optional[Dict]) -> List[Tuple[int, str, str, float]]:
+        with span("keyword_search", k=k) as s:
+            keyword_results = self.db.keyword_search(query, k=k, doc_filter=doc_filter)
+            s.set(hits=len(keyword_results))
+        return keyword_results
+
+    def retrieve_batch(self, queries: List[str], k: int = 5, doc_filter: Optional[Dict] = None) -> List[List[Dict]]:
+        """
+        批量混合检索：所有查询一次批量嵌入、一次 FAISS 批量搜索，关键词检索和融合逐个查询进行。
+        结果与逐个调用 retrieve 相同，但嵌入请求和索引调用从 n 次减少为 1 次。
+
+        Returns:
+            每个查询一个结果列表（格式同 retrieve）
+        """
+        if not queries:
+            return []
+
+        allowed_chunk_ids = None
+        if doc_filter:
+            with span("filter"):
+                allowed_chunk_ids = set(self.db.get_chunk_ids_by_filter(doc_filter))
+
+        with span("embed_query", batch=len(queries)):
+            query_vectors = np.array(self.embedder.get_embeddings(queries))
+
+        with span("vector_search", k=k, batch=len(queries)):
+            vector_results = self.index.search_batch(query_vectors, k=k, allowed_chunk_ids=allowed_chunk_ids)
+
+        results = []
+        for query, (distances, chunk_ids) in zip(queries, vector_results):
+            with span("keyword_search", k=k):
+                keyword_results = self.db.keyword_search(query, k=k, doc_filter=doc_filter)
+            with span("fuse"):
+                results.append(self.fuse(distances, chunk_ids, keyword_results, k, doc_filter))
+        return results
+
+    def expand_neighbors(self, hits: List[Dict], window: int = 1) -> List[Dict]:
+        """
+        “小块检索、大块阅读”：为每个命中块补充同一文档中前后 window 个相邻块。
+
+        相邻块通过一次批量查询取回，不需要额外的嵌入。返回的列表包含原始命中块和相邻块，
+        相邻块带有 'window_distance'（与命中块的距离）和 'neighbor_of'，其分数继承自命中块。
+        ContextPacker 会优先装填命中块，再按距离装填相邻块，并把连续的块合并为窗口。
+        """
+        if window <= 0 or not hits:
+            return list(hits)
+
+        positioned = [h for h in hits if h.get('chunk_index') is not None]
+        with span("fetch_neighbors", window=window):
+            neighbors = self.db.get_neighbor_chunks([h['chunk_id'] for h in positioned], window)
+
+        expanded = list(hits)
+        seen = {h['chunk_id'] for h in hits}
+        for hit in positioned:
+            for neighbor in neighbors.get(hit['chunk_id'], []):
+                if neighbor['chunk_id'] in seen:
+                    continue
+                seen.add(neighbor['chunk_id'])
+                expanded.append({
+                    **neighbor,
+                    'vector_score': 0,
+                    'keyword_score': 0,
+                    'combined_score': hit['combined_score'],
+                    'similarity': hit['similarity'],
+                    'neighbor_of': hit['chunk_id'],
+                    'window_distance': abs(neighbor['chunk_index'] - hit['chunk_index'])
+                })
+
+        return expanded
+
+    def fuse(self, distances: List[float], chunk_ids: List[int],
+             keyword_results: List[Tuple[int, str, str, float]], k: int,
+             doc_filter: Optional[Dict] = None) -> List[Dict]:
+        """
+        合并向量和关键词结果（混合搜索），返回前 k 个。
+        有过滤条件时，命中的规范块归属到范围内的成员块（文本、文件名、doc_id 和 chunk_index 以成员块为准）。
+        """
+        combined_chunks = {}  # chunk_id -> 数据
+
+        # 添加向量搜索结果（一次批量查询取回文本）
+        with span("fetch_chunks", count=len(chunk_ids)):
+            rows = self.db.get_chunks_by_ids(chunk_ids)
+        for dist, chunk_id in zip(distances, chunk_ids):
+            row = rows.get(chunk_id)
+            if row is None:
+                # 索引中的块已从数据库删除
+                continue
+            combined_chunks[chunk_id] = {
+                'text': row['text'],
+                'filename': row['filename'],
+                'chunk_id': chunk_id,
+                'doc_id': row['doc_id'],
+                'chunk_index': row['chunk_index'],
+                'vector_score': 1 / (1 + dist),
+                'keyword_score': 0
+            }
+
+        # 添加关键词搜索结果
+        if keyword_results:
+            max_kw = max(r[3] for r in keyword_results)
+            missing = [r[0] for r in keyword_results if r[0] not in combined_chunks]
+            with span("fetch_chunks", count=len(missing)):
+                extra = self.db.get_chunks_by_ids(missing)
+            for chunk_id, text, filename, score in keyword_results:
+                norm_kw = score / max_kw if max_kw > 0 else 0
+                if chunk_id in combined_chunks:
+                    combined_chunks[chunk_id]['keyword_score'] = norm_kw
+                else:
+                    # 近似重复块已映射到规范块，文本和来源以规范块为准
+                    row = extra.get(chunk_id, {})
+                    combined_chunks[chunk_id] = {
+                        'text': row.get('text', text),
+                        'filename': row.get('filename', filename),
+                        'chunk_id': chunk_id,
+                        'doc_id': row.get('doc_id'),
+                        'chunk_index': row.get('chunk_index'),
+                        'vector_score': 0,
+                        'keyword_score': norm_kw
+                    }
+
+        # 计算综合分数
+        for data in combined_chunks.values():
+            data['combined_score'] = data['vector_score'] * VECTOR_WEIGHT + data['keyword_score'] * KEYWORD_WEIGHT
+            data['similarity'] = data['combined_score']
+
+        top = sorted(combined_chunks.values(), key=lambda x: x['combined_score'], reverse=True)[:k]
+
+        # 近似重复块共享规范块的索引条目：记录同样包含该内容的其他文档，用于引用
+        canonical_ids = [data['chunk_id'] for data in top]
+        with span("fetch_duplicate_sources"):
+            sources = self.db.get_duplicate_sources(canonical_ids)
+
+        # 规范块不在过滤范围内（只有其近似重复块在范围内）时，改为引用范围内的成员块
+        if doc_filter and top:
+            with span("fetch_scoped_members"):
+                members = self.db.get_scoped_members(canonical_ids, doc_filter)
+                moved = {chunk_id: member for chunk_id, member in members.items() if member != chunk_id}
+                rows = self.db.get_chunks_by_ids(list(moved.values())) if moved else {}
+            for data in top:
+                row = rows.get(moved.get(data['chunk_id']))
+                if row is not None:
+                    data.update(text=row['text'], filename=row['filename'], chunk_id=moved[data['chunk_id']],
+                                doc_id=row['doc_id'], chunk_index=row['chunk_index'])
+
+        for data, canonical_id in zip(top, canonical_ids):
+            data['also_in'] = [name for name in sources.get(canonical_id, []) if name != data['filename']]
+
+        return top
@@ -0,0 +1,298 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+import faiss
+
+
+class SnapshotError(Exception):
+    """快照缺失、损坏或与清单不一致。"""
+
+
+class SnapshotStore:
+    """
+    FAISS 索引的版本化快照存储。
+
+    目录结构:
+        snapshots/
+            CURRENT              当前快照名（通过原子替换更新）
+            snap-000003/
+                faiss.index      FAISS 索引
+                ids.npy          vector_id -> chunk_id 映射
+                manifest.json    版本、数量与各文件的 SHA256 校验和
+
+    每次提交先写入临时目录，再通过原子重命名生成快照目录，最后切换 CURRENT 指针。
+    任何一步崩溃都不会破坏已提交的快照，恢复只需切换指针。
+    """
+
+    MANIFEST_VERSION = 1
+    INDEX_FILE = "faiss.index"
+    IDS_FILE = "ids.npy"
+    MANIFEST_FILE = "manifest.json"
+    POINTER_FILE = "CURRENT"
+    PREFIX = "snap-"
+
+    def __init__(self, root_dir: str, keep: Optional[int] = 3):
+        """
+        Args:
+            root_dir: 快照根目录
+            keep: 保留的快照数量（用于回滚），至少为 1；
+                  None 时提交后不自动删除旧快照（由外部清单引用快照的调用方用 prune 清理）
+        """
+        self.root_dir = root_dir
+        self.keep = max(1, keep) if keep is not None else None
+        os.makedirs(root_dir, exist_ok=True)
+
+    # ---------- 查询 ----------
+
+    def list_snapshots(self) -> List[str]:
+        """按版本号升序返回所有已提交的快照名。"""
+        names = []
+        for name in os.listdir(self.root_dir):
+            if name.startswith(self.PREFIX) and name[len(self.PREFIX):].isdigit():
+                if os.path.isdir(os.path.join(self.root_dir, name)):
+                    names.append(name)
+        return sorted(names, key=self._seq)
+
+    def current(self) -> Optional[str]:
+        """返回 CURRENT 指向的快照名，没有则返回 None。"""
+        pointer = os.path.join(self.root_dir, self.POINTER_FILE)
+        if not os.path.exists(pointer):
+            return None
+        with open(pointer, 'r', encoding='utf-8') as f:
+            name = f.read().strip()
+        return name or None
+
+    def read_manifest(self, name: str) -> dict:
+        path = os.path.join(self.root_dir, name, self.MANIFEST_FILE)
+        if not os.path.exists(path):
+            raise SnapshotError(f"Snapshot {name} has no manifest")
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    # ---------- 提交 ----------
+
+    def commit(self, index, chunk_ids: List[int], dimension: int) -> str:
+        """
+        将索引和 ID 写成一个新快照并切换 CURRENT 指针。
+
+        Returns:
+            新快照名
+        """
+        if index.ntotal != len(chunk_ids):
+            raise ValueError(
+                f"Index has {index.ntotal} vectors but {len(chunk_ids)} chunk_ids"
+            )
+
+        self._cleanup_partial()
+
+        existing = self.list_snapshots()
+        seq = self._seq(existing[-1]) + 1 if existing else 1
+        name = f"{self.PREFIX}{seq:06d}"
+        tmp_dir = os.path.join(self.root_dir, f".{name}.tmp")
+        final_dir = os.path.join(self.root_dir, name)
+        os.makedirs(tmp_dir)
+
+        try:
+            # FAISS 在 Windows 上不支持非 ASCII 路径，先写入系统临时文件再移动
+            fd, temp_path = tempfile.mkstemp(suffix=".index")
+            os.close(fd)
+            try:
+                faiss.write_index(index, temp_path)
+                shutil.move(temp_path, os.path.join(tmp_dir, self.INDEX_FILE))
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+            ids_path = os.path.join(tmp_dir, self.IDS_FILE)
+            with open(ids_path, 'wb') as f:
+                np.save(f, np.asarray(chunk_ids, dtype=np.int64))
+
+            manifest = {
+                "version": self.MANIFEST_VERSION,
+                "name": name,
+                "created": datetime.now().isoformat(),
+                "dimension": dimension,
+                "total": int(index.ntotal),
+                "files": {
+                    self.INDEX_FILE: self._file_info(os.path.join(tmp_dir, self.INDEX_FILE)),
+                    self.IDS_FILE: self._file_info(ids_path),
+                },
+            }
+            manifest_path = os.path.join(tmp_dir, self.MANIFEST_FILE)
+            with open(manifest_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+
+            for filename in (self.INDEX_FILE, self.IDS_FILE):
+                self._fsync_path(os.path.join(tmp_dir, filename))
+
+            # 原子重命名：快照目录要么完整存在，要么不存在
+            os.rename(tmp_dir, final_dir)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        self._set_current(name)
+        self._prune()
+        return name
+
+    # ---------- 加载与校验 ----------
+
+    def verify(self, name: str) -> dict:
+        """
+        校验快照的清单、校验和与数量，成功返回清单，失败抛出 SnapshotError。
+        """
+        snap_dir = os.path.join(self.root_dir, name)
+        if not os.path.isdir(snap_dir):
+            raise SnapshotError(f"Snapshot {name} does not exist")
+
+        manifest = self.read_manifest(name)
+        if manifest.get("version") != self.MANIFEST_VERSION:
+            raise SnapshotError(f"Unsupported snapshot version: {manifest.get('version')}")
+
+        for filename, info in manifest.get("files", {}).items():
+            path = os.path.join(snap_dir, filename)
+            if not os.path.exists(path):
+                raise SnapshotError(f"Snapshot {name} is missing {filename}")
+            actual = self._file_info(path)
+            if actual["size"] != info["size"] or actual["sha256"] != info["sha256"]:
+                raise SnapshotError(f"Checksum mismatch for {name}/{filename}")
+
+        return manifest
+
+    def load(self, name: str) -> Tuple[object, List[int], dict]:
+        """
+        加载并校验指定快照。
+
+        Returns:
+            (index, chunk_ids, manifest) 的元组
+        """
+        manifest = self.verify(name)
+        snap_dir = os.path.join(self.root_dir, name)
+
+        fd, temp_path = tempfile.mkstemp(suffix=".index")
+        os.close(fd)
+        try:
+            shutil.copy2(os.path.join(snap_dir, self.INDEX_FILE), temp_path)
+            index = faiss.read_index(temp_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        with open(os.path.join(snap_dir, self.IDS_FILE), 'rb') as f:
+            chunk_ids = np.load(f).tolist()
+
+        if index.ntotal != manifest["total"] or len(chunk_ids) != manifest["total"]:
+            raise SnapshotError(
+                f"Snapshot {name} count mismatch: index={index.ntotal}, "
+                f"ids={len(chunk_ids)}, manifest={manifest['total']}"
+            )
+
+        return index, chunk_ids, manifest
+
+    def load_latest(self) -> Optional[Tuple[object, List[int], dict]]:
+        """
+        加载 CURRENT 指向的快照；如果它损坏或缺失，按版本从新到旧回退到
+        第一个有效快照并把指针切换过去。没有任何可用快照时返回 None。
+        """
+        current = self.current()
+        candidates = list(reversed(self.list_snapshots()))
+        if current in candidates:
+            candidates.remove(current)
+            candidates.insert(0, current)
+
+        for name in candidates:
+            try:
+                result = self.load(name)
+            except Exception as e:
+                print(f"Snapshot {name} is unusable: {e}")
+                continue
+            if name != current:
+                print(f"Recovered index from snapshot {name}")
+                self._set_current(name)
+            return result
+
+        return None
+
+    def rollback(self) -> Optional[str]:
+        """
+        将 CURRENT 指针切换到上一个有效快照。
+
+        Returns:
+            新的当前快照名，没有更早的有效快照时返回 None
+        """
+        names = self.list_snapshots()
+        current = self.current()
+        if current in names:
+            older = names[:names.index(current)]
+        else:
+            older = names
+
+        for name in reversed(older):
+            try:
+                self.verify(name)
+            except SnapshotError:
+                continue
+            self._set_current(name)
+            return name
+
+        return None
+
+    # ---------- 内部工具 ----------
+
+    def _set_current(self, name: str):
+        pointer = os.path.join(self.root_dir, self.POINTER_FILE)
+        tmp_pointer = pointer + ".tmp"
+        with open(tmp_pointer, 'w', encoding='utf-8') as f:
+            f.write(name)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_pointer, pointer)
+
+    def prune(self, keep_names: Iterable[str]):
+        """删除 keep_names 之外的所有快照。"""
+        keep_names = set(keep_names)
+        for name in self.list_snapshots():
+            if name not in keep_names:
+                shutil.rmtree(os.path.join(self.root_dir, name), ignore_errors=True)
+
+    def _prune(self):
+        """删除超出保留数量的旧快照（当前快照永不删除）。"""
+        if self.keep is None:
+            return
+        names = self.list_snapshots()
+        current = self.current()
+        for name in names[:-self.keep]:
+            if name != current:
+                shutil.rmtree(os.path.join(self.root_dir, name), ignore_errors=True)
+
+    def _cleanup_partial(self):
+        """清理崩溃时遗留的半写临时目录。"""
+        for name in os.listdir(self.root_dir):
+            if name.startswith(f".{self.PREFIX}") and name.endswith(".tmp"):
+                shutil.rmtree(os.path.join(self.root_dir, name), ignore_errors=True)
+
+    @classmethod
+    def _seq(cls, name: str) -> int:
+        return int(name[len(cls.PREFIX):])
+
+    @staticmethod
+    def _file_info(path: str) -> dict:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(block)
+        return {"size": os.path.getsize(path), "sha256": sha.hexdigest()}
+
+    @staticmethod
+    def _fsync_path(path: str):
+        # Windows 上 fsync 需要可写句柄，追加模式打开不会修改内容
+        with open(path, 'ab') as f:
+            os.fsync(f.fileno())
@@ -0,0 +1,147 @@
+import os
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from core.tracing import span, bind
+
+# 推测生成所用 Top-K 与最终 Top-K 的最小重合比例，低于该值（或首位改变）时取消并重新生成
+SPECULATIVE_MIN_OVERLAP = 0.8
+
+_generation_executor = None
+_generation_executor_lock = threading.Lock()
+
+def _generation_pool() -> ThreadPoolExecutor:
+    global _generation_executor
+    with _generation_executor_lock:
+        if _generation_executor is None:
+            _generation_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="kb-speculative")
+        return _generation_executor
+
+def speculative_enabled() -> bool:
+    """是否启用推测式提前生成（SPECULATIVE_GENERATION=1）。"""
+    return os.getenv("SPECULATIVE_GENERATION", "0").lower() in ("1", "true", "yes")
+
+class SpeculativeAnswerer:
+    """
+    推测式提前生成（可选的流水线模式）。
+
+    向量检索完成而关键词检索尚未返回时，若仅由向量结果融合出的 Top-K 已通过置信度检查，
+    立即在后台开始生成，不再等待关键词检索。关键词结果到达后按完整的混合分数重新融合：
+    - Top-K 基本不变（首位相同且重合比例不低于 min_overlap）：采用推测生成的回答；
+    - Top-K 明显改变：取消推测生成，用最终结果重新生成；
+    - 最终结果置信度不足：取消推测生成，返回备用回复。
+    关键词分数只会提高文本块的综合分数，因此向量结果通过置信度检查时，最终结果通常也会通过。
+    """
+
+    def __init__(self, retriever, rag, window: Optional[int] = None, min_overlap: Optional[float] = None):
+        """
+        Args:
+            retriever: Retriever 实例
+            rag: RAGGenerator 实例
+            window: 相邻块扩展窗口，默认读取 CONTEXT_WINDOW
+            min_overlap: 采用推测回答所需的最小 Top-K 重合比例，默认读取 SPECULATIVE_MIN_OVERLAP
+        """
+        self.retriever = retriever
+        self.rag = rag
+        self.window = window if window is not None else int(os.getenv("CONTEXT_WINDOW", "1"))
+        if min_overlap is None:
+            min_overlap = float(os.getenv("SPECULATIVE_MIN_OVERLAP", str(SPECULATIVE_MIN_OVERLAP)))
+        self.min_overlap = min_overlap
+
+    def answer(self, query: str, k: int = 5, doc_filter: Optional[Dict] = None,
+               on_stage: Optional[Callable[[str, int], None]] = None) -> Dict:
+        """
+        检索并回答一个问题。
+
+        Returns:
+            {'answer', 'citations', 'chunks'（最终检索结果）, 'context_blocks', 'confident', 'reason',
+             'citations_valid', 'citation_issue', 'speculation'}
+            speculation 为 'kept'（采用推测回答）、'restarted'（取消后重新生成）、
+            'cancelled'（最终置信度不足，推测生成被取消）或 'none'（未推测）
+        """
+        def stage(message, percent):
+            if on_stage:
+                on_stage(message, percent)
+
+        retriever = self.retriever
+        allowed_chunk_ids = None
+        if doc_filter:
+            with span("filter"):
+                allowed_chunk_ids = set(retriever.db.get_chunk_ids_by_filter(doc_filter))
+
+        keyword_future = retriever.submit_keyword_search(query, k, doc_filter)
+        cancel = threading.Event()
+        speculation = None
+        early_hits = []
+        try:
+            stage("正在嵌入查询...", 30)
+            with span("embed_query"):
+                query_vector = np.array(retriever.embedder.get_embedding(query))
+
+            stage("正在搜索索引...", 60)
+            with span("vector_search", k=k):
+                distances, chunk_ids = retriever.index.search(query_vector, k=k, allowed_chunk_ids=allowed_chunk_ids)
+
+            # 关键词检索尚未返回：向量结果足够可信时提前开始生成
+            if not keyword_future.done():
+                with span("fuse", speculative=True):
+                    early_hits = retriever.fuse(distances, chunk_ids, [], k, doc_filter)
+                if self.rag.check_confidence(early_hits)[0]:
+                    stage("正在生成回答...", 70)
+                    speculation = _generation_pool().submit(bind(self._generate), query, early_hits, cancel.is_set)
+
+            keyword_results = keyword_future.result()
+            with span("fuse"):
+                hits = retriever.fuse(distances, chunk_ids, keyword_results, k, doc_filter)
+        except BaseException:
+            keyword_future.cancel()
+            cancel.set()
+            raise
+
+        is_confident, reason = self.rag.check_confidence(hits)
+        result = {'chunks': hits, 'confident': is_confident, 'reason': reason,
+                  'citations_valid': True, 'citation_issue': None, 'context_blocks': [],
+                  'speculation': 'none'}
+
+        if not is_confident:
+            if speculation is not None:
+                cancel.set()
+                result['speculation'] = 'cancelled'
+            answer, citations = self.rag.generate_fallback_response(query, hits, reason)
+            result.update(answer=answer, citations=citations)
+            return result
+
+        if speculation is not None and not self.topk_changed(early_hits, hits):
+            answer, citations, blocks = speculation.result()
+            result['speculation'] = 'kept'
+        else:
+            if speculation is not None:
+                cancel.set()
+                result['speculation'] = 'restarted'
+            stage("正在生成回答...", 85)
+            answer, citations, blocks = self._generate(query, hits)
+
+        is_valid, issue = self.rag.verify_citations(answer, blocks)
+        result.update(answer=answer, citations=citations, context_blocks=blocks,
+                      citations_valid=is_valid, citation_issue=None if is_valid else issue)
+        return result
+
+    def topk_changed(self, early_hits: List[Dict], final_hits: List[Dict]) -> bool:
+        """关键词结果是否明显改变了 Top-K：首位不同，或重合比例低于 min_overlap。"""
+        if not early_hits or not final_hits:
+            return True
+        if early_hits[0]['chunk_id'] != final_hits[0]['chunk_id']:
+            return True
+        early_ids = {h['chunk_id'] for h in early_hits}
+        overlap = sum(1 for h in final_hits if h['chunk_id'] in early_ids) / len(final_hits)
+        return overlap < self.min_overlap
+
+    def _generate(self, query: str, hits: List[Dict],
+                  should_stop: Optional[Callable[[], bool]] = None) -> Tuple[str, List[Dict], List[Dict]]:
+        """相邻块扩展、装填并生成，返回 (回答, 引用, 装填后的文档块)。"""
+        expanded = self.retriever.expand_neighbors(hits, window=self.window)
+        blocks = self.rag.pack_context(expanded)
+        answer, citations = self.rag.generate_answer(query, blocks, should_stop=should_stop)
+        return answer, citations, blocks
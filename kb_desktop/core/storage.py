@@ -1,11 +1,64 @@
 import sqlite3
 import os
+import json
 import hashlib
+import threading
+from collections import OrderedDict
 from datetime import datetime
-from typing import List, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
+
+from core.compression import TextCodec
+
+# 文本块文本：内联存储时直接使用 text 列，否则按偏移从文档内容中切出
+CHUNK_TEXT_SQL = "chunk_text(c.text, c.doc_id, c.start_offset, c.end_offset)"
+
+INSERT_CHUNK_SQL = '''
+    INSERT INTO chunks (doc_id, chunk_index, text, meta_info, start_offset, end_offset, simhash, canonical_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# 文本块字典中单独存列（或仅用于入库过程）的键，其余键存入 meta_info
+RESERVED_CHUNK_KEYS = ('text', 'start', 'end', 'chunk_index', 'simhash', 'canonical_id', 'duplicate_of')
+
+def content_hash(content: str, block_chars: int = 1 << 20) -> str:
+    """文档内容的 SHA256（按块编码，不为整个文档生成一份 UTF-8 副本；结果与一次性编码相同）。"""
+    hasher = hashlib.sha256()
+    for i in range(0, len(content), block_chars):
+        hasher.update(content[i:i + block_chars].encode('utf-8'))
+    return hasher.hexdigest()
+
+class _DocumentCache:
+    """
+    最近使用的文档内容缓存（LRU），用于按偏移延迟生成文本块文本。
+    """
+
+    def __init__(self, loader, max_docs=16):
+        self.loader = loader
+        self.max_docs = max_docs
+        self._docs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, doc_id):
+        with self._lock:
+            if doc_id in self._docs:
+                self._docs.move_to_end(doc_id)
+                return self._docs[doc_id]
+        content = self.loader(doc_id)
+        with self._lock:
+            self._docs[doc_id] = content
+            while len(self._docs) > self.max_docs:
+                self._docs.popitem(last=False)
+        return content
+
+    def invalidate(self, doc_id=None):
+        with self._lock:
+            if doc_id is None:
+                self._docs.clear()
+            else:
+                self._docs.pop(doc_id, None)
 
 class DBManager:
-    def __init__(self, db_path=None):
+    def __init__(self, db_path=None, chunk_storage=None, compression=None):
         # 如果没有指定路径，使用 kb_desktop/data/kb.sqlite
         if db_path is None:
             # 获取 storage.py 的目录（kb_desktop/core）
@@ -17,10 +70,36 @@ class DBManager:
         # 确保 data 目录存在
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
         self.db_path = db_path
+        # "inline"：每个文本块保存自己的文本；"offsets"：只保存在文档内容中的 (start, end) 偏移
+        self.chunk_storage = (chunk_storage or os.getenv("CHUNK_STORAGE", "inline")).lower()
+        if self.chunk_storage not in ("inline", "offsets"):
+            raise ValueError(f"Unknown chunk storage mode: {self.chunk_storage}")
+        # 文档内容的压缩方式（none | zlib | zstd），读取时自动识别解码。
+        # 内联文本块文本始终保存为未压缩的 TEXT，关键词检索可以直接在列上匹配
+        self.codec = TextCodec(compression)
+        self.content_cache = _DocumentCache(self._load_content)
         self.init_db()
 
     def get_connection(self):
-        return sqlite3.connect(self.db_path)
+        conn = sqlite3.connect(self.db_path)
+        conn.create_function("chunk_text", 4, self._chunk_text, deterministic=True)
+        return conn
+
+    def _load_content(self, doc_id):
+        # 使用独立连接：在 SQL 函数回调中不能复用当前连接
+        conn = sqlite3.connect(self.db_path)
+        try:
+            row = conn.execute('SELECT content FROM documents WHERE id = ?', (doc_id,)).fetchone()
+        finally:
+            conn.close()
+        return self.codec.decode(row[0]) if row else None
+
+    def _chunk_text(self, text, doc_id, start, end):
+        """SQL 函数 chunk_text()：返回（解压后的）内联文本，或按偏移从（缓存的）文档内容中切出文本。"""
+        if text is not None or start is None:
+            return self.codec.decode(text)
+        content = self.content_cache.get(doc_id)
+        return content[start:end] if content is not None else None
 
     def init_db(self):
         conn = self.get_connection()
@@ -48,6 +127,10 @@ class DBManager:
                 chunk_index INTEGER,
                 text TEXT,
                 meta_info TEXT, -- 额外信息的JSON字符串
+                start_offset INTEGER, -- 在文档内容中的字符偏移（text 为空时据此生成文本）
+                end_offset INTEGER,
+                simhash INTEGER, -- 近似重复检测指纹（有符号 64 位）
+                canonical_id INTEGER, -- 近似重复时指向共享嵌入和索引条目的规范块，否则为 NULL
                 FOREIGN KEY(doc_id) REFERENCES documents(id)
             )
         ''')
@@ -64,9 +147,43 @@ class DBManager:
             if 'last_indexed' not in columns:
                 cursor.execute('ALTER TABLE documents ADD COLUMN last_indexed TIMESTAMP')
                 print("✓ Migration: Added last_indexed column")
+            
+            cursor.execute("PRAGMA table_info(chunks)")
+            chunk_columns = [row[1] for row in cursor.fetchall()]
+            
+            if 'start_offset' not in chunk_columns:
+                cursor.execute('ALTER TABLE chunks ADD COLUMN start_offset INTEGER')
+                cursor.execute('ALTER TABLE chunks ADD COLUMN end_offset INTEGER')
+                print("✓ Migration: Added chunk offset columns")
+            
+            if 'canonical_id' not in chunk_columns:
+                cursor.execute('ALTER TABLE chunks ADD COLUMN simhash INTEGER')
+                cursor.execute('ALTER TABLE chunks ADD COLUMN canonical_id INTEGER')
+                print("✓ Migration: Added near-duplicate columns")
         except sqlite3.OperationalError as e:
             print(f"Migration warning: {e}")
         
+        # 源文件指纹表：导入前按 (路径, 大小, 修改时间) 或文件哈希判断是否已导入，无需解析文件
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS file_fingerprints (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                file_hash TEXT NOT NULL, -- 文件字节的 BLAKE2b 哈希
+                doc_id INTEGER,
+                checked_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY(doc_id) REFERENCES documents(id)
+            )
+        ''')
+        
+        # 按文档顺序读取文本块（相邻块扩展、文档浏览）
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_chunks_doc_index ON chunks(doc_id, chunk_index)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_chunks_canonical ON chunks(canonical_id)')
+        # 按文件哈希查找已导入的文件（documents.file_hash 已有 UNIQUE 索引）
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_fingerprints_hash ON file_fingerprints(file_hash)')
+        # 按文件名缩小源文件路径匹配的范围（Windows 下路径不区分大小写）
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_documents_filename ON documents(filename COLLATE NOCASE)')
+        
         conn.commit()
         conn.close()
 
@@ -75,7 +192,7 @@ class DBManager:
         如果成功返回文档ID，如果重复（按哈希值）则返回None。
         """
         # 计算哈希值以防止重复（使用SHA256以确保安全）
-        content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        digest = content_hash(content)
         
         conn = self.get_connection()
         cursor = conn.cursor()
@@ -84,7 +201,7 @@ class DBManager:
             cursor.execute('''
                 INSERT INTO documents (filename, file_path, file_hash, content)
                 VALUES (?, ?, ?, ?)
-            ''', (filename, file_path, content_hash, content))
+            ''', (filename, file_path, digest, self.codec.encode(content)))
             doc_id = cursor.lastrowid
             conn.commit()
             return doc_id
@@ -95,23 +212,79 @@ class DBManager:
         finally:
             conn.close()
 
-    def add_chunks(self, doc_id, chunks):
+    def find_document_by_hash(self, content_hash: str) -> Optional[int]:
+        """按内容哈希查找文档 ID（使用 file_hash 的唯一索引）。"""
+        conn = self.get_connection()
+        row = conn.execute('SELECT id FROM documents WHERE file_hash = ?', (content_hash,)).fetchone()
+        conn.close()
+        return row[0] if row else None
+
+    def get_fingerprint(self, path: str) -> Optional[Dict]:
         """
-        为文档批量插入文本块。
-        chunks: 字符串列表
+        返回路径对应的文件指纹 {'path', 'size', 'mtime', 'file_hash', 'doc_id'}。
+        指纹指向的文档已被删除时返回 None。
+        """
+        conn = self.get_connection()
+        row = conn.execute('''
+            SELECT f.path, f.size, f.mtime, f.file_hash, f.doc_id
+            FROM file_fingerprints f
+            JOIN documents d ON d.id = f.doc_id
+            WHERE f.path = ?
+        ''', (path,)).fetchone()
+        conn.close()
+        if row is None:
+            return None
+        return dict(zip(('path', 'size', 'mtime', 'file_hash', 'doc_id'), row))
+
+    def find_document_by_file_hash(self, file_hash: str) -> Optional[int]:
+        """按源文件字节哈希查找已导入的文档 ID（例如同一文件被复制到了其他路径）。"""
+        conn = self.get_connection()
+        row = conn.execute('''
+            SELECT f.doc_id
+            FROM file_fingerprints f
+            JOIN documents d ON d.id = f.doc_id
+            WHERE f.file_hash = ?
+            LIMIT 1
+        ''', (file_hash,)).fetchone()
+        conn.close()
+        return row[0] if row else None
+
+    def delete_fingerprint(self, path: str):
+        """删除路径的文件指纹（例如副本路径的内容已与所指向的文档不同）。"""
+        conn = self.get_connection()
+        conn.execute('DELETE FROM file_fingerprints WHERE path = ?', (path,))
+        conn.commit()
+        conn.close()
+
+    def save_fingerprint(self, path: str, size: int, mtime: float, file_hash: str, doc_id: int):
+        """记录（或更新）路径的文件指纹。"""
+        conn = self.get_connection()
+        conn.execute('''
+            INSERT OR REPLACE INTO file_fingerprints (path, size, mtime, file_hash, doc_id, checked_time)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (path, size, mtime, file_hash, doc_id))
+        conn.commit()
+        conn.close()
+
+    def add_chunks(self, doc_id, chunks) -> List[int]:
+        """
+        为文档批量插入文本块，返回按顺序排列的 chunk_id。
+        chunks: 字符串列表，或 Chunker.chunk() 返回的字典列表
+                （start/end 偏移存入偏移列，simhash/canonical_id/duplicate_of 见 ChunkDeduplicator，
+                其余 'text' 以外的键存入 meta_info）
+        
+        chunk_storage 为 "offsets" 且文本块带有偏移时，不再保存文本副本，
+        读取时从文档内容中按偏移切出。
         """
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        data = []
-        for i, text in enumerate(chunks):
-            # (doc_id, chunk_index, text, meta_info)
-            data.append((doc_id, i, text, "{}"))
-            
-        cursor.executemany('''
-            INSERT INTO chunks (doc_id, chunk_index, text, meta_info)
-            VALUES (?, ?, ?, ?)
-        ''', data)
+        data = [self._chunk_row(doc_id, i, chunk) for i, chunk in enumerate(chunks)]
+        cursor.executemany(INSERT_CHUNK_SQL, data)
+        
+        cursor.execute('SELECT id FROM chunks WHERE doc_id = ? ORDER BY chunk_index ASC', (doc_id,))
+        chunk_ids = [row[0] for row in cursor.fetchall()]
+        self._resolve_batch_duplicates(cursor, chunks, chunk_ids)
         
         # 更新文档表中的文本块数量
         cursor.execute('''
@@ -120,15 +293,437 @@ class DBManager:
         
         conn.commit()
         conn.close()
+        return chunk_ids
+
+    def _chunk_row(self, doc_id, chunk_index, chunk) -> Tuple:
+        """
+        文本块（字符串或字典）-> INSERT_CHUNK_SQL 的参数:
+        (doc_id, chunk_index, text, meta_info, start_offset, end_offset, simhash, canonical_id)
+        """
+        if not isinstance(chunk, dict):
+            return (doc_id, chunk_index, chunk, "{}", None, None, None, None)
+        
+        text = chunk['text']
+        start, end = chunk.get('start'), chunk.get('end')
+        meta = json.dumps({k: v for k, v in chunk.items() if k not in RESERVED_CHUNK_KEYS})
+        if self.chunk_storage == "offsets" and start is not None and end is not None:
+            text = None
+        return (doc_id, chunk_index, text, meta, start, end,
+                chunk.get('simhash'), chunk.get('canonical_id'))
+
+    @staticmethod
+    def _resolve_batch_duplicates(cursor, chunks, chunk_ids):
+        """同一批次内的近似重复块（duplicate_of 为批次下标）指向本批次中更早的规范块。"""
+        duplicates = [(chunk_ids[chunk['duplicate_of']], chunk_ids[i]) for i, chunk in enumerate(chunks)
+                      if isinstance(chunk, dict) and chunk.get('duplicate_of') is not None]
+        cursor.executemany('UPDATE chunks SET canonical_id = ? WHERE id = ?', duplicates)
+
+    def get_chunk_records(self, doc_id) -> List[Dict]:
+        """按顺序返回文档的文本块 {'id', 'chunk_index', 'text', 'canonical_id'}（用于与新内容比对）。"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT c.id, c.chunk_index, {CHUNK_TEXT_SQL}, c.canonical_id
+            FROM chunks c WHERE c.doc_id = ? ORDER BY c.chunk_index ASC
+        ''', (doc_id,))
+        records = [dict(zip(('id', 'chunk_index', 'text', 'canonical_id'), row)) for row in cursor.fetchall()]
+        conn.close()
+        return records
+
+    def update_document(self, doc_id, file_path, content, kept: List[Tuple[int, int, Optional[int], Optional[int]]],
+                        added: List[Dict], removed: List[int]) -> Dict:
+        """
+        用修改后的内容更新文档，只改动变化的文本块（在一个事务中完成）。
+        
+        Args:
+            kept: 未变化的文本块 (chunk_id, 新 chunk_index, 新 start, 新 end)，保留 ID（以及已存储的向量）
+            added: 新增的文本块字典，带 'chunk_index' 键（duplicate_of 为 added 中的下标）
+            removed: 要删除的 chunk_id
+        
+        Returns:
+            {'added': 需要嵌入和索引的新 chunk_id（含提升为规范块的重复块）,
+             'removed': 被删除的 chunk_id}
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        digest = content_hash(content)
+        
+        try:
+            cursor.execute('''
+                UPDATE documents
+                SET file_path = ?, file_hash = ?, content = ?, chunk_count = ?,
+                    last_indexed = CASE WHEN ? THEN NULL ELSE last_indexed END
+                WHERE id = ?
+            ''', (file_path, digest, self.codec.encode(content), len(kept) + len(added),
+                  bool(added), doc_id))
+            
+            cursor.executemany(
+                'UPDATE chunks SET chunk_index = ?, start_offset = ?, end_offset = ? WHERE id = ?',
+                [(chunk_index, start, end, chunk_id) for chunk_id, chunk_index, start, end in kept]
+            )
+            
+            new_ids = []
+            for chunk in added:
+                cursor.execute(INSERT_CHUNK_SQL, self._chunk_row(doc_id, chunk['chunk_index'], chunk))
+                new_ids.append(cursor.lastrowid)
+            self._resolve_batch_duplicates(cursor, added, new_ids)
+            
+            promoted = self._promote_duplicates(cursor, removed)
+            self._delete_chunks(cursor, removed)
+            
+            indexable = []
+            for i in range(0, len(new_ids), 500):
+                batch = new_ids[i:i+500]
+                placeholders = ",".join("?" * len(batch))
+                cursor.execute(f'SELECT id FROM chunks WHERE id IN ({placeholders}) AND canonical_id IS NULL', batch)
+                indexable.extend(row[0] for row in cursor.fetchall())
+            
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        self.content_cache.invalidate(doc_id)
+        return {'added': sorted(indexable) + promoted, 'removed': list(removed)}
+
+    @staticmethod
+    def _promote_duplicates(cursor, removed_ids: List[int]) -> List[int]:
+        """
+        即将删除的规范块若还有保留下来的近似重复块，改以其中第一个块为新的规范块。
+        返回成为新规范块的 chunk_id 列表（需要嵌入和索引）。
+        """
+        removed = set(removed_ids)
+        ids = list(removed_ids)
+        groups = {}
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i+500]
+            placeholders = ",".join("?" * len(batch))
+            cursor.execute(f'''
+                SELECT canonical_id, id FROM chunks
+                WHERE canonical_id IN ({placeholders})
+                ORDER BY canonical_id, id
+            ''', batch)
+            for canonical_id, chunk_id in cursor.fetchall():
+                if chunk_id not in removed:
+                    groups.setdefault(canonical_id, []).append(chunk_id)
+        
+        promoted = []
+        for members in groups.values():
+            new_canonical = members[0]
+            promoted.append(new_canonical)
+            cursor.execute('UPDATE chunks SET canonical_id = NULL WHERE id = ?', (new_canonical,))
+            cursor.executemany('UPDATE chunks SET canonical_id = ? WHERE id = ?',
+                               [(new_canonical, chunk_id) for chunk_id in members[1:]])
+        return promoted
+
+    @staticmethod
+    def _delete_chunks(cursor, chunk_ids: List[int]):
+        ids = list(chunk_ids)
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i+500]
+            placeholders = ",".join("?" * len(batch))
+            cursor.execute(f'DELETE FROM chunks WHERE id IN ({placeholders})', batch)
 
     def get_document_chunks(self, doc_id):
         conn = self.get_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT chunk_index, text FROM chunks WHERE doc_id = ? ORDER BY chunk_index ASC', (doc_id,))
+        cursor.execute(f'SELECT c.chunk_index, {CHUNK_TEXT_SQL} FROM chunks c WHERE c.doc_id = ? ORDER BY c.chunk_index ASC', (doc_id,))
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+
+    def get_chunk_ids(self) -> List[int]:
+        """返回 chunks 表中的全部文本块 ID（升序）。"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT id FROM chunks ORDER BY id ASC')
+        ids = [row[0] for row in cursor.fetchall()]
+        conn.close()
+        return ids
+
+    def get_indexable_chunk_ids(self) -> List[int]:
+        """返回需要嵌入和索引的文本块 ID（规范块，不含近似重复块），升序。"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT id FROM chunks WHERE canonical_id IS NULL ORDER BY id ASC')
+        ids = [row[0] for row in cursor.fetchall()]
+        conn.close()
+        return ids
+
+    def get_canonical_simhashes(self) -> List[Tuple[int, int]]:
+        """返回所有带指纹的规范块 (chunk_id, simhash)。"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, simhash FROM chunks WHERE canonical_id IS NULL AND simhash IS NOT NULL')
         rows = cursor.fetchall()
         conn.close()
         return rows
 
+    def get_chunk_doc_ids(self, chunk_ids: List[int]) -> Dict[int, int]:
+        """返回 chunk_id -> 所属文档 ID（不存在的 chunk_id 不出现在结果中）。"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        result = {}
+        ids = list(chunk_ids)
+        # 分批以避免超过 SQLite 的参数数量上限
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i+500]
+            placeholders = ",".join("?" * len(batch))
+            cursor.execute(f'SELECT id, doc_id FROM chunks WHERE id IN ({placeholders})', batch)
+            result.update(cursor.fetchall())
+        conn.close()
+        return result
+
+    def get_duplicate_sources(self, chunk_ids: List[int]) -> Dict[int, List[str]]:
+        """
+        返回规范块及其近似重复块所在的文档文件名（用于引用）。
+        返回: chunk_id -> 文件名列表（按文档 ID 排序去重）；没有近似重复块的 chunk_id 不出现在结果中
+        """
+        if not chunk_ids:
+            return {}
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        result = {}
+        ids = list(chunk_ids)
+        # 分批以避免超过 SQLite 的参数数量上限
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i+500]
+            placeholders = ",".join("?" * len(batch))
+            cursor.execute(f'''
+                SELECT DISTINCT COALESCE(c.canonical_id, c.id) AS canonical, d.id, d.filename
+                FROM chunks c
+                JOIN documents d ON d.id = c.doc_id
+                WHERE c.id IN ({placeholders}) OR c.canonical_id IN ({placeholders})
+                ORDER BY canonical, d.id
+            ''', batch + batch)
+            for canonical_id, _, filename in cursor.fetchall():
+                result.setdefault(canonical_id, []).append(filename)
+        conn.close()
+        return {chunk_id: names for chunk_id, names in result.items() if len(names) > 1}
+
+    def get_scoped_members(self, chunk_ids: List[int], doc_filter: Optional[Dict]) -> Dict[int, int]:
+        """
+        返回索引中的文本块在过滤范围内的成员块：规范块本身满足过滤条件时为其自身，
+        否则为满足条件的第一个近似重复块（用于把命中归属到范围内的文档）。
+        返回: chunk_id -> 成员块 chunk_id；范围内没有成员的 chunk_id 不出现在结果中
+        """
+        if not chunk_ids:
+            return {}
+        
+        where_sql, params = self.build_doc_filter(doc_filter)
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        result = {}
+        ids = list(chunk_ids)
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i+500]
+            placeholders = ",".join("?" * len(batch))
+            cursor.execute(f'''
+                SELECT COALESCE(c.canonical_id, c.id) AS canonical, c.id
+                FROM chunks c
+                JOIN documents d ON d.id = c.doc_id
+                WHERE (c.id IN ({placeholders}) OR c.canonical_id IN ({placeholders})) AND {where_sql}
+                ORDER BY canonical, c.canonical_id IS NOT NULL, c.id
+            ''', batch + batch + params)
+            for canonical_id, chunk_id in cursor.fetchall():
+                result.setdefault(canonical_id, chunk_id)
+        conn.close()
+        return result
+
+    def get_chunks_by_ids(self, chunk_ids: List[int]) -> Dict[int, Dict]:
+        """
+        批量获取文本块及其文档信息。
+        返回: chunk_id -> {'text', 'filename', 'doc_id', 'chunk_index'}
+        """
+        if not chunk_ids:
+            return {}
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        result = {}
+        ids = list(chunk_ids)
+        # 分批以避免超过 SQLite 的参数数量上限
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i+500]
+            placeholders = ",".join("?" * len(batch))
+            cursor.execute(f'''
+                SELECT c.id, {CHUNK_TEXT_SQL}, d.filename, c.doc_id, c.chunk_index
+                FROM chunks c
+                JOIN documents d ON c.doc_id = d.id
+                WHERE c.id IN ({placeholders})
+            ''', batch)
+            for chunk_id, text, filename, doc_id, chunk_index in cursor.fetchall():
+                result[chunk_id] = {
+                    'text': text,
+                    'filename': filename,
+                    'doc_id': doc_id,
+                    'chunk_index': chunk_index
+                }
+        conn.close()
+        return result
+
+    def get_neighbor_chunks(self, chunk_ids: List[int], window: int = 1) -> Dict[int, List[Dict]]:
+        """
+        批量查询取回每个文本块前后 window 个相邻块（同一文档，按 chunk_index）。
+        返回: chunk_id -> 按 chunk_index 排序的块列表（包含该块本身），每个块为
+              {'chunk_id', 'doc_id', 'chunk_index', 'text', 'filename'}
+        """
+        if not chunk_ids:
+            return {}
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        result = {}
+        ids = list(chunk_ids)
+        # 分批以避免超过 SQLite 的参数数量上限
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i+500]
+            placeholders = ",".join("?" * len(batch))
+            cursor.execute(f'''
+                SELECT h.id, n.id, n.doc_id, n.chunk_index,
+                       chunk_text(n.text, n.doc_id, n.start_offset, n.end_offset), d.filename
+                FROM chunks h
+                JOIN chunks n ON n.doc_id = h.doc_id
+                    AND n.chunk_index BETWEEN h.chunk_index - ? AND h.chunk_index + ?
+                JOIN documents d ON d.id = n.doc_id
+                WHERE h.id IN ({placeholders})
+                ORDER BY h.id, n.chunk_index
+            ''', [window, window] + batch)
+            
+            for hit_id, chunk_id, doc_id, chunk_index, text, filename in cursor.fetchall():
+                result.setdefault(hit_id, []).append({
+                    'chunk_id': chunk_id,
+                    'doc_id': doc_id,
+                    'chunk_index': chunk_index,
+                    'text': text,
+                    'filename': filename
+                })
+        conn.close()
+        return result
+
+    @staticmethod
+    def build_doc_filter(doc_filter: Optional[Dict]) -> Tuple[str, list]:
+        """
+        将文档过滤条件转换为针对 documents 表（别名 d）的 SQL 谓词。
+        
+        doc_filter 支持的键（均可选，多个条件之间为 AND）:
+            doc_ids: 文档 ID 列表
+            filename_pattern: 文件名的 LIKE 模式，例如 '%手册%'
+            start_time / end_time: upload_time 的范围（含边界），如 '2024-01-01'
+        
+        Returns:
+            (where_sql, params)，没有条件时 where_sql 为 "1=1"
+        """
+        if not doc_filter:
+            return "1=1", []
+        
+        conditions = []
+        params = []
+        
+        doc_ids = doc_filter.get('doc_ids')
+        if doc_ids is not None:
+            if not doc_ids:
+                return "0=1", []
+            conditions.append(f"d.id IN ({','.join('?' * len(doc_ids))})")
+            params.extend(doc_ids)
+        
+        if doc_filter.get('filename_pattern'):
+            conditions.append("d.filename LIKE ?")
+            params.append(doc_filter['filename_pattern'])
+        
+        if doc_filter.get('start_time'):
+            conditions.append("d.upload_time >= ?")
+            params.append(doc_filter['start_time'])
+        
+        if doc_filter.get('end_time'):
+            conditions.append("d.upload_time <= ?")
+            params.append(doc_filter['end_time'])
+        
+        return (" AND ".join(conditions) or "1=1"), params
+
+    def get_chunk_ids_by_filter(self, doc_filter: Optional[Dict]) -> List[int]:
+        """
+        返回满足文档过滤条件的所有文本块在索引中的 ID
+        （近似重复块映射到其规范块，因为只有规范块在索引中；
+        命中后用 get_scoped_members 归属回范围内的成员块）。
+        """
+        where_sql, params = self.build_doc_filter(doc_filter)
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT DISTINCT COALESCE(c.canonical_id, c.id) FROM chunks c
+            JOIN documents d ON c.doc_id = d.id
+            WHERE {where_sql}
+        ''', params)
+        ids = [row[0] for row in cursor.fetchall()]
+        conn.close()
+        return ids
+
+    def delete_document(self, doc_id: int) -> Dict:
+        """
+        删除文档及其文本块和文件指纹。
+        
+        其他文档中以本文档文本块为规范块的近似重复块，改为以其中第一个块为新的规范块。
+        返回: {'chunks': 删除的文本块数, 'chunk_ids': 删除的 chunk_id（需要从索引中移除）,
+               'promoted': 成为新规范块的 chunk_id 列表（需要嵌入和索引）}
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT id FROM chunks WHERE doc_id = ?', (doc_id,))
+        chunk_ids = [row[0] for row in cursor.fetchall()]
+        promoted = self._promote_duplicates(cursor, chunk_ids)
+        
+        # 先删除文本块（外键约束）
+        cursor.execute('DELETE FROM chunks WHERE doc_id = ?', (doc_id,))
+        cursor.execute('DELETE FROM file_fingerprints WHERE doc_id = ?', (doc_id,))
+        cursor.execute('DELETE FROM documents WHERE id = ?', (doc_id,))
+        
+        conn.commit()
+        conn.close()
+        self.content_cache.invalidate(doc_id)
+        return {'chunks': len(chunk_ids), 'chunk_ids': chunk_ids, 'promoted': promoted}
+
+    def find_document_by_path(self, path: str) -> Optional[int]:
+        """
+        按源文件路径查找以该路径为源文件（documents.file_path）的文档 ID。path 为 normalize_path() 的结果。
+
+        指纹中记录的其他路径（例如同一文件的副本，见 get_source_paths）不算：
+        副本被修改后应作为新文档导入，而不是覆盖原文档。
+        """
+        conn = self.get_connection()
+        known = self.get_fingerprint(path)
+        if known:
+            row = conn.execute('SELECT file_path FROM documents WHERE id = ?', (known['doc_id'],)).fetchone()
+            if row and os.path.normcase(os.path.abspath(row[0])) == path:
+                conn.close()
+                return known['doc_id']
+        # 指纹指向其他文档或没有指纹（早于文件指纹导入）：只比较文件名相同的文档
+        rows = conn.execute(
+            'SELECT id, file_path FROM documents WHERE filename = ? COLLATE NOCASE ORDER BY id',
+            (os.path.basename(path),)
+        ).fetchall()
+        conn.close()
+        for doc_id, file_path in rows:
+            if os.path.normcase(os.path.abspath(file_path)) == path:
+                return doc_id
+        return None
+
+    def get_source_paths(self) -> List[Tuple[int, str]]:
+        """返回所有已导入文档的源文件路径 (doc_id, path)，包含文件指纹中记录的其他路径。"""
+        conn = self.get_connection()
+        rows = conn.execute('''
+            SELECT id, file_path FROM documents
+            UNION
+            SELECT f.doc_id, f.path FROM file_fingerprints f JOIN documents d ON d.id = f.doc_id
+            ORDER BY 1, 2
+        ''').fetchall()
+        conn.close()
+        return rows
+
     def get_all_documents(self):
         """返回 (id, filename, upload_time, chunk_count, last_indexed)"""
         conn = self.get_connection()
@@ -144,7 +739,58 @@ class DBManager:
         cursor.execute('SELECT content FROM documents WHERE id = ?', (doc_id,))
         row = cursor.fetchone()
         conn.close()
-        return row[0] if row else None
+        return self.codec.decode(row[0]) if row else None
+    
+    def recompress(self, batch_size: int = 200, vacuum: bool = True,
+                   on_progress: Optional[Callable[[str, int], None]] = None) -> Dict:
+        """
+        按当前压缩设置重新编码已有的文档内容（codec 为 none 时即解压），
+        并把旧版本压缩过的内联文本块文本还原为 TEXT。
+        分批读取和提交，避免一次性加载整个数据库。
+        
+        返回: {'documents', 'chunks'（被改写的行数）, 'bytes_before', 'bytes_after'（列数据字节数）,
+               'file_before', 'file_after'（数据库文件大小）}
+        """
+        stats = {'documents': 0, 'chunks': 0, 'bytes_before': 0, 'bytes_after': 0,
+                 'file_before': os.path.getsize(self.db_path)}
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        for table, column, codec in (("documents", "content", self.codec), ("chunks", "text", TextCodec("none"))):
+            total = cursor.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+            done = 0
+            last_id = 0
+            while True:
+                cursor.execute(f'SELECT id, {column} FROM {table} WHERE id > ? ORDER BY id LIMIT ?',
+                               (last_id, batch_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                
+                updates = []
+                for row_id, value in rows:
+                    encoded = codec.encode(self.codec.decode(value))
+                    before, after = TextCodec.stored_size(value), TextCodec.stored_size(encoded)
+                    stats['bytes_before'] += before
+                    stats['bytes_after'] += after
+                    if type(encoded) is not type(value) or before != after:
+                        updates.append((encoded, row_id))
+                
+                cursor.executemany(f'UPDATE {table} SET {column} = ? WHERE id = ?', updates)
+                conn.commit()
+                stats[table] += len(updates)
+                done += len(rows)
+                last_id = rows[-1][0]
+                if on_progress:
+                    on_progress(f"{table}: {done}/{total}", int(done / max(total, 1) * 100))
+        
+        if vacuum:
+            conn.execute('VACUUM')
+        conn.close()
+        
+        self.content_cache.invalidate()
+        stats['file_after'] = os.path.getsize(self.db_path)
+        return stats
     
     def mark_as_indexed(self, doc_id):
         """将文档标记为已索引，使用当前时间戳。"""
@@ -156,11 +802,37 @@ class DBManager:
         conn.commit()
         conn.close()
     
-    def keyword_search(self, query: str, k: int = 10) -> List[Tuple[int, str, str, float]]:
+    def mark_chunks_indexed(self, chunk_ids: List[int]) -> int:
+        """
+        将包含给定文本块的所有文档标记为已索引。
+        返回被标记的文档数量。
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        doc_ids = set()
+        ids = list(chunk_ids)
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i+500]
+            placeholders = ",".join("?" * len(batch))
+            # 近似重复块随其规范块一起进入索引
+            cursor.execute(f'SELECT DISTINCT doc_id FROM chunks WHERE id IN ({placeholders}) OR canonical_id IN ({placeholders})',
+                           batch + batch)
+            doc_ids.update(row[0] for row in cursor.fetchall())
+        
+        cursor.executemany('''
+            UPDATE documents SET last_indexed = CURRENT_TIMESTAMP WHERE id = ?
+        ''', [(doc_id,) for doc_id in doc_ids])
+        conn.commit()
+        conn.close()
+        return len(doc_ids)
+    
+    def keyword_search(self, query: str, k: int = 10, doc_filter: Optional[Dict] = None) -> List[Tuple[int, str, str, float]]:
         """
         对文本块执行简单的基于关键词的搜索。
         返回: (chunk_id, text, filename, score) 的列表
         
+        doc_filter: 可选的文档过滤条件（见 build_doc_filter），在 SQL 中直接过滤
+        
         为简单起见使用 SQL LIKE。生产环境请考虑使用 FTS5。
         """
         conn = self.get_connection()
@@ -169,33 +841,39 @@ class DBManager:
         # 将查询分解为关键词（简单方法）
         keywords = query.split()
         
-        # 构建查询条件
-        conditions = []
-        params = []
-        for keyword in keywords:
-            conditions.append("c.text LIKE ?")
-            params.append(f"%{keyword}%")
-        
-        if not conditions:
+        if not keywords:
             conn.close()
             return []
         
-        where_clause = " OR ".join(conditions)
+        # 构建查询条件：内联的未压缩文本直接在列上 LIKE，
+        # 只有其余的行（偏移存储、压缩）才通过 chunk_text() 生成文本
+        patterns = [f"%{keyword}%" for keyword in keywords]
+        inline_clause = " OR ".join("c.text LIKE ?" for _ in keywords)
+        derived_clause = " OR ".join(f"{CHUNK_TEXT_SQL} LIKE ?" for _ in keywords)
+        filter_sql, filter_params = self.build_doc_filter(doc_filter)
         
         cursor.execute(f'''
-            SELECT c.id, c.text, d.filename
+            SELECT COALESCE(c.canonical_id, c.id),
+                   CASE WHEN typeof(c.text) = 'text' THEN c.text ELSE {CHUNK_TEXT_SQL} END,
+                   d.filename
             FROM chunks c
             JOIN documents d ON c.doc_id = d.id
-            WHERE {where_clause}
+            WHERE {filter_sql}
+              AND ((typeof(c.text) = 'text' AND ({inline_clause}))
+                   OR (typeof(c.text) != 'text' AND ({derived_clause})))
             LIMIT ?
-        ''', params + [k * 2])  # 获取更多候选结果用于评分
+        ''', filter_params + patterns + patterns + [k * 2])  # 获取更多候选结果用于评分
         
         results = cursor.fetchall()
         conn.close()
         
-        # 根据关键词匹配数量评分结果
+        # 根据关键词匹配数量评分结果（近似重复块已映射到规范块，只保留一次）
         scored_results = []
+        seen = set()
         for chunk_id, text, filename in results:
+            if chunk_id in seen:
+                continue
+            seen.add(chunk_id)
             score = 0
             text_lower = text.lower()
             for keyword in keywords:
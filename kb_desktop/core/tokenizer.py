@@ -0,0 +1,107 @@
+import os
+import re
+import numpy as np
+from typing import List, Optional, Tuple
+
+# CJK 字符（含全角标点）通常各占一个 token；其他连续字符按约 4 个字符一个 token 估算
+_CJK_RANGES = r'\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef'
+_TOKEN_PATTERN = re.compile(rf'[{_CJK_RANGES}]|[^\s{_CJK_RANGES}]{{1,4}}')
+# 与上面的字符类一致的字符分类表（BMP 以内），用于向量化计算
+CHAR_OTHER, CHAR_CJK, CHAR_SPACE = 0, 1, 2
+_CHAR_CLASSES = np.zeros(0x10000, dtype=np.uint8)
+_CHAR_CLASSES[[c for c in range(0x3000) if chr(c).isspace()]] = CHAR_SPACE
+for _low, _high in [(0x3000, 0x303f), (0x3400, 0x4dbf), (0x4e00, 0x9fff), (0xf900, 0xfaff), (0xff00, 0xffef)]:
+    _CHAR_CLASSES[_low:_high + 1] = CHAR_CJK
+
+def char_classes(codepoints: np.ndarray) -> np.ndarray:
+    """把 UTF-32 码位数组映射为 CHAR_OTHER / CHAR_CJK / CHAR_SPACE（BMP 以外的字符归为 CHAR_OTHER）。"""
+    return _CHAR_CLASSES[np.minimum(codepoints, 0xFFFF)]
+
+class TokenCounter:
+    """
+    Token 计数器。
+
+    默认使用针对中文优化的启发式估算（无依赖、无网络）：每个 CJK 字符计 1 个 token，
+    其他非空白字符每 4 个计 1 个 token。设置 TIKTOKEN_ENCODING 环境变量
+    （例如 cl100k_base）且安装了 tiktoken 时，使用精确的 BPE 计数。
+    """
+
+    def __init__(self, encoding_name=None):
+        self.encoding = None
+        encoding_name = encoding_name or os.getenv("TIKTOKEN_ENCODING")
+        if encoding_name:
+            try:
+                import tiktoken
+                self.encoding = tiktoken.get_encoding(encoding_name)
+            except Exception as e:
+                print(f"tiktoken unavailable ({e}), using heuristic token counts")
+
+    def count(self, text: str) -> int:
+        """返回文本的 token 数。"""
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text))
+        return sum(1 for _ in _TOKEN_PATTERN.finditer(text))
+
+    def spans(self, text: str) -> List[Tuple[int, int]]:
+        """
+        返回每个 token 在文本中的 (start, end) 字符位置。
+        启发式模式下与 count() 一致；用于按 token 切分文本。
+        """
+        if self.encoding is not None:
+            spans = []
+            pos = 0
+            for token in self.encoding.encode(text):
+                piece = self.encoding.decode([token])
+                spans.append((pos, pos + len(piece)))
+                pos += len(piece)
+            return spans
+        return [m.span() for m in _TOKEN_PATTERN.finditer(text)]
+
+    def token_starts(self, text: str, classes: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        返回每个 token 起始字符位置的数组（升序，int64）。
+
+        启发式模式下对整段文本做一次向量化计算，结果与 spans() 的起点一致；
+        text[a:b] 的 token 数即 searchsorted(b) - searchsorted(a)。
+        classes 为调用方已计算的 char_classes(text)，传入时不再重复分类。
+        """
+        if not text:
+            return np.zeros(0, dtype=np.int64)
+        if self.encoding is not None:
+            _, offsets = self.encoding.decode_with_offsets(self.encoding.encode(text))
+            return np.asarray(offsets, dtype=np.int64)
+
+        if classes is None:
+            classes = char_classes(np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32))
+        marks = classes == CHAR_CJK
+
+        # 非 CJK 连续字符从段首起每 4 个一个 token：只按连续段（而不是逐字符）计算起点
+        edges = np.flatnonzero(np.diff((classes == CHAR_OTHER).view(np.int8), prepend=0, append=0))
+        run_starts, run_ends = edges[0::2], edges[1::2]
+        counts = (run_ends - run_starts + 3) // 4
+        offsets = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+        marks[np.repeat(run_starts, counts) + offsets * 4] = True
+        return np.flatnonzero(marks)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """截断文本使其不超过 max_tokens 个 token。"""
+        if max_tokens <= 0:
+            return ""
+        spans = self.spans(text)
+        if len(spans) <= max_tokens:
+            return text
+        return text[:spans[max_tokens - 1][1]]
+
+_default_counter = None
+
+def get_token_counter() -> TokenCounter:
+    """返回进程内共享的默认计数器。"""
+    global _default_counter
+    if _default_counter is None:
+        _default_counter = TokenCounter()
+    return _default_counter
+
+def count_tokens(text: str) -> int:
+    return get_token_counter().count(text)
@@ -0,0 +1,301 @@
+import os
+import json
+import time
+import uuid
+import threading
+import functools
+import contextvars
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# 当前线程（或协程）正在记录的追踪；没有追踪时 span() 不做任何事
+_current_trace = contextvars.ContextVar("kb_trace", default=None)
+# 当前所在的阶段。按上下文（而不是共享的栈）记录，并发的协程和线程中的阶段互为兄弟而不是错误地相互嵌套
+_current_span = contextvars.ContextVar("kb_span", default=None)
+
+class Span:
+    """
+    追踪中的一个阶段：名称、相对追踪开始的起止时间（单调时钟）、属性和子阶段。
+    """
+
+    def __init__(self, trace, name: str, parent=None, **attrs):
+        self.trace = trace
+        self.name = name
+        self.parent = parent
+        self.attrs = attrs
+        self.children: List["Span"] = []
+        self.events: List[tuple] = []  # (名称, 相对追踪开始的毫秒数)
+        self.start = time.perf_counter()
+        self.end = None
+        self._token = None
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000
+
+    def elapsed_ms(self) -> float:
+        """从本阶段开始到现在的毫秒数。"""
+        return (time.perf_counter() - self.start) * 1000
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def event(self, name: str):
+        self.events.append((name, self.trace.elapsed_ms()))
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.perf_counter()
+        if exc_type is not None:
+            self.attrs['error'] = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(self._token)
+        return False
+
+    def to_dict(self) -> Dict:
+        data = {
+            'name': self.name,
+            'start_ms': round((self.start - self.trace.start) * 1000, 3),
+            'duration_ms': round(self.duration_ms, 3)
+        }
+        if self.attrs:
+            data['attrs'] = self.attrs
+        if self.events:
+            data['events'] = [{'name': n, 'at_ms': round(t, 3)} for n, t in self.events]
+        if self.children:
+            data['children'] = [child.to_dict() for child in self.children]
+        return data
+
+class _NullSpan:
+    """没有活动追踪时 span() 返回的空对象（几乎没有开销）。"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+    def event(self, name: str):
+        pass
+
+    def elapsed_ms(self) -> float:
+        return 0.0
+
+_NULL_SPAN = _NullSpan()
+
+class Trace:
+    """
+    一次请求（例如一次提问）的追踪：按调用嵌套的阶段树，以及首个 token 等事件。
+    """
+
+    def __init__(self, name: str, **attrs):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.timestamp = datetime.now().isoformat()
+        self.start = time.perf_counter()
+        self.end = None
+        self.spans: List[Span] = []   # 顶层阶段
+        self.events: List[tuple] = []
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.start) * 1000
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000
+
+    def span(self, name: str, **attrs) -> Span:
+        parent = _current_span.get()
+        if parent is not None and parent.trace is not self:
+            parent = None
+        span = Span(self, name, parent, **attrs)
+        (parent.children if parent else self.spans).append(span)
+        return span
+
+    def event(self, name: str):
+        at = self.elapsed_ms()
+        self.events.append((name, at))
+        parent = _current_span.get()
+        if parent is not None and parent.trace is self:
+            parent.events.append((name, at))
+
+    def iter_spans(self):
+        pending = list(self.spans)
+        while pending:
+            span = pending.pop(0)
+            yield span
+            pending.extend(span.children)
+
+    @property
+    def ttft_ms(self) -> Optional[float]:
+        """从追踪开始（用户提问）到生成第一个 token 的毫秒数（已取消的生成不计入）。"""
+        discarded = {at for span in self.iter_spans() if span.attrs.get('cancelled') for _, at in span.events}
+        for name, at in self.events:
+            if name == "first_token" and at not in discarded:
+                return at
+        return None
+
+    def stage_totals(self) -> Dict[str, float]:
+        """各阶段名称的累计耗时（毫秒，同名阶段相加）。"""
+        totals = {}
+        for span in self.iter_spans():
+            totals[span.name] = totals.get(span.name, 0.0) + span.duration_ms
+        return totals
+
+    def to_dict(self) -> Dict:
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'timestamp': self.timestamp,
+            'duration_ms': round(self.duration_ms, 3),
+            'ttft_ms': round(self.ttft_ms, 3) if self.ttft_ms is not None else None,
+            'attrs': self.attrs,
+            'events': [{'name': n, 'at_ms': round(t, 3)} for n, t in self.events],
+            'spans': [span.to_dict() for span in self.spans]
+        }
+
+    def format(self) -> str:
+        """文本形式的阶段瀑布图（缩进表示嵌套），用于界面显示。"""
+        total = self.duration_ms or 1.0
+        lines = [f"{self.name}  总耗时 {self.duration_ms:.1f} ms"
+                 + (f"  首 token {self.ttft_ms:.1f} ms" if self.ttft_ms is not None else "")]
+
+        def walk(spans, depth):
+            for span in spans:
+                offset = (span.start - self.start) * 1000
+                extra = "".join(f"  {k}={v}" for k, v in span.attrs.items())
+                lines.append(f"{'  ' * depth}{span.name:<20} {span.duration_ms:9.1f} ms "
+                             f"{span.duration_ms / total * 100:5.1f}%  @{offset:.1f}{extra}")
+                walk(span.children, depth + 1)
+
+        walk(self.spans, 1)
+        return "\n".join(lines)
+
+class TraceRecorder:
+    """
+    收集已完成的追踪：保留最近 max_traces 个用于统计和界面显示，
+    设置了 log_path（默认读取 TRACE_LOG）时每个追踪追加一行 JSON。
+    """
+
+    def __init__(self, log_path: Optional[str] = None, max_traces: int = 200):
+        self.log_path = log_path if log_path is not None else os.getenv("TRACE_LOG") or None
+        self._traces = deque(maxlen=max_traces)
+        self._lock = threading.Lock()
+
+    def record(self, trace: Trace):
+        with self._lock:
+            self._traces.append(trace)
+            if self.log_path:
+                try:
+                    os.makedirs(os.path.dirname(os.path.abspath(self.log_path)), exist_ok=True)
+                    with open(self.log_path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(trace.to_dict(), ensure_ascii=False) + "\n")
+                except OSError as e:
+                    print(f"Failed to write trace log: {e}")
+
+    def recent(self, n: Optional[int] = None) -> List[Trace]:
+        with self._lock:
+            traces = list(self._traces)
+        return traces[-n:] if n else traces
+
+    def last(self) -> Optional[Trace]:
+        with self._lock:
+            return self._traces[-1] if self._traces else None
+
+    def clear(self):
+        with self._lock:
+            self._traces.clear()
+
+    def stage_stats(self, name: Optional[str] = None) -> Dict[str, Dict]:
+        """
+        最近的追踪中每个阶段的耗时分布（毫秒）:
+        {阶段: {'count', 'mean', 'p50', 'p95', 'max'}}，另含 'total'（整个追踪）和 'ttft'。
+        name 不为空时只统计该名称的追踪。
+        """
+        samples: Dict[str, List[float]] = {}
+        for trace in self.recent():
+            if name and trace.name != name:
+                continue
+            samples.setdefault('total', []).append(trace.duration_ms)
+            if trace.ttft_ms is not None:
+                samples.setdefault('ttft', []).append(trace.ttft_ms)
+            for stage, ms in trace.stage_totals().items():
+                samples.setdefault(stage, []).append(ms)
+
+        stats = {}
+        for stage, values in samples.items():
+            values = np.array(values)
+            stats[stage] = {
+                'count': len(values), 'mean': float(values.mean()),
+                'p50': float(np.percentile(values, 50)), 'p95': float(np.percentile(values, 95)),
+                'max': float(values.max())
+            }
+        return stats
+
+# 进程内默认的追踪收集器
+recorder = TraceRecorder()
+
+class _TraceScope:
+    def __init__(self, trace: Trace, recorder: Optional[TraceRecorder]):
+        self.trace = trace
+        self.recorder = recorder
+        self._token = None
+
+    def __enter__(self) -> Trace:
+        self._token = _current_trace.set(self.trace)
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        self.trace.end = time.perf_counter()
+        if exc_type is not None:
+            self.trace.attrs['error'] = f"{exc_type.__name__}: {exc}"
+        _current_trace.reset(self._token)
+        if self.recorder is not None:
+            self.recorder.record(self.trace)
+        return False
+
+def start_trace(name: str, recorder: Optional[TraceRecorder] = recorder, **attrs) -> _TraceScope:
+    """
+    开始一次追踪（with 语句），期间各模块中的 span() 都记录到这个追踪中；
+    结束时交给 recorder（默认为模块级 recorder，传 None 则不记录）。
+    """
+    return _TraceScope(Trace(name, **attrs), recorder)
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+def bind(func):
+    """
+    返回在当前上下文（追踪和所在阶段）中运行 func 的可调用对象，用于提交到线程池:
+    线程池不会继承调用方的上下文，直接提交时其中的 span() 不会被记录。
+    """
+    return functools.partial(contextvars.copy_context().run, func)
+
+def span(name: str, **attrs):
+    """
+    计时一个阶段（with 语句），嵌套调用形成阶段树。没有活动追踪时返回空对象，开销可以忽略。
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return _NULL_SPAN
+    return trace.span(name, **attrs)
+
+def event(name: str):
+    """在当前追踪中记录一个时间点（例如 "first_token"）。"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.event(name)
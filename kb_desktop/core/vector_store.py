@@ -0,0 +1,201 @@
+import os
+import json
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+class VectorStore:
+    """
+    文本块嵌入的只追加存储，使 FAISS 索引可以离线重建而无需再次调用嵌入 API。
+
+    文件:
+        vectors.f32    行优先的 float32 矩阵 (n, dimension)，可内存映射
+        vector_ids.i64 每一行对应的 chunk_id (int64)
+        vectors.json   头信息: dimension, model
+
+    同一 chunk_id 被多次写入时以最后一行为准。
+    追加时先写向量再写 ID，打开时按两者中较短的行数截断，因此写入中断不会产生错位。
+    """
+
+    VECTORS_FILE = "vectors.f32"
+    IDS_FILE = "vector_ids.i64"
+    HEADER_FILE = "vectors.json"
+
+    def __init__(self, store_dir=None):
+        """
+        Args:
+            store_dir: 存储目录，默认 kb_desktop/data/vectors
+        """
+        if store_dir is None:
+            current_dir = os.path.dirname(os.path.abspath(__file__))
+            kb_desktop_dir = os.path.dirname(current_dir)
+            store_dir = os.path.join(kb_desktop_dir, "data", "vectors")
+
+        os.makedirs(store_dir, exist_ok=True)
+        self.store_dir = store_dir
+        self.vectors_path = os.path.join(store_dir, self.VECTORS_FILE)
+        self.ids_path = os.path.join(store_dir, self.IDS_FILE)
+        self.header_path = os.path.join(store_dir, self.HEADER_FILE)
+
+        self.dimension = None
+        self.model = None
+        self._rows: Dict[int, int] = {}  # chunk_id -> 行号
+        self._count = 0
+        self._matrix = None  # 延迟创建的内存映射
+
+        self._open()
+
+    # ---------- 打开与修复 ----------
+
+    def _open(self):
+        if not os.path.exists(self.header_path):
+            return
+
+        with open(self.header_path, 'r', encoding='utf-8') as f:
+            header = json.load(f)
+        self.dimension = header['dimension']
+        self.model = header.get('model')
+        if self.dimension is None:
+            return
+
+        row_bytes = self.dimension * 4
+        vec_rows = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+        id_rows = os.path.getsize(self.ids_path) // 8 if os.path.exists(self.ids_path) else 0
+        count = min(vec_rows, id_rows)
+
+        # 截断中断写入留下的多余字节
+        for path, size in ((self.vectors_path, count * row_bytes), (self.ids_path, count * 8)):
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+
+        self._count = count
+        if count:
+            ids = np.fromfile(self.ids_path, dtype=np.int64, count=count)
+            self._rows = {int(cid): row for row, cid in enumerate(ids)}
+
+    def reset(self, dimension: Optional[int] = None, model: Optional[str] = None):
+        """
+        清空存储并设置新的维度/模型（例如更换了嵌入模型）。
+        dimension 为 None 时在第一次追加时确定。
+        """
+        for path in (self.vectors_path, self.ids_path):
+            open(path, 'wb').close()
+
+        header = {"dimension": dimension, "model": model}
+        with open(self.header_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(header, f, ensure_ascii=False, indent=2)
+        os.replace(self.header_path + ".tmp", self.header_path)
+
+        self.dimension = dimension
+        self.model = model
+        self._rows = {}
+        self._count = 0
+        self._matrix = None
+
+    def is_compatible(self, dimension: Optional[int] = None, model: Optional[str] = None) -> bool:
+        """存储是否已初始化且与给定的维度/模型一致。"""
+        if self.dimension is None:
+            return False
+        if dimension is not None and dimension != self.dimension:
+            return False
+        if model is not None and self.model is not None and model != self.model:
+            return False
+        return True
+
+    # ---------- 写入 ----------
+
+    def append(self, chunk_ids: List[int], vectors):
+        """
+        追加一批嵌入。首次写入时按向量维度初始化存储。
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) != len(chunk_ids):
+            raise ValueError("Number of vectors must match number of chunk_ids")
+        if len(vectors) == 0:
+            return
+
+        if self.dimension is None:
+            self.reset(vectors.shape[1], self.model)
+        if vectors.shape[1] != self.dimension:
+            raise ValueError(f"Vector dimension {vectors.shape[1]} doesn't match store dimension {self.dimension}")
+
+        with open(self.vectors_path, 'ab') as f:
+            f.write(np.ascontiguousarray(vectors).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.ids_path, 'ab') as f:
+            f.write(np.asarray(chunk_ids, dtype=np.int64).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        for offset, cid in enumerate(chunk_ids):
+            self._rows[int(cid)] = self._count + offset
+        self._count += len(chunk_ids)
+        self._matrix = None
+
+    def compact(self, live_chunk_ids=None):
+        """
+        重写存储，只保留每个 chunk 的最新向量（可选只保留 live_chunk_ids 中的 chunk）。
+        """
+        if self.dimension is None:
+            return
+
+        if live_chunk_ids is None:
+            keep = self._rows
+        else:
+            live = set(live_chunk_ids)
+            keep = {cid: row for cid, row in self._rows.items() if cid in live}
+        ids = sorted(keep)
+        matrix = self._get_matrix()
+        vectors = matrix[[keep[cid] for cid in ids]] if ids else np.zeros((0, self.dimension), dtype=np.float32)
+
+        vectors.astype(np.float32).tofile(self.vectors_path + ".tmp")
+        np.asarray(ids, dtype=np.int64).tofile(self.ids_path + ".tmp")
+        self._matrix = None  # 释放内存映射后再替换文件（Windows 要求）
+        del matrix
+        os.replace(self.vectors_path + ".tmp", self.vectors_path)
+        os.replace(self.ids_path + ".tmp", self.ids_path)
+
+        self._rows = {cid: row for row, cid in enumerate(ids)}
+        self._count = len(ids)
+
+    # ---------- 读取 ----------
+
+    def _get_matrix(self):
+        if self._matrix is None:
+            if self._count == 0:
+                return np.zeros((0, self.dimension or 0), dtype=np.float32)
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r',
+                                     shape=(self._count, self.dimension))
+        return self._matrix
+
+    def __len__(self):
+        """不同 chunk 的数量。"""
+        return len(self._rows)
+
+    @property
+    def row_count(self) -> int:
+        """文件中的总行数（包括被覆盖的旧行）。"""
+        return self._count
+
+    def __contains__(self, chunk_id) -> bool:
+        return chunk_id in self._rows
+
+    def missing_ids(self, chunk_ids: List[int]) -> List[int]:
+        """返回尚未存储嵌入的 chunk_id。"""
+        return [cid for cid in chunk_ids if cid not in self._rows]
+
+    def get(self, chunk_ids: List[int]) -> np.ndarray:
+        """
+        按顺序返回 chunk_ids 的向量矩阵。任何 chunk 缺失时抛出 KeyError。
+        """
+        missing = self.missing_ids(chunk_ids)
+        if missing:
+            raise KeyError(f"{len(missing)} chunks have no stored embedding, e.g. {missing[:5]}")
+        rows = [self._rows[cid] for cid in chunk_ids]
+        return np.asarray(self._get_matrix()[rows])
+
+    def items(self) -> Tuple[List[int], np.ndarray]:
+        """返回所有 chunk 的 (chunk_ids, vectors)，按 chunk_id 升序。"""
+        ids = sorted(self._rows)
+        return ids, self.get(ids)
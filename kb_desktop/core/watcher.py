@@ -0,0 +1,342 @@
+import os
+import time
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from core.importer import normalize_path
+from core.parsers import supported_extensions
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+# 默认监听的文档类型（与 Ingestor 支持的格式一致）
+WATCH_EXTENSIONS = tuple(supported_extensions())
+
+def _is_document(path: str, extensions: Iterable[str]) -> bool:
+    name = os.path.basename(path)
+    # 跳过编辑器和 Office 的临时文件
+    if name.startswith(('~$', '.')) or name.endswith(('.tmp', '~')):
+        return False
+    return os.path.splitext(name)[1].lower() in extensions
+
+class PollingSource:
+    """
+    定时扫描目录树，按文件 (大小, 修改时间) 的变化产生事件（任何平台可用）。
+    第一次调用 wait() 返回目录中已有的全部文件。
+    """
+
+    backend = "polling"
+
+    def __init__(self, folder: str, extensions: Iterable[str] = WATCH_EXTENSIONS, interval: float = 1.0):
+        self.folder = folder
+        self.extensions = tuple(extensions)
+        self.interval = interval
+        self._snapshot: Dict[str, Tuple[int, float]] = {}
+        self._last_scan = None
+
+    def scan(self) -> Dict[str, Tuple[int, float]]:
+        """返回目录树中所有文档的 path -> (大小, 修改时间)。"""
+        files = {}
+        for root, dirs, names in os.walk(self.folder):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for name in names:
+                path = os.path.join(root, name)
+                if not _is_document(path, self.extensions):
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # 扫描期间被删除
+                files[path] = (stat.st_size, stat.st_mtime)
+        return files
+
+    def wait(self, timeout: float) -> List[str]:
+        """等待最多 timeout 秒，返回新增、修改或删除的文件路径。"""
+        if self._last_scan is not None:
+            remaining = self.interval - (time.monotonic() - self._last_scan)
+            if remaining > 0:
+                if remaining > timeout:
+                    time.sleep(timeout)
+                    return []
+                time.sleep(remaining)
+
+        self._last_scan = time.monotonic()
+        current = self.scan()
+        changed = [path for path, stat in current.items() if self._snapshot.get(path) != stat]
+        changed.extend(path for path in self._snapshot if path not in current)
+        self._snapshot = current
+        return changed
+
+    def close(self):
+        pass
+
+class InotifySource:
+    """
+    基于 Linux inotify 的事件源（需要 inotify_simple），文件写完（CLOSE_WRITE）或移入时立即产生事件。
+    新建的子目录会自动加入监听。第一次调用 wait() 返回目录中已有的全部文件。
+    """
+
+    backend = "inotify"
+
+    def __init__(self, folder: str, extensions: Iterable[str] = WATCH_EXTENSIONS):
+        if inotify_simple is None:
+            raise RuntimeError("inotify_simple is not installed")
+        self.folder = folder
+        self.extensions = tuple(extensions)
+        flags = inotify_simple.flags
+        self._file_mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | flags.DELETE
+        self._dir_mask = self._file_mask | flags.CREATE
+        self._inotify = inotify_simple.INotify()
+        self._dirs: Dict[int, str] = {}
+        self._initial = []
+        for root, dirs, names in os.walk(folder):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            self._add_dir(root)
+            self._initial.extend(os.path.join(root, n) for n in names
+                                 if _is_document(os.path.join(root, n), self.extensions))
+
+    def _add_dir(self, path: str):
+        self._dirs[self._inotify.add_watch(path, self._dir_mask)] = path
+
+    def wait(self, timeout: float) -> List[str]:
+        if self._initial:
+            changed, self._initial = self._initial, []
+            return changed
+
+        changed = []
+        for event in self._inotify.read(timeout=int(timeout * 1000)):
+            parent = self._dirs.get(event.wd)
+            if parent is None or not event.name:
+                continue
+            path = os.path.join(parent, event.name)
+            if event.mask & inotify_simple.flags.ISDIR:
+                if event.mask & (inotify_simple.flags.CREATE | inotify_simple.flags.MOVED_TO):
+                    # 新目录：加入监听，并把其中已有的文件作为事件（创建与监听之间写入的文件）
+                    for root, dirs, names in os.walk(path):
+                        self._add_dir(root)
+                        changed.extend(os.path.join(root, n) for n in names)
+            else:
+                changed.append(path)
+        return [path for path in changed if _is_document(path, self.extensions)]
+
+    def close(self):
+        self._inotify.close()
+
+def create_source(folder: str, extensions: Iterable[str] = WATCH_EXTENSIONS,
+                  backend: Optional[str] = None, interval: float = 1.0):
+    """
+    创建事件源。backend 默认读取 WATCH_BACKEND（auto）：
+    auto 在 Linux 且安装了 inotify_simple 时使用 inotify，否则轮询。
+    """
+    backend = (backend or os.getenv("WATCH_BACKEND", "auto")).lower()
+    if backend not in ("auto", "inotify", "polling"):
+        raise ValueError(f"Unknown watch backend: {backend}")
+
+    if backend != "polling" and inotify_simple is not None:
+        try:
+            return InotifySource(folder, extensions)
+        except OSError as e:
+            # 例如超出 max_user_watches
+            print(f"inotify unavailable ({e}), falling back to polling")
+    elif backend == "inotify":
+        print("inotify_simple is not installed, falling back to polling")
+    return PollingSource(folder, extensions, interval)
+
+class FolderWatcher:
+    """
+    监听文件夹，把新增或修改的文档持续导入知识库并增量更新索引。
+
+    文件事件先进入待处理队列并去抖动：同一文件在 debounce 秒内没有新的事件后才处理
+    （避免处理写到一半的文件，以及编辑器保存时的多次事件）。
+    到期的文件按最多 batch_size 个一批经 Importer 导入（指纹检查 -> 解析 -> 分块 -> 入库），
+    每批只调用一次 Indexer.apply_changes，只嵌入新增或改动的文本块，索引只保存一次。
+    文档入库后索引更新失败（例如嵌入请求出错）时，这些文本块的变更保留下来，
+    与下一批一起重试（没有新文件时在下一次 run_once 中单独重试）。
+
+    metrics() 提供队列深度和延迟（从第一次文件事件到进入索引的时间）。
+    """
+
+    def __init__(self, folder: str, importer, indexer, source=None,
+                 debounce: Optional[float] = None, batch_size: Optional[int] = None,
+                 delete_missing: Optional[bool] = None):
+        """
+        Args:
+            folder: 监听的目录
+            importer: Importer 实例
+            indexer: Indexer 实例（其 embedder 为 None 时只能使用已存储的嵌入）
+            source: 事件源，默认 create_source(folder)
+            debounce: 去抖动秒数，默认读取 WATCH_DEBOUNCE（2.0）
+            batch_size: 每批处理的最大文件数，默认读取 WATCH_BATCH_SIZE（32）
+            delete_missing: 源文件被删除时是否删除对应文档，默认读取 WATCH_DELETE（关闭）
+        """
+        if not os.path.isdir(folder):
+            raise ValueError(f"Not a directory: {folder}")
+
+        self.folder = folder
+        self.importer = importer
+        self.indexer = indexer
+        self.source = source or create_source(folder)
+        self.debounce = float(os.getenv("WATCH_DEBOUNCE", "2.0")) if debounce is None else debounce
+        self.batch_size = batch_size or int(os.getenv("WATCH_BATCH_SIZE", "32"))
+        if delete_missing is None:
+            delete_missing = os.getenv("WATCH_DELETE", "0").lower() in ("1", "true", "yes")
+        self.delete_missing = delete_missing
+
+        self._pending: Dict[str, List[float]] = {}  # path -> [第一次事件时间, 最近一次事件时间]
+        self._unindexed: Tuple[List[int], List[int]] = ([], [])  # 尚未应用到索引的 (added, removed)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {
+            'batches': 0, 'files': 0, 'imported': 0, 'updated': 0, 'deleted': 0, 'failed': 0,
+            'vectors_added': 0, 'vectors_removed': 0, 'embedded': 0,
+            'last_lag': 0.0, 'max_lag': 0.0, 'last_batch_seconds': 0.0, 'last_batch_time': None,
+            'errors': 0
+        }
+
+    # ---------- 后台线程 ----------
+
+    def start(self):
+        """在后台守护线程中开始监听。"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="kb-folder-watcher", daemon=True)
+        self._thread.start()
+        print(f"Watching {self.folder} ({self.source.backend}, debounce={self.debounce}s, batch={self.batch_size})")
+
+    def stop(self, timeout: float = 10.0):
+        """停止监听并等待当前批次完成。"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.source.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once(timeout=min(1.0, max(self.debounce, 0.05)))
+            except Exception as e:
+                with self._lock:
+                    self._stats['errors'] += 1
+                print(f"Watcher error: {e}")
+                self._stop.wait(1.0)
+
+    # ---------- 事件处理 ----------
+
+    def run_once(self, timeout: float = 0.0) -> Optional[Dict]:
+        """
+        收集一次文件事件，并处理一批已到期的文件。
+        返回本批次的处理结果，没有到期文件时返回 None。
+        """
+        changed = self.source.wait(timeout)
+        if changed:
+            now = time.monotonic()
+            with self._lock:
+                for path in changed:
+                    times = self._pending.setdefault(path, [now, now])
+                    times[1] = now
+
+        batch = self._take_ready(time.monotonic())
+        if not batch and not any(self._unindexed):
+            return None
+        return self._process(batch)
+
+    def _take_ready(self, now: float) -> List[Tuple[str, float]]:
+        """取出去抖动到期的文件（先到先处理），返回 [(path, 第一次事件时间)]。"""
+        with self._lock:
+            ready = sorted((times[0], path) for path, times in self._pending.items()
+                           if now - times[1] >= self.debounce)[:self.batch_size]
+            for _, path in ready:
+                del self._pending[path]
+        return [(path, first_seen) for first_seen, path in ready]
+
+    def _process(self, batch: List[Tuple[str, float]]) -> Dict:
+        started = time.monotonic()
+        existing = [path for path, _ in batch if os.path.exists(path)]
+        result = self.importer.import_files(existing)
+        # 先带上此前未能进入索引的变更
+        added, removed = self._unindexed[0] + result['added'], self._unindexed[1] + result['removed']
+
+        deleted = 0
+        if self.delete_missing:
+            for path, _ in batch:
+                if path in existing:
+                    continue
+                doc_id = self.importer.db.find_document_by_path(normalize_path(path))
+                if doc_id is None:
+                    continue
+                outcome = self.importer.db.delete_document(doc_id)
+                removed.extend(outcome['chunk_ids'])
+                added.extend(outcome['promoted'])
+                deleted += 1
+            if deleted:
+                self.importer.deduplicator.invalidate()
+
+        changes = {'added': 0, 'removed': 0, 'embedded': 0}
+        index_error = None
+        if added or removed:
+            removed_set = set(removed)
+            added = [cid for cid in added if cid not in removed_set]
+            try:
+                changes = self.indexer.apply_changes(added, removed)
+                unindexed = ([], [])
+            except Exception as e:
+                # 文档和指纹已经入库：记下变更以便重试，否则这些文本块永远不会进入索引
+                index_error = str(e)
+                unindexed = (added, removed)
+                print(f"Index update failed, will retry {len(added) + len(removed)} chunk changes: {e}")
+            with self._lock:
+                self._unindexed = unindexed
+
+        finished = time.monotonic()
+        lags = [finished - first_seen for _, first_seen in batch] or [0.0]
+        with self._lock:
+            stats = self._stats
+            stats['batches'] += 1
+            stats['files'] += len(batch)
+            stats['imported'] += result['imported']
+            stats['updated'] += result['updated']
+            stats['deleted'] += deleted
+            stats['failed'] += result['failed']
+            stats['vectors_added'] += changes['added']
+            stats['vectors_removed'] += changes['removed']
+            stats['embedded'] += changes['embedded']
+            stats['last_lag'] = max(lags)
+            stats['max_lag'] = max(stats['max_lag'], stats['last_lag'])
+            stats['last_batch_seconds'] = finished - started
+            stats['last_batch_time'] = time.time()
+            if index_error is not None:
+                stats['errors'] += 1
+
+        return {
+            'files': len(batch), 'imported': result['imported'], 'updated': result['updated'],
+            'deleted': deleted, 'failed': result['failed'], 'errors': result['errors'],
+            'index_error': index_error, **changes
+        }
+
+    # ---------- 指标 ----------
+
+    def metrics(self) -> Dict:
+        """
+        返回监听指标:
+            'queue_depth'       等待处理的文件数
+            'oldest_pending'    队列中最早的事件已等待的秒数
+            'unindexed'         已入库但尚未应用到索引（等待重试）的文本块变更数
+            'last_lag'/'max_lag' 最近一批/历史最大的事件到入索引延迟（秒）
+            以及累计的批次数、文件数、导入/更新/删除/失败数、向量增删数和嵌入数
+        """
+        now = time.monotonic()
+        with self._lock:
+            oldest = min((times[0] for times in self._pending.values()), default=None)
+            return {
+                'backend': self.source.backend,
+                'queue_depth': len(self._pending),
+                'oldest_pending': now - oldest if oldest is not None else 0.0,
+                'unindexed': len(self._unindexed[0]) + len(self._unindexed[1]),
+                'running': self._thread is not None and self._thread.is_alive(),
+                **self._stats
+            }
@@ -1,8 +1,9 @@
 import json
 import time
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional
 from datetime import datetime
 import os
+import numpy as np
 
 class Evaluator:
     """
@@ -31,7 +32,7 @@ class Evaluator:
                       query: str, 
                       expected_docs: List[str],
                       retrieved_chunks: List[Dict],
-                      answer: str,
+                      answer: Optional[str],
                       latency: float) -> Dict:
         """
         Evaluate a single query.
@@ -40,7 +41,7 @@ class Evaluator:
             query: The question
             expected_docs: List of expected document names/keywords
             retrieved_chunks: Retrieved chunks with 'filename' field
-            answer: Generated answer
+            answer: Generated answer (None in retrieval-only runs)
             latency: Time taken in seconds
             
         Returns:
@@ -58,13 +59,23 @@ class Evaluator:
         
         hit_rate = len(hits) / len(expected_docs) if expected_docs else 0
         
+        # Reciprocal rank of the first retrieved chunk from any expected doc
+        reciprocal_rank = 0.0
+        for rank, retrieved in enumerate(retrieved_docs, 1):
+            if any(expected.lower() in retrieved.lower() for expected in expected_docs):
+                reciprocal_rank = 1 / rank
+                break
+        
         # Check if citations exist
-        has_citations = "【引用】" in answer or "文档" in answer or "[" in answer
+        has_citations = None
+        if answer is not None:
+            has_citations = "【引用】" in answer or "文档" in answer or "[" in answer
         
         return {
             'query': query,
             'hit_rate': hit_rate,
             'hits': hits,
+            'reciprocal_rank': reciprocal_rank,
             'expected': expected_docs,
             'retrieved_count': len(retrieved_chunks),
             'has_citations': has_citations,
@@ -82,19 +93,28 @@ class Evaluator:
         if not results:
             return {
                 'avg_hit_rate': 0,
+                'hit_at_k': 0,
+                'mrr': 0,
                 'citation_rate': 0,
                 'avg_latency': 0,
                 'total_queries': 0
             }
         
         total_hit_rate = sum(r['hit_rate'] for r in results)
-        total_citations = sum(1 for r in results if r['has_citations'])
-        total_latency = sum(r['latency'] for r in results)
+        answered = [r for r in results if r['has_citations'] is not None]
+        total_citations = sum(1 for r in answered if r['has_citations'])
+        latencies = np.array([r['latency'] for r in results])
         
         return {
             'avg_hit_rate': total_hit_rate / len(results),
-            'citation_rate': total_citations / len(results),
-            'avg_latency': total_latency / len(results),
+            'hit_at_k': sum(1 for r in results if r['hits']) / len(results),
+            'mrr': sum(r.get('reciprocal_rank', 0) for r in results) / len(results),
+            # None when no answers were generated (retrieval-only runs)
+            'citation_rate': total_citations / len(answered) if answered else None,
+            'avg_latency': float(latencies.mean()),
+            'latency_p50': float(np.percentile(latencies, 50)),
+            'latency_p95': float(np.percentile(latencies, 95)),
+            'latency_p99': float(np.percentile(latencies, 99)),
             'total_queries': len(results),
             'results': results
         }
@@ -115,8 +135,8 @@ class Evaluator:
         os.makedirs(os.path.dirname(output_file), exist_ok=True)
         
         with open(output_file, 'w', newline='', encoding='utf-8-sig') as f:
-            writer = csv.DictWriter(f, fieldnames=[
-                'query', 'hit_rate', 'hits', 'expected', 'retrieved_count', 
+            writer = csv.DictWriter(f, extrasaction='ignore', fieldnames=[
+                'query', 'hit_rate', 'hits', 'reciprocal_rank', 'expected', 'retrieved_count', 
                 'has_citations', 'latency', 'timestamp'
             ])
             writer.writeheader()
@@ -0,0 +1,200 @@
+import sys
+import os
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Make core/ and eval/ importable when run as a script
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.append(project_root)
+
+from core.tracing import start_trace
+from core.retriever import Retriever
+from eval.evaluator import Evaluator
+
+# Spans recorded once per batch vs. once per question by Retriever.retrieve_batch
+BATCH_STAGES = ("filter", "embed_query", "vector_search")
+QUERY_STAGES = ("keyword_search", "fuse")
+
+class EvalRunner:
+    """
+    Runs an eval.jsonl set against the knowledge base.
+
+    All questions are embedded in one batch and searched with one batched FAISS call;
+    answers are then generated concurrently on a bounded thread pool. With
+    retrieval_only=True the LLM is never called and only retrieval is scored.
+    """
+
+    def __init__(self, db, index, embedder, rag=None, k: int = 5, workers: int = 8,
+                 retrieval_only: bool = False, window: Optional[int] = None):
+        """
+        Args:
+            db: DBManager instance
+            index: FaissIndex or ShardedFaissIndex (loaded)
+            embedder: embedder used for the questions (same model as the index)
+            rag: RAGGenerator, required unless retrieval_only
+            k: number of chunks retrieved per question
+            workers: max concurrent LLM generations
+            retrieval_only: skip generation and citation scoring
+            window: neighbor expansion window, defaults to CONTEXT_WINDOW
+        """
+        if rag is None and not retrieval_only:
+            raise ValueError("A RAGGenerator is required unless retrieval_only is set.")
+        self.retriever = Retriever(db, index, embedder)
+        self.rag = rag
+        self.k = k
+        self.workers = max(1, workers)
+        self.retrieval_only = retrieval_only
+        self.window = window if window is not None else int(os.getenv("CONTEXT_WINDOW", "1"))
+        self.evaluator = Evaluator()
+
+    def run(self, eval_data: List[Dict]) -> Dict:
+        """
+        Evaluate every item ({'question', 'expected_docs', ...}).
+
+        Returns:
+            Evaluator.calculate_metrics output plus retrieval/generation latency
+            percentiles, wall time and run settings
+        """
+        start = time.perf_counter()
+        questions = [item['question'] for item in eval_data]
+        hits, retrieval_latencies = self.retrieve_all(questions)
+
+        if self.retrieval_only:
+            generated = [(None, 0.0, None)] * len(questions)
+        else:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                generated = list(executor.map(self._generate, questions, hits))
+
+        results = []
+        for item, chunks, retrieval_latency, (answer, generation_latency, error) in zip(
+                eval_data, hits, retrieval_latencies, generated):
+            result = self.evaluator.evaluate_query(
+                item['question'], item.get('expected_docs', []), chunks, answer,
+                retrieval_latency + generation_latency
+            )
+            result['retrieval_latency'] = retrieval_latency
+            result['generation_latency'] = generation_latency
+            if error:
+                result['error'] = error
+            results.append(result)
+
+        wall_time = time.perf_counter() - start
+        metrics = self.evaluator.calculate_metrics(results)
+        if results:
+            for name in ('retrieval', 'generation'):
+                values = np.array([r[f'{name}_latency'] for r in results])
+                metrics[f'{name}_latency_p50'] = float(np.percentile(values, 50))
+                metrics[f'{name}_latency_p95'] = float(np.percentile(values, 95))
+        metrics.update({
+            'mode': 'retrieval' if self.retrieval_only else 'full',
+            'k': self.k,
+            'workers': self.workers,
+            'wall_time': wall_time,
+            'qps': len(results) / wall_time if wall_time > 0 else 0,
+            'timestamp': datetime.now().isoformat()
+        })
+        return metrics
+
+    def retrieve_all(self, questions: List[str]):
+        """
+        Batched retrieval for all questions.
+
+        Returns:
+            (hits per question, retrieval latency per question in seconds). A question's
+            latency is its own keyword search and fusion time plus an equal share of the
+            batched embedding and FAISS search.
+        """
+        if not questions:
+            return [], []
+        with start_trace("eval_retrieval", recorder=None) as trace:
+            hits = self.retriever.retrieve_batch(questions, k=self.k)
+
+        shared = sum(span.duration_ms for span in trace.spans if span.name in BATCH_STAGES) / len(questions)
+        own = [span.duration_ms for span in trace.spans if span.name in QUERY_STAGES]
+        per_query = [sum(own[i:i + len(QUERY_STAGES)]) for i in range(0, len(own), len(QUERY_STAGES))]
+        return hits, [(shared + ms) / 1000 for ms in per_query]
+
+    def _generate(self, question: str, chunks: List[Dict]):
+        """Same answer path as the UI. Returns (answer, seconds, error)."""
+        start = time.perf_counter()
+        try:
+            is_confident, reason = self.rag.check_confidence(chunks)
+            if not is_confident:
+                answer, _ = self.rag.generate_fallback_response(question, chunks, reason)
+            else:
+                expanded = self.retriever.expand_neighbors(chunks, window=self.window)
+                answer, _ = self.rag.generate_answer(question, self.rag.pack_context(expanded))
+            return answer, time.perf_counter() - start, None
+        except Exception as e:
+            return "", time.perf_counter() - start, str(e)
+
+def format_summary(metrics: Dict) -> str:
+    lines = [
+        f"Mode: {metrics['mode']}  questions: {metrics['total_queries']}  k={metrics['k']}  "
+        f"wall time: {metrics['wall_time']:.2f}s ({metrics['qps']:.1f} q/s)",
+        f"Hit@{metrics['k']}: {metrics['hit_at_k']:.3f}  MRR: {metrics['mrr']:.3f}  "
+        f"avg expected-doc recall: {metrics['avg_hit_rate']:.3f}",
+    ]
+    if metrics['citation_rate'] is not None:
+        lines.append(f"Citation rate: {metrics['citation_rate']:.3f}")
+    if metrics['total_queries']:
+        lines.append(
+            f"Latency p50/p95/p99: {metrics['latency_p50'] * 1000:.1f} / {metrics['latency_p95'] * 1000:.1f} / "
+            f"{metrics['latency_p99'] * 1000:.1f} ms (retrieval p95 {metrics['retrieval_latency_p95'] * 1000:.1f} ms)"
+        )
+    errors = [r for r in metrics.get('results', []) if r.get('error')]
+    if errors:
+        lines.append(f"Generation errors: {len(errors)} (first: {errors[0]['error']})")
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the eval.jsonl set against the knowledge base")
+    parser.add_argument("--eval-file", default=os.path.join(current_dir, "eval.jsonl"))
+    parser.add_argument("--k", type=int, default=5, help="chunks retrieved per question")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent LLM generations")
+    parser.add_argument("--retrieval-only", action="store_true", help="skip the LLM, score retrieval only")
+    parser.add_argument("--window", type=int, default=None, help="neighbor expansion window (CONTEXT_WINDOW)")
+    parser.add_argument("--output", default=os.path.join(current_dir, "report.json"))
+    parser.add_argument("--csv", default=None, help="also write per-question results as CSV")
+    args = parser.parse_args(argv)
+
+    from core.storage import DBManager
+    from core.index_faiss import FaissIndex
+    from core.index_sharded import ShardedFaissIndex
+    from core.embedder import create_embedder
+
+    eval_data = Evaluator(args.eval_file).load_eval_data()
+    if not eval_data:
+        print(f"No evaluation data in {args.eval_file}")
+        return 1
+
+    db = DBManager()
+    shard_size = os.getenv("INDEX_SHARD_SIZE")
+    index = ShardedFaissIndex(max_shard_size=int(shard_size)) if shard_size else FaissIndex()
+    if not index.load(db=db):
+        print("No index loaded. Build the index first.")
+        return 1
+
+    rag = None
+    if not args.retrieval_only:
+        from core.rag import RAGGenerator
+        rag = RAGGenerator()
+
+    runner = EvalRunner(db, index, create_embedder(), rag=rag, k=args.k, workers=args.workers,
+                        retrieval_only=args.retrieval_only, window=args.window)
+    metrics = runner.run(eval_data)
+    print(format_summary(metrics))
+
+    runner.evaluator.export_report(metrics, args.output)
+    if args.csv:
+        runner.evaluator.export_csv(metrics['results'], args.csv)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+import sys
+import os
+import time
+import shutil
+import asyncio
+import tempfile
+import numpy as np
+
+# Ensure core modules can be imported
+sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+from core.storage import DBManager
+from core.index_faiss import FaissIndex
+from core.embedder import HashingEmbedder, ThreadedAsyncEmbedder
+from core.retriever import Retriever
+from core.rag import RAGGenerator
+from core.async_engine import AsyncRAGEngine
+from core import tracing
+
+DOCS = {
+    "员工手册.txt": ["年假 天数 按工龄计算", "病假 需要 医院证明", "试用期 为 三个月"],
+    "薪酬管理.txt": ["加班费 按 工资 比例 计算", "工资 每月 十日 发放", "绩效奖金 季度 发放"],
+    "请假流程.txt": ["请假 申请 提交 主管 审批", "病假 申请 流程", "事假 扣除 工资"],
+}
+
+class SlowAsyncEmbedder(ThreadedAsyncEmbedder):
+    """Each query embedding waits `delay` seconds, like a remote embedding API."""
+    def __init__(self, embedder, delay=0.2, fail=False):
+        super().__init__(embedder)
+        self.delay = delay
+        self.fail = fail
+
+    async def get_embeddings(self, texts):
+        if self.fail:
+            raise RuntimeError("embedding service unavailable")
+        await asyncio.sleep(self.delay)
+        return await super().get_embeddings(texts)
+
+class SlowKeywordDB(DBManager):
+    """Keyword search takes `delay` seconds, like a large FTS table."""
+    delay = 0.0
+
+    def keyword_search(self, query, k=10, doc_filter=None):
+        time.sleep(self.delay)
+        return super().keyword_search(query, k, doc_filter)
+
+class SlowAsyncLLM:
+    """Stands in for AsyncLLMClient: each answer takes 0.2s."""
+    def __init__(self):
+        self.model = "mock"
+
+    async def chat(self, messages, stream=True):
+        await asyncio.sleep(0.1)
+        yield "根据文档1，"
+        await asyncio.sleep(0.1)
+        yield "答案如下。【引用】文档1"
+
+def test_async_engine():
+    print("Testing asyncio retrieval and generation engine...")
+
+    test_dir = tempfile.mkdtemp(prefix="kb_async_")
+    try:
+        db = SlowKeywordDB(db_path=os.path.join(test_dir, "kb.sqlite"))
+        for name, chunks in DOCS.items():
+            doc_id = db.add_document(name, name, "\n".join(chunks))
+            db.add_chunks(doc_id, chunks)
+
+        embedder = HashingEmbedder(dimension=64)
+        chunk_ids = db.get_chunk_ids()
+        texts = db.get_chunks_by_ids(chunk_ids)
+        vectors = np.array(embedder.get_embeddings([texts[cid]['text'] for cid in chunk_ids]))
+        index = FaissIndex(index_path=os.path.join(test_dir, "faiss.index"),
+                           meta_path=os.path.join(test_dir, "meta.json"))
+        index.build_index(vectors, chunk_ids, 64)
+
+        os.environ.setdefault("OPENAI_API_KEY", "sk-test-key")
+        rag = RAGGenerator()
+        rag.check_confidence = lambda chunks: (True, "置信度足够")
+        questions = ["年假 天数", "加班费 计算", "请假 申请 审批", "病假 医院证明"]
+
+        # 1. 结果与同步检索一致
+        engine = AsyncRAGEngine(db, index, ThreadedAsyncEmbedder(embedder), llm=SlowAsyncLLM(), rag=rag)
+        sync_retriever = Retriever(db, index, embedder)
+        for question in questions:
+            expected = [h['chunk_id'] for h in sync_retriever.retrieve(question, k=3)]
+            actual = [h['chunk_id'] for h in asyncio.run(engine.retrieve(question, k=3))]
+            if actual != expected:
+                print(f"FAILURE: Async retrieval differs for '{question}': {actual} != {expected}")
+                sys.exit(1)
+
+        # 2. 查询嵌入和关键词检索并发：延迟约为两者的较大值（0.2s）而不是之和（0.4s）
+        db.delay = 0.2
+        engine = AsyncRAGEngine(db, index, SlowAsyncEmbedder(embedder, 0.2), llm=SlowAsyncLLM(), rag=rag)
+        with tracing.start_trace("question", recorder=tracing.TraceRecorder()) as trace:
+            start = time.perf_counter()
+            asyncio.run(engine.retrieve("年假 天数", k=3))
+            elapsed = time.perf_counter() - start
+        totals = trace.stage_totals()
+        print(f"Overlapped retrieval: {elapsed:.2f}s, stages={totals}")
+        if elapsed >= 0.35:
+            print(f"FAILURE: Embedding and keyword search did not overlap ({elapsed:.2f}s)")
+            sys.exit(1)
+        if totals.get('embed_query', 0) < 180 or totals.get('keyword_search', 0) < 180:
+            print("FAILURE: Concurrent stages were not traced")
+            sys.exit(1)
+
+        # 3. 一个分支失败时立即取消另一个分支
+        engine = AsyncRAGEngine(db, index, SlowAsyncEmbedder(embedder, fail=True), llm=SlowAsyncLLM(), rag=rag)
+        db.delay = 0.5
+        start = time.perf_counter()
+        try:
+            asyncio.run(engine.retrieve("年假 天数", k=3))
+            print("FAILURE: Embedding failure was swallowed")
+            sys.exit(1)
+        except RuntimeError as e:
+            elapsed = time.perf_counter() - start
+            if "unavailable" not in str(e) or elapsed >= 0.3:
+                print(f"FAILURE: Failure did not cancel the keyword branch ({elapsed:.2f}s, {e})")
+                sys.exit(1)
+        db.delay = 0.0
+
+        # 4. 多个问题在同一事件循环中并发回答
+        engine = AsyncRAGEngine(db, index, SlowAsyncEmbedder(embedder, 0.1), llm=SlowAsyncLLM(), rag=rag)
+        tokens = []
+        result = asyncio.run(engine.answer("年假 天数", k=3, on_token=tokens.append))
+        if tokens != ["根据文档1，", "答案如下。【引用】文档1"] or result['answer'] != "".join(tokens) \
+                or not result['citations'] or not result['citations_valid']:
+            print(f"FAILURE: Unexpected answer: {result}")
+            sys.exit(1)
+
+        many = questions * 5
+
+        async def answer_all():
+            try:
+                return await engine.answer_many(many, k=3)
+            finally:
+                await engine.close()
+
+        start = time.perf_counter()
+        results = asyncio.run(answer_all())
+        elapsed = time.perf_counter() - start
+        print(f"{len(many)} concurrent questions: {elapsed:.2f}s")
+        if len(results) != len(many) or not all(r['answer'].endswith("文档1") for r in results):
+            print("FAILURE: Concurrent answers are wrong")
+            sys.exit(1)
+        if elapsed >= 1.5:
+            print(f"FAILURE: Questions did not run concurrently ({elapsed:.2f}s)")
+            sys.exit(1)
+
+        print("SUCCESS: Async engine verified.")
+    finally:
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_async_engine()
@@ -0,0 +1,76 @@
+import sys
+import os
+import json
+import copy
+import numpy as np
+
+# Ensure bench modules can be imported
+sys.path.append(os.getcwd())
+try:
+    from kb_desktop.bench.corpus import SyntheticCorpus
+    from kb_desktop.bench.fake_embedder import FakeEmbedder
+    from kb_desktop.bench.run_bench import run_benchmark, compare, parse_size
+except ImportError:
+    sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+    from bench.corpus import SyntheticCorpus
+    from bench.fake_embedder import FakeEmbedder
+    from bench.run_bench import run_benchmark, compare, parse_size
+
+def test_benchmark():
+    print("Testing benchmark harness...")
+
+    # 1. 语料和假嵌入器是确定性的
+    if [parse_size(s) for s in ("1k", "100k", "1m", "250")] != [1000, 100000, 1000000, 250]:
+        print("FAILURE: Size parsing is wrong")
+        sys.exit(1)
+    if SyntheticCorpus(seed=7).document(3) != SyntheticCorpus(seed=7).document(3):
+        print("FAILURE: Corpus is not deterministic")
+        sys.exit(1)
+    texts = ["差旅报销 发票", "报销发票审批", "网络安全", ""]
+    a, b = FakeEmbedder(seed=1).embed_batch(texts), FakeEmbedder(seed=1).embed_batch(texts)
+    if not np.array_equal(a, b) or np.any(a[3]) or abs(np.linalg.norm(a[0]) - 1) > 1e-5:
+        print("FAILURE: Fake embedder is not deterministic or not normalized")
+        sys.exit(1)
+    if not a[0] @ a[1] > a[0] @ a[2]:
+        print("FAILURE: Fake embeddings do not reflect shared characters")
+        sys.exit(1)
+
+    # 2. 小规模完整流程
+    report = run_benchmark([400], k=5, num_queries=20, workers=0)
+    json.dumps(report)  # 结果必须可以直接写成 JSON
+    result = report['results'][0]
+    print(f"Result: {result['chunks']} chunks, recall@5={result['recall_at_5']}, "
+          f"hybrid p95={result['latency_ms']['hybrid']['p95']:.2f}ms")
+
+    if result['size'] != "400" or result['chunks'] != 400 or result['documents'] != 20:
+        print(f"FAILURE: Unexpected corpus size: {result['chunks']} chunks, {result['documents']} docs")
+        sys.exit(1)
+    if result['recall_at_5'] != 1.0:
+        print(f"FAILURE: Flat index recall should be exact, got {result['recall_at_5']}")
+        sys.exit(1)
+    for mode in ("vector", "keyword", "hybrid"):
+        stats = result['latency_ms'][mode]
+        if not 0 < stats['p50'] <= stats['p95'] <= stats['p99']:
+            print(f"FAILURE: Bad latency percentiles for {mode}: {stats}")
+            sys.exit(1)
+    if result['ingest']['failed'] or result['size_bytes']['index'] <= 0:
+        print("FAILURE: Ingest failed or index size missing")
+        sys.exit(1)
+
+    # 3. 与基线比较
+    if compare(report, report):
+        print("FAILURE: Identical reports should not regress")
+        sys.exit(1)
+    slower = copy.deepcopy(report)
+    slower['results'][0]['latency_ms']['vector']['p95'] *= 2
+    slower['results'][0]['recall_at_5'] = 0.9
+    regressions = compare(slower, report)
+    if len(regressions) != 2:
+        print(f"FAILURE: Expected 2 regressions, got {regressions}")
+        sys.exit(1)
+    print(f"Regressions detected: {regressions}")
+
+    print("SUCCESS: Benchmark harness verified.")
+
+if __name__ == "__main__":
+    test_benchmark()
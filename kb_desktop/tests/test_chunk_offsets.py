@@ -0,0 +1,84 @@
+import sys
+import os
+import shutil
+import tempfile
+
+# Ensure core modules can be imported
+sys.path.append(os.getcwd())
+try:
+    from kb_desktop.core.storage import DBManager
+    from kb_desktop.core.chunker import Chunker
+except ImportError:
+    sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+    from core.storage import DBManager
+    from core.chunker import Chunker
+
+def test_chunk_offsets():
+    print("Testing offset-only chunk storage...")
+
+    test_dir = tempfile.mkdtemp(prefix="kb_offsets_")
+    try:
+        content = "\n".join(f"第{i}条：员工请假需提前提交申请，年假按工龄计算。" * 5 for i in range(200))
+        chunks = Chunker(max_tokens=120, overlap_tokens=30).chunk(content)
+
+        sizes = {}
+        stored = {}
+        for mode in ("inline", "offsets"):
+            db_path = os.path.join(test_dir, f"{mode}.sqlite")
+            db = DBManager(db_path=db_path, chunk_storage=mode)
+            doc_id = db.add_document("制度.txt", "制度.txt", content)
+            db.add_chunks(doc_id, chunks)
+            conn = db.get_connection()
+            conn.execute("VACUUM")
+            conn.close()
+            sizes[mode] = os.path.getsize(db_path)
+            stored[mode] = (db, doc_id)
+        print(f"DB size inline: {sizes['inline']} bytes, offsets: {sizes['offsets']} bytes")
+
+        db, doc_id = stored["offsets"]
+
+        # 1. No chunk text copies are stored in offsets mode
+        conn = db.get_connection()
+        inline_count = conn.execute("SELECT COUNT(*) FROM chunks WHERE text IS NOT NULL").fetchone()[0]
+        conn.close()
+        if inline_count != 0 or sizes["offsets"] >= sizes["inline"]:
+            print("FAILURE: Offsets mode should not store chunk text.")
+            sys.exit(1)
+
+        # 2. All readers materialize the same text
+        expected = [c['text'] for c in chunks]
+        if [text for _, text in db.get_document_chunks(doc_id)] != expected:
+            print("FAILURE: get_document_chunks returned wrong text.")
+            sys.exit(1)
+
+        chunk_ids = db.get_chunk_ids()
+        rows = db.get_chunks_by_ids(chunk_ids)
+        if [rows[cid]['text'] for cid in chunk_ids] != expected:
+            print("FAILURE: get_chunks_by_ids returned wrong text.")
+            sys.exit(1)
+
+        neighbors = db.get_neighbor_chunks([chunk_ids[3]], window=1)
+        if [n['text'] for n in neighbors[chunk_ids[3]]] != expected[2:5]:
+            print("FAILURE: get_neighbor_chunks returned wrong text.")
+            sys.exit(1)
+
+        # 3. Keyword search matches against the materialized text
+        results = db.keyword_search("第150条", k=5)
+        if not results or "第150条" not in results[0][1]:
+            print(f"FAILURE: Keyword search failed in offsets mode: {results}")
+            sys.exit(1)
+
+        # 4. Plain string chunks (no offsets) are still stored inline
+        doc2 = db.add_document("附录.txt", "附录.txt", "附录内容")
+        db.add_chunks(doc2, ["附录内容"])
+        if db.get_document_chunks(doc2) != [(0, "附录内容")]:
+            print("FAILURE: String chunks should be stored inline.")
+            sys.exit(1)
+
+        print("SUCCESS: Chunks stored as offsets are materialized transparently!")
+
+    finally:
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_chunk_offsets()
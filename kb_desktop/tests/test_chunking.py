@@ -33,7 +33,7 @@ def test_day3():
         content = Ingestor.load_file(test_file_name)
         
         # 3. Chunk
-        chunks = Chunker.split_text(content, max_len=100) # Small max_len for testing
+        chunks = Chunker.split_text(content, max_tokens=100) # Small max_tokens for testing
         print(f"Original Length: {len(content)}")
         print(f"Generated Chunks: {len(chunks)}")
         
@@ -0,0 +1,100 @@
+import sys
+import os
+import shutil
+import sqlite3
+import tempfile
+
+# Ensure core modules can be imported
+sys.path.append(os.getcwd())
+try:
+    from kb_desktop.core.storage import DBManager
+    from kb_desktop.core.chunker import Chunker
+except ImportError:
+    sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+    from core.storage import DBManager
+    from core.chunker import Chunker
+
+def test_content_compression():
+    print("Testing compressed content storage...")
+
+    test_dir = tempfile.mkdtemp(prefix="kb_compress_")
+    try:
+        db_path = os.path.join(test_dir, "kb.sqlite")
+        contents = {}
+
+        # 1. Existing uncompressed data (inline and offset chunks)
+        plain_db = DBManager(db_path=db_path, chunk_storage="offsets", compression="none")
+        for i in range(5):
+            content = "\n".join(f"文档{i} 第{j}条：报销单据需在三十日内提交财务部审核。" * 4 for j in range(60))
+            doc_id = plain_db.add_document(f"制度{i}.txt", f"制度{i}.txt", content)
+            plain_db.add_chunks(doc_id, Chunker(max_tokens=150).chunk(content))
+            contents[doc_id] = content
+        inline_doc = plain_db.add_document("附录.txt", "附录.txt", "附录：差旅标准。" * 100)
+        plain_db.add_chunks(inline_doc, ["附录：差旅标准。" * 50, "附录：差旅标准。" * 50])
+        expected_chunks = {doc_id: plain_db.get_document_chunks(doc_id) for doc_id in list(contents) + [inline_doc]}
+
+        # 2. Batched migration reports savings
+        db = DBManager(db_path=db_path, chunk_storage="offsets", compression="zlib")
+        stats = db.recompress(batch_size=2)
+        print(f"Content bytes: {stats['bytes_before']} -> {stats['bytes_after']}, "
+              f"file: {stats['file_before']} -> {stats['file_after']}")
+        if stats['documents'] != 6 or stats['chunks'] != 0 or stats['bytes_after'] >= stats['bytes_before'] / 2:
+            print(f"FAILURE: Unexpected migration stats: {stats}")
+            sys.exit(1)
+        if stats['file_after'] >= stats['file_before']:
+            print("FAILURE: Database file should shrink after compression.")
+            sys.exit(1)
+
+        # Chunk text stays uncompressed so keyword search can match the column directly
+        conn = sqlite3.connect(db_path)
+        conn.execute("UPDATE chunks SET text = ? WHERE doc_id = ? AND chunk_index = 0",
+                     (db.codec.encode("附录：差旅标准。" * 50), inline_doc))  # written by an older version
+        conn.commit()
+        conn.close()
+        doc_id = db.add_document("新增.txt", "新增.txt", "新增：差旅标准。" * 100)
+        db.add_chunks(doc_id, ["新增：差旅标准。" * 50])
+        if db.recompress(vacuum=False)['chunks'] != 1:
+            print("FAILURE: Compressed chunk text from older versions should be restored.")
+            sys.exit(1)
+        conn = sqlite3.connect(db_path)
+        blobs = conn.execute("SELECT COUNT(*) FROM chunks WHERE typeof(text) = 'blob'").fetchone()[0]
+        conn.close()
+        if blobs != 0:
+            print("FAILURE: Chunk text should not be compressed.")
+            sys.exit(1)
+
+        # 3. Readers decode transparently
+        for doc_id, content in contents.items():
+            if db.get_document_content(doc_id) != content:
+                print("FAILURE: Document content changed after compression.")
+                sys.exit(1)
+        for doc_id, chunks in expected_chunks.items():
+            if db.get_document_chunks(doc_id) != chunks:
+                print("FAILURE: Chunk text changed after compression.")
+                sys.exit(1)
+        results = db.keyword_search("差旅标准", k=2)
+        if len(results) != 2 or "差旅标准" not in results[0][1]:
+            print("FAILURE: Keyword search should match compressed chunk text.")
+            sys.exit(1)
+
+        # 4. Duplicate detection still uses the raw content hash
+        if db.add_document("重复.txt", "重复.txt", contents[1]) is not None:
+            print("FAILURE: Duplicate content should be rejected.")
+            sys.exit(1)
+
+        # 5. Migrating back to uncompressed storage restores TEXT rows
+        DBManager(db_path=db_path, compression="none").recompress(vacuum=False)
+        conn = sqlite3.connect(db_path)
+        blobs = conn.execute("SELECT COUNT(*) FROM documents WHERE typeof(content) = 'blob'").fetchone()[0]
+        conn.close()
+        if blobs != 0 or plain_db.get_document_content(2) != contents[2]:
+            print("FAILURE: Decompression migration failed.")
+            sys.exit(1)
+
+        print("SUCCESS: Content is compressed and decoded transparently!")
+
+    finally:
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_content_compression()
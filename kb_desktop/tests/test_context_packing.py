@@ -0,0 +1,71 @@
+import sys
+import os
+
+sys.path.append(os.getcwd())
+try:
+    from kb_desktop.core.context_packer import ContextPacker
+except ImportError:
+    sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+    from core.context_packer import ContextPacker
+
+def test_context_packing():
+    print("Testing token-budgeted context packing...")
+
+    # Three consecutive chunks of one document with 10-char overlaps, as the chunker produces
+    sentence = "年假需要提前两周向部门经理提交申请。"
+    part1 = sentence * 3
+    part2 = part1[-10:] + "病假需要提供医院证明，并在返岗后补交材料。"
+    part3 = part2[-10:] + "加班费按照国家规定的标准计算发放。"
+
+    chunks = [
+        {'text': part2, 'filename': '员工手册.docx', 'chunk_id': 2, 'doc_id': 1, 'chunk_index': 1, 'similarity': 0.9},
+        {'text': part1, 'filename': '员工手册.docx', 'chunk_id': 1, 'doc_id': 1, 'chunk_index': 0, 'similarity': 0.8},
+        {'text': part3, 'filename': '员工手册.docx', 'chunk_id': 3, 'doc_id': 1, 'chunk_index': 2, 'similarity': 0.7},
+        {'text': part1, 'filename': '员工手册-副本.docx', 'chunk_id': 9, 'doc_id': 2, 'chunk_index': 0, 'similarity': 0.6},
+        {'text': "机房温度应保持在二十度左右。" * 20, 'filename': '运维.txt', 'chunk_id': 20, 'doc_id': 3, 'chunk_index': 0, 'similarity': 0.5},
+    ]
+
+    # 1. Large budget: adjacent chunks merge without duplicated overlap, exact duplicate dropped
+    blocks = ContextPacker(token_budget=1000).pack(chunks)
+    for block in blocks:
+        print(f"Block {block['chunk_ids']} from {block['filename']}: {block['tokens']} tokens")
+
+    merged = blocks[0]
+    if merged['chunk_ids'] != [1, 2, 3]:
+        print("FAILURE: Adjacent chunks were not merged.")
+        sys.exit(1)
+    if merged['text'] != part1 + part2[10:] + part3[10:]:
+        print("FAILURE: Overlap was not removed when merging.")
+        sys.exit(1)
+    if any(b['filename'] == '员工手册-副本.docx' for b in blocks):
+        print("FAILURE: Duplicate chunk text was not removed.")
+        sys.exit(1)
+
+    # 2. Small budget: only the best chunks that fit are kept
+    small = ContextPacker(token_budget=60).pack(chunks)
+    total = sum(b['tokens'] for b in small)
+    print(f"Small budget packed {len(small)} blocks, {total} tokens")
+    if total > 60 or small[0]['chunk_id'] != 2:
+        print("FAILURE: Budget not respected or best chunk dropped.")
+        sys.exit(1)
+    if ContextPacker(token_budget=0).pack(chunks):
+        print("FAILURE: A zero budget should pack nothing.")
+        sys.exit(1)
+
+    # 2b. The best chunk alone exceeds the budget: it is truncated to fit instead of dropped
+    tiny = ContextPacker(token_budget=30).pack(chunks)
+    print(f"Tiny budget packed {[(b['chunk_id'], b['tokens']) for b in tiny]}")
+    if not tiny or tiny[0]['chunk_id'] != 2 or not part2.startswith(tiny[0]['text']) \
+            or sum(b['tokens'] for b in tiny) > 30:
+        print("FAILURE: Oversized best chunk was not truncated to the budget.")
+        sys.exit(1)
+
+    # 3. Packing is idempotent
+    if ContextPacker(token_budget=1000).pack(blocks) != blocks:
+        print("FAILURE: Re-packing packed blocks changed them.")
+        sys.exit(1)
+
+    print("SUCCESS: Context packing respects the budget, dedupes and merges!")
+
+if __name__ == "__main__":
+    test_context_packing()
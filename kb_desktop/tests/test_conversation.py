@@ -0,0 +1,148 @@
+import sys
+import os
+import shutil
+import tempfile
+import numpy as np
+
+# Ensure core modules can be imported
+sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+from core.storage import DBManager
+from core.index_faiss import FaissIndex
+from core.embedder import HashingEmbedder
+from core.retriever import Retriever
+from core.rag import RAGGenerator
+from core.conversation import Conversation
+
+DOCS = {
+    "员工手册.txt": ["年假 天数 按工龄计算", "年假 申请 需要 提前 三天", "病假 需要 医院证明"],
+    "薪酬管理.txt": ["加班费 按 工资 比例 计算", "工资 每月 十日 发放", "绩效奖金 季度 发放"],
+}
+
+class RecordingLLM:
+    """Stands in for LLMClient and records every request."""
+    def __init__(self):
+        self.model = "mock"
+        self.requests = []
+
+    def chat(self, messages, stream=True):
+        self.requests.append(messages)
+        if "改写" in messages[0]['content']:
+            yield "病假 需要 什么 证明"
+        else:
+            yield "根据文档1，" + "答案说明" * 20 + "\n【引用】文档1"
+
+class CountingRetriever(Retriever):
+    calls = 0
+
+    def retrieve(self, *args, **kwargs):
+        self.calls += 1
+        return super().retrieve(*args, **kwargs)
+
+def test_conversation():
+    print("Testing multi-turn conversation...")
+
+    test_dir = tempfile.mkdtemp(prefix="kb_conversation_")
+    try:
+        db = DBManager(db_path=os.path.join(test_dir, "kb.sqlite"))
+        for name, chunks in DOCS.items():
+            doc_id = db.add_document(name, name, "\n".join(chunks))
+            db.add_chunks(doc_id, chunks)
+
+        embedder = HashingEmbedder(dimension=64)
+        chunk_ids = db.get_chunk_ids()
+        texts = db.get_chunks_by_ids(chunk_ids)
+        vectors = np.array(embedder.get_embeddings([texts[cid]['text'] for cid in chunk_ids]))
+        index = FaissIndex(index_path=os.path.join(test_dir, "faiss.index"),
+                           meta_path=os.path.join(test_dir, "meta.json"))
+        index.build_index(vectors, chunk_ids, 64)
+
+        os.environ.setdefault("OPENAI_API_KEY", "sk-test-key")
+        rag = RAGGenerator()
+        rag.llm = RecordingLLM()
+        rag.check_confidence = lambda chunks: (True, "置信度足够")
+        retriever = CountingRetriever(db, index, embedder)
+
+        # 1. 第一轮：正常检索，消息中没有历史
+        conversation = Conversation(retriever, rag, history_budget=1000, reuse_similarity=0.5, window=0)
+        first = conversation.ask("年假 天数", k=3)
+        if retriever.calls != 1 or first['reused'] or first['standalone_query'] != "年假 天数":
+            print("FAILURE: First turn should retrieve")
+            sys.exit(1)
+        if len(rag.llm.requests[-1]) != 2:
+            print("FAILURE: First turn should not carry history")
+            sys.exit(1)
+
+        # 2. 追问：改写为独立问题，同一话题复用检索结果，消息中带上一轮（不含引用行）
+        follow = conversation.ask("那 申请 需要 提前 吗", k=3)
+        print(f"Follow-up: standalone='{follow['standalone_query']}', reused={follow['reused']}")
+        if follow['standalone_query'] != "年假 天数 那 申请 需要 提前 吗" or not follow['reused'] \
+                or retriever.calls != 1:
+            print("FAILURE: Follow-up was not condensed or did not reuse retrieval")
+            sys.exit(1)
+        messages = rag.llm.requests[-1]
+        if [m['role'] for m in messages] != ["system", "user", "assistant", "user"] \
+                or messages[1]['content'] != "年假 天数" or "【引用】" in messages[2]['content']:
+            print(f"FAILURE: Wrong history messages: {[m['role'] for m in messages]}")
+            sys.exit(1)
+        if follow['chunks'] != first['chunks'] or not follow['citations']:
+            print("FAILURE: Reused turn should answer from the cached chunks")
+            sys.exit(1)
+
+        # 3. 换话题：不是追问，重新检索
+        other = conversation.ask("加班费 计算", k=3)
+        if other['reused'] or retriever.calls != 2 or other['chunks'][0]['filename'] != "薪酬管理.txt":
+            print("FAILURE: New topic should trigger retrieval")
+            sys.exit(1)
+        if conversation.condense("那 发放 时间 呢") != "加班费 计算 那 发放 时间 呢":
+            print("FAILURE: Follow-up should be condensed against the new topic")
+            sys.exit(1)
+
+        # 独立问题即使与上一轮相似也不复用检索结果
+        for question in ("如果 加班费 计算 有 疑问 应该 找 哪个 部门", "这 家 公司 的 加班费 怎么 计算",
+                         "那么 加班费 是 按 小时 还是 按 天 计算"):
+            if conversation.is_follow_up(question):
+                print(f"FAILURE: Standalone question classified as follow-up: {question}")
+                sys.exit(1)
+        conversation.reuse_similarity = 0.0  # 任何相似度都满足阈值
+        standalone = conversation.ask("如果 加班费 计算 有 疑问 应该 找 哪个 部门", k=3)
+        if standalone['reused'] or retriever.calls != 3 \
+                or standalone['standalone_query'] != "如果 加班费 计算 有 疑问 应该 找 哪个 部门":
+            print("FAILURE: Standalone question should not reuse the previous retrieval")
+            sys.exit(1)
+
+        # 4. 历史按 token 预算截断：最早的轮次先被丢弃
+        small = Conversation(retriever, rag, history_budget=60, reuse_similarity=0.5, window=0)
+        for question in ("年假 天数", "那 申请 需要 提前 吗", "它 按 工龄 计算 吗"):
+            small.ask(question, k=3)
+        print(f"Bounded history: {len(small.turns)} turns, {small.history_tokens()} tokens")
+        if small.history_tokens() > 60 or not small.turns or small.turns[-1]['question'] != "它 按 工龄 计算 吗":
+            print("FAILURE: History exceeded the token budget")
+            sys.exit(1)
+        if len(rag.llm.requests[-1]) > 2 + 2 * 2:
+            print("FAILURE: Prompt history is not bounded")
+            sys.exit(1)
+
+        # 5. LLM 改写追问
+        llm_conversation = Conversation(retriever, rag, condense="llm", reuse_similarity=0.99, window=0)
+        llm_conversation.ask("年假 天数", k=3)
+        result = llm_conversation.ask("那 病假 呢", k=3)
+        if result['standalone_query'] != "病假 需要 什么 证明" or result['reused']:
+            print(f"FAILURE: LLM condensation not used: {result['standalone_query']}")
+            sys.exit(1)
+        if result['chunks'][0]['text'] != "病假 需要 医院证明":
+            print("FAILURE: Condensed query did not drive retrieval")
+            sys.exit(1)
+
+        # 6. 新对话清空历史
+        conversation.reset()
+        conversation.ask("病假 证明", k=3)
+        if len(rag.llm.requests[-1]) != 2 or len(conversation.turns) != 1:
+            print("FAILURE: Reset did not clear history")
+            sys.exit(1)
+
+        print("SUCCESS: Conversation verified.")
+    finally:
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_conversation()
@@ -0,0 +1,177 @@
+import sys
+import os
+import time
+import shutil
+import tempfile
+import numpy as np
+
+# Ensure core modules can be imported
+sys.path.append(os.getcwd())
+try:
+    from kb_desktop.core.storage import DBManager
+    from kb_desktop.core.importer import Importer
+    from kb_desktop.core.chunker import Chunker
+    from kb_desktop.core.tokenizer import TokenCounter
+    from kb_desktop.core.index_faiss import FaissIndex
+    from kb_desktop.core.vector_store import VectorStore
+    from kb_desktop.core.indexer import Indexer
+except ImportError:
+    sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+    from core.storage import DBManager
+    from core.importer import Importer
+    from core.chunker import Chunker
+    from core.tokenizer import TokenCounter
+    from core.index_faiss import FaissIndex
+    from core.vector_store import VectorStore
+    from core.indexer import Indexer
+
+# Mock Embedder that counts embedded texts
+class CountingEmbedder:
+    model = "mock-embedding"
+
+    def __init__(self):
+        self.embedded = 0
+
+    def get_embeddings(self, texts):
+        self.embedded += len(texts)
+        return [np.random.rand(16).tolist() for _ in texts]
+
+TOPICS = ["考勤", "报销", "年假", "加班", "出差", "培训", "采购", "保密", "绩效", "招聘", "离职", "福利"]
+
+def write_doc(path, sections):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n\n".join(sections))
+
+def test_document_sync():
+    print("Testing change-aware document sync...")
+
+    test_dir = tempfile.mkdtemp(prefix="kb_sync_")
+    try:
+        db = DBManager(db_path=os.path.join(test_dir, "kb.sqlite"))
+        chunker = Chunker(max_tokens=40, overlap_tokens=0, paragraph_overlap=False,
+                          counter=TokenCounter(encoding_name=""))
+        importer = Importer(db, chunker)
+
+        docs_dir = os.path.join(test_dir, "docs")
+        os.makedirs(docs_dir)
+        paths = []
+        for d in range(3):
+            path = os.path.join(docs_dir, f"制度_{d}.txt")
+            write_doc(path, [f"第{d}册{topic}管理规定：相关事项由{topic}小组负责解释，违者按{topic}条例处理。"
+                             for topic in TOPICS])
+            paths.append(path)
+        importer.import_files(paths)
+
+        index = FaissIndex(index_path=os.path.join(test_dir, "faiss.index"),
+                           meta_path=os.path.join(test_dir, "meta.json"))
+        embedder = CountingEmbedder()
+        indexer = Indexer(db, index, embedder, VectorStore(os.path.join(test_dir, "vectors")))
+        total = indexer.rebuild()['total']
+
+        doc_id = db.find_document_by_path(os.path.normcase(os.path.abspath(paths[0])))
+        before = {r['text']: r['id'] for r in db.get_chunk_records(doc_id)}
+
+        # 1. Nothing changed: sync reads no files
+        result = importer.sync()
+        if result['unchanged'] != 3 or result['added'] or result['removed']:
+            print(f"FAILURE: Unchanged files should not be re-chunked: {result}")
+            sys.exit(1)
+
+        # 2. Edit one paragraph in the middle of a document
+        time.sleep(0.01)
+        sections = [f"第0册{topic}管理规定：相关事项由{topic}小组负责解释，违者按{topic}条例处理。" for topic in TOPICS]
+        sections[5] = "第0册出差管理规定：出差须提前三天提交申请，住宿标准按城市等级执行。"
+        write_doc(paths[0], sections)
+
+        result = importer.sync()
+        print(f"Sync: updated={result['updated']}, added={len(result['added'])}, removed={len(result['removed'])}")
+        if result['updated'] != 1 or result['unchanged'] != 2:
+            print(f"FAILURE: Only the edited file should be updated: {result}")
+            sys.exit(1)
+        if not result['added'] or len(result['added']) > 2 or len(result['removed']) > 2:
+            print("FAILURE: Only the chunks around the edit should change.")
+            sys.exit(1)
+
+        # 3. Unchanged chunks keep their ids; the document is not duplicated
+        after = db.get_chunk_records(doc_id)
+        kept = [r for r in after if r['text'] in before]
+        if len(db.get_all_documents()) != 3 or any(before[r['text']] != r['id'] for r in kept):
+            print("FAILURE: Unchanged chunks should keep their ids.")
+            sys.exit(1)
+        if [r['chunk_index'] for r in after] != list(range(len(after))):
+            print("FAILURE: Chunk indices should be renumbered in order.")
+            sys.exit(1)
+        if db.get_document_content(doc_id) != "\n\n".join(sections):
+            print("FAILURE: Document content should be replaced.")
+            sys.exit(1)
+
+        # 4. Only the changed chunks are embedded; the index matches the database
+        embedder.embedded = 0
+        changes = indexer.apply_changes(result['added'], result['removed'])
+        print(f"Index changes: {changes}")
+        if embedder.embedded != len(result['added']):
+            print(f"FAILURE: Expected {len(result['added'])} embeddings, got {embedder.embedded}")
+            sys.exit(1)
+        if not index.verify_against_db(db)['consistent'] or index.index.ntotal != total - changes['removed'] + changes['added']:
+            print("FAILURE: Index should match the database after applying changes.")
+            sys.exit(1)
+
+        # 5. Deleted source files are reported, not removed
+        os.remove(paths[2])
+        result = importer.sync()
+        if result['missing'] != 1 or len(db.get_all_documents()) != 3:
+            print(f"FAILURE: Missing source file should be reported: {result}")
+            sys.exit(1)
+
+        # 6. Editing a byte-identical copy imports it as a new document; the original stays intact
+        original_id = db.find_document_by_path(os.path.normcase(os.path.abspath(paths[1])))
+        original_content = db.get_document_content(original_id)
+        for edit_via_sync in (False, True):
+            copy_path = os.path.join(docs_dir, f"副本_{int(edit_via_sync)}.txt")
+            shutil.copyfile(paths[1], copy_path)
+            if importer.import_file(copy_path)['status'] != "duplicate":
+                print("FAILURE: Byte-identical copy should be reported as a duplicate")
+                sys.exit(1)
+            time.sleep(0.01)
+            write_doc(copy_path, [f"副本{int(edit_via_sync)}修改后的{topic}规定。" for topic in TOPICS])
+            if edit_via_sync:
+                result = importer.sync()
+                status = "imported" if result['imported'] == 1 and result['updated'] == 0 else str(result)
+                copy_id = db.find_document_by_path(os.path.normcase(os.path.abspath(copy_path)))
+            else:
+                outcome = importer.import_file(copy_path)
+                status, copy_id = outcome['status'], outcome['doc_id']
+            print(f"Edited copy ({'sync' if edit_via_sync else 'import'}): {status}, doc {copy_id}")
+            if status != "imported" or copy_id in (None, original_id):
+                print("FAILURE: Edited copy should be imported as a new document")
+                sys.exit(1)
+            if db.get_document_content(original_id) != original_content \
+                    or db.find_document_by_path(os.path.normcase(os.path.abspath(paths[1]))) != original_id:
+                print("FAILURE: Editing a copy overwrote the original document")
+                sys.exit(1)
+        result = importer.sync()
+        if result['updated'] or result['imported'] or result['unchanged'] != 4:
+            print(f"FAILURE: Both originals and edited copies should now be unchanged: {result}")
+            sys.exit(1)
+
+        # 7. Editing a document into a byte-identical copy of another is reported as a duplicate
+        doc_count = len(db.get_all_documents())
+        chunk_ids = [r['id'] for r in db.get_chunk_records(doc_id)]
+        time.sleep(0.01)
+        shutil.copyfile(paths[1], paths[0])
+        result = importer.sync()
+        print(f"Sync into duplicate: duplicate={result['duplicate']}, updated={result['updated']}")
+        if result['duplicate'] != 1 or result['updated'] or sorted(result['removed']) != sorted(chunk_ids):
+            print(f"FAILURE: Edited document matching another should be a duplicate: {result}")
+            sys.exit(1)
+        if len(db.get_all_documents()) != doc_count - 1 \
+                or db.get_fingerprint(os.path.normcase(os.path.abspath(paths[0])))['doc_id'] != original_id:
+            print("FAILURE: Duplicate document should be removed and its path point to the original")
+            sys.exit(1)
+    finally:
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+    print("SUCCESS: Sync re-embeds only edited chunks!")
+
+if __name__ == "__main__":
+    test_document_sync()
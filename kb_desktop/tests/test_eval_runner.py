@@ -0,0 +1,114 @@
+import sys
+import os
+import time
+import shutil
+import tempfile
+import numpy as np
+
+# Ensure core and eval modules can be imported
+sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+from core.storage import DBManager
+from core.index_faiss import FaissIndex
+from core.index_sharded import ShardedFaissIndex
+from core.embedder import HashingEmbedder
+from core.retriever import Retriever
+from core.rag import RAGGenerator
+from eval.runner import EvalRunner
+
+DOCS = {
+    "员工手册.txt": ["年假 天数 按工龄计算", "病假 需要 医院证明", "试用期 为 三个月"],
+    "薪酬管理.txt": ["加班费 按 工资 比例 计算", "工资 每月 十日 发放", "绩效奖金 季度 发放"],
+    "请假流程.txt": ["请假 申请 提交 主管 审批", "病假 申请 流程", "事假 扣除 工资"],
+}
+
+EVAL_DATA = [
+    {"question": "年假 天数", "expected_docs": ["员工手册"]},
+    {"question": "加班费 计算", "expected_docs": ["薪酬管理"]},
+    {"question": "请假 申请 审批", "expected_docs": ["请假流程"]},
+    {"question": "工资 发放", "expected_docs": ["不存在的文档"]},
+]
+
+class SlowLLM:
+    """Stands in for LLMClient: each answer takes 0.2s."""
+    def __init__(self):
+        self.model = "mock"
+
+    def chat(self, messages, stream=True):
+        time.sleep(0.2)
+        yield "根据文档1，答案如下。【引用】文档1"
+
+def test_eval_runner():
+    print("Testing batched evaluation runner...")
+
+    test_dir = tempfile.mkdtemp(prefix="kb_eval_")
+    try:
+        db = DBManager(db_path=os.path.join(test_dir, "kb.sqlite"))
+        for name, chunks in DOCS.items():
+            doc_id = db.add_document(name, name, "\n".join(chunks))
+            db.add_chunks(doc_id, chunks)
+
+        embedder = HashingEmbedder(dimension=64)
+        chunk_ids = db.get_chunk_ids()
+        texts = db.get_chunks_by_ids(chunk_ids)
+        vectors = np.array(embedder.get_embeddings([texts[cid]['text'] for cid in chunk_ids]))
+        index = FaissIndex(index_path=os.path.join(test_dir, "faiss.index"),
+                           meta_path=os.path.join(test_dir, "meta.json"))
+        index.build_index(vectors, chunk_ids, 64)
+
+        # 1. 批量搜索与逐个搜索结果一致（平坦索引和分片索引）
+        sharded = ShardedFaissIndex(shard_dir=os.path.join(test_dir, "shards"), max_shard_size=4)
+        sharded.build_index(vectors, chunk_ids, 64)
+        queries = vectors[:5]
+        for idx in (index, sharded):
+            batch = idx.search_batch(queries, k=3)
+            single = [idx.search(q, k=3) for q in queries]
+            if [b[1] for b in batch] != [s[1] for s in single]:
+                print(f"FAILURE: search_batch differs from search for {type(idx).__name__}")
+                sys.exit(1)
+
+        retriever = Retriever(db, index, embedder)
+        questions = [item['question'] for item in EVAL_DATA]
+        batched = retriever.retrieve_batch(questions, k=3)
+        single = [retriever.retrieve(q, k=3) for q in questions]
+        if [[h['chunk_id'] for h in r] for r in batched] != [[h['chunk_id'] for h in r] for r in single]:
+            print("FAILURE: retrieve_batch differs from retrieve")
+            sys.exit(1)
+
+        # 2. 仅检索模式：不需要 LLM
+        metrics = EvalRunner(db, index, embedder, k=3, retrieval_only=True).run(EVAL_DATA)
+        print(f"Retrieval only: Hit@3={metrics['hit_at_k']:.2f}, MRR={metrics['mrr']:.2f}, "
+              f"p95={metrics['latency_p95'] * 1000:.2f}ms")
+        if metrics['hit_at_k'] != 0.75 or not 0 < metrics['mrr'] <= 0.75:
+            print(f"FAILURE: Unexpected retrieval metrics: {metrics['hit_at_k']}, {metrics['mrr']}")
+            sys.exit(1)
+        if metrics['citation_rate'] is not None or any(r['generation_latency'] for r in metrics['results']):
+            print("FAILURE: Retrieval-only run should not generate answers")
+            sys.exit(1)
+        if not all(r['retrieval_latency'] > 0 for r in metrics['results']):
+            print("FAILURE: Missing per-question retrieval latency")
+            sys.exit(1)
+
+        # 3. 完整模式：生成并发执行
+        os.environ.setdefault("OPENAI_API_KEY", "sk-test-key")
+        rag = RAGGenerator()
+        rag.llm = SlowLLM()
+        rag.check_confidence = lambda chunks: (True, "置信度足够")
+
+        metrics = EvalRunner(db, index, embedder, rag=rag, k=3, workers=4).run(EVAL_DATA)
+        print(f"Full run: {metrics['wall_time']:.2f}s, citation rate={metrics['citation_rate']}")
+        if metrics['citation_rate'] != 1.0 or any(r.get('error') for r in metrics['results']):
+            print(f"FAILURE: Generation failed: {[r.get('error') for r in metrics['results']]}")
+            sys.exit(1)
+        if metrics['wall_time'] >= 0.6:
+            print(f"FAILURE: Generation did not run concurrently ({metrics['wall_time']:.2f}s)")
+            sys.exit(1)
+        if not all(r['generation_latency'] >= 0.2 for r in metrics['results']):
+            print("FAILURE: Generation latency not recorded")
+            sys.exit(1)
+
+        print("SUCCESS: Evaluation runner verified.")
+    finally:
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_eval_runner()
@@ -0,0 +1,75 @@
+import sys
+import os
+import shutil
+import tempfile
+import numpy as np
+
+# Ensure core modules can be imported
+sys.path.append(os.getcwd())
+try:
+    from kb_desktop.core.storage import DBManager
+    from kb_desktop.core.index_faiss import FaissIndex
+    from kb_desktop.core.retriever import Retriever
+except ImportError:
+    sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+    from core.storage import DBManager
+    from core.index_faiss import FaissIndex
+    from core.retriever import Retriever
+
+# Mock Embedder for testing (to avoid requiring API key)
+class MockEmbedder:
+    def get_embedding(self, text):
+        return np.random.rand(16).tolist()
+
+def test_filtered_search():
+    print("Testing metadata-filtered retrieval...")
+
+    test_dir = tempfile.mkdtemp(prefix="kb_filter_")
+    try:
+        db = DBManager(db_path=os.path.join(test_dir, "kb.sqlite"))
+        doc_ids = {}
+        for name in ["员工手册.docx", "薪酬制度.txt", "请假流程.md"]:
+            doc_id = db.add_document(name, name, f"{name} 内容")
+            db.add_chunks(doc_id, [f"{name} 年假 片段 {i}" for i in range(10)])
+            doc_ids[name] = doc_id
+
+        chunk_ids = db.get_chunk_ids()
+        index = FaissIndex(index_path=os.path.join(test_dir, "faiss.index"),
+                           meta_path=os.path.join(test_dir, "meta.json"))
+        index.build_index(np.random.rand(len(chunk_ids), 16), chunk_ids, 16)
+
+        retriever = Retriever(db, index, MockEmbedder())
+
+        # 1. Filter by document id keeps full top-k depth
+        doc_filter = {'doc_ids': [doc_ids["薪酬制度.txt"]]}
+        results = retriever.retrieve("年假", k=5, doc_filter=doc_filter)
+        print(f"Filtered by doc id: {[r['filename'] for r in results]}")
+        if len(results) != 5 or any(r['filename'] != "薪酬制度.txt" for r in results):
+            print("FAILURE: Document filter returned wrong chunks.")
+            sys.exit(1)
+
+        # 2. Filter by filename pattern
+        results = retriever.retrieve("年假", k=8, doc_filter={'filename_pattern': '%手册%'})
+        if len(results) != 8 or any(r['filename'] != "员工手册.docx" for r in results):
+            print("FAILURE: Filename filter returned wrong chunks.")
+            sys.exit(1)
+
+        # 3. Keyword search honours the same filter
+        keyword_results = db.keyword_search("年假", k=20, doc_filter={'filename_pattern': '%流程%'})
+        if not keyword_results or any(r[2] != "请假流程.md" for r in keyword_results):
+            print("FAILURE: Keyword filter returned wrong chunks.")
+            sys.exit(1)
+
+        # 4. Time range that excludes everything
+        results = retriever.retrieve("年假", k=5, doc_filter={'end_time': '2000-01-01'})
+        if results:
+            print("FAILURE: Empty time range should return no chunks.")
+            sys.exit(1)
+
+        print("SUCCESS: Filtered retrieval works for ids, filename patterns and time ranges!")
+
+    finally:
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_filtered_search()
@@ -0,0 +1,128 @@
+import sys
+import os
+import time
+import shutil
+import tempfile
+import numpy as np
+
+# Ensure core modules can be imported
+sys.path.append(os.getcwd())
+try:
+    from kb_desktop.core.storage import DBManager
+    from kb_desktop.core.importer import Importer
+    from kb_desktop.core.index_faiss import FaissIndex
+    from kb_desktop.core.vector_store import VectorStore
+    from kb_desktop.core.indexer import Indexer
+    from kb_desktop.core.watcher import FolderWatcher, PollingSource
+except ImportError:
+    sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+    from core.storage import DBManager
+    from core.importer import Importer
+    from core.index_faiss import FaissIndex
+    from core.vector_store import VectorStore
+    from core.indexer import Indexer
+    from core.watcher import FolderWatcher, PollingSource
+
+# Mock Embedder that counts embedded texts
+class CountingEmbedder:
+    model = "mock-embedding"
+
+    def __init__(self):
+        self.embedded = 0
+        self.fail = False
+
+    def get_embeddings(self, texts):
+        if self.fail:
+            raise RuntimeError("embedding service unavailable")
+        self.embedded += len(texts)
+        return [np.random.rand(16).tolist() for _ in texts]
+
+def write(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+def test_folder_watcher():
+    print("Testing watch-folder ingestion...")
+
+    test_dir = tempfile.mkdtemp(prefix="kb_watch_")
+    try:
+        inbox = os.path.join(test_dir, "inbox")
+        os.makedirs(os.path.join(inbox, "sub"))
+        write(os.path.join(inbox, "考勤.txt"), "考勤制度：每天九点前打卡。")
+        write(os.path.join(inbox, "sub", "报销.md"), "报销流程：发票三十天内提交。")
+        write(os.path.join(inbox, "~$临时.docx"), "")
+
+        db = DBManager(db_path=os.path.join(test_dir, "kb.sqlite"))
+        index = FaissIndex(index_path=os.path.join(test_dir, "faiss.index"),
+                           meta_path=os.path.join(test_dir, "meta.json"))
+        embedder = CountingEmbedder()
+        indexer = Indexer(db, index, embedder, VectorStore(os.path.join(test_dir, "vectors")))
+
+        # 1. Debounced events stay queued
+        slow = FolderWatcher(inbox, Importer(db), indexer, source=PollingSource(inbox, interval=0), debounce=60)
+        if slow.run_once() is not None or slow.metrics()['queue_depth'] != 2:
+            print(f"FAILURE: Events inside the debounce window should stay queued: {slow.metrics()}")
+            sys.exit(1)
+
+        # 2. Existing files are imported and indexed in one micro-batch
+        watcher = FolderWatcher(inbox, Importer(db), indexer, source=PollingSource(inbox, interval=0),
+                                debounce=0, batch_size=10)
+        batch = watcher.run_once()
+        print(f"Initial batch: {batch}")
+        if batch['imported'] != 2 or index.index.ntotal != 2:
+            print("FAILURE: Existing files should be imported and indexed.")
+            sys.exit(1)
+
+        # 3. Changed and new files only embed their new chunks
+        time.sleep(0.01)
+        embedder.embedded = 0
+        write(os.path.join(inbox, "考勤.txt"), "考勤制度：每天九点前打卡。\n迟到三次计旷工半天。")
+        write(os.path.join(inbox, "年假.txt"), "年假规定：满一年五天。")
+        batch = watcher.run_once()
+        print(f"Change batch: {batch}")
+        if batch['updated'] != 1 or batch['imported'] != 1 or embedder.embedded != batch['added']:
+            print("FAILURE: Changed files should be updated incrementally.")
+            sys.exit(1)
+        if not index.verify_against_db(db)['consistent']:
+            print("FAILURE: Index should stay consistent with the database.")
+            sys.exit(1)
+
+        # 4. Metrics report queue depth and lag
+        metrics = watcher.metrics()
+        print(f"Metrics: {metrics}")
+        if metrics['queue_depth'] != 0 or metrics['batches'] != 2 or metrics['files'] != 4 or metrics['last_lag'] <= 0:
+            print("FAILURE: Metrics not recorded.")
+            sys.exit(1)
+
+        # 5. Chunks whose indexing failed are retried on the next run
+        embedder.fail = True
+        write(os.path.join(inbox, "加班.txt"), "加班须提前填写申请单。")
+        batch = watcher.run_once()
+        embedder.fail = False
+        print(f"Failed batch: {batch}, unindexed={watcher.metrics()['unindexed']}")
+        if batch['imported'] != 1 or not batch['index_error'] or watcher.metrics()['unindexed'] != 1:
+            print("FAILURE: Failed index changes should be kept for retry.")
+            sys.exit(1)
+        batch = watcher.run_once()
+        if batch is None or batch['added'] != 1 or watcher.metrics()['unindexed'] != 0 \
+                or not index.verify_against_db(db)['consistent']:
+            print(f"FAILURE: Failed index changes were not retried: {batch}")
+            sys.exit(1)
+
+        # 6. Background thread picks up new files
+        watcher.start()
+        write(os.path.join(inbox, "sub", "出差.txt"), "出差须提前三天申请。")
+        deadline = time.time() + 10
+        while watcher.metrics()['imported'] < 5 and time.time() < deadline:
+            time.sleep(0.05)
+        watcher.stop()
+        if watcher.metrics()['imported'] != 5 or watcher.metrics()['running']:
+            print("FAILURE: Background watcher should import new files.")
+            sys.exit(1)
+    finally:
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+    print("SUCCESS: Watched folder stays indexed!")
+
+if __name__ == "__main__":
+    test_folder_watcher()
@@ -0,0 +1,80 @@
+import sys
+import os
+import time
+import shutil
+import tempfile
+
+# Ensure core modules can be imported
+sys.path.append(os.getcwd())
+try:
+    from kb_desktop.core.storage import DBManager
+    from kb_desktop.core.importer import Importer
+except ImportError:
+    sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+    from core.storage import DBManager
+    from core.importer import Importer
+
+def test_import_fingerprint():
+    print("Testing fingerprint-based duplicate detection...")
+
+    test_dir = tempfile.mkdtemp(prefix="kb_fingerprint_")
+    try:
+        db = DBManager(db_path=os.path.join(test_dir, "kb.sqlite"))
+        importer = Importer(db)
+
+        docs_dir = os.path.join(test_dir, "docs")
+        os.makedirs(docs_dir)
+        paths = []
+        for i in range(20):
+            path = os.path.join(docs_dir, f"制度_{i}.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(f"第{i}号制度：员工考勤管理办法。" * 20)
+            paths.append(path)
+
+        # 1. First import parses everything
+        result = importer.import_files(paths)
+        print(f"First import: {result['imported']} imported, {result['parsed']} parsed")
+        if result['imported'] != 20 or result['parsed'] != 20:
+            print("FAILURE: First import should parse all files.")
+            sys.exit(1)
+
+        # 2. Re-scan of unchanged files parses nothing
+        result = importer.import_files(paths)
+        if result['duplicate'] != 20 or result['parsed'] != 0:
+            print(f"FAILURE: Unchanged files should be skipped before parsing: {result}")
+            sys.exit(1)
+
+        # 3. A copy at another path is recognised by its file hash
+        copy_path = os.path.join(test_dir, "副本.txt")
+        shutil.copy(paths[0], copy_path)
+        outcome = importer.import_file(copy_path)
+        if outcome['status'] != "duplicate" or outcome['parsed']:
+            print(f"FAILURE: Copied file should be a duplicate without parsing: {outcome}")
+            sys.exit(1)
+
+        # 4. A modified file is parsed again and updates its document
+        time.sleep(0.01)
+        with open(paths[1], "a", encoding="utf-8") as f:
+            f.write("补充条款。")
+        outcome = importer.import_file(paths[1])
+        if outcome['status'] != "updated" or not outcome['parsed']:
+            print(f"FAILURE: Modified file should be parsed and update its document: {outcome}")
+            sys.exit(1)
+
+        # 5. Deleting a document invalidates its fingerprint
+        conn = db.get_connection()
+        conn.execute("DELETE FROM chunks WHERE doc_id = ?", (outcome['doc_id'],))
+        conn.execute("DELETE FROM documents WHERE id = ?", (outcome['doc_id'],))
+        conn.commit()
+        conn.close()
+        if importer.import_file(paths[1])['status'] != "imported":
+            print("FAILURE: Deleted document should be importable again.")
+            sys.exit(1)
+
+        print("SUCCESS: Known files are skipped before parsing!")
+
+    finally:
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_import_fingerprint()
@@ -0,0 +1,77 @@
+import sys
+import os
+import shutil
+import tempfile
+import numpy as np
+
+# Ensure core modules can be imported
+sys.path.append(os.getcwd())
+try:
+    from kb_desktop.core.storage import DBManager
+    from kb_desktop.core.index_faiss import FaissIndex
+except ImportError:
+    sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+    from core.storage import DBManager
+    from core.index_faiss import FaissIndex
+
+def test_snapshots():
+    print("Testing versioned index snapshots...")
+
+    test_dir = tempfile.mkdtemp(prefix="kb_snapshot_")
+    snapshot_dir = os.path.join(test_dir, "snapshots")
+    dimension = 16
+
+    try:
+        # 1. Save three versions, keeping only the last two
+        for n in (3, 5, 7):
+            fi = FaissIndex(index_path=os.path.join(test_dir, "faiss.index"),
+                            meta_path=os.path.join(test_dir, "meta.json"),
+                            snapshot_dir=snapshot_dir, keep_snapshots=2)
+            fi.build_index(np.random.rand(n, dimension), list(range(1, n + 1)), dimension)
+            fi.save()
+
+        snapshots = fi.snapshots.list_snapshots()
+        print(f"Snapshots on disk: {snapshots}")
+        if snapshots != ["snap-000002", "snap-000003"]:
+            print("FAILURE: Old snapshots were not pruned.")
+            sys.exit(1)
+
+        # 2. Load current snapshot
+        loaded = FaissIndex(index_path=os.path.join(test_dir, "faiss.index"),
+                            meta_path=os.path.join(test_dir, "meta.json"),
+                            snapshot_dir=snapshot_dir)
+        if not loaded.load() or loaded.get_stats()["total_vectors"] != 7:
+            print("FAILURE: Could not load current snapshot.")
+            sys.exit(1)
+
+        # 3. Corrupt current snapshot -> load falls back to the previous one
+        with open(os.path.join(snapshot_dir, "snap-000003", "faiss.index"), "r+b") as f:
+            f.truncate(10)
+
+        recovered = FaissIndex(index_path=os.path.join(test_dir, "faiss.index"),
+                               meta_path=os.path.join(test_dir, "meta.json"),
+                               snapshot_dir=snapshot_dir)
+        if not recovered.load() or recovered.get_stats()["total_vectors"] != 5:
+            print("FAILURE: Did not recover from corrupted snapshot.")
+            sys.exit(1)
+        if recovered.snapshots.current() != "snap-000002":
+            print("FAILURE: CURRENT pointer was not flipped to the valid snapshot.")
+            sys.exit(1)
+
+        # 4. Consistency check against the chunks table
+        db = DBManager(db_path=os.path.join(test_dir, "kb.sqlite"))
+        doc_id = db.add_document("a.txt", "a.txt", "内容")
+        db.add_chunks(doc_id, ["一", "二", "三"])
+        report = recovered.verify_against_db(db)
+        print(f"Consistency report: {report}")
+        if report["consistent"] or report["missing_chunk_ids"] != [4, 5]:
+            print("FAILURE: Stale chunk ids were not detected.")
+            sys.exit(1)
+
+        print("SUCCESS: Snapshots commit, prune, recover and verify correctly!")
+
+    finally:
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_snapshots()
@@ -0,0 +1,106 @@
+import sys
+import os
+import shutil
+import tempfile
+
+# Ensure core and bench modules can be imported
+sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+from core.index_faiss import FaissIndex
+from bench.index_sweep import sweep, recommend, default_nlist, default_pq_m, synthetic_data
+
+def test_index_sweep():
+    print("Testing index factory support and parameter sweep...")
+
+    if default_nlist(100000) != 1264 or default_nlist(1000) != 25 or default_pq_m(128) != 32 or default_pq_m(100) != 25:
+        print("FAILURE: Wrong default nlist / PQ m")
+        sys.exit(1)
+
+    test_dir = tempfile.mkdtemp(prefix="kb_sweep_")
+    try:
+        vectors, queries = synthetic_data(3000, 100, 32, seed=1)
+
+        # 1. 非平坦索引：构建、搜索参数、删除（HNSW 不支持删除，需重建）、过滤搜索、保存和加载
+        for factory, params in (("HNSW16", "efSearch=64"), ("IVF16,Flat", "nprobe=16")):
+            index = FaissIndex(index_path=os.path.join(test_dir, "sweep.index"),
+                               meta_path=os.path.join(test_dir, "sweep.json"),
+                               index_factory=factory, search_params=params)
+            index.build_index(vectors, list(range(len(vectors))), 32)
+            print(f"{factory}: {index.get_stats()}")
+            if index.index_type() == "IndexFlatL2":
+                print(f"FAILURE: {factory} fell back to a flat index")
+                sys.exit(1)
+
+            # nprobe 覆盖全部聚类 / efSearch 足够大时，搜索向量自身应返回它自己
+            _, found = index.search(vectors[10], k=1)
+            if found != [10]:
+                print(f"FAILURE: {factory} did not find the query vector itself: {found}")
+                sys.exit(1)
+
+            index.remove_ids(list(range(0, 100)))
+            if index.index.ntotal != 2900 or index.chunk_ids[0] != 100:
+                print(f"FAILURE: {factory} remove_ids left {index.index.ntotal} vectors")
+                sys.exit(1)
+            _, found = index.search(vectors[500], k=1)
+            if found != [500]:
+                print(f"FAILURE: {factory} search after removal is wrong: {found}")
+                sys.exit(1)
+
+            allowed = set(range(2000, 2100))
+            _, found = index.search(vectors[2050], k=5, allowed_chunk_ids=allowed)
+            if found[0] != 2050 or not set(found) <= allowed:
+                print(f"FAILURE: {factory} filtered search is wrong: {found}")
+                sys.exit(1)
+
+            index.save()
+            reloaded = FaissIndex(index_path=index.index_path, meta_path=index.meta_path,
+                                  index_factory=factory, search_params=params)
+            if not reloaded.load() or reloaded.index_type() != index.index_type() \
+                    or reloaded.search(vectors[500], k=1)[1] != [500]:
+                print(f"FAILURE: {factory} did not survive save/load")
+                sys.exit(1)
+
+        # 2. 向量太少无法训练时退回平坦索引
+        small = FaissIndex(index_path=os.path.join(test_dir, "small.index"),
+                           meta_path=os.path.join(test_dir, "small.json"), index_factory="IVF64,Flat")
+        small.build_index(vectors[:20], list(range(20)), 32)
+        if small.index_type() != "IndexFlatL2":
+            print("FAILURE: Untrainable index did not fall back to flat")
+            sys.exit(1)
+
+        # 3. 参数扫描和帕累托表
+        rows = sweep(vectors, queries, k=10, factories=("Flat", "HNSW16", "IVF{nlist},Flat"),
+                     ef_search=(8, 64), nprobe=(1, 8))
+        configs = [(r['factory'], r['search_params']) for r in rows]
+        print(f"Configs: {configs}")
+        if configs != [("Flat", ""), ("HNSW16", "efSearch=8"), ("HNSW16", "efSearch=64"),
+                       ("IVF76,Flat", "nprobe=1"), ("IVF76,Flat", "nprobe=8")]:
+            print("FAILURE: Unexpected sweep configurations")
+            sys.exit(1)
+        flat = rows[0]
+        if flat['recall_at_10'] != 1.0 or not flat['pareto']:
+            print("FAILURE: Flat index should have exact recall and be Pareto-optimal")
+            sys.exit(1)
+        ivf_1, ivf_8 = rows[3], rows[4]
+        if not ivf_1['recall_at_10'] < ivf_8['recall_at_10'] <= 1.0:
+            print("FAILURE: More probes should raise IVF recall")
+            sys.exit(1)
+        if not all(r['memory_bytes'] > 0 and r['qps'] > 0 and r['build_seconds'] >= 0 for r in rows):
+            print("FAILURE: Missing memory, QPS or build time")
+            sys.exit(1)
+        for row in rows:
+            dominated = any(o['recall_at_10'] >= row['recall_at_10'] and o['qps'] >= row['qps']
+                            and (o['recall_at_10'] > row['recall_at_10'] or o['qps'] > row['qps'])
+                            for o in rows if o is not row)
+            if row['pareto'] == dominated:
+                print(f"FAILURE: Wrong Pareto flag for {row['factory']} {row['search_params']}")
+                sys.exit(1)
+        if recommend(rows, 10, 1.0)['recall_at_10'] != 1.0 or recommend(rows, 10, 1.01) is not None:
+            print("FAILURE: Wrong recommendation")
+            sys.exit(1)
+
+        print("SUCCESS: Index sweep verified.")
+    finally:
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_index_sweep()
@@ -0,0 +1,59 @@
+import sys
+import os
+import time
+import numpy as np
+
+# Ensure core modules can be imported
+sys.path.append(os.getcwd())
+try:
+    from kb_desktop.core.embedder import HashingEmbedder, create_embedder
+except ImportError:
+    sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+    from core.embedder import HashingEmbedder, create_embedder
+
+def test_local_embedder():
+    print("Testing local hashing embedder...")
+
+    embedder = create_embedder("hashing")
+    print(f"Backend model: {embedder.model}, dimension: {embedder.get_dimension()}")
+
+    texts = ["公司的年假政策是什么？", "员工每年享有带薪年假。", "服务器机房的温度控制"]
+    vectors = np.array(embedder.get_embeddings(texts))
+
+    if vectors.shape != (3, embedder.get_dimension()):
+        print(f"FAILURE: Unexpected shape {vectors.shape}")
+        sys.exit(1)
+
+    # 1. Related texts are closer than unrelated ones
+    related = np.linalg.norm(vectors[0] - vectors[1])
+    unrelated = np.linalg.norm(vectors[0] - vectors[2])
+    print(f"Distance related={related:.3f}, unrelated={unrelated:.3f}")
+    if related >= unrelated:
+        print("FAILURE: Related texts should be closer.")
+        sys.exit(1)
+
+    # 2. Deterministic across instances and thread counts
+    many = [f"第{i}条 制度说明：请假需提前申请。" for i in range(500)]
+    single = np.array(HashingEmbedder(batch_size=50, num_threads=1).get_embeddings(many))
+    start = time.perf_counter()
+    threaded = np.array(HashingEmbedder(batch_size=50, num_threads=4).get_embeddings(many))
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"Embedded {len(many)} texts in {elapsed:.1f} ms")
+    if not np.allclose(single, threaded):
+        print("FAILURE: Threaded embeddings differ from single-threaded ones.")
+        sys.exit(1)
+
+    # 3. The local backend falls back to the configured hashing embedder when the model is unavailable
+    os.environ["HASHING_EMBEDDING_DIM"] = "64"
+    try:
+        fallback = create_embedder("local")
+    finally:
+        del os.environ["HASHING_EMBEDDING_DIM"]
+    if isinstance(fallback, HashingEmbedder) and fallback.get_dimension() != 64:
+        print("FAILURE: Fallback ignored HASHING_EMBEDDING_DIM.")
+        sys.exit(1)
+
+    print("SUCCESS: Local embedder is deterministic, batched and fast!")
+
+if __name__ == "__main__":
+    test_local_embedder()
@@ -0,0 +1,134 @@
+import sys
+import os
+import shutil
+import tempfile
+
+# Ensure core modules can be imported
+sys.path.append(os.getcwd())
+try:
+    from kb_desktop.core.storage import DBManager
+    from kb_desktop.core.importer import Importer
+    from kb_desktop.core.chunker import Chunker
+    from kb_desktop.core.tokenizer import TokenCounter
+    from kb_desktop.core.dedup import simhash, hamming_distance
+    from kb_desktop.core.index_faiss import FaissIndex
+    from kb_desktop.core.vector_store import VectorStore
+    from kb_desktop.core.indexer import Indexer
+    from kb_desktop.core.embedder import HashingEmbedder
+    from kb_desktop.core.retriever import Retriever
+except ImportError:
+    sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+    from core.storage import DBManager
+    from core.importer import Importer
+    from core.chunker import Chunker
+    from core.tokenizer import TokenCounter
+    from core.dedup import simhash, hamming_distance
+    from core.index_faiss import FaissIndex
+    from core.vector_store import VectorStore
+    from core.indexer import Indexer
+    from core.embedder import HashingEmbedder
+    from core.retriever import Retriever
+
+BOILERPLATE = "本文件为公司内部资料，未经许可不得外传。如有疑问请联系人力资源部，电话 010-12345678，第 {page} 页。"
+
+def test_near_duplicates():
+    print("Testing near-duplicate chunk detection...")
+
+    # 1. Fingerprints of near-identical text are close, unrelated text is far
+    a, b = simhash(BOILERPLATE.format(page=1)), simhash(BOILERPLATE.format(page=27))
+    c = simhash("年假规定：员工工作满一年后享有五天带薪年假，满十年享有十天。")
+    print(f"Distances: near={hamming_distance(a, b)}, far={hamming_distance(a, c)}")
+    if hamming_distance(a, b) > 3 or hamming_distance(a, c) <= 3:
+        print("FAILURE: SimHash distances don't separate near duplicates.")
+        sys.exit(1)
+
+    test_dir = tempfile.mkdtemp(prefix="kb_near_dup_")
+    try:
+        db = DBManager(db_path=os.path.join(test_dir, "kb.sqlite"))
+        chunker = Chunker(max_tokens=60, overlap_tokens=0, paragraph_overlap=False,
+                          counter=TokenCounter(encoding_name=""))
+        importer = Importer(db, chunker)
+
+        docs_dir = os.path.join(test_dir, "docs")
+        os.makedirs(docs_dir)
+        topics = ["考勤管理：每天九点前打卡，迟到三次计旷工半天。",
+                  "报销流程：发票须在三十天内提交财务部审核。",
+                  "年假规定：员工工作满一年后享有五天带薪年假。"]
+        paths = []
+        for i, topic in enumerate(topics):
+            path = os.path.join(docs_dir, f"制度_{i}.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(f"{topic}\n\n{BOILERPLATE.format(page=i + 1)}\n")
+            paths.append(path)
+        importer.import_files(paths)
+
+        # 2. Boilerplate chunks share one canonical chunk
+        all_ids = db.get_chunk_ids()
+        indexable = db.get_indexable_chunk_ids()
+        print(f"Chunks: {len(all_ids)}, indexable: {len(indexable)}")
+        if len(all_ids) != 6 or len(indexable) != 4:
+            print("FAILURE: Boilerplate should be stored once per document but indexed once.")
+            sys.exit(1)
+
+        # 3. Only canonical chunks are embedded
+        index = FaissIndex(index_path=os.path.join(test_dir, "faiss.index"),
+                           meta_path=os.path.join(test_dir, "meta.json"))
+        embedder = HashingEmbedder(dimension=64, num_threads=1)
+        result = Indexer(db, index, embedder, VectorStore(os.path.join(test_dir, "vectors"))).rebuild()
+        if result['total'] != 4 or result['embedded'] != 4:
+            print(f"FAILURE: Expected 4 embedded chunks, got {result}")
+            sys.exit(1)
+
+        # 4. Keyword search returns the shared chunk once
+        keyword_results = db.keyword_search("内部资料 外传", k=5)
+        if len(keyword_results) != 1:
+            print(f"FAILURE: Expected one keyword hit for boilerplate, got {len(keyword_results)}")
+            sys.exit(1)
+
+        # 5. Hits on the shared chunk keep every document for citations
+        hits = Retriever(db, index, embedder).retrieve("内部资料不得外传", k=2)
+        boiler = [h for h in hits if "内部资料" in h['text']]
+        if not boiler or sorted([boiler[0]['filename']] + boiler[0]['also_in']) != ["制度_0.txt", "制度_1.txt", "制度_2.txt"]:
+            print(f"FAILURE: Shared chunk should cite all documents: {boiler}")
+            sys.exit(1)
+
+        # 6. Filters on a document still reach its duplicate chunks
+        ids = db.get_chunk_ids_by_filter({'filename_pattern': '制度_2%'})
+        if boiler[0]['chunk_id'] not in ids:
+            print("FAILURE: Filtered search should map duplicates to their canonical chunk.")
+            sys.exit(1)
+
+        # 7. Filtered hits are attributed to the in-scope duplicate, not the canonical document
+        doc_ids = {row[1]: row[0] for row in db.get_all_documents()}
+        scoped = Retriever(db, index, embedder).retrieve("内部资料不得外传", k=2,
+                                                         doc_filter={'filename_pattern': '制度_2%'})
+        print(f"Filtered hits: {[(h['filename'], h['chunk_id'], h['also_in']) for h in scoped]}")
+        if any(h['filename'] != "制度_2.txt" or h['doc_id'] != doc_ids["制度_2.txt"] for h in scoped):
+            print("FAILURE: Filtered search returned a hit from an out-of-scope document.")
+            sys.exit(1)
+        scoped_boiler = [h for h in scoped if "内部资料" in h['text']]
+        if not scoped_boiler or scoped_boiler[0]['chunk_id'] == boiler[0]['chunk_id'] \
+                or sorted(scoped_boiler[0]['also_in']) != ["制度_0.txt", "制度_1.txt"]:
+            print(f"FAILURE: Filtered hit should cite the in-scope duplicate chunk: {scoped_boiler}")
+            sys.exit(1)
+
+        # 8. Deleting the canonical document promotes a duplicate
+        canonical_doc = boiler[0]['doc_id']
+        deleted = db.delete_document(canonical_doc)
+        print(f"Delete result: {deleted}")
+        if deleted['chunks'] != 2 or len(deleted['promoted']) != 1:
+            print("FAILURE: Deleting the canonical document should promote one duplicate.")
+            sys.exit(1)
+        if deleted['promoted'][0] not in db.get_indexable_chunk_ids() or len(db.get_indexable_chunk_ids()) != 3:
+            print("FAILURE: Promoted chunk should become indexable.")
+            sys.exit(1)
+        if len(db.get_duplicate_sources(deleted['promoted']).get(deleted['promoted'][0], [])) != 2:
+            print("FAILURE: Remaining duplicate should point to the promoted chunk.")
+            sys.exit(1)
+    finally:
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+    print("SUCCESS: Near-duplicate chunks share one embedding!")
+
+if __name__ == "__main__":
+    test_near_duplicates()
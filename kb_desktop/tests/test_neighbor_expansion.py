@@ -0,0 +1,91 @@
+import sys
+import os
+import shutil
+import tempfile
+
+# Ensure core modules can be imported
+sys.path.append(os.getcwd())
+try:
+    from kb_desktop.core.storage import DBManager
+    from kb_desktop.core.retriever import Retriever
+    from kb_desktop.core.context_packer import ContextPacker
+except ImportError:
+    sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+    from core.storage import DBManager
+    from core.retriever import Retriever
+    from core.context_packer import ContextPacker
+
+def test_neighbor_expansion():
+    print("Testing adjacent-chunk context expansion...")
+
+    test_dir = tempfile.mkdtemp(prefix="kb_window_")
+    try:
+        db = DBManager(db_path=os.path.join(test_dir, "kb.sqlite"))
+        doc_a = db.add_document("制度.txt", "制度.txt", "制度全文")
+        doc_b = db.add_document("流程.txt", "流程.txt", "流程全文")
+        db.add_chunks(doc_a, [f"第{i}条规定的内容。" for i in range(10)])
+        db.add_chunks(doc_b, [f"第{i}步操作说明。" for i in range(3)])
+
+        # (chunk_id, text, chunk_index) in insertion order
+        chunk_ids = db.get_chunk_ids()
+        rows = db.get_chunks_by_ids(chunk_ids)
+        chunks = [(cid, rows[cid]['text'], rows[cid]['chunk_index']) for cid in chunk_ids]
+        chunks_a, chunks_b = chunks[:10], chunks[10:]
+
+        # 1. One batched query returns the window around each hit, clipped at document edges
+        hit_ids = [chunks_a[5][0], chunks_b[0][0]]
+        neighbors = db.get_neighbor_chunks(hit_ids, window=2)
+        indexes_a = [n['chunk_index'] for n in neighbors[chunks_a[5][0]]]
+        indexes_b = [n['chunk_index'] for n in neighbors[chunks_b[0][0]]]
+        print(f"Window around hit A: {indexes_a}, hit B: {indexes_b}")
+        if indexes_a != [3, 4, 5, 6, 7] or indexes_b != [0, 1, 2]:
+            print("FAILURE: Neighbour windows are wrong.")
+            sys.exit(1)
+
+        # 2. Retriever expands hits without duplicating chunks that are already hits
+        hits = []
+        for chunk_id, text, chunk_index in (chunks_a[5], chunks_a[6]):
+            hits.append({'text': text, 'filename': "制度.txt", 'chunk_id': chunk_id,
+                         'doc_id': doc_a, 'chunk_index': chunk_index,
+                         'combined_score': 0.8, 'similarity': 0.8})
+        retriever = Retriever(db, index=None, embedder=None)
+        expanded = retriever.expand_neighbors(hits, window=1)
+        expanded_indexes = sorted(c['chunk_index'] for c in expanded)
+        if expanded_indexes != [4, 5, 6, 7]:
+            print(f"FAILURE: Expected chunks 4-7, got {expanded_indexes}")
+            sys.exit(1)
+
+        # 3. Packer merges the window into one block
+        blocks = ContextPacker(token_budget=1000).pack(expanded)
+        if len(blocks) != 1 or blocks[0]['text'] != "".join(f"第{i}条规定的内容。" for i in range(4, 8)):
+            print(f"FAILURE: Window was not merged into one block: {blocks}")
+            sys.exit(1)
+
+        # 4. Under a tight budget the hits are kept before their neighbours
+        blocks = ContextPacker(token_budget=40).pack(expanded)
+        kept = {cid for b in blocks for cid in b['chunk_ids']}
+        if not {chunks_a[5][0], chunks_a[6][0]} <= kept:
+            print(f"FAILURE: Hits were dropped in favour of neighbours: {kept}")
+            sys.exit(1)
+
+        # 5. Window 0 disables expansion
+        if len(retriever.expand_neighbors(hits, window=0)) != len(hits):
+            print("FAILURE: Window 0 should return the hits unchanged.")
+            sys.exit(1)
+
+        # 6. More hits than one SQLite batch still get their windows
+        doc_c = db.add_document("条例.txt", "条例.txt", "条例全文")
+        db.add_chunks(doc_c, [f"第{i}款。" for i in range(600)])
+        many_ids = db.get_chunk_ids()[-600:]
+        many = db.get_neighbor_chunks(many_ids, window=1)
+        if len(many) != 600 or [n['chunk_index'] for n in many[many_ids[-1]]] != [598, 599]:
+            print(f"FAILURE: Only {len(many)} of 600 hits were expanded.")
+            sys.exit(1)
+
+        print("SUCCESS: Neighbouring chunks are fetched in one query and merged into windows!")
+
+    finally:
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_neighbor_expansion()
@@ -0,0 +1,163 @@
+import sys
+import os
+import time
+import shutil
+import tempfile
+import multiprocessing
+
+# Ensure core modules can be imported (the parser registry lives in core.parsers)
+sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+from core.ingest import Ingestor
+from core.parsers import ParsePool, get_parser, register_parser, supported_extensions
+from core.storage import DBManager
+from core.importer import Importer
+
+HTML = """<!DOCTYPE html>
+<html><head><title>报销制度</title><style>body { color: red; }</style>
+<script>var tracking = "不应出现";</script></head>
+<body>
+<nav><a href="/">首页</a> | <a href="/hr">人事</a></nav>
+<div class="site-header">网站导航栏</div>
+<main>
+  <h1>差旅报销规定</h1>
+  <p>出差人员应在返回后
+     <b>五个工作日</b>内提交报销单。</p>
+  <ul><li>住宿标准：每晚 500 元</li><li>餐补：每天 100 元</li></ul>
+  <table><tr><th>城市</th><th>标准</th></tr><tr><td>北京</td><td>600</td></tr></table>
+</main>
+<aside>相关推荐</aside>
+<footer>版权所有 &copy; 2024</footer>
+</body></html>"""
+
+CSV = "城市,住宿标准,餐补\n北京,600,120\n上海,,120\n"
+
+def test_parser_registry():
+    print("Testing parser registry and parallel parsing...")
+
+    test_dir = tempfile.mkdtemp(prefix="kb_parsers_")
+    try:
+        # 1. 按扩展名和 MIME 类型查找解析器
+        for ext in ['.txt', '.md', '.docx', '.pdf', '.html', '.htm', '.csv', '.xlsx', '.pptx']:
+            if ext not in supported_extensions():
+                print(f"FAILURE: {ext} is not registered")
+                sys.exit(1)
+        if get_parser("a.HTML") is not get_parser("b.htm") or get_parser("a.xyz") is not None:
+            print("FAILURE: Parser lookup by extension is wrong")
+            sys.exit(1)
+        if get_parser("notes.markdown") is not get_parser("notes.md"):
+            print("FAILURE: Parser lookup by MIME type failed")
+            sys.exit(1)
+
+        unsupported = os.path.join(test_dir, "data.xyz")
+        with open(unsupported, "w") as f:
+            f.write("x")
+        try:
+            Ingestor.load_file(unsupported)
+            print("FAILURE: Unsupported file type was accepted")
+            sys.exit(1)
+        except Exception as e:
+            if "Unsupported file type" not in str(e):
+                print(f"FAILURE: Unexpected error for unsupported type: {e}")
+                sys.exit(1)
+
+        # 2. HTML：去除脚本、样式、导航、页眉页脚，块级元素分段
+        html_path = os.path.join(test_dir, "报销.html")
+        with open(html_path, "w", encoding="gb18030") as f:
+            f.write(HTML)
+        content = Ingestor.load_file(html_path)
+        lines = content.split("\n")
+        for boilerplate in ["tracking", "color", "首页", "网站导航栏", "相关推荐", "版权所有"]:
+            if boilerplate in content:
+                print(f"FAILURE: Boilerplate '{boilerplate}' was not stripped: {content!r}")
+                sys.exit(1)
+        expected = ["报销制度", "差旅报销规定", "出差人员应在返回后 五个工作日内提交报销单。",
+                    "住宿标准：每晚 500 元", "餐补：每天 100 元", "城市 标准", "北京 600"]
+        if lines != expected:
+            print(f"FAILURE: HTML paragraphs {lines} != {expected}")
+            sys.exit(1)
+        print("HTML boilerplate stripped, paragraphs preserved")
+
+        # 3. CSV：表头作为列名，空单元格省略
+        csv_path = os.path.join(test_dir, "标准.csv")
+        with open(csv_path, "w", encoding="utf-8") as f:
+            f.write(CSV)
+        rows = Ingestor.load_file(csv_path).split("\n")
+        if rows != ["城市: 北京，住宿标准: 600，餐补: 120", "城市: 上海，餐补: 120"]:
+            print(f"FAILURE: Unexpected CSV rows: {rows}")
+            sys.exit(1)
+        print(f"CSV rows: {rows}")
+
+        # 4. 解析进程池：卡住的文件超时后终止，其他文件照常解析
+        if hasattr(os, "mkfifo"):
+            blocked = os.path.join(test_dir, "blocked.txt")
+            os.mkfifo(blocked)  # 没有写入方，打开时一直阻塞
+            start = time.monotonic()
+            results = {path: (content, error) for path, content, error in
+                       ParsePool(workers=2, timeout=1.0).imap([blocked, html_path, csv_path])}
+            elapsed = time.monotonic() - start
+            if results[blocked][0] is not None or "timed out" not in results[blocked][1]:
+                print(f"FAILURE: Blocked file did not time out: {results[blocked]}")
+                sys.exit(1)
+            if results[html_path][0] != "\n".join(expected) or results[csv_path][1] is not None:
+                print("FAILURE: Other files were not parsed alongside the blocked one")
+                sys.exit(1)
+            if elapsed > 10:
+                print(f"FAILURE: Timeout took too long ({elapsed:.1f}s)")
+                sys.exit(1)
+            print(f"Blocked file timed out after {elapsed:.1f}s, other files parsed")
+        else:
+            print("Skipping timeout check (no named pipes on this platform)")
+
+        # 4b. 只导入一个文件时也在解析进程中解析：卡住的解析器超时，不会拖住调用方
+        if multiprocessing.get_start_method() == "fork":
+            @register_parser([".hang"])
+            def parse_hang(path):
+                time.sleep(60)
+                yield ""
+
+            hang_path = os.path.join(test_dir, "卡住.hang")
+            with open(hang_path, "w", encoding="utf-8") as f:
+                f.write("卡住")
+            db = DBManager(db_path=os.path.join(test_dir, "kb_hang.sqlite"))
+            start = time.monotonic()
+            result = Importer(db, workers=1, parse_timeout=1.0).import_files([hang_path])
+            elapsed = time.monotonic() - start
+            if result['failed'] != 1 or "timed out" not in result['errors'].get(hang_path, "") or elapsed > 10:
+                print(f"FAILURE: Single hung file did not time out: {result['errors']} ({elapsed:.1f}s)")
+                sys.exit(1)
+            print(f"Single hung file timed out after {elapsed:.1f}s")
+
+        # 5. 并行导入与逐个导入的结果相同
+        docs_dir = os.path.join(test_dir, "docs")
+        os.makedirs(docs_dir)
+        paths = []
+        for i in range(6):
+            path = os.path.join(docs_dir, f"制度_{i}.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(f"第{i}号制度：" + "各部门应按照规定办理相关事项。" * (i + 1))
+            paths.append(path)
+        copy = os.path.join(docs_dir, "制度_0_副本.txt")
+        shutil.copy(paths[0], copy)
+        paths += [html_path, csv_path, copy, paths[2], unsupported]
+
+        outcomes = []
+        for workers in (0, 3):
+            db = DBManager(db_path=os.path.join(test_dir, f"kb_{workers}.sqlite"))
+            result = Importer(db, workers=workers).import_files(paths)
+            docs = [(doc[0], doc[1], doc[3], db.get_document_content(doc[0])) for doc in sorted(db.get_all_documents())]
+            outcomes.append(({k: result[k] for k in ('imported', 'duplicate', 'unchanged', 'failed')}, docs))
+
+        if outcomes[0] != outcomes[1]:
+            print(f"FAILURE: Parallel import differs from sequential: {outcomes[0][0]} vs {outcomes[1][0]}")
+            sys.exit(1)
+        if outcomes[1][0] != {'imported': 8, 'duplicate': 1, 'unchanged': 1, 'failed': 1}:
+            print(f"FAILURE: Unexpected import counts: {outcomes[1][0]}")
+            sys.exit(1)
+        print(f"Parallel import matches sequential: {outcomes[1][0]}")
+
+        print("SUCCESS: Parser registry and parallel parsing verified.")
+    finally:
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_parser_registry()
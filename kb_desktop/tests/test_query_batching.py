@@ -0,0 +1,152 @@
+import sys
+import os
+import time
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# Ensure core modules can be imported
+sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+from core.embedder import HashingEmbedder, BatchingEmbedder, create_embedder
+from core import tracing
+
+class SlowEmbedder(HashingEmbedder):
+    """Each request takes `delay` seconds regardless of size, like a remote embeddings API."""
+    def __init__(self, delay=0.05):
+        super().__init__(dimension=32)
+        self.delay = delay
+        self.calls = []
+        self.fail = False
+
+    def get_embeddings(self, texts):
+        self.calls.append(len(texts))
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("rate limited")
+        return super().get_embeddings(texts)
+
+def test_query_batching():
+    print("Testing micro-batching query embedder...")
+
+    backend = SlowEmbedder()
+    embedder = BatchingEmbedder(backend, max_wait_ms=10, max_batch=64)
+    queries = [f"问题 {i} 年假 天数" for i in range(16)]
+    expected = HashingEmbedder(dimension=32).get_embeddings(queries)
+
+    # 1. 单个调用方：延迟约为一次请求 + 时间窗口
+    start = time.perf_counter()
+    vector = embedder.get_embedding(queries[0])
+    single = time.perf_counter() - start
+    print(f"Single query: {single * 1000:.0f}ms")
+    if not np.allclose(vector, expected[0]) or single >= 0.12:
+        print(f"FAILURE: Single-caller latency or result is wrong ({single:.3f}s)")
+        sys.exit(1)
+
+    # 2. 并发调用方：合并为少量批量请求，结果按调用方分发
+    backend.calls.clear()
+    barrier = threading.Barrier(len(queries))
+
+    def ask(i):
+        barrier.wait()
+        return embedder.get_embedding(queries[i])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(queries)) as pool:
+        vectors = list(pool.map(ask, range(len(queries))))
+    elapsed = time.perf_counter() - start
+    print(f"16 concurrent queries: {elapsed * 1000:.0f}ms in {len(backend.calls)} requests {backend.calls}")
+    if not all(np.allclose(v, e) for v, e in zip(vectors, expected)):
+        print("FAILURE: Results were not fanned back to the right callers")
+        sys.exit(1)
+    if len(backend.calls) > 3 or sum(backend.calls) != len(queries):
+        print("FAILURE: Concurrent queries were not coalesced")
+        sys.exit(1)
+    if embedder.stats()['requests'] != 17 or embedder.stats()['requests_per_batch'] <= 2:
+        print(f"FAILURE: Wrong stats: {embedder.stats()}")
+        sys.exit(1)
+
+    # 3. 大批量调用（建索引）直接交给底层嵌入器
+    backend.calls.clear()
+    embedder.get_embeddings([f"文本 {i}" for i in range(100)])
+    if backend.calls != [100]:
+        print(f"FAILURE: Large batch was not passed through: {backend.calls}")
+        sys.exit(1)
+
+    # 4. 批量请求失败时每个调用方都收到异常
+    backend.fail = True
+    errors = []
+
+    def ask_failing(i):
+        try:
+            embedder.get_embedding(queries[i])
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(ask_failing, range(4)))
+    backend.fail = False
+    if errors != ["rate limited"] * 4:
+        print(f"FAILURE: Batch failure not propagated: {errors}")
+        sys.exit(1)
+
+    # 5. 慢请求不阻塞后续批次的收集和发出；调用方等待有上限
+    slow = SlowEmbedder(delay=0.3)
+    slow_embedder = BatchingEmbedder(slow, max_wait_ms=10, max_batch=64, concurrency=4)
+
+    def ask_slow(delay):
+        time.sleep(delay)
+        return slow_embedder.get_embedding(queries[0])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        list(pool.map(ask_slow, (0, 0.1)))
+    elapsed = time.perf_counter() - start
+    print(f"Two batches 100ms apart with 300ms requests: {elapsed * 1000:.0f}ms")
+    if slow.calls != [1, 1] or elapsed >= 0.55:
+        print("FAILURE: Second batch waited for the first request to finish")
+        sys.exit(1)
+    slow_embedder.close()
+
+    hanging = BatchingEmbedder(SlowEmbedder(delay=1.0), max_wait_ms=1, max_batch=64, timeout=0.2)
+    try:
+        hanging.get_embedding(queries[0])
+        print("FAILURE: Hanging request did not time out")
+        sys.exit(1)
+    except TimeoutError as e:
+        print(f"Timed out: {e}")
+    hanging.close()
+
+    # close() 之后再次使用会启动新的收集线程，旧线程的结束标记不会让新请求挂起
+    restarted = BatchingEmbedder(HashingEmbedder(dimension=32), max_wait_ms=1, max_batch=64, timeout=1)
+    try:
+        for _ in range(20):
+            restarted.close()
+            restarted.get_embedding(queries[0])
+    except TimeoutError:
+        print("FAILURE: Request after close() was not served")
+        sys.exit(1)
+    restarted.close()
+
+    # 6. 追踪中记录批大小；配置 QUERY_BATCH_WINDOW_MS 时 create_embedder 返回批处理前端
+    with tracing.start_trace("question", recorder=tracing.TraceRecorder()) as trace:
+        with tracing.span("embed_query"):
+            embedder.get_embedding(queries[0])
+    if trace.spans[0].attrs.get('batch') != 1:
+        print("FAILURE: Batch size not recorded in the trace")
+        sys.exit(1)
+    embedder.close()
+
+    os.environ["QUERY_BATCH_WINDOW_MS"] = "5"
+    try:
+        wrapped = create_embedder("hashing")
+    finally:
+        del os.environ["QUERY_BATCH_WINDOW_MS"]
+    if not isinstance(wrapped, BatchingEmbedder) or wrapped.max_wait != 0.005 \
+            or isinstance(create_embedder("hashing"), BatchingEmbedder):
+        print("FAILURE: QUERY_BATCH_WINDOW_MS not applied")
+        sys.exit(1)
+
+    print("SUCCESS: Query batching verified.")
+
+if __name__ == "__main__":
+    test_query_batching()
@@ -0,0 +1,112 @@
+import sys
+import os
+import time
+import shutil
+import tempfile
+import numpy as np
+
+# Ensure core modules can be imported
+sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+from core.storage import DBManager
+from core.index_faiss import FaissIndex
+from core.embedder import HashingEmbedder
+from core.retriever import Retriever
+
+class SlowEmbedder(HashingEmbedder):
+    """Query embedding waits `delay` seconds, like the embeddings HTTP call."""
+    delay = 0.2
+    fail = False
+
+    def get_embeddings(self, texts):
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("embedding service unavailable")
+        return super().get_embeddings(texts)
+
+class SlowKeywordDB(DBManager):
+    """Keyword search waits `delay` seconds, like a large FTS table."""
+    delay = 0.2
+    fail = False
+
+    def keyword_search(self, query, k=10, doc_filter=None):
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("database is locked")
+        return super().keyword_search(query, k, doc_filter)
+
+class CountingIndex(FaissIndex):
+    searches = 0
+
+    def search(self, query_vector, k=5, allowed_chunk_ids=None):
+        self.searches += 1
+        return super().search(query_vector, k=k, allowed_chunk_ids=allowed_chunk_ids)
+
+def test_retrieval_overlap():
+    print("Testing overlapped keyword search and query embedding...")
+
+    test_dir = tempfile.mkdtemp(prefix="kb_overlap_")
+    try:
+        db = SlowKeywordDB(db_path=os.path.join(test_dir, "kb.sqlite"))
+        doc_id = db.add_document("员工手册.txt", "员工手册.txt", "内容")
+        db.add_chunks(doc_id, ["年假 天数 按工龄计算", "病假 需要 医院证明", "加班费 按 工资 比例 计算"])
+
+        embedder = SlowEmbedder(dimension=64)
+        chunk_ids = db.get_chunk_ids()
+        texts = db.get_chunks_by_ids(chunk_ids)
+        embedder.delay = 0
+        vectors = np.array(embedder.get_embeddings([texts[cid]['text'] for cid in chunk_ids]))
+        index = CountingIndex(index_path=os.path.join(test_dir, "faiss.index"),
+                              meta_path=os.path.join(test_dir, "meta.json"))
+        index.build_index(vectors, chunk_ids, 64)
+        retriever = Retriever(db, index, embedder)
+
+        db.delay = 0
+        expected = retriever.retrieve("年假 天数", k=3)
+
+        # 1. 两个分支各 0.2s：总延迟约为 0.2s 而不是 0.4s，结果不变
+        embedder.delay = db.delay = 0.2
+        start = time.perf_counter()
+        results = retriever.retrieve("年假 天数", k=3)
+        elapsed = time.perf_counter() - start
+        print(f"Overlapped retrieval: {elapsed:.2f}s")
+        if elapsed >= 0.35:
+            print(f"FAILURE: Keyword search did not overlap with embedding ({elapsed:.2f}s)")
+            sys.exit(1)
+        if [r['chunk_id'] for r in results] != [r['chunk_id'] for r in expected] \
+                or results[0]['keyword_score'] == 0:
+            print("FAILURE: Overlapped retrieval changed the results")
+            sys.exit(1)
+
+        # 2. 嵌入失败：异常立即抛出，不等待关键词检索
+        embedder.fail, embedder.delay, db.delay = True, 0, 0.5
+        start = time.perf_counter()
+        try:
+            retriever.retrieve("年假 天数", k=3)
+            print("FAILURE: Embedding failure was swallowed")
+            sys.exit(1)
+        except RuntimeError as e:
+            elapsed = time.perf_counter() - start
+            if "unavailable" not in str(e) or elapsed >= 0.3:
+                print(f"FAILURE: Embedding failure waited for keyword search ({elapsed:.2f}s)")
+                sys.exit(1)
+        embedder.fail = False
+        time.sleep(0.5)
+
+        # 3. 关键词检索失败：异常抛出，嵌入完成后不再搜索索引
+        db.fail, db.delay, embedder.delay = True, 0, 0.1
+        index.searches = 0
+        try:
+            retriever.retrieve("年假 天数", k=3)
+            print("FAILURE: Keyword search failure was swallowed")
+            sys.exit(1)
+        except RuntimeError as e:
+            if "locked" not in str(e) or index.searches != 0:
+                print(f"FAILURE: Keyword failure not propagated before vector search ({index.searches})")
+                sys.exit(1)
+
+        print("SUCCESS: Retrieval overlap verified.")
+    finally:
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_retrieval_overlap()
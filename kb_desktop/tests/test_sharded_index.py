@@ -0,0 +1,115 @@
+import sys
+import os
+import shutil
+import tempfile
+import numpy as np
+
+# Ensure core modules can be imported
+sys.path.append(os.getcwd())
+try:
+    from kb_desktop.core.index_faiss import FaissIndex
+    from kb_desktop.core.index_sharded import ShardedFaissIndex
+    from kb_desktop.core.storage import DBManager
+    from kb_desktop.core.embedder import HashingEmbedder
+    from kb_desktop.core.indexer import Indexer
+    from kb_desktop.core.vector_store import VectorStore
+except ImportError:
+    sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+    from core.index_faiss import FaissIndex
+    from core.index_sharded import ShardedFaissIndex
+    from core.storage import DBManager
+    from core.embedder import HashingEmbedder
+    from core.indexer import Indexer
+    from core.vector_store import VectorStore
+
+def test_sharded_index():
+    print("Testing sharded FAISS index...")
+
+    test_dir = tempfile.mkdtemp(prefix="kb_shards_")
+    dimension = 32
+    rng = np.random.default_rng(0)
+    vectors = rng.random((250, dimension)).astype('float32')
+    chunk_ids = list(range(1000, 1250))
+
+    try:
+        # 1. Build by size: 250 vectors / 100 per shard -> 3 shards
+        sharded = ShardedFaissIndex(shard_dir=test_dir, max_shard_size=100, max_workers=3)
+        sharded.build_index(vectors, chunk_ids, dimension)
+        sharded.save()
+        stats = sharded.get_stats()
+        print(f"Shard stats: {stats['shards']}")
+        if stats["shards"] != {0: 100, 1: 100, 2: 50}:
+            print("FAILURE: Unexpected shard layout.")
+            sys.exit(1)
+
+        # 2. Fan-out search must match exact flat search
+        flat = FaissIndex(index_path=os.path.join(test_dir, "flat.index"),
+                          meta_path=os.path.join(test_dir, "flat.json"))
+        flat.build_index(vectors, chunk_ids, dimension)
+        for query in rng.random((5, dimension)):
+            _, expected = flat.search(query, k=10)
+            _, actual = sharded.search(query, k=10)
+            if expected != actual:
+                print(f"FAILURE: Sharded results {actual} != flat results {expected}")
+                sys.exit(1)
+
+        # 3. Incremental add only touches the last shard
+        sharded.add_to_index(rng.random((30, dimension)), list(range(2000, 2030)))
+        if sharded.dirty != {2}:
+            print(f"FAILURE: Expected only shard 2 to be dirty, got {sharded.dirty}")
+            sys.exit(1)
+        sharded.save()
+
+        # 4. Reload from disk
+        reloaded = ShardedFaissIndex(shard_dir=test_dir)
+        if not reloaded.load() or reloaded.ntotal != 280:
+            print("FAILURE: Could not reload shards.")
+            sys.exit(1)
+
+        # 4b. Crash after a shard was written but before the manifest: reload sees the last full save
+        reloaded.add_to_index(rng.random((10, dimension)), list(range(3000, 3010)))
+        reloaded.shards[2].save()
+        recovered = ShardedFaissIndex(shard_dir=test_dir)
+        if not recovered.load() or recovered.ntotal != 280 or 3000 in recovered.chunk_ids:
+            print("FAILURE: Interrupted save left the shards inconsistent.")
+            sys.exit(1)
+
+        # 5. Document sharding keeps each document in one shard
+        by_doc = ShardedFaissIndex(shard_dir=os.path.join(test_dir, "by_doc"),
+                                   shard_by="document", num_shards=4)
+        doc_ids = [cid % 7 for cid in chunk_ids]
+        by_doc.build_index(vectors, chunk_ids, dimension, doc_ids=doc_ids)
+        for sid, shard in by_doc.shards.items():
+            if any((cid % 7) % 4 != sid for cid in shard.chunk_ids):
+                print("FAILURE: Document sharding misplaced a vector.")
+                sys.exit(1)
+
+        # 6. Indexer supplies document ids for a document-sharded index
+        db = DBManager(db_path=os.path.join(test_dir, "kb.sqlite"))
+        for i in range(6):
+            doc_id = db.add_document(f"doc{i}.txt", f"doc{i}.txt", f"文档 {i}")
+            db.add_chunks(doc_id, [f"文档 {i} 段落 {j}" for j in range(3)])
+        doc_index = ShardedFaissIndex(shard_dir=os.path.join(test_dir, "indexer"),
+                                      shard_by="document", num_shards=4)
+        indexer = Indexer(db, doc_index, HashingEmbedder(dimension=dimension),
+                          VectorStore(os.path.join(test_dir, "vectors")))
+        indexer.rebuild()
+        doc_id = db.add_document("doc6.txt", "doc6.txt", "文档 6")
+        db.add_chunks(doc_id, ["文档 6 段落 0"])
+        indexer.index_chunks(db.get_chunk_ids()[-1:])
+        owners = db.get_chunk_doc_ids(db.get_chunk_ids())
+        for sid, shard in doc_index.shards.items():
+            if any(owners[cid] % 4 != sid for cid in shard.chunk_ids):
+                print("FAILURE: Indexer placed a chunk outside its document's shard.")
+                sys.exit(1)
+        if not doc_index.verify_against_db(db)['consistent']:
+            print("FAILURE: Document-sharded index does not match the database.")
+            sys.exit(1)
+
+        print("SUCCESS: Sharded index builds, searches, updates and reloads correctly!")
+
+    finally:
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_sharded_index()
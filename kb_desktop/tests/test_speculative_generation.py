@@ -0,0 +1,130 @@
+import sys
+import os
+import time
+import shutil
+import tempfile
+import numpy as np
+
+# Ensure core modules can be imported
+sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+from core.storage import DBManager
+from core.index_faiss import FaissIndex
+from core.embedder import HashingEmbedder
+from core.retriever import Retriever
+from core.rag import RAGGenerator
+from core.speculative import SpeculativeAnswerer
+from core import tracing
+
+CHUNKS = [f"规定 {topic} 条款 {i}" for topic in ("年假", "病假", "加班", "报销", "考勤") for i in range(2)]
+
+class ScriptedKeywordDB(DBManager):
+    """Keyword search waits `delay` seconds and can return scripted hits."""
+    delay = 0.5
+    scripted = None
+
+    def keyword_search(self, query, k=10, doc_filter=None):
+        time.sleep(self.delay)
+        if self.scripted is not None:
+            return self.scripted
+        return super().keyword_search(query, k, doc_filter)
+
+class StreamingLLM:
+    """Stands in for LLMClient: five chunks, 0.15s apart."""
+    def __init__(self):
+        self.model = "mock"
+        self.calls = 0
+
+    def chat(self, messages, stream=True):
+        self.calls += 1
+        yield "根据文档1，"
+        for part in ("年假", "按工龄", "计算。", "【引用】文档1"):
+            time.sleep(0.15)
+            yield part
+
+def test_speculative_generation():
+    print("Testing speculative early generation...")
+
+    test_dir = tempfile.mkdtemp(prefix="kb_speculative_")
+    try:
+        db = ScriptedKeywordDB(db_path=os.path.join(test_dir, "kb.sqlite"))
+        doc_id = db.add_document("员工手册.txt", "员工手册.txt", "\n".join(CHUNKS))
+        db.add_chunks(doc_id, CHUNKS)
+        chunk_ids = db.get_chunk_ids()
+
+        embedder = HashingEmbedder(dimension=64)
+        vectors = np.array(embedder.get_embeddings(CHUNKS))
+        index = FaissIndex(index_path=os.path.join(test_dir, "faiss.index"),
+                           meta_path=os.path.join(test_dir, "meta.json"))
+        index.build_index(vectors, chunk_ids, 64)
+
+        os.environ.setdefault("OPENAI_API_KEY", "sk-test-key")
+        rag = RAGGenerator()
+        rag.llm = StreamingLLM()
+        retriever = Retriever(db, index, embedder)
+        answerer = SpeculativeAnswerer(retriever, rag, window=0)
+        query = CHUNKS[0]
+
+        # 1. 关键词结果不改变 Top-K：采用推测回答，首 token 早于关键词检索完成
+        recorder = tracing.TraceRecorder()
+        with tracing.start_trace("question", recorder=recorder) as trace:
+            result = answerer.answer(query, k=3)
+        keyword_ms = trace.stage_totals()['keyword_search']
+        print(f"Kept: speculation={result['speculation']}, ttft={trace.ttft_ms:.0f}ms, keyword={keyword_ms:.0f}ms")
+        if result['speculation'] != 'kept' or rag.llm.calls != 1:
+            print(f"FAILURE: Speculative answer not kept ({result['speculation']}, {rag.llm.calls} calls)")
+            sys.exit(1)
+        if trace.ttft_ms >= keyword_ms:
+            print("FAILURE: Generation did not start before keyword search finished")
+            sys.exit(1)
+        if result['chunks'][0]['chunk_id'] != chunk_ids[0] or result['chunks'][0]['keyword_score'] == 0:
+            print("FAILURE: Final hits should include keyword scores")
+            sys.exit(1)
+        if not result['answer'].endswith("文档1") or not result['citations_valid'] or not result['citations']:
+            print(f"FAILURE: Unexpected answer: {result['answer']}")
+            sys.exit(1)
+
+        # 2. 关键词结果明显改变 Top-K：取消推测生成并重新生成，被取消的首 token 不计入 TTFT
+        rag.llm.calls = 0
+        db.scripted = [(chunk_ids[i], CHUNKS[i], "员工手册.txt", 10.0) for i in (1, 2)]
+        with tracing.start_trace("question", recorder=recorder) as trace:
+            result = answerer.answer(query, k=3)
+        generations = [sp for sp in trace.iter_spans() if sp.name == "llm_generate"]
+        print(f"Restarted: speculation={result['speculation']}, top-k={[h['chunk_id'] for h in result['chunks']]}")
+        if result['speculation'] != 'restarted' or rag.llm.calls != 2:
+            print(f"FAILURE: Changed top-k did not restart generation ({result['speculation']})")
+            sys.exit(1)
+        if len(generations) != 2 or not generations[0].attrs.get('cancelled') \
+                or generations[1].attrs.get('cancelled'):
+            print("FAILURE: Speculative generation was not cancelled")
+            sys.exit(1)
+        if trace.ttft_ms < trace.stage_totals()['keyword_search']:
+            print("FAILURE: TTFT counted the cancelled generation")
+            sys.exit(1)
+        if result['chunks'][0]['chunk_id'] not in (chunk_ids[1], chunk_ids[2]):
+            print("FAILURE: Restarted answer did not use the final top-k")
+            sys.exit(1)
+
+        # 3. 最终结果置信度不足：取消推测生成，返回备用回复
+        rag.llm.calls = 0
+        db.scripted = None
+        check_confidence = rag.check_confidence
+        rag.check_confidence = lambda hits: (False, "测试") if any(h['keyword_score'] for h in hits) \
+            else check_confidence(hits)
+        result = answerer.answer(query, k=3)
+        rag.check_confidence = check_confidence
+        if result['speculation'] != 'cancelled' or result['confident'] or "测试" not in result['reason']:
+            print(f"FAILURE: Low final confidence did not cancel speculation ({result['speculation']})")
+            sys.exit(1)
+
+        # 4. 最终检索结果与普通检索一致
+        expected = [h['chunk_id'] for h in retriever.retrieve(query, k=3)]
+        if [h['chunk_id'] for h in answerer.answer(query, k=3)['chunks']] != expected:
+            print("FAILURE: Speculative mode changed the final retrieval results")
+            sys.exit(1)
+
+        print("SUCCESS: Speculative generation verified.")
+    finally:
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_speculative_generation()
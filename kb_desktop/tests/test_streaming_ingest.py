@@ -0,0 +1,89 @@
+import sys
+import os
+import shutil
+import tempfile
+import docx
+from docx.enum.text import WD_BREAK
+
+# Ensure core modules can be imported (the parser registry lives in core.parsers)
+sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+from core.ingest import Ingestor
+
+def test_streaming_ingest():
+    print("Testing sample-based encoding detection and streaming extraction...")
+
+    test_dir = tempfile.mkdtemp(prefix="kb_stream_")
+    reads = []
+    original_iter_blocks = Ingestor._iter_blocks
+
+    def counting_iter_blocks(path, encoding, errors='strict'):
+        reads.append(encoding)
+        return original_iter_blocks(path, encoding, errors)
+
+    Ingestor._iter_blocks = staticmethod(counting_iter_blocks)
+    try:
+        text = "员工手册\r\n第一章 总则\n" + "年假规定：工作满一年享有五天年假。\n" * 20000
+
+        # 1. Each encoding is detected from a sample and the file is decoded once
+        for encoding in ("utf-8", "gb18030"):
+            path = os.path.join(test_dir, f"{encoding}.txt")
+            with open(path, "w", encoding=encoding, newline="") as f:
+                f.write(text)
+            reads.clear()
+            content = Ingestor.load_file(path)
+            if reads != [encoding] or "第一章" not in content or "\r" in content:
+                print(f"FAILURE: {encoding} file should be decoded once: {reads}")
+                sys.exit(1)
+
+        # 2. A sample boundary inside a multi-byte character is not an error
+        path = os.path.join(test_dir, "boundary.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("a" + "中" * (Ingestor.SAMPLE_SIZE // 3 + 10))
+        if Ingestor.detect_encoding(path) != "utf-8":
+            print("FAILURE: Truncated character at the sample end should be ignored.")
+            sys.exit(1)
+
+        # 3. Content that changes encoding after the sample still decodes correctly
+        path = os.path.join(test_dir, "mixed.txt")
+        mixed = "ASCII header line\n" * 5000 + "中文正文内容\n"
+        with open(path, "w", encoding="gbk") as f:
+            f.write(mixed)
+        if Ingestor.load_file(path) != mixed:
+            print("FAILURE: Fallback after the sample should decode the whole file.")
+            sys.exit(1)
+
+        # 4. BOMs are recognised
+        path = os.path.join(test_dir, "utf16.txt")
+        with open(path, "w", encoding="utf-16") as f:
+            f.write("带 BOM 的文本")
+        if Ingestor.load_file(path) != "带 BOM 的文本":
+            print("FAILURE: UTF-16 BOM should be detected.")
+            sys.exit(1)
+
+        # 5. Streaming docx extraction matches python-docx
+        document = docx.Document()
+        document.add_paragraph("第一段")
+        paragraph = document.add_paragraph("制表符\t与")
+        paragraph.add_run("换行").add_break()
+        paragraph.add_run("之后")
+        paragraph = document.add_paragraph("分页")
+        paragraph.add_run().add_break(WD_BREAK.PAGE)
+        document.add_table(rows=1, cols=1).cell(0, 0).text = "表格中的文字不在正文段落中"
+        document.add_paragraph("")
+        for i in range(200):
+            document.add_paragraph(f"第{i}条：条款内容。")
+        path = os.path.join(test_dir, "manual.docx")
+        document.save(path)
+
+        expected = [p.text for p in docx.Document(path).paragraphs]
+        if Ingestor.load_file(path) != "\n".join(expected):
+            print("FAILURE: Streaming docx text differs from python-docx.")
+            sys.exit(1)
+    finally:
+        Ingestor._iter_blocks = staticmethod(original_iter_blocks)
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+    print("SUCCESS: Files are decoded once and streamed!")
+
+if __name__ == "__main__":
+    test_streaming_ingest()
@@ -0,0 +1,83 @@
+import sys
+import os
+import json
+import shutil
+import tempfile
+
+# Ensure core modules can be imported
+sys.path.append(os.getcwd())
+try:
+    from kb_desktop.core.chunker import Chunker
+    from kb_desktop.core.tokenizer import TokenCounter
+    from kb_desktop.core.storage import DBManager
+except ImportError:
+    sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+    from core.chunker import Chunker
+    from core.tokenizer import TokenCounter
+    from core.storage import DBManager
+
+def test_token_chunker():
+    print("Testing offset-based token chunker...")
+
+    counter = TokenCounter(encoding_name="")
+    text = ("  员工手册总则。\r\n\n" + "年假规定：工作满一年享有五天年假。" * 30 + "\n"
+            + "English policy text, reviewed yearly. " * 20 + "\n\n结束。\n")
+
+    # 1. Offsets point into the original text and respect the token limit
+    chunker = Chunker(max_tokens=80, overlap_tokens=10, paragraph_overlap=False, counter=counter)
+    chunks = chunker.chunk(text)
+    print(f"Generated {len(chunks)} chunks")
+    for chunk in chunks:
+        if text[chunk['start']:chunk['end']] != chunk['text']:
+            print(f"FAILURE: Offsets don't match chunk text: {chunk}")
+            sys.exit(1)
+        if chunk['text'] != chunk['text'].strip():
+            print(f"FAILURE: Chunk has surrounding whitespace: {chunk['text']!r}")
+            sys.exit(1)
+        if counter.count(chunk['text']) > 80:
+            print(f"FAILURE: Chunk exceeds token limit: {counter.count(chunk['text'])}")
+            sys.exit(1)
+
+    # 2. Long paragraphs are cut at sentence ends with overlap between pieces
+    long_pieces = [c for c in chunks if "年假" in c['text']]
+    if len(long_pieces) < 2 or not all(c['text'].endswith("。") for c in long_pieces[:-1]):
+        print("FAILURE: Long paragraph should be split at sentence ends.")
+        sys.exit(1)
+    if long_pieces[1]['start'] >= long_pieces[0]['end']:
+        print("FAILURE: Pieces of a long paragraph should overlap.")
+        sys.exit(1)
+
+    # 3. Cross-paragraph overlap is optional
+    short = "第一句。第二句。\n第二段内容。\n第三段内容。"
+    plain = Chunker(max_tokens=14, overlap_tokens=7, paragraph_overlap=False, counter=counter).chunk(short)
+    overlapped = Chunker(max_tokens=14, overlap_tokens=7, paragraph_overlap=True, counter=counter).chunk(short)
+    if plain[1]['text'] != "第二段内容。\n第三段内容。" or overlapped[1]['text'] != "第二句。\n第二段内容。":
+        print(f"FAILURE: Paragraph overlap not applied as configured: {plain} / {overlapped}")
+        sys.exit(1)
+
+    # 4. Legacy string API is unchanged
+    if Chunker.split_text(text, max_tokens=80, overlap_tokens=10) != [c['text'] for c in chunks]:
+        print("FAILURE: split_text should return the chunk texts.")
+        sys.exit(1)
+
+    # 5. Offsets are stored with each chunk
+    test_dir = tempfile.mkdtemp(prefix="kb_chunker_")
+    try:
+        db = DBManager(db_path=os.path.join(test_dir, "kb.sqlite"))
+        doc_id = db.add_document("手册.txt", "手册.txt", text)
+        db.add_chunks(doc_id, chunks)
+        conn = db.get_connection()
+        rows = conn.execute("SELECT text, start_offset, end_offset, meta_info FROM chunks WHERE doc_id = ? ORDER BY chunk_index",
+                            (doc_id,)).fetchall()
+        conn.close()
+        for stored_text, start, end, meta_info in rows:
+            if text[start:end] != stored_text or 'tokens' not in json.loads(meta_info):
+                print("FAILURE: Stored offsets don't match stored text.")
+                sys.exit(1)
+    finally:
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+    print("SUCCESS: Chunker emits token-sized chunks with offsets!")
+
+if __name__ == "__main__":
+    test_token_chunker()
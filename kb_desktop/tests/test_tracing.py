@@ -0,0 +1,126 @@
+import sys
+import os
+import json
+import time
+import shutil
+import tempfile
+import numpy as np
+
+# Ensure core modules can be imported
+sys.path.append(os.getcwd())
+try:
+    from kb_desktop.core.storage import DBManager
+    from kb_desktop.core.index_faiss import FaissIndex
+    from kb_desktop.core.retriever import Retriever
+except ImportError:
+    sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+    from core.storage import DBManager
+    from core.index_faiss import FaissIndex
+    from core.retriever import Retriever
+
+# 使用检索器实际导入的 tracing 模块（包导入和 core 导入两条路径下是不同的模块对象）
+tracing = sys.modules[sys.modules[Retriever.__module__].span.__module__]
+
+# Mock Embedder for testing (to avoid requiring API key)
+class MockEmbedder:
+    def get_embedding(self, text):
+        time.sleep(0.002)
+        return np.random.rand(16).tolist()
+
+def test_tracing():
+    print("Testing per-stage tracing...")
+
+    test_dir = tempfile.mkdtemp(prefix="kb_trace_")
+    try:
+        log_path = os.path.join(test_dir, "traces.jsonl")
+        recorder = tracing.TraceRecorder(log_path=log_path)
+
+        # 1. 没有活动追踪时 span() 不记录任何内容
+        with tracing.span("orphan") as s:
+            s.set(x=1)
+        tracing.event("first_token")
+        if tracing.current_trace() is not None:
+            print("FAILURE: Trace active outside start_trace")
+            sys.exit(1)
+
+        # 2. 嵌套阶段、属性和首 token 事件
+        with tracing.start_trace("question", recorder=recorder) as trace:
+            with tracing.span("retrieve"):
+                with tracing.span("embed_query"):
+                    time.sleep(0.01)
+            with tracing.span("llm_generate") as s:
+                time.sleep(0.01)
+                tracing.event("first_token")
+                s.set(output_chars=42)
+
+        if [sp.name for sp in trace.spans] != ["retrieve", "llm_generate"] \
+                or [c.name for c in trace.spans[0].children] != ["embed_query"]:
+            print(f"FAILURE: Wrong span tree: {trace.to_dict()['spans']}")
+            sys.exit(1)
+        retrieve, generate = trace.spans
+        if not (retrieve.duration_ms >= retrieve.children[0].duration_ms >= 10
+                and trace.duration_ms >= retrieve.duration_ms + generate.duration_ms):
+            print("FAILURE: Span durations are inconsistent")
+            sys.exit(1)
+        if not trace.ttft_ms or not 20 <= trace.ttft_ms <= trace.duration_ms:
+            print(f"FAILURE: Bad TTFT: {trace.ttft_ms}")
+            sys.exit(1)
+        if generate.attrs.get('output_chars') != 42 or not generate.events:
+            print("FAILURE: Span attributes or events missing")
+            sys.exit(1)
+        print(trace.format())
+
+        # 3. 阶段中的异常会记录下来并继续抛出，阶段栈保持正确
+        try:
+            with tracing.start_trace("question", recorder=recorder) as failed:
+                with tracing.span("retrieve"):
+                    raise RuntimeError("boom")
+        except RuntimeError:
+            pass
+        else:
+            print("FAILURE: Exception swallowed by span")
+            sys.exit(1)
+        if "boom" not in failed.spans[0].attrs.get('error', '') or tracing.current_span() is not None:
+            print("FAILURE: Span error not recorded")
+            sys.exit(1)
+
+        # 4. 检索器的各个阶段
+        db = DBManager(db_path=os.path.join(test_dir, "kb.sqlite"))
+        doc_id = db.add_document("员工手册.txt", "员工手册.txt", "内容")
+        db.add_chunks(doc_id, [f"年假 规定 片段 {i}" for i in range(10)])
+        chunk_ids = db.get_chunk_ids()
+        index = FaissIndex(index_path=os.path.join(test_dir, "faiss.index"),
+                           meta_path=os.path.join(test_dir, "meta.json"))
+        index.build_index(np.random.rand(len(chunk_ids), 16), chunk_ids, 16)
+        retriever = Retriever(db, index, MockEmbedder())
+
+        with tracing.start_trace("question", recorder=recorder) as trace:
+            results = retriever.retrieve("年假", k=3, doc_filter={'doc_ids': [doc_id]})
+        names = [sp.name for sp in trace.spans]
+        print(f"Retriever spans: {names}")
+        # 关键词检索与查询嵌入并发执行，顺序不固定，但仍是顶层阶段
+        if sorted(names) != sorted(["filter", "embed_query", "vector_search", "keyword_search", "fuse"]) \
+                or names[0] != "filter" or names[-1] != "fuse" or len(results) != 3:
+            print("FAILURE: Retriever stages not traced")
+            sys.exit(1)
+        if "fetch_chunks" not in [c.name for c in trace.spans[-1].children]:
+            print("FAILURE: SQLite fetches not traced inside fuse")
+            sys.exit(1)
+
+        # 5. 统计和 JSONL 日志
+        stats = recorder.stage_stats("question")
+        if stats['total']['count'] != 3 or stats['ttft']['count'] != 1 or stats['embed_query']['count'] != 2:
+            print(f"FAILURE: Wrong stage stats: {stats}")
+            sys.exit(1)
+        with open(log_path, encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f]
+        if len(lines) != 3 or lines[0]['ttft_ms'] is None or lines[0]['spans'][0]['name'] != "retrieve":
+            print("FAILURE: Trace log is wrong")
+            sys.exit(1)
+
+        print("SUCCESS: Tracing verified.")
+    finally:
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_tracing()
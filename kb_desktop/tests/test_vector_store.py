@@ -0,0 +1,85 @@
+import sys
+import os
+import shutil
+import tempfile
+import numpy as np
+
+# Ensure core modules can be imported
+sys.path.append(os.getcwd())
+try:
+    from kb_desktop.core.storage import DBManager
+    from kb_desktop.core.index_faiss import FaissIndex
+    from kb_desktop.core.vector_store import VectorStore
+    from kb_desktop.core.indexer import Indexer
+except ImportError:
+    sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+    from core.storage import DBManager
+    from core.index_faiss import FaissIndex
+    from core.vector_store import VectorStore
+    from core.indexer import Indexer
+
+# Mock Embedder that counts API calls
+class CountingEmbedder:
+    model = "mock-embedding"
+
+    def __init__(self):
+        self.calls = 0
+        self.embedded = 0
+
+    def get_embeddings(self, texts):
+        self.calls += 1
+        self.embedded += len(texts)
+        return [np.random.rand(24).tolist() for _ in texts]
+
+def test_vector_store():
+    print("Testing stored embeddings and offline rebuild...")
+
+    test_dir = tempfile.mkdtemp(prefix="kb_vectors_")
+    try:
+        db = DBManager(db_path=os.path.join(test_dir, "kb.sqlite"))
+        doc_id = db.add_document("a.txt", "a.txt", "内容")
+        db.add_chunks(doc_id, [f"片段 {i}" for i in range(30)])
+
+        store_dir = os.path.join(test_dir, "vectors")
+        index = FaissIndex(index_path=os.path.join(test_dir, "faiss.index"),
+                           meta_path=os.path.join(test_dir, "meta.json"))
+        embedder = CountingEmbedder()
+
+        # 1. First build embeds everything
+        result = Indexer(db, index, embedder, VectorStore(store_dir), batch_size=8).rebuild()
+        print(f"First build: {result}")
+        if embedder.embedded != 30 or result['total'] != 30:
+            print("FAILURE: First build should embed all chunks.")
+            sys.exit(1)
+
+        # 2. Second build is fully local
+        offline = Indexer(db, index, None, VectorStore(store_dir)).rebuild()
+        print(f"Offline rebuild: {offline}")
+        if offline['embedded'] != 0:
+            print("FAILURE: Offline rebuild should not embed anything.")
+            sys.exit(1)
+
+        # 3. New chunks only embed the delta
+        doc2 = db.add_document("b.txt", "b.txt", "内容2")
+        db.add_chunks(doc2, ["新片段 1", "新片段 2"])
+        Indexer(db, index, embedder, VectorStore(store_dir)).rebuild()
+        if embedder.embedded != 32:
+            print(f"FAILURE: Expected 2 new embeddings, got {embedder.embedded - 30}")
+            sys.exit(1)
+
+        # 4. A torn append is repaired on open
+        store = VectorStore(store_dir)
+        with open(store.vectors_path, "ab") as f:
+            f.write(b"\x00" * 10)
+        repaired = VectorStore(store_dir)
+        if len(repaired) != 32 or repaired.get([1]).shape != (1, 24):
+            print("FAILURE: Store was not repaired after torn write.")
+            sys.exit(1)
+
+        print("SUCCESS: Embeddings persisted and index rebuilt without the API!")
+
+    finally:
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_vector_store()
@@ -0,0 +1,24 @@
+import sys
+import os
+
+sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+from core.storage import DBManager
+
+def compress_database(codec):
+    """按指定压缩方式重新编码数据库中的文档内容，并报告节省的空间。"""
+    db = DBManager(db_path="kb_desktop/data/kb.sqlite", compression=codec)
+    print(f"Re-encoding stored content with codec: {db.codec.codec}")
+
+    stats = db.recompress(on_progress=lambda message, percent: print(f"[{percent:3d}%] {message}"))
+
+    saved = stats['bytes_before'] - stats['bytes_after']
+    ratio = stats['bytes_after'] / stats['bytes_before'] if stats['bytes_before'] else 1.0
+    print(f"\nRewrote {stats['documents']} documents and {stats['chunks']} chunks")
+    print(f"Content: {stats['bytes_before']:,} -> {stats['bytes_after']:,} bytes "
+          f"(saved {saved:,} bytes, {ratio:.0%} of original)")
+    print(f"Database file: {stats['file_before']:,} -> {stats['file_after']:,} bytes")
+    print("Set CONTENT_COMPRESSION in .env to the same codec so new imports are compressed too.")
+
+if __name__ == "__main__":
+    codec = sys.argv[1] if len(sys.argv) > 1 else "zlib"
+    compress_database(codec)
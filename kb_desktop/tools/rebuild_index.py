@@ -0,0 +1,31 @@
+import sys
+import os
+
+sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+from core.storage import DBManager
+from core.index_faiss import FaissIndex
+from core.index_sharded import ShardedFaissIndex
+from core.vector_store import VectorStore
+from core.indexer import Indexer
+
+def rebuild_offline():
+    """仅使用已存储的嵌入重建 FAISS 索引（不调用嵌入 API）。"""
+    db = DBManager(db_path="kb_desktop/data/kb.sqlite")
+    store = VectorStore(store_dir="kb_desktop/data/vectors")
+    # 与界面使用同一种索引：设置 INDEX_SHARD_SIZE 时重建分片索引
+    shard_size = os.getenv("INDEX_SHARD_SIZE")
+    index = ShardedFaissIndex(max_shard_size=int(shard_size)) if shard_size else FaissIndex()
+
+    missing = store.missing_ids(db.get_indexable_chunk_ids())
+    if missing:
+        print(f"{len(missing)} chunks have no stored embedding.")
+        print("Rebuild the index from the app once (with an API key) to embed them.")
+        return
+
+    result = Indexer(db, index, embedder=None, vector_store=store).rebuild(
+        on_progress=lambda message, percent: print(f"[{percent:3d}%] {message}")
+    )
+    print(f"\nRebuilt index offline: {result['total']} vectors, dimension={result['dimension']}")
+
+if __name__ == "__main__":
+    rebuild_offline()
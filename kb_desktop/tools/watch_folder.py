@@ -0,0 +1,48 @@
+import sys
+import os
+import time
+
+sys.path.append(os.path.join(os.getcwd(), 'kb_desktop'))
+from core.storage import DBManager
+from core.importer import Importer
+from core.embedder import create_embedder
+from core.index_faiss import FaissIndex
+from core.index_sharded import ShardedFaissIndex
+from core.vector_store import VectorStore
+from core.indexer import Indexer
+from core.watcher import FolderWatcher
+
+def watch_folder(folder, report_interval=10.0):
+    """监听文件夹，持续导入新增或修改的文档并增量更新索引，定期打印队列深度和延迟。"""
+    db = DBManager(db_path="kb_desktop/data/kb.sqlite")
+    shard_size = os.getenv("INDEX_SHARD_SIZE")
+    index = ShardedFaissIndex(max_shard_size=int(shard_size)) if shard_size else FaissIndex()
+    index.load(db=db)
+
+    try:
+        embedder = create_embedder()
+    except ValueError as e:
+        print(f"No embedder available ({e}); only chunks with stored embeddings can be indexed.")
+        embedder = None
+
+    indexer = Indexer(db, index, embedder, VectorStore(store_dir="kb_desktop/data/vectors"))
+    watcher = FolderWatcher(folder, Importer(db), indexer)
+    watcher.start()
+
+    try:
+        while True:
+            time.sleep(report_interval)
+            m = watcher.metrics()
+            print(f"queue={m['queue_depth']} oldest={m['oldest_pending']:.1f}s "
+                  f"lag={m['last_lag']:.1f}s (max {m['max_lag']:.1f}s) "
+                  f"files={m['files']} imported={m['imported']} updated={m['updated']} "
+                  f"failed={m['failed']} vectors=+{m['vectors_added']}/-{m['vectors_removed']}")
+    except KeyboardInterrupt:
+        print("Stopping watcher...")
+        watcher.stop()
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python kb_desktop/tools/watch_folder.py <folder>")
+        sys.exit(1)
+    watch_folder(sys.argv[1])